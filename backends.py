@@ -0,0 +1,47 @@
+"""
+モデルプロファイルに基づいて llm.Model を作成するモジュール
+
+backend が "openai_compatible" のプロファイルは、ローカルで動く OpenAI 互換サーバー
+(llama.cpp server, ollama, vLLM など) を llm の OpenAI チャットモデルとして扱う。
+llm にモデルを登録する必要はなく、参加者の model にはプロファイルのモデルIDを書くだけでよい。
+"""
+from typing import Optional
+
+import llm
+from llm.default_plugins.openai_models import Chat
+
+from config import ModelProfile
+
+
+def build_openai_compatible_model(model_id: str, profile: ModelProfile) -> llm.Model:
+    """
+    OpenAI 互換サーバーのモデルを作成する。
+
+    api_key_env が指定されていればその環境変数 (または `llm keys set <モデルID>` で保存したキー) を
+    APIキーとして使い、指定されていなければキーを要求しない
+    (ローカルのサーバーはキーを検証しないため、llm はダミーのキーを送る)。
+    """
+    model = Chat(
+        model_id,
+        model_name=profile.model_name or model_id,
+        api_base=profile.api_base,
+    )
+    if profile.api_key_env:
+        model.needs_key = model_id
+        model.key_env_var = profile.api_key_env
+    else:
+        # llm の extra-openai-models.yaml で api_base を指定した場合と同じ扱い
+        model.needs_key = None
+    return model
+
+
+def get_model(model_id: str, profile: Optional[ModelProfile] = None) -> llm.Model:
+    """
+    モデルIDからモデルを取得する。
+
+    プロファイルがない場合や backend が "llm" の場合は、インストール済みのプラグイン
+    (llm-gpt4all, llm-ollama など) を含めて llm.get_model で解決する。
+    """
+    if profile is not None and profile.backend == "openai_compatible":
+        return build_openai_compatible_model(model_id, profile)
+    return llm.get_model(model_id)
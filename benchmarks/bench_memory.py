@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+長い会話のメモリ使用量のベンチマーク
+
+LLMの代わりに固定長のレスポンスを返すモデルで会話を実行し、ターン数ごとのピークRSSと
+Python のピーク割り当て量 (tracemalloc) を計測する。ピークRSSはプロセス単位でしか
+減らないため、ターン数ごとに子プロセスで実行する。
+
+使い方:
+    python benchmarks/bench_memory.py --turns 100 1000 10000 --response-chars 2000
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import AppConfig, ParticipantConfig  # noqa: E402
+from conversation import ConversationManager  # noqa: E402
+from database import init_db  # noqa: E402
+
+
+class FakeModel:
+    """チャンクに分けた固定のレスポンスを返すモデル"""
+
+    def __init__(self, response_chars: int, chunk_chars: int = 50):
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+
+    def prompt(self, prompt, **kwargs):
+        text = ("あいうえおかきくけこ" * (self.response_chars // 10 + 1))[:self.response_chars]
+        return iter([text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)])
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_conversation(turns: int, response_chars: int, summary: bool, summary_chunk_chars: int) -> dict:
+    """1回の会話を実行して計測結果を返す"""
+    participants = [
+        ParticipantConfig("Alice", "fake-a", "Alice's persona"),
+        ParticipantConfig("Bob", "fake-b", "Bob's persona"),
+    ]
+    config = AppConfig(
+        topic="Benchmark",
+        participants=participants,
+        moderator=ParticipantConfig("MC", "fake-mc", "MC's persona"),
+        max_turns=turns,
+        llm_wait_time=0,
+        summary_chunk_chars=summary_chunk_chars,
+    )
+    logger = logging.getLogger("bench_memory")
+    logger.setLevel(logging.CRITICAL + 1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config.db_path = os.path.join(temp_dir, "conversation.db")
+        init_db(config.db_path)
+        model = FakeModel(response_chars)
+        model_cache = {"fake-a": model, "fake-b": model, "fake-mc": model}
+        manager = ConversationManager(config, logger, model_cache=model_cache, console=False)
+        tracemalloc.start()
+        started = time.perf_counter()
+        manager.start_conversation(max_turns=turns, show_summary=summary)
+        elapsed = time.perf_counter() - started
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "turns": turns,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "traced_peak_mb": round(traced_peak / (1024 * 1024), 2),
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="長い会話のメモリ使用量のベンチマーク")
+    parser.add_argument("--turns", type=int, nargs="+", default=[100, 1000, 10000], help="計測するターン数")
+    parser.add_argument("--response-chars", type=int, default=2000, help="1回の発言の文字数")
+    parser.add_argument("--no-summary", action="store_true", help="会話の要約を行わない")
+    parser.add_argument("--summary-chunk-chars", type=int, default=20000, help="トランスクリプトに保持する発言本文の文字数 (0 で無制限)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_conversation(args.turns[0], args.response_chars, not args.no_summary, args.summary_chunk_chars)))
+        return
+
+    print(f"{'ターン数':>8} {'ピークRSS (MB)':>14} {'Pythonピーク (MB)':>17} {'秒':>8}")
+    for turns in args.turns:
+        command = [sys.executable, os.path.abspath(__file__), "--child", "--turns", str(turns),
+                   "--response-chars", str(args.response_chars), "--summary-chunk-chars", str(args.summary_chunk_chars)]
+        if args.no_summary:
+            command.append("--no-summary")
+        result = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout.strip().splitlines()[-1])
+        print(f"{result['turns']:>8} {result['peak_rss_mb']:>14} {result['traced_peak_mb']:>17} {result['seconds']:>8}")
+
+
+if __name__ == "__main__":
+    main()
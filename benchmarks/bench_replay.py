@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+記録したLLM呼び出しの再生による会話のオーバーヘッドのベンチマーク
+
+`python main.py --record fixture.jsonl` で記録したフィクスチャを再生して start_conversation を実行し、
+実行時間から再生にかかった時間 (記録されたチャンクの間隔の合計 / 速度) を引いたものを、
+表示・データベース・会話の制御のオーバーヘッドとして計測する。LLMは呼び出さないため、オフラインで再現性のある計測ができる。
+
+使い方:
+    python main.py --config config.yaml --record fixture.jsonl
+    python benchmarks/bench_replay.py --config config.yaml --fixture fixture.jsonl --runs 5
+    python benchmarks/bench_replay.py --config config.yaml --fixture fixture.jsonl --speed 1 --console
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import AppConfig, load_config_from_file  # noqa: E402
+from conversation import ConversationManager  # noqa: E402
+from database import init_db  # noqa: E402
+from replay import RecordedCall, build_replay_cache, load_fixture  # noqa: E402
+
+
+def run_replay(config: AppConfig, calls: List[RecordedCall], speed: float, console: bool) -> Dict[str, float]:
+    """フィクスチャを再生して1会話を実行し、実行時間と再生にかかった時間を返す"""
+    logger = logging.getLogger("bench_replay")
+    logger.setLevel(logging.CRITICAL + 1)
+    model_cache = build_replay_cache(calls, speed=speed)
+    manager = ConversationManager(config, logger, model_cache=model_cache, console=console)
+    replay_seconds = sum(call.seconds for call in calls) / speed if speed > 0 else 0.0
+    # コンソールへの表示も計測に含めるが、出力は捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        manager.start_conversation(config.max_turns, False, config.show_summary)
+        elapsed = time.perf_counter() - started
+    remaining = sum(model.remaining for model in model_cache.values())
+    return {
+        "seconds": elapsed,
+        "replay_seconds": replay_seconds,
+        "overhead_seconds": elapsed - replay_seconds,
+        "unused_calls": remaining,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録したLLM呼び出しの再生による会話のオーバーヘッドのベンチマーク")
+    parser.add_argument("--config", default="config.yaml", help="記録したときの設定ファイル")
+    parser.add_argument("--fixture", required=True, help="--record で記録したフィクスチャファイル")
+    parser.add_argument("--runs", type=int, default=5, help="計測する回数")
+    parser.add_argument("--speed", type=float, default=0.0, help="再生速度の倍率 (0 は待機せずに再生する)")
+    parser.add_argument("--console", action="store_true", help="コンソールへの表示 (色付け・スピナー) も計測に含める")
+    args = parser.parse_args()
+
+    calls = load_fixture(args.fixture)
+    recorded = sum(call.seconds for call in calls)
+    chunks = sum(len(call.chunks) for call in calls)
+    print(f"フィクスチャ: {len(calls)} 呼び出し, {chunks} チャンク, 記録時の生成時間 {recorded:.2f} 秒")
+    print(f"{'回':>4} {'秒':>8} {'再生':>8} {'オーバーヘッド':>14} {'未使用':>6}")
+    overheads = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for run in range(1, args.runs + 1):
+            config = load_config_from_file(args.config)
+            config.db_path = os.path.join(temp_dir, f"conversation-{run}.db")
+            config.llm_wait_time = 0
+            init_db(config.db_path)
+            result = run_replay(config, calls, args.speed, args.console)
+            overheads.append(result["overhead_seconds"])
+            print(
+                f"{run:>4} {result['seconds']:>8.3f} {result['replay_seconds']:>8.3f} "
+                f"{result['overhead_seconds']:>14.3f} {result['unused_calls']:>6}"
+            )
+    print(f"オーバーヘッドの中央値: {statistics.median(overheads) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+ローカルモデルでの会話のスループット (ターン/秒) のベンチマーク
+
+複数の会話を並行して実行し、モデルの同時実行数の上限 (model_profiles の max_concurrency) ごとに
+ターン/秒と1ターンの平均レイテンシを計測する。既定では、同時に処理できるリクエスト数 (スロット数) が
+決まっていて、同時に届いたリクエストをまとめてバッチ処理するローカルサーバーを模したモデルを使う。
+--config と --model を指定すると、設定ファイルの model_profiles に従って実際のモデル
+(llama.cpp server や ollama など) を呼び出して計測する。
+--adaptive を指定すると、各上限を最大値として AIMD で調整する上限 (adaptive_concurrency) で計測し、
+計測後の上限も表示する。
+
+使い方:
+    python benchmarks/bench_throughput.py --conversations 8 --turns 4 --limits 1 2 4 8
+    python benchmarks/bench_throughput.py --config config.yaml --model local-llama --limits 1 4
+    python benchmarks/bench_throughput.py --conversations 8 --turns 8 --limits 8 --adaptive
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from concurrency import ModelConcurrencyLimiter  # noqa: E402
+from config import AppConfig, ParticipantConfig, load_config_from_file  # noqa: E402
+from conversation import ConversationManager  # noqa: E402
+from database import init_db  # noqa: E402
+
+
+class SimulatedLocalServerModel:
+    """
+    ローカルサーバーを模したモデル。
+
+    同時に処理するのは slots 件までで、それを超えたリクエストはサーバー側のキューで待たされる。
+    同時に処理しているリクエストはまとめてバッチ処理されるため、1トークンあたりの時間は
+    バッチが大きくなっても少ししか増えない。
+    """
+
+    def __init__(self, slots: int, prefill_seconds: float, token_seconds: float, tokens: int, batch_overhead: float = 0.1):
+        self.slots = threading.Semaphore(slots)
+        self.prefill_seconds = prefill_seconds
+        self.token_seconds = token_seconds
+        self.tokens = tokens
+        self.batch_overhead = batch_overhead
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def _generate(self):
+        with self.slots:
+            with self._lock:
+                self._active += 1
+            try:
+                time.sleep(self.prefill_seconds)
+                for _ in range(self.tokens):
+                    with self._lock:
+                        active = self._active
+                    time.sleep(self.token_seconds * (1 + self.batch_overhead * (active - 1)))
+                    yield "あ"
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+    def prompt(self, prompt, **kwargs):
+        return self._generate()
+
+
+def run_benchmark(
+    config: AppConfig,
+    model_id: str,
+    conversations: int,
+    turns: int,
+    limit: int,
+    model_cache_factory: Callable[[], Dict[str, object]],
+    adaptive: bool = False,
+) -> Dict[str, float]:
+    """同時実行数の上限を limit (adaptive の場合は上限の最大値) にして conversations 件の会話を並行して実行し、計測結果を返す"""
+    logger = logging.getLogger("bench_throughput")
+    logger.setLevel(logging.CRITICAL + 1)
+    limiter = ModelConcurrencyLimiter({model_id: limit}, adaptive={model_id: 1} if adaptive else None)
+    model_cache = model_cache_factory()
+    managers = [
+        ConversationManager(config, logger, model_cache=model_cache, console=False, limiter=limiter)
+        for _ in range(conversations)
+    ]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=conversations) as executor:
+        futures = [
+            executor.submit(manager.start_conversation, turns, False, False)
+            for manager in managers
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    # MC の開始アナウンスを含めたターン数
+    total_turns = conversations * (turns + 1)
+    return {
+        "limit": limit,
+        "turns": total_turns,
+        "seconds": elapsed,
+        "turns_per_second": total_turns / elapsed,
+        "waits": limiter.waits,
+        "final_limit": limiter.limits[model_id],
+    }
+
+
+def _benchmark_config(model_id: str, base: Optional[AppConfig], turns: int, db_path: str) -> AppConfig:
+    """全員が同じモデルを使う計測用の設定を作成する"""
+    participants = [
+        ParticipantConfig("Alice", model_id, "Alice's persona"),
+        ParticipantConfig("Bob", model_id, "Bob's persona"),
+    ]
+    config = AppConfig(
+        topic=base.topic if base else "Benchmark",
+        participants=participants,
+        moderator=ParticipantConfig("MC", model_id, "MC's persona"),
+        max_turns=turns,
+        llm_wait_time=0,
+        max_response_chars=base.max_response_chars if base else 0,
+        model_profiles=base.model_profiles if base else {},
+    )
+    config.db_path = db_path
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルモデルでの会話のスループットのベンチマーク")
+    parser.add_argument("--conversations", type=int, default=8, help="並行して実行する会話の数")
+    parser.add_argument("--turns", type=int, default=4, help="1会話あたりのターン数")
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 2, 4, 8], help="計測する同時実行数の上限")
+    parser.add_argument("--slots", type=int, default=4, help="模擬サーバーのスロット数")
+    parser.add_argument("--tokens", type=int, default=40, help="模擬サーバーの1回の発言のトークン数")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="模擬サーバーの1トークンあたりの時間 (ミリ秒)")
+    parser.add_argument("--prefill-ms", type=float, default=30.0, help="模擬サーバーのプロンプト処理の時間 (ミリ秒)")
+    parser.add_argument("--adaptive", action="store_true", help="上限を最大値として AIMD で調整する")
+    parser.add_argument("--config", help="実際のモデルで計測する場合の設定ファイル (model_profiles を参照する)")
+    parser.add_argument("--model", help="実際のモデルで計測する場合のモデルID")
+    args = parser.parse_args()
+
+    base = load_config_from_file(args.config) if args.config else None
+    model_id = args.model or "simulated-local"
+    if base is not None and args.model is None:
+        parser.error("--config を指定する場合は --model も指定してください")
+
+    if args.model:
+        # 実際のモデルは ConversationManager が model_profiles に従って取得する
+        def model_cache_factory():
+            return {}
+        target = f"{model_id} (実モデル)"
+    else:
+        def model_cache_factory():
+            return {model_id: SimulatedLocalServerModel(
+                args.slots, args.prefill_ms / 1000, args.token_ms / 1000, args.tokens,
+            )}
+        target = f"模擬サーバー (スロット数: {args.slots})"
+
+    print(f"対象: {target}, 会話数: {args.conversations}, ターン数: {args.turns}")
+    print(f"{'上限':>6} {'ターン':>8} {'秒':>8} {'ターン/秒':>10} {'待機':>6} {'最終上限':>8}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "conversation.db")
+        init_db(db_path)
+        config = _benchmark_config(model_id, base, args.turns, db_path)
+        for limit in args.limits:
+            result = run_benchmark(config, model_id, args.conversations, args.turns, limit, model_cache_factory, args.adaptive)
+            print(
+                f"{result['limit']:>6} {result['turns']:>8} {result['seconds']:>8.2f} "
+                f"{result['turns_per_second']:>10.2f} {result['waits']:>6} {result['final_limit']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import copy
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from config import BudgetConfig, BudgetLimit, ModelPrice, DB_PATH
+from database import fetch_usage_by_model
+
+# ロガーを取得
+logger = logging.getLogger(__name__)
+
+# 出力トークン数の上限を指定するオプション名の候補 (プラグインによって異なる)
+MAX_TOKENS_OPTION_NAMES = ("max_tokens", "max_output_tokens")
+
+# 出力トークン数の上限がわからないモデルで、予算による制限を始める残りトークン数 (通常の発言の最大長の目安)
+DEFAULT_OUTPUT_TOKEN_CAP = 4096
+
+
+class BudgetExceededError(Exception):
+    """トークン・料金の予算の上限に達した場合に送出される例外"""
+
+
+class UsageTotals:
+    """トークン数と料金の累計を保持するクラス"""
+
+    def __init__(self, input_tokens: int = 0, output_tokens: int = 0, cost: float = 0.0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cost = cost
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, input_tokens: int, output_tokens: int, cost: float) -> None:
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost += cost
+
+    def __repr__(self):
+        return f"<UsageTotals input={self.input_tokens} output={self.output_tokens} cost={self.cost:.6f}>"
+
+
+def max_tokens_options(model: Any, max_tokens: Optional[int]) -> Dict[str, int]:
+    """モデルがサポートしていれば、出力トークン数の上限を指定するオプションを返す"""
+    if max_tokens is None:
+        return {}
+    options_class = getattr(model, "Options", None)
+    fields = getattr(options_class, "model_fields", None)
+    if not isinstance(fields, dict):
+        return {}
+    for name in MAX_TOKENS_OPTION_NAMES:
+        if name in fields:
+            return {name: max_tokens}
+    return {}
+
+
+def model_output_limit(model: Any, options: Optional[Dict[str, Any]] = None) -> int:
+    """
+    1回の呼び出しの出力トークン数の上限を返す。
+
+    プロファイルのオプション (max_tokens など) で指定されていればその値、モデルのオプションの既定値があればその値、
+    どちらもなければ DEFAULT_OUTPUT_TOKEN_CAP を返す。
+    """
+    for name in MAX_TOKENS_OPTION_NAMES:
+        value = (options or {}).get(name)
+        if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+            return value
+    fields = getattr(getattr(model, "Options", None), "model_fields", None)
+    if isinstance(fields, dict):
+        for name in MAX_TOKENS_OPTION_NAMES:
+            default = getattr(fields.get(name), "default", None)
+            if isinstance(default, int) and not isinstance(default, bool) and default > 0:
+                return default
+    return DEFAULT_OUTPUT_TOKEN_CAP
+
+
+class BudgetManager:
+    """
+    会話・モデル・バッチ単位でトークン数と料金を集計し、予算の上限を適用するクラス。
+
+    モデル単位の上限は、バッチIDが指定されていればバッチ全体、そうでなければ会話内の使用量に適用される。
+    バッチの使用量は、同じバッチの他の会話についてデータベースに記録済みの値を check() のたびに読み直し、
+    この会話の使用量 (メモリ上の累計) と合算する。同時に実行中の他のワーカーやセッションの使用量も
+    1ターン以内に反映されるため、プロセスをまたいでもバッチの上限を超えるのは実行中の呼び出しの分までに抑えられる。
+    """
+
+    def __init__(
+        self,
+        budget: BudgetConfig,
+        pricing: Dict[str, ModelPrice],
+        conversation_id: str,
+        db_path: str = DB_PATH,
+        on_warning: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Args:
+            on_warning: 予算の warn_ratio を超えたときに警告のメッセージを渡す関数
+                (ConversationManager がコンソールへの表示やイベントの通知に使う。ログには常に記録する)。
+        """
+        self.budget = budget
+        self.pricing = pricing
+        self.conversation_id = conversation_id
+        self.db_path = db_path
+        self.on_warning = on_warning
+        self.conversation = UsageTotals()
+        self.batch = UsageTotals()
+        self.models: Dict[str, UsageTotals] = {}
+        # この会話のモデルごとの使用量と、同じバッチの他の会話のモデルごとの使用量 (データベースから読み込む)
+        self._conversation_models: Dict[str, UsageTotals] = {}
+        self._other_models: Dict[str, UsageTotals] = {}
+        self._warned: Set[str] = set()
+        # MCの開始アナウンスの非同期生成など、別スレッドからも記録されるため
+        self._lock = threading.Lock()
+        self._shares_batch = bool(budget.batch_id and (budget.batch or budget.models))
+        if self._shares_batch:
+            self._load_batch_usage()
+            logger.info("バッチ '%s' の使用量を読み込みました: %r", budget.batch_id, self.batch)
+
+    def _load_batch_usage(self) -> None:
+        """データベースから同じバッチの他の会話の使用量を読み直し、この会話の使用量と合算する"""
+        usage = fetch_usage_by_model(
+            batch_id=self.budget.batch_id, exclude_conversation_id=self.conversation_id, db_path=self.db_path,
+        )
+        with self._lock:
+            self._other_models = {
+                model_id: UsageTotals(input_tokens, output_tokens, self.cost(model_id, input_tokens, output_tokens))
+                for model_id, (input_tokens, output_tokens) in usage.items()
+            }
+            self._combine()
+
+    def _combine(self) -> None:
+        """バッチとモデルごとの累計を、他の会話の使用量とこの会話の使用量から作り直す"""
+        self.batch = UsageTotals()
+        self.models = {}
+        for source in (self._other_models, self._conversation_models):
+            for model_id, totals in source.items():
+                self.batch.add(totals.input_tokens, totals.output_tokens, totals.cost)
+                self.models.setdefault(model_id, UsageTotals()).add(totals.input_tokens, totals.output_tokens, totals.cost)
+
+    def reconfigure(self, budget: BudgetConfig, pricing: Dict[str, ModelPrice]) -> None:
+        """
+        設定の再読み込みで予算の上限と料金を差し替える。
+
+        記録済みの使用量は引き継ぎ、料金は新しい料金表で計算し直す。batch_id は会話の途中で変えると
+        使用量の集計先が変わってしまうため、変更は無視して元の batch_id を使い続ける。
+        """
+        if budget.batch_id != self.budget.batch_id:
+            logger.warning(
+                "batch_id は会話の途中で変更できないため、'%s' のまま使います (新しい設定: '%s')",
+                self.budget.batch_id, budget.batch_id, extra={"event": "config_reload_ignored", "reason": "batch_id"},
+            )
+            budget = copy.copy(budget)
+            budget.batch_id = self.budget.batch_id
+        with self._lock:
+            self.budget = budget
+            self.pricing = pricing
+            self._conversation_models = {
+                model_id: UsageTotals(totals.input_tokens, totals.output_tokens, self.cost(model_id, totals.input_tokens, totals.output_tokens))
+                for model_id, totals in self._conversation_models.items()
+            }
+            self.conversation = UsageTotals()
+            for totals in self._conversation_models.values():
+                self.conversation.add(totals.input_tokens, totals.output_tokens, totals.cost)
+            self._shares_batch = bool(budget.batch_id and (budget.batch or budget.models))
+            if not self._shares_batch:
+                self._other_models = {}
+            self._combine()
+        if self._shares_batch:
+            self._load_batch_usage()
+
+    def cost(self, model_id: str, input_tokens: int, output_tokens: int) -> float:
+        """料金 (USD) を計算する (料金が設定されていないモデルは0)"""
+        price = self.pricing.get(model_id)
+        return price.cost(input_tokens, output_tokens) if price else 0.0
+
+    def _scopes(self, model_id: str) -> Iterator[Tuple[str, BudgetLimit, UsageTotals]]:
+        """モデルに適用される (ラベル, 上限, 累計) を列挙する"""
+        if self.budget.conversation:
+            yield "会話", self.budget.conversation, self.conversation
+        if self.budget.batch and self.budget.batch_id:
+            yield f"バッチ '{self.budget.batch_id}'", self.budget.batch, self.batch
+        model_limit = self.budget.models.get(model_id)
+        if model_limit:
+            yield f"モデル '{model_id}'", model_limit, self.models.get(model_id, UsageTotals())
+
+    def record(self, model_id: str, input_tokens: int, output_tokens: int) -> float:
+        """1回のLLM呼び出しの使用量を記録し、その料金を返す"""
+        cost = self.cost(model_id, input_tokens, output_tokens)
+        with self._lock:
+            self.conversation.add(input_tokens, output_tokens, cost)
+            self._conversation_models.setdefault(model_id, UsageTotals()).add(input_tokens, output_tokens, cost)
+            self.batch.add(input_tokens, output_tokens, cost)
+            self.models.setdefault(model_id, UsageTotals()).add(input_tokens, output_tokens, cost)
+            warnings = self._warn_if_needed(model_id)
+        if self.on_warning is not None:
+            for message in warnings:
+                self.on_warning(message)
+        return cost
+
+    def _warn_if_needed(self, model_id: str) -> List[str]:
+        """上限の warn_ratio を超えた範囲について一度だけ警告し、警告のメッセージを返す"""
+        warnings = []
+        for label, limit, totals in self._scopes(model_id):
+            if label in self._warned:
+                continue
+            ratio = max(
+                totals.tokens / limit.max_tokens if limit.max_tokens else 0.0,
+                totals.cost / limit.max_cost if limit.max_cost else 0.0,
+            )
+            if ratio >= self.budget.warn_ratio:
+                self._warned.add(label)
+                message = f"{label} の予算の {ratio:.0%} を使用しました ({totals!r}, 上限: {limit!r})"
+                logger.warning(
+                    "%s", message,
+                    extra={"event": "budget_warning", "conversation_id": self.conversation_id, "model": model_id},
+                )
+                warnings.append(message)
+        return warnings
+
+    def check(self, model_id: str) -> None:
+        """
+        次のLLM呼び出しの前に予算を確認する (バッチの予算があれば、他の会話の使用量をデータベースから読み直す)。
+
+        Raises:
+            BudgetExceededError: いずれかの範囲で上限に達している場合。
+        """
+        if self._shares_batch:
+            self._load_batch_usage()
+        for label, limit, totals in self._scopes(model_id):
+            if limit.max_tokens and totals.tokens >= limit.max_tokens:
+                raise BudgetExceededError(f"{label} のトークン数が上限に達しました ({totals.tokens} >= {limit.max_tokens})")
+            if limit.max_cost and totals.cost >= limit.max_cost:
+                raise BudgetExceededError(f"{label} の料金が上限に達しました (${totals.cost:.4f} >= ${limit.max_cost})")
+
+    def remaining_output_tokens(self, model_id: str, input_tokens: int = 0) -> Optional[int]:
+        """
+        予算内で次の呼び出しに許される出力トークン数を返す (上限がなければ None)。
+
+        Args:
+            model_id: 呼び出すモデルのID。
+            input_tokens: 次の呼び出しで送信する入力トークン数 (推定値)。
+        """
+        remaining: Optional[int] = None
+        price = self.pricing.get(model_id)
+        for _, limit, totals in self._scopes(model_id):
+            candidates = []
+            if limit.max_tokens:
+                candidates.append(limit.max_tokens - totals.tokens - input_tokens)
+            if limit.max_cost and price and price.output_per_million:
+                input_cost = input_tokens * price.input_per_million / 1_000_000
+                remaining_cost = limit.max_cost - totals.cost - input_cost
+                candidates.append(int(remaining_cost * 1_000_000 / price.output_per_million))
+            for candidate in candidates:
+                remaining = candidate if remaining is None else min(remaining, candidate)
+        if remaining is None:
+            return None
+        return max(remaining, 1)
+
+    def output_token_limit(self, model_id: str, input_tokens: int = 0, cap: int = DEFAULT_OUTPUT_TOKEN_CAP) -> Optional[int]:
+        """
+        次の呼び出しで出力トークン数を制限する場合、その上限を返す。
+
+        予算の残りが1回の呼び出しの上限 cap (model_output_limit の値) 以上であれば制限しない (None)。
+        残りの予算をそのまま max_tokens に指定すると、プロバイダーの出力上限を超えてリクエストが拒否されるため。
+        """
+        remaining = self.remaining_output_tokens(model_id, input_tokens)
+        if remaining is None or remaining >= cap:
+            return None
+        return remaining
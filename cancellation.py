@@ -0,0 +1,51 @@
+import threading
+from typing import Optional
+
+
+class TurnCancelled(Exception):
+    """実行中のターンがキャンセルされた場合に送出される例外 (途中までのレスポンスを保持する)"""
+
+    def __init__(self, reason: str, partial_text: str = ""):
+        super().__init__(reason)
+        self.reason = reason
+        self.partial_text = partial_text
+
+
+class CancelToken:
+    """
+    会話セッションのキャンセルを通知するトークン。
+
+    別のスレッド (サーバーのイベントループなど) から `cancel()` を呼び出すと、会話を実行しているスレッドは
+    ストリームのチャンクの区切りやターンの間の待機中にそれを検出し、そのセッションだけを中断する。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """キャンセルを要求する (最初の理由のみ保持する)"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """最大 timeout 秒待機する。キャンセルされた場合はすぐに True を返す"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self, partial_text: str = "") -> None:
+        """
+        キャンセルされていれば例外を送出する。
+
+        Raises:
+            TurnCancelled: キャンセルが要求されている場合。
+        """
+        if self._event.is_set():
+            raise TurnCancelled(self.reason or "cancelled", partial_text)
+
+    def __repr__(self):
+        return f"<CancelToken cancelled={self.cancelled} reason={self.reason!r}>"
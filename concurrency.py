@@ -0,0 +1,336 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from cancellation import CancelToken, TurnCancelled
+
+# ロガーを取得
+logger = logging.getLogger(__name__)
+
+# キャンセルを確認しながら空きを待つ間隔 (秒)
+_ACQUIRE_POLL_SECONDS = 0.5
+
+# 適応的な上限 (AIMD) のパラメータ
+# 過負荷のエラー (429 / 5xx / タイムアウト) を受けたときに上限に掛ける係数
+_OVERLOAD_DECREASE = 0.5
+# 最初のチャンクまでの時間が平常時の _LATENCY_SPIKE_RATIO 倍を超えたときに上限に掛ける係数
+_LATENCY_DECREASE = 0.75
+_LATENCY_SPIKE_RATIO = 2.0
+# 平常時との差がこの秒数未満のばらつきはスパイクとみなさない (応答の速いモデルでの誤検出を防ぐ)
+_LATENCY_SPIKE_MIN_SECONDS = 0.5
+# 平常時のレイテンシ (指数移動平均) の平滑化係数と、スパイクの判定を始めるまでのサンプル数
+_LATENCY_EWMA_ALPHA = 0.2
+_LATENCY_MIN_SAMPLES = 5
+
+# 過負荷とみなす例外のクラス名の一部 (openai.RateLimitError, APITimeoutError, anthropic.OverloadedError など)
+_OVERLOAD_ERROR_NAMES = ("RateLimit", "Timeout", "Overloaded")
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """
+    例外がサーバーの過負荷 (429 / 5xx / タイムアウト) によるものかどうかを判定する。
+
+    llm のプラグインは各社の SDK や httpx の例外をそのまま送出するため、
+    status_code / status / response.status_code 属性とクラス名で判定する。
+    """
+    for status in (
+        getattr(exc, "status_code", None),
+        getattr(exc, "status", None),
+        getattr(getattr(exc, "response", None), "status_code", None),
+    ):
+        if isinstance(status, int) and not isinstance(status, bool):
+            return status == 429 or status >= 500
+    name = type(exc).__name__
+    return any(part in name for part in _OVERLOAD_ERROR_NAMES)
+
+
+class _Gate:
+    """
+    1つのモデル (または concurrency_group) の実行枠。
+
+    adaptive が False の場合は上限 ceiling の固定の枠として動作する。True の場合は AIMD で上限を調整する:
+    呼び出しの間に上限まで使い切った状態で正常に応答するたびに上限を 1/上限 ずつ増やし (上限ぶんの応答でおよそ +1)、
+    過負荷のエラーやレイテンシのスパイクを受けると係数を掛けて減らす。減らした後に開始した呼び出しの結果が
+    出るまでは次の減少を行わないため、同じ混雑で実行中の呼び出しが一斉に失敗しても1回しか減らさない。
+    """
+
+    def __init__(self, key: str, ceiling: int, floor: int = 1, adaptive: bool = False):
+        self.key = key
+        self.ceiling = ceiling
+        self.floor = max(1, min(floor, ceiling))
+        self.adaptive = adaptive
+        # 適応的な上限は floor から始めて、応答を見ながら ceiling まで増やす
+        self.limit = float(self.floor if adaptive else ceiling)
+        self.in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        self.errors = 0
+        self.latency_spikes = 0
+        self.waits = 0
+        self.latency_ewma: Optional[float] = None
+        self.latency_samples = 0
+        # 実行中の呼び出し数が上限に達した回数 (呼び出しの間に上限まで使い切ったかどうかの判定用)
+        self._saturations = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def reconfigure(self, ceiling: int, floor: int, adaptive: bool) -> None:
+        """上限の設定を差し替える (実行中の呼び出しはそのまま続け、調整済みの上限は新しい範囲に収める)"""
+        with self._condition:
+            self.ceiling = ceiling
+            self.floor = max(1, min(floor, ceiling))
+            if not adaptive:
+                self.limit = float(ceiling)
+            elif not self.adaptive:
+                self.limit = float(self.floor)
+            else:
+                self.limit = min(float(ceiling), max(float(self.floor), self.limit))
+            self.adaptive = adaptive
+            self._condition.notify_all()
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.floor, int(self.limit))
+
+    def acquire(self, cancel_token: Optional[CancelToken]) -> "Slot":
+        with self._condition:
+            if self.in_flight >= self.current_limit:
+                self.waits += 1
+                logger.debug(
+                    "モデル '%s' の同時実行数の上限 (%d) に達したため待機します", self.key, self.current_limit,
+                    extra={"event": "concurrency_wait", "model": self.key},
+                )
+                while self.in_flight >= self.current_limit:
+                    self._condition.wait(timeout=_ACQUIRE_POLL_SECONDS)
+                    if cancel_token is not None and cancel_token.cancelled:
+                        # 待機をやめる前に、次に待っているスレッドへ通知を引き継ぐ
+                        self._condition.notify()
+                        cancel_token.raise_if_cancelled()
+            self.in_flight += 1
+            if self.in_flight >= self.current_limit:
+                self._saturations += 1
+            return Slot(self, self._saturations - (self.in_flight >= self.current_limit))
+
+    def release(self, slot: "Slot", latency: Optional[float], overloaded: bool, failed: bool) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            previous = self.current_limit
+            if overloaded:
+                self.errors += 1
+                self.overloads += 1
+                self._decrease(slot, _OVERLOAD_DECREASE, "過負荷のエラー")
+            elif failed:
+                # 過負荷以外のエラー (プロンプトの不備など) は上限の調整に使わない
+                self.errors += 1
+            elif latency is not None:
+                self.successes += 1
+                self._observe_latency(slot, latency)
+            if self.current_limit != previous:
+                logger.info(
+                    "モデル '%s' の同時実行数の上限を %d から %d に変更しました",
+                    self.key, previous, self.current_limit,
+                    extra={"event": "concurrency_limit", "model": self.key, "reason": "increase" if self.current_limit > previous else "decrease"},
+                )
+            self._condition.notify_all()
+
+    def _observe_latency(self, slot: "Slot", latency: float) -> None:
+        spike = (
+            self.latency_samples >= _LATENCY_MIN_SAMPLES
+            and latency > self.latency_ewma * _LATENCY_SPIKE_RATIO
+            and latency - self.latency_ewma >= _LATENCY_SPIKE_MIN_SECONDS
+        )
+        if spike:
+            self.latency_spikes += 1
+            self._decrease(slot, _LATENCY_DECREASE, "レイテンシのスパイク")
+        elif self.adaptive and self._saturations > slot.saturations:
+            # 呼び出しの間に上限まで使い切っていなかった場合は、上限を増やしても効果が確認できないため増やさない
+            self.limit = min(float(self.ceiling), self.limit + 1.0 / self.limit)
+        self.latency_ewma = latency if self.latency_ewma is None else (
+            _LATENCY_EWMA_ALPHA * latency + (1 - _LATENCY_EWMA_ALPHA) * self.latency_ewma
+        )
+        self.latency_samples += 1
+
+    def _decrease(self, slot: "Slot", factor: float, reason: str) -> None:
+        if not self.adaptive or slot.started < self._last_decrease:
+            return
+        self.limit = max(float(self.floor), self.limit * factor)
+        self._last_decrease = time.monotonic()
+        logger.debug(
+            "モデル '%s' で%sを検出したため同時実行数の上限を減らします", self.key, reason,
+            extra={"event": "concurrency_decrease", "model": self.key, "reason": reason},
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "limit": self.current_limit,
+                "ceiling": self.ceiling,
+                "floor": self.floor,
+                "adaptive": self.adaptive,
+                "in_flight": self.in_flight,
+                "successes": self.successes,
+                "overloads": self.overloads,
+                "errors": self.errors,
+                "latency_spikes": self.latency_spikes,
+                "latency_ewma_ms": round(self.latency_ewma * 1000) if self.latency_ewma is not None else None,
+                "waits": self.waits,
+            }
+
+
+class Slot:
+    """
+    確保したモデルの実行枠。
+
+    レイテンシは first_chunk() を呼んだ時点 (最初のチャンクが届いた時点) までの時間で測る。
+    呼ばなかった場合は枠を解放した時点までの時間になる。出力の長さに左右されないため、
+    最初のチャンクまでの時間のほうがサーバーの混み具合をよく表す。
+    """
+
+    def __init__(self, gate: Optional[_Gate] = None, saturations: int = 0):
+        self._gate = gate
+        # 確保した時点 (この呼び出しで上限に達した場合はその直前) の _Gate._saturations
+        self.saturations = saturations
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def first_chunk(self) -> None:
+        """最初のチャンクが届いたことを記録する"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def _release(self, exc: Optional[BaseException]) -> None:
+        if self._gate is None:
+            return
+        if exc is None:
+            self.first_chunk()
+            self._gate.release(self, self.latency, overloaded=False, failed=False)
+        elif isinstance(exc, TurnCancelled) or not isinstance(exc, Exception):
+            # キャンセルや Ctrl+C による中断はサーバーの状態と関係ないため、上限の調整にも集計にも使わない
+            self._gate.release(self, None, overloaded=False, failed=False)
+        else:
+            self._gate.release(self, None, overloaded=is_overload_error(exc), failed=True)
+
+
+class ModelConcurrencyLimiter:
+    """
+    モデルIDごとに同時に実行するLLM呼び出しの数を制限するクラス。
+
+    ローカルのサーバー (llama.cpp server の --parallel, ollama の OLLAMA_NUM_PARALLEL など) は
+    同時に処理できるリクエスト数 (スロット数) が決まっており、それを超えるとキューで待たされるか
+    メモリ不足で失敗する。上限をスロット数に合わせて複数の会話で共有すると、サーバー側で
+    同時に届いたリクエストがまとめてバッチ処理され、スループットが最大になる。
+    上限が0 (または未設定) のモデルは制限しない。制限は同じプロセス内の会話の間でのみ共有される。
+
+    adaptive が有効なモデルは、上限を min_concurrency から max_concurrency の間で AIMD により調整する
+    (レート制限のあるAPIなど、適切な上限が事前にわからない場合用)。groups で複数のモデルIDを
+    1つの枠 (同じプロバイダーやサーバー) にまとめられる。
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        adaptive: Optional[Dict[str, int]] = None,
+        groups: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Args:
+            limits (Optional[Dict[str, int]]): モデルID (またはグループ名) ごとの上限。
+            adaptive (Optional[Dict[str, int]]): 上限を調整するモデルID (またはグループ名) と、その下限。
+            groups (Optional[Dict[str, str]]): モデルIDから枠を共有するグループ名への対応。
+        """
+        adaptive = adaptive or {}
+        self._groups = dict(groups or {})
+        self._gates = {
+            key: _Gate(key, limit, adaptive.get(key, 1), key in adaptive)
+            for key, limit in (limits or {}).items() if limit
+        }
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {}
+
+    @classmethod
+    def from_profiles(cls, profiles: Dict[str, "ModelProfile"]) -> "ModelConcurrencyLimiter":
+        """モデルプロファイルの max_concurrency / adaptive_concurrency / concurrency_group から作成する"""
+        limits: Dict[str, int] = {}
+        adaptive: Dict[str, int] = {}
+        groups: Dict[str, str] = {}
+        for model_id, profile in profiles.items():
+            key = profile.concurrency_group or model_id
+            if key != model_id:
+                groups[model_id] = key
+            # 同じグループのモデルは、最も大きい上限と最も小さい下限を使う
+            limits[key] = max(limits.get(key, 0), profile.max_concurrency)
+            if profile.adaptive_concurrency:
+                adaptive[key] = min(adaptive.get(key, profile.min_concurrency), profile.min_concurrency)
+        return cls(limits, adaptive, groups)
+
+    def reconfigure(self, profiles: Dict[str, "ModelProfile"]) -> None:
+        """
+        モデルプロファイルの変更 (設定の再読み込み) を反映する。
+
+        既存の枠は実行中の呼び出しの数と調整済みの上限を引き継ぐ。上限がなくなった枠は、
+        実行中の呼び出しが元の枠に返却された後に使われなくなる。
+        """
+        updated = ModelConcurrencyLimiter.from_profiles(profiles)
+        with self._lock:
+            gates: Dict[str, _Gate] = {}
+            for key, new_gate in updated._gates.items():
+                gate = self._gates.get(key)
+                if gate is None:
+                    gates[key] = new_gate
+                else:
+                    gate.reconfigure(new_gate.ceiling, new_gate.floor, new_gate.adaptive)
+                    gates[key] = gate
+            self._gates = gates
+            self._groups = updated._groups
+
+    def _key(self, model_id: str) -> str:
+        return self._groups.get(model_id, model_id)
+
+    @property
+    def limits(self) -> Dict[str, int]:
+        """上限のあるモデルID (またはグループ名) ごとの現在の上限"""
+        return {key: gate.current_limit for key, gate in self._gates.items()}
+
+    @property
+    def waits(self) -> int:
+        """空きを待った回数 (ベンチマークやログでの確認用)"""
+        return sum(gate.waits for gate in self._gates.values())
+
+    def in_flight(self, model_id: str) -> int:
+        """実行中の呼び出し数を返す"""
+        with self._lock:
+            return self._in_flight.get(model_id, 0)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """上限のあるモデルID (またはグループ名) ごとの上限・実行中の呼び出し数・応答の集計"""
+        return {key: gate.metrics() for key, gate in self._gates.items()}
+
+    @contextmanager
+    def slot(self, model_id: str, cancel_token: Optional[CancelToken] = None) -> Iterator[Slot]:
+        """
+        モデルの実行枠を1つ確保する (空きがなければ待機する)。
+
+        ブロック内で送出された例外は、過負荷によるものであれば上限の調整に使ってからそのまま伝播する。
+
+        Raises:
+            TurnCancelled: 待機中に cancel_token がキャンセルされた場合。
+        """
+        gate = self._gates.get(self._key(model_id))
+        slot = gate.acquire(cancel_token) if gate is not None else Slot()
+        with self._lock:
+            self._in_flight[model_id] = self._in_flight.get(model_id, 0) + 1
+        try:
+            yield slot
+        except BaseException as e:
+            slot._release(e)
+            raise
+        else:
+            slot._release(None)
+        finally:
+            with self._lock:
+                self._in_flight[model_id] -= 1
+
+    def __repr__(self):
+        return f"<ModelConcurrencyLimiter limits={self.limits}>"
@@ -1,6 +1,9 @@
 import argparse
+import logging
 import os
-from typing import List, Dict, Any, Optional
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 
 
 # Use yaml_include for !include tag support
@@ -18,6 +21,10 @@ yaml.add_constructor('!include', include_constructor, Loader=yaml.FullLoader)
 # --- セットアップ完了 ---
 
 
+# ロガーを取得
+logger = logging.getLogger(__name__)
+
+
 CONFIG_FILE_PATH = "config.yaml"
 DB_PATH = os.path.join("logs", "conversation.db")
 
@@ -34,10 +41,188 @@ class ParticipantConfig:
         return f"<ParticipantConfig name='{self.name}' model='{self.model}'>"
 
 
+class TerminationConfig:
+    """会話の早期終了 (収束検出) の設定を保持するクラス"""
+
+    def __init__(
+        self,
+        similarity_threshold: Optional[float] = None,
+        similarity_window: int = 4,
+        end_markers: Optional[List[str]] = None,
+        moderator_judge_every: int = 0,
+        max_tokens: int = 0,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.similarity_window = similarity_window
+        self.end_markers = end_markers or []
+        self.moderator_judge_every = moderator_judge_every
+        self.max_tokens = max_tokens
+
+    def __repr__(self):
+        return (
+            f"<TerminationConfig similarity_threshold={self.similarity_threshold} "
+            f"end_markers={self.end_markers} moderator_judge_every={self.moderator_judge_every} "
+            f"max_tokens={self.max_tokens}>"
+        )
+
+
+class RetrievalConfig:
+    """
+    ターンの埋め込みベクトルによる意味検索 (関連する過去の発言の参照) の設定を保持するクラス。
+
+    embedding_model が指定されていない場合は無効。
+    """
+
+    def __init__(
+        self,
+        embedding_model: Optional[str] = None,
+        top_k: int = 3,
+        exclude_recent: int = 1,
+        min_score: float = 0.0,
+    ):
+        self.embedding_model = embedding_model
+        self.top_k = top_k
+        self.exclude_recent = exclude_recent
+        self.min_score = min_score
+
+    def __bool__(self):
+        return bool(self.embedding_model and self.top_k)
+
+    def __repr__(self):
+        return (
+            f"<RetrievalConfig embedding_model='{self.embedding_model}' top_k={self.top_k} "
+            f"exclude_recent={self.exclude_recent} min_score={self.min_score}>"
+        )
+
+
+class ModelPrice:
+    """モデルの料金 (100万トークンあたりのUSD) を保持するクラス"""
+
+    def __init__(self, input_per_million: float = 0.0, output_per_million: float = 0.0):
+        self.input_per_million = input_per_million
+        self.output_per_million = output_per_million
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        """トークン数から料金 (USD) を計算する"""
+        return (input_tokens * self.input_per_million + output_tokens * self.output_per_million) / 1_000_000
+
+    def __repr__(self):
+        return f"<ModelPrice input={self.input_per_million} output={self.output_per_million}>"
+
+
+class BudgetLimit:
+    """トークン数と料金の上限を保持するクラス (0 は無制限)"""
+
+    def __init__(self, max_tokens: int = 0, max_cost: float = 0.0):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+
+    def __bool__(self):
+        return bool(self.max_tokens or self.max_cost)
+
+    def __repr__(self):
+        return f"<BudgetLimit max_tokens={self.max_tokens} max_cost={self.max_cost}>"
+
+
+class BudgetConfig:
+    """トークン・料金の予算設定を保持するクラス"""
+
+    def __init__(
+        self,
+        conversation: Optional[BudgetLimit] = None,
+        batch: Optional[BudgetLimit] = None,
+        models: Optional[Dict[str, BudgetLimit]] = None,
+        warn_ratio: float = 0.8,
+        batch_id: Optional[str] = None,
+    ):
+        self.conversation = conversation or BudgetLimit()
+        self.batch = batch or BudgetLimit()
+        self.models = models or {}
+        self.warn_ratio = warn_ratio
+        self.batch_id = batch_id
+
+    def __repr__(self):
+        return (
+            f"<BudgetConfig conversation={self.conversation!r} batch={self.batch!r} "
+            f"models={self.models!r} batch_id='{self.batch_id}'>"
+        )
+
+
+MODEL_BACKENDS = ("llm", "openai_compatible")
+
+
+class ModelProfile:
+    """
+    モデルIDごとの実行プロファイルを保持するクラス。
+
+    backend が "llm" の場合はインストール済みの llm プラグイン (llm-gpt4all, llm-ollama など) でモデルを解決し、
+    "openai_compatible" の場合は api_base の OpenAI 互換サーバー (llama.cpp server, ollama, vLLM など) を使う。
+    adaptive_concurrency が有効な場合、max_concurrency は上限の最大値になり、実際の上限は min_concurrency から
+    レイテンシと過負荷のエラーを見ながら調整される。concurrency_group が同じモデルは同時実行数の枠を共有する。
+    """
+
+    def __init__(
+        self,
+        backend: str = "llm",
+        api_base: Optional[str] = None,
+        model_name: Optional[str] = None,
+        api_key_env: Optional[str] = None,
+        max_concurrency: int = 0,
+        options: Optional[Dict[str, Any]] = None,
+        adaptive_concurrency: bool = False,
+        min_concurrency: int = 1,
+        concurrency_group: Optional[str] = None,
+    ):
+        self.backend = backend
+        self.api_base = api_base
+        self.model_name = model_name
+        self.api_key_env = api_key_env
+        self.max_concurrency = max_concurrency
+        self.options = options or {}
+        self.adaptive_concurrency = adaptive_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_group = concurrency_group
+
+    def __repr__(self):
+        return (
+            f"<ModelProfile backend='{self.backend}' api_base='{self.api_base}' "
+            f"max_concurrency={self.max_concurrency} adaptive_concurrency={self.adaptive_concurrency}>"
+        )
+
+
+TOURNAMENT_FORMATS = ("round_robin", "swiss")
+
+
+class TournamentConfig:
+    """モデル・ペルソナの組み合わせを対戦させるトーナメントの設定を保持するクラス"""
+
+    def __init__(
+        self,
+        entrants: List[ParticipantConfig],
+        format: str = "round_robin",
+        rounds: int = 3,
+        games_per_pair: int = 1,
+        concurrency: int = 4,
+        max_turns: Optional[int] = None,
+    ):
+        self.entrants = entrants
+        self.format = format
+        self.rounds = rounds
+        self.games_per_pair = games_per_pair
+        self.concurrency = concurrency
+        self.max_turns = max_turns
+
+    def __repr__(self):
+        return (
+            f"<TournamentConfig format='{self.format}' entrants={len(self.entrants)} "
+            f"rounds={self.rounds} games_per_pair={self.games_per_pair} concurrency={self.concurrency}>"
+        )
+
+
 class AppConfig:
     """アプリケーション全体の設定を保持するクラス"""
 
-    def __init__(self, topic: str, participants: List[ParticipantConfig], moderator: ParticipantConfig, max_turns: int = 10, llm_wait_time: int = 1, show_prompt: bool = False, log_level: str = "none", show_summary: bool = True):
+    def __init__(self, topic: str, participants: List[ParticipantConfig], moderator: ParticipantConfig, max_turns: int = 10, llm_wait_time: int = 1, show_prompt: bool = False, log_level: str = "none", show_summary: bool = True, prompt_cache: bool = True, store_persona_fragments: bool = False, termination: Optional[TerminationConfig] = None, max_response_chars: int = 0, strip_reasoning: bool = True, budget: Optional[BudgetConfig] = None, pricing: Optional[Dict[str, ModelPrice]] = None, tournament: Optional[TournamentConfig] = None, cache_moderator_intro: bool = False, async_moderator_intro: bool = False, summary_chunk_chars: int = 0, model_profiles: Optional[Dict[str, ModelProfile]] = None, retrieval: Optional[RetrievalConfig] = None):
         self.topic = topic
         self.participants = participants
         self.moderator = moderator
@@ -46,6 +231,19 @@ class AppConfig:
         self.show_prompt = show_prompt
         self.log_level = log_level
         self.show_summary = show_summary
+        self.prompt_cache = prompt_cache
+        self.store_persona_fragments = store_persona_fragments
+        self.termination = termination or TerminationConfig()
+        self.max_response_chars = max_response_chars
+        self.strip_reasoning = strip_reasoning
+        self.budget = budget or BudgetConfig()
+        self.pricing = pricing or {}
+        self.tournament = tournament
+        self.cache_moderator_intro = cache_moderator_intro
+        self.async_moderator_intro = async_moderator_intro
+        self.summary_chunk_chars = summary_chunk_chars
+        self.model_profiles = model_profiles or {}
+        self.retrieval = retrieval or RetrievalConfig()
         self.db_path = DB_PATH
 
 
@@ -61,6 +259,190 @@ def _validate_participant(p: Dict[str, Any], index: int) -> None:
             raise ValueError(f"参加者 {index+1} の '{field}' は空文字列にできません")
 
 
+def _validate_termination(termination_data: Any) -> None:
+    """早期終了設定のバリデーション"""
+    if not isinstance(termination_data, dict):
+        raise ValueError("'termination' はマッピングである必要があります。")
+    threshold = termination_data.get("similarity_threshold")
+    if threshold is not None and (isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 < threshold <= 1):
+        raise ValueError(f"'termination.similarity_threshold' は 0 より大きく 1 以下の数値である必要があります: {threshold}")
+    for key in ("similarity_window", "moderator_judge_every", "max_tokens"):
+        value = termination_data.get(key, 0)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"'termination.{key}' は0以上の整数である必要があります: {value}")
+    end_markers = termination_data.get("end_markers", [])
+    if isinstance(end_markers, str):
+        end_markers = [end_markers]
+    if not isinstance(end_markers, list) or not all(isinstance(m, str) for m in end_markers):
+        raise ValueError(f"'termination.end_markers' は文字列のリストである必要があります: {end_markers}")
+
+
+def _validate_retrieval(retrieval_data: Any) -> None:
+    """意味検索の設定のバリデーション"""
+    if not isinstance(retrieval_data, dict):
+        raise ValueError("'retrieval' はマッピングである必要があります。")
+    embedding_model = retrieval_data.get("embedding_model")
+    if embedding_model is not None and (not isinstance(embedding_model, str) or not embedding_model.strip()):
+        raise ValueError(f"'retrieval.embedding_model' は空でない文字列である必要があります: {embedding_model}")
+    for key, default in (("top_k", 3), ("exclude_recent", 1)):
+        value = retrieval_data.get(key, default)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"'retrieval.{key}' は0以上の整数である必要があります: {value}")
+    min_score = retrieval_data.get("min_score", 0.0)
+    if isinstance(min_score, bool) or not isinstance(min_score, (int, float)) or not -1 <= min_score <= 1:
+        raise ValueError(f"'retrieval.min_score' は -1 以上 1 以下の数値である必要があります: {min_score}")
+
+
+def _is_non_negative_number(value: Any) -> bool:
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and value >= 0
+
+
+def _validate_budget_limit(limit_data: Any, label: str) -> None:
+    """予算の上限設定 (max_tokens / max_cost) のバリデーション"""
+    if not isinstance(limit_data, dict):
+        raise ValueError(f"'{label}' はマッピングである必要があります。")
+    max_tokens = limit_data.get("max_tokens", 0)
+    if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 0:
+        raise ValueError(f"'{label}.max_tokens' は0以上の整数である必要があります: {max_tokens}")
+    max_cost = limit_data.get("max_cost", 0)
+    if not _is_non_negative_number(max_cost):
+        raise ValueError(f"'{label}.max_cost' は0以上の数値である必要があります: {max_cost}")
+
+
+def _validate_budget(budget_data: Any) -> None:
+    """予算設定のバリデーション"""
+    if not isinstance(budget_data, dict):
+        raise ValueError("'budget' はマッピングである必要があります。")
+    for scope in ("conversation", "batch"):
+        if scope in budget_data:
+            _validate_budget_limit(budget_data[scope], f"budget.{scope}")
+    models = budget_data.get("models", {})
+    if not isinstance(models, dict):
+        raise ValueError("'budget.models' はモデルIDをキーとするマッピングである必要があります。")
+    for model_id, limit_data in models.items():
+        _validate_budget_limit(limit_data, f"budget.models.{model_id}")
+    warn_ratio = budget_data.get("warn_ratio", 0.8)
+    if not _is_non_negative_number(warn_ratio) or warn_ratio > 1:
+        raise ValueError(f"'budget.warn_ratio' は0以上1以下の数値である必要があります: {warn_ratio}")
+
+
+def _validate_pricing(pricing_data: Any) -> None:
+    """料金設定のバリデーション"""
+    if not isinstance(pricing_data, dict):
+        raise ValueError("'pricing' はモデルIDをキーとするマッピングである必要があります。")
+    for model_id, price in pricing_data.items():
+        if not isinstance(price, dict):
+            raise ValueError(f"'pricing.{model_id}' はマッピングである必要があります。")
+        for key in ("input", "output"):
+            if not _is_non_negative_number(price.get(key, 0)):
+                raise ValueError(f"'pricing.{model_id}.{key}' は0以上の数値である必要があります: {price.get(key)}")
+
+
+def _validate_model_profiles(profiles_data: Any) -> None:
+    """モデルプロファイル設定のバリデーション"""
+    if not isinstance(profiles_data, dict):
+        raise ValueError("'model_profiles' はモデルIDをキーとするマッピングである必要があります。")
+    for model_id, profile in profiles_data.items():
+        label = f"model_profiles.{model_id}"
+        if not isinstance(profile, dict):
+            raise ValueError(f"'{label}' はマッピングである必要があります。")
+        backend = profile.get("backend", "llm")
+        if backend not in MODEL_BACKENDS:
+            raise ValueError(f"'{label}.backend' は {' / '.join(MODEL_BACKENDS)} のいずれかである必要があります: {backend}")
+        if backend == "openai_compatible" and not profile.get("api_base"):
+            raise ValueError(f"'{label}.api_base' は backend が openai_compatible の場合に必須です。")
+        for key in ("api_base", "model_name", "api_key_env", "concurrency_group"):
+            if key in profile and not isinstance(profile[key], str):
+                raise ValueError(f"'{label}.{key}' は文字列である必要があります: {profile[key]}")
+        max_concurrency = profile.get("max_concurrency", 0)
+        if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency < 0:
+            raise ValueError(f"'{label}.max_concurrency' は0以上の整数である必要があります: {max_concurrency}")
+        adaptive_concurrency = profile.get("adaptive_concurrency", False)
+        if not isinstance(adaptive_concurrency, bool):
+            raise ValueError(f"'{label}.adaptive_concurrency' は真偽値である必要があります: {adaptive_concurrency}")
+        if adaptive_concurrency and not max_concurrency:
+            raise ValueError(f"'{label}.max_concurrency' は adaptive_concurrency が有効な場合に必須です (上限の最大値)。")
+        min_concurrency = profile.get("min_concurrency", 1)
+        if not _positive_int(min_concurrency):
+            raise ValueError(f"'{label}.min_concurrency' は正の整数である必要があります: {min_concurrency}")
+        if max_concurrency and min_concurrency > max_concurrency:
+            raise ValueError(f"'{label}.min_concurrency' ({min_concurrency}) は max_concurrency ({max_concurrency}) 以下である必要があります。")
+        if not isinstance(profile.get("options", {}), dict):
+            raise ValueError(f"'{label}.options' はマッピングである必要があります。")
+
+
+def _positive_int(value: Any) -> bool:
+    return not isinstance(value, bool) and isinstance(value, int) and value > 0
+
+
+def _validate_tournament(tournament_data: Any) -> None:
+    """トーナメント設定のバリデーション"""
+    if not isinstance(tournament_data, dict):
+        raise ValueError("'tournament' はマッピングである必要があります。")
+    tournament_format = tournament_data.get("format", "round_robin")
+    if tournament_format not in TOURNAMENT_FORMATS:
+        raise ValueError(f"'tournament.format' は {' / '.join(TOURNAMENT_FORMATS)} のいずれかである必要があります: {tournament_format}")
+    for key in ("rounds", "games_per_pair", "concurrency", "max_turns"):
+        if key in tournament_data and not _positive_int(tournament_data[key]):
+            raise ValueError(f"'tournament.{key}' は正の整数である必要があります: {tournament_data[key]}")
+
+    entrants = tournament_data.get("entrants", [])
+    if not isinstance(entrants, list):
+        raise ValueError("'tournament.entrants' はリストである必要があります。")
+    for i, entrant in enumerate(entrants):
+        try:
+            _validate_participant(entrant, i)
+        except ValueError as e:
+            raise ValueError(f"トーナメント参加者 {i+1} の設定エラー: {e}") from e
+
+    # models × personas の組み合わせから参加者を生成する形式
+    models = tournament_data.get("models", [])
+    personas = tournament_data.get("personas", [])
+    if not isinstance(models, list) or not all(isinstance(m, str) and m for m in models):
+        raise ValueError("'tournament.models' はモデルIDのリストである必要があります。")
+    if not isinstance(personas, list):
+        raise ValueError("'tournament.personas' はリストである必要があります。")
+    for i, persona in enumerate(personas):
+        if not isinstance(persona, dict) or not persona.get("name") or not isinstance(persona.get("persona"), str):
+            raise ValueError(f"'tournament.personas' の {i+1} 番目には 'name' と 'persona' が必要です。")
+    if bool(models) != bool(personas):
+        raise ValueError("'tournament.models' と 'tournament.personas' は両方指定する必要があります。")
+
+    names = [e["name"] for e in entrants] + [_tournament_entrant_name(p["name"], m) for m in models for p in personas]
+    if len(names) < 2:
+        raise ValueError("トーナメントには少なくとも2人の参加者が必要です。")
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"トーナメント参加者の名前が重複しています: {', '.join(duplicates)}")
+
+
+def _tournament_entrant_name(persona_name: str, model_id: str) -> str:
+    """models × personas から生成する参加者の名前"""
+    return f"{persona_name} ({model_id})"
+
+
+def _parse_tournament(tournament_data: Dict[str, Any]) -> TournamentConfig:
+    entrants = [ParticipantConfig(e["name"], e["model"], e["persona"]) for e in tournament_data.get("entrants", [])]
+    entrants += [
+        ParticipantConfig(_tournament_entrant_name(p["name"], model_id), model_id, p["persona"])
+        for model_id in tournament_data.get("models", [])
+        for p in tournament_data.get("personas", [])
+    ]
+    return TournamentConfig(
+        entrants,
+        format=tournament_data.get("format", "round_robin"),
+        rounds=tournament_data.get("rounds", 3),
+        games_per_pair=tournament_data.get("games_per_pair", 1),
+        concurrency=tournament_data.get("concurrency", 4),
+        max_turns=tournament_data.get("max_turns"),
+    )
+
+
+def _parse_budget_limit(limit_data: Optional[Dict[str, Any]]) -> BudgetLimit:
+    limit_data = limit_data or {}
+    return BudgetLimit(limit_data.get("max_tokens", 0), limit_data.get("max_cost", 0.0))
+
+
 def _validate_config_data(config_data: Dict[str, Any]) -> None:
     """設定データ全体のバリデーション"""
     # topic のバリデーション
@@ -105,6 +487,52 @@ def _validate_config_data(config_data: Dict[str, Any]) -> None:
     if not isinstance(llm_wait_time, int) or llm_wait_time < 0:
         raise ValueError(f"'llm_wait_time' は0以上の整数である必要があります: {llm_wait_time}")
 
+    # 真偽値のオプションのバリデーション
+    for key, default in (
+        ("prompt_cache", True),
+        ("store_persona_fragments", False),
+        ("strip_reasoning", True),
+        ("cache_moderator_intro", False),
+        ("async_moderator_intro", False),
+    ):
+        value = config_data.get(key, default)
+        if not isinstance(value, bool):
+            raise ValueError(f"'{key}' は真偽値 (true/false) である必要があります: {value}")
+
+    # max_response_chars / summary_chunk_chars のバリデーション (オプション)
+    for key, default in (("max_response_chars", 0), ("summary_chunk_chars", 0)):
+        value = config_data.get(key, default)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"'{key}' は0以上の整数である必要があります: {value}")
+
+    # termination のバリデーション (オプション)
+    termination_data = config_data.get("termination")
+    if termination_data is not None:
+        _validate_termination(termination_data)
+
+    # budget / pricing のバリデーション (オプション)
+    budget_data = config_data.get("budget")
+    if budget_data is not None:
+        _validate_budget(budget_data)
+    pricing_data = config_data.get("pricing")
+    if pricing_data is not None:
+        _validate_pricing(pricing_data)
+
+    # retrieval のバリデーション (オプション)
+    retrieval_data = config_data.get("retrieval")
+    if retrieval_data is not None:
+        _validate_retrieval(retrieval_data)
+
+    # model_profiles のバリデーション (オプション)
+    profiles_data = config_data.get("model_profiles")
+    if profiles_data is not None:
+        _validate_model_profiles(profiles_data)
+
+    # tournament のバリデーション (オプション)
+    tournament_data = config_data.get("tournament")
+    if tournament_data is not None:
+        _validate_tournament(tournament_data)
+
 
 def load_config_from_file(config_path: str = CONFIG_FILE_PATH) -> AppConfig:
     """YAML設定ファイルから設定を読み込む"""
@@ -141,7 +569,76 @@ def load_config_from_file(config_path: str = CONFIG_FILE_PATH) -> AppConfig:
     # llm_wait_time の設定を読み込む (デフォルト値は1秒)
     llm_wait_time = config_data.get("llm_wait_time", 1)
 
-    return AppConfig(topic, participants, moderator, max_turns, llm_wait_time, show_prompt, log_level, show_summary)
+    # ペルソナのプロンプトキャッシュ設定
+    prompt_cache = config_data.get("prompt_cache", True)
+    store_persona_fragments = config_data.get("store_persona_fragments", False)
+
+    # 早期終了 (収束検出) の設定を読み込む (未指定の場合は max_turns まで実行)
+    termination_data = config_data.get("termination") or {}
+    end_markers = termination_data.get("end_markers", [])
+    termination = TerminationConfig(
+        similarity_threshold=termination_data.get("similarity_threshold"),
+        similarity_window=termination_data.get("similarity_window", 4) or 4,
+        end_markers=[end_markers] if isinstance(end_markers, str) else end_markers,
+        moderator_judge_every=termination_data.get("moderator_judge_every", 0),
+        max_tokens=termination_data.get("max_tokens", 0),
+    )
+
+    # レスポンスの後処理 (文字数の上限、推論タグの除去)
+    max_response_chars = config_data.get("max_response_chars", 0)
+    strip_reasoning = config_data.get("strip_reasoning", True)
+
+    # トークン・料金の予算と、モデルごとの料金 (100万トークンあたりのUSD)
+    budget_data = config_data.get("budget") or {}
+    budget = BudgetConfig(
+        conversation=_parse_budget_limit(budget_data.get("conversation")),
+        batch=_parse_budget_limit(budget_data.get("batch")),
+        models={model_id: _parse_budget_limit(limit) for model_id, limit in (budget_data.get("models") or {}).items()},
+        warn_ratio=budget_data.get("warn_ratio", 0.8),
+        batch_id=budget_data.get("batch_id"),
+    )
+    pricing = {
+        model_id: ModelPrice(price.get("input", 0.0), price.get("output", 0.0))
+        for model_id, price in (config_data.get("pricing") or {}).items()
+    }
+
+    # トーナメント (評価モード) の設定 (--tournament 指定時のみ使用)
+    tournament_data = config_data.get("tournament")
+    tournament = _parse_tournament(tournament_data) if tournament_data else None
+
+    # MCの開始アナウンスのキャッシュと非同期生成
+    cache_moderator_intro = config_data.get("cache_moderator_intro", False)
+    async_moderator_intro = config_data.get("async_moderator_intro", False)
+
+    # 要約のプロンプトに含める会話履歴の最大文字数 (超える部分は段階的に要約する)
+    summary_chunk_chars = config_data.get("summary_chunk_chars", 0)
+
+    # モデルごとの実行プロファイル (ローカルのバックエンド、同時実行数の上限とその調整、オプション)
+    model_profiles = {
+        model_id: ModelProfile(
+            backend=profile.get("backend", "llm"),
+            api_base=profile.get("api_base"),
+            model_name=profile.get("model_name"),
+            api_key_env=profile.get("api_key_env"),
+            max_concurrency=profile.get("max_concurrency", 0),
+            options=profile.get("options"),
+            adaptive_concurrency=profile.get("adaptive_concurrency", False),
+            min_concurrency=profile.get("min_concurrency", 1),
+            concurrency_group=profile.get("concurrency_group"),
+        )
+        for model_id, profile in (config_data.get("model_profiles") or {}).items()
+    }
+
+    # ターンの埋め込みベクトルによる意味検索 (関連する過去の発言の参照)
+    retrieval_data = config_data.get("retrieval") or {}
+    retrieval = RetrievalConfig(
+        embedding_model=retrieval_data.get("embedding_model"),
+        top_k=retrieval_data.get("top_k", 3),
+        exclude_recent=retrieval_data.get("exclude_recent", 1),
+        min_score=retrieval_data.get("min_score", 0.0),
+    )
+
+    return AppConfig(topic, participants, moderator, max_turns, llm_wait_time, show_prompt, log_level, show_summary, prompt_cache, store_persona_fragments, termination, max_response_chars, strip_reasoning, budget, pricing, tournament, cache_moderator_intro, async_moderator_intro, summary_chunk_chars, model_profiles, retrieval)
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -149,6 +646,12 @@ def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="LLM同士がテーマについて会話するアプリケーション"
     )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["stats"],
+        help="stats: 会話を実行せず、記録済みの会話ログの統計を表示する"
+    )
     parser.add_argument(
         "--config", "-c",
         default=CONFIG_FILE_PATH,
@@ -174,15 +677,166 @@ def parse_arguments() -> argparse.Namespace:
         action="store_true",
         help="会話の要約をコンソールに出力する"
     )
+    parser.add_argument(
+        "--batch-id",
+        default=None,
+        help="バッチ実行の識別子 (予算の batch 上限はこのIDの会話の合計に適用される)"
+    )
+    parser.add_argument(
+        "--watch-config",
+        action="store_true",
+        help="設定ファイル (とインクルードされたペルソナファイル) の変更を監視し、ターンの区切りで再読み込みする (--serve / --workers / --tournament でも実行中の会話に適用する)"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="サーバーモードで起動し、HTTP API で会話を開始して SSE/WebSocket で配信する"
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="サーバーモードで待ち受けるホスト (デフォルト: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="サーバーモードで待ち受けるポート (デフォルト: 8765)"
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=8,
+        help="サーバーモードで同時に実行する会話セッションの最大数 (デフォルト: 8)"
+    )
+    parser.add_argument(
+        "--enqueue",
+        type=int,
+        metavar="N",
+        default=0,
+        help="会話を実行せず、現在の設定の会話ジョブを N 件ジョブキューに追加する"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        metavar="N",
+        default=0,
+        help="N 個のワーカープロセスを起動し、ジョブキューの会話を実行する"
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=300,
+        help="ワーカーがジョブを保持するリースの秒数 (期限切れのジョブは再実行される, デフォルト: 300)"
+    )
+    parser.add_argument(
+        "--tournament",
+        action="store_true",
+        help="設定ファイルの tournament セクションの参加者で総当たり/スイス式のトーナメントを実行し、MCの採点でリーダーボードを作成する"
+    )
+    parser.add_argument(
+        "--fork",
+        metavar="CONVERSATION_ID",
+        default=None,
+        help="記録済みの会話のターン --fork-turn までを引き継ぎ、その続きを現在の設定 (または --fork-config の設定) で実行する"
+    )
+    parser.add_argument(
+        "--fork-turn",
+        type=int,
+        metavar="K",
+        default=None,
+        help="--fork で分岐するターン番号 (このターンまでを分岐元から引き継ぐ)"
+    )
+    parser.add_argument(
+        "--fork-config",
+        action="append",
+        metavar="PATH",
+        default=None,
+        help="分岐ごとの設定ファイル (複数指定すると、それぞれの分岐を並行して実行する)"
+    )
+    parser.add_argument(
+        "--fork-concurrency",
+        type=int,
+        default=4,
+        help="同時に実行する分岐の数 (デフォルト: 4)"
+    )
+    parser.add_argument(
+        "--estimate",
+        type=int,
+        nargs="?",
+        const=1,
+        metavar="N",
+        default=0,
+        help="会話を実行せず、N 件 (省略時は1件) の会話のトークン数・料金・所要時間を会話ログの実績から見積もる"
+    )
+    parser.add_argument(
+        "--estimate-concurrency",
+        type=int,
+        default=1,
+        help="--estimate で同時に実行する会話の数 (所要時間の見積もりに使う, デフォルト: 1)"
+    )
+    parser.add_argument(
+        "--similar",
+        metavar="TEXT",
+        default=None,
+        help="会話を実行せず、記録済みの全会話から TEXT に意味の近い発言を検索する (retrieval.embedding_model が必要)"
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=5,
+        help="--similar で表示する発言の数 (デフォルト: 5)"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        default=None,
+        help="会話を実行し、LLM呼び出しごとのチャンクとその時間をフィクスチャファイル (JSONL) に記録する"
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        default=None,
+        help="LLMを呼び出さず、--record で記録したフィクスチャのチャンクを再生して会話を実行する"
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="--replay の再生速度の倍率 (0 は待機せずに再生する, デフォルト: 1.0)"
+    )
+    parser.add_argument(
+        "--replay-strict",
+        action="store_true",
+        help="--replay で、プロンプトが一致する記録がない呼び出しを記録順に割り当てずにエラーにする"
+    )
+    parser.add_argument(
+        "--group-by",
+        default="model,persona",
+        help="stats の集計の軸 (model, persona, topic, role をカンマ区切りで指定, デフォルト: model,persona)"
+    )
+    parser.add_argument(
+        "--include-partial",
+        action="store_true",
+        help="stats の集計に中断された途中までのレスポンスも含める"
+    )
+    parser.add_argument(
+        "--export-parquet",
+        metavar="PATH",
+        default=None,
+        help="stats の代わりに、会話ログを Parquet ファイルに書き出す (pyarrow が必要)"
+    )
+    parser.add_argument(
+        "--include-text",
+        action="store_true",
+        help="--export-parquet でプロンプトとレスポンスの本文も書き出す"
+    )
     # 今後、データベースパスなどのオプションを追加できます
     return parser.parse_args()
 
 
-def get_app_config() -> AppConfig:
-    """アプリケーションの設定を取得する (ファイル -> 引数 の優先順位)"""
-    args = parse_arguments()
-    config = load_config_from_file(args.config)
-
+def apply_arguments(config: AppConfig, args: argparse.Namespace) -> AppConfig:
+    """コマンドライン引数の値で設定を上書きする"""
     # コマンドライン引数でテーマが指定されていれば上書き
     if args.topic:
         config.topic = args.topic
@@ -195,5 +849,113 @@ def get_app_config() -> AppConfig:
     # コマンドライン引数で--show-summaryが指定されていればshow_summaryをTrueに設定
     if args.show_summary:
         config.show_summary = True
+    # コマンドライン引数でバッチIDが指定されていれば上書き
+    if getattr(args, "batch_id", None):
+        config.budget.batch_id = args.batch_id
+
+    return config
 
-    return config
\ No newline at end of file
+
+def get_app_config(args: Optional[argparse.Namespace] = None) -> AppConfig:
+    """アプリケーションの設定を取得する (ファイル -> 引数 の優先順位)"""
+    if args is None:
+        args = parse_arguments()
+    config = load_config_from_file(args.config)
+    return apply_arguments(config, args)
+
+
+# !include タグで参照されているファイルパスを抽出する正規表現
+_INCLUDE_PATTERN = re.compile(r"""!include\s+["']?([^"'\s#]+)""")
+
+
+def _find_included_files(config_path: str) -> List[str]:
+    """設定ファイル中の !include で参照されているファイル (ペルソナファイルなど) を列挙する"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as file:
+            content = file.read()
+    except OSError:
+        return []
+    return [os.path.abspath(path) for path in _INCLUDE_PATTERN.findall(content)]
+
+
+class ConfigWatcher:
+    """
+    設定ファイルとインクルードされたファイルの変更を監視し、AppConfig を差し替えるクラス。
+
+    `poll()` はファイルの更新時刻を確認し、変更があれば再読み込みとバリデーションを行う。
+    バリデーションに失敗した場合は現在の設定を維持する。
+    設定の差し替えは参照の付け替えだけで行われるため、読み取り側は常に
+    古い設定か新しい設定のどちらか一方を完全な形で参照する。
+
+    1プロセスで1つの監視を複数の会話で共有できる。再読み込みのたびに version が増えるため、
+    各会話は `changed_since()` に最後に適用した version を渡して、自分がまだ適用していない変更を受け取る
+    (どの会話の `poll()` が変更を検知しても、すべての会話に変更が届く)。
+    """
+
+    def __init__(self, config_path: str = CONFIG_FILE_PATH, args: Optional[argparse.Namespace] = None):
+        self.config_path = config_path
+        self.args = args
+        self._lock = threading.Lock()
+        self._config = self._load()
+        self._mtimes = self._snapshot()
+        # 設定を再読み込みした回数 (利用者ごとの適用済みの設定の判定に使う)
+        self.version = 0
+
+    def _load(self) -> AppConfig:
+        config = load_config_from_file(self.config_path)
+        if self.args is not None:
+            config = apply_arguments(config, self.args)
+        return config
+
+    def _snapshot(self) -> Dict[str, Optional[float]]:
+        """監視対象ファイルの更新時刻を取得する"""
+        paths = [os.path.abspath(self.config_path)] + _find_included_files(self.config_path)
+        mtimes: Dict[str, Optional[float]] = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    @property
+    def config(self) -> AppConfig:
+        """現在有効な設定"""
+        return self._config
+
+    def poll(self) -> Optional[AppConfig]:
+        """
+        ファイルの変更を確認し、変更があれば新しい設定を読み込む。
+
+        Returns:
+            Optional[AppConfig]: 新しい設定に差し替えた場合はその設定、変更がない場合や
+                                 新しい設定が不正な場合は None。
+        """
+        with self._lock:
+            mtimes = self._snapshot()
+            if mtimes == self._mtimes:
+                return None
+            # 不正な設定で毎回警告しないよう、先に更新時刻を記録しておく
+            self._mtimes = mtimes
+            try:
+                new_config = self._load()
+            except (ValueError, FileNotFoundError, yaml.YAMLError) as e:
+                logger.warning("設定ファイルの再読み込みに失敗しました。現在の設定を維持します: %s", e, extra={"event": "config_reload_failed"})
+                return None
+            self._config = new_config
+            self.version += 1
+            logger.info("設定ファイルを再読み込みしました: %s", self.config_path, extra={"event": "config_reloaded"})
+            return new_config
+
+    def changed_since(self, version: int) -> Optional[Tuple[int, AppConfig]]:
+        """
+        ファイルの変更を確認し、version より新しい設定があればそれを返す。
+
+        Returns:
+            Optional[Tuple[int, AppConfig]]: (現在の version, 現在の設定)。version から変わっていない場合は None。
+        """
+        self.poll()
+        with self._lock:
+            if self.version == version:
+                return None
+            return self.version, self._config
\ No newline at end of file
@@ -1,10 +1,21 @@
 import llm
 import uuid
-from config import AppConfig, ParticipantConfig
-from database import log_conversation_turn, log_conversation_meta, fetch_conversation_history
+from config import AppConfig, ParticipantConfig, ConfigWatcher
+from database import log_conversation_turn, log_conversation_meta, log_llm_call
+from persona import PersonaRegistry, count_tokens
+from termination import build_termination_policies, check_termination
+from stream_filters import build_stream_pipeline
+from budget import BudgetManager, BudgetExceededError, max_tokens_options, model_output_limit
+from moderator_cache import ModeratorCache, moderator_cache_key
+from cancellation import CancelToken, TurnCancelled
+from concurrency import ModelConcurrencyLimiter
+from semantic_index import SearchResult, SemanticIndex
+from transcript import Transcript
+import backends
 import time
 import sys
-from typing import Optional, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, List, Dict, Tuple
 import logging
 import importlib
 
@@ -28,33 +39,209 @@ importlib.reload(llm)
 llm.load_plugins()
 
 
+class _NullSpinner:
+    """コンソール出力を行わない場合に yaspin の代わりに使うスピナー"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def stop(self):
+        pass
+
+
+# 会話の進行を通知するイベントのコールバック (サーバーモードなどで使用)
+EventCallback = Callable[[Dict[str, Any]], None]
+
+
+# 会話全体の要約・途中要約を依頼するプロンプトの前置き (見積もり (estimate.py) でも使う)
+SUMMARY_INSTRUCTION = "以下の会話履歴を要約してください:\n\n"
+FOLD_SUMMARY_INSTRUCTION = "以下の会話履歴を、後で全体の要約に使えるよう要点を残して簡潔に要約してください:\n\n"
+
+
+def build_moderator_intro_prompt(config: AppConfig, shared_intro: bool = False) -> str:
+    """
+    MCに会話の開始をアナウンスさせるプロンプトを作成する。
+
+    shared_intro が True の場合は参加者に依存しない内容にして、同じテーマの会話間で共有できるようにする。
+    """
+    if shared_intro:
+        return f"テーマ: {config.topic}\n\n2人の参加者がこのテーマについて会話します。参加者の名前やモデルには触れずに、会話の開始をアナウンスしてください。"
+    participant_a, participant_b = config.participants[0], config.participants[1]
+    return f"テーマ: {config.topic}\n参加者A: {participant_a.name} ({participant_a.model})\n参加者B: {participant_b.name} ({participant_b.model})\n\nこれらの情報を使って、会話の開始をアナウンスしてください。"
+
+
+def build_judge_prompt(topic: str, recent_responses: List[str], earlier_responses: Optional[List[str]] = None) -> str:
+    """
+    MCに会話が結論に達したかを判定させるプロンプトを作成する。
+
+    earlier_responses には、直近の発言に意味の近い以前の発言 (意味検索の結果) を指定する。
+    """
+    history = "\n\n".join(recent_responses)
+    earlier = ""
+    if earlier_responses:
+        earlier = "以下は直近の発言に似た、以前の発言です:\n\n" + "\n\n".join(earlier_responses) + "\n\n"
+    return (
+        f"テーマ: {topic}\n\n{earlier}以下は会話の直近の発言です:\n\n{history}\n\n"
+        "この会話は結論に達したか、同じ内容の繰り返しになっていますか？"
+        "「はい」または「いいえ」だけで答えてください。"
+    )
+
+
 class ConversationManager:
     """LLM同士の会話を管理するクラス"""
 
-    def __init__(self, config: AppConfig, logger: logging.Logger):
+    def __init__(
+        self,
+        config: AppConfig,
+        logger: logging.Logger,
+        persona_registry: Optional[PersonaRegistry] = None,
+        config_watcher: Optional[ConfigWatcher] = None,
+        model_cache: Optional[Dict[str, llm.Model]] = None,
+        event_callback: Optional[EventCallback] = None,
+        console: bool = True,
+        moderator_cache: Optional[ModeratorCache] = None,
+        shared_intro: bool = False,
+        cancel_token: Optional[CancelToken] = None,
+        limiter: Optional[ModelConcurrencyLimiter] = None,
+        parent_conversation_id: Optional[str] = None,
+        fork_turn: Optional[int] = None,
+        semantic_index: Optional[SemanticIndex] = None,
+        config_overrides: Optional[Callable[[AppConfig], AppConfig]] = None,
+        interactive: bool = True,
+    ):
         self.config = config
         self.logger = logger
         self.conversation_id = str(uuid.uuid4())
         self.turn_count = 0
+        # 会話のターンの記録 (本文は要約1回分の文字数だけメモリに保持し、それより古い本文はデータベースから読み直す)
+        self.transcript = Transcript(self.conversation_id, text_chars_limit=config.summary_chunk_chars)
+        # 設定ファイルの監視 (プロセス内の会話で共有する) と、この会話で適用済みの設定の version
+        self.config_watcher = config_watcher
+        self._config_version = config_watcher.version if config_watcher is not None else 0
+        # 再読み込みした設定に、この会話固有の設定 (セッション・ジョブ・対戦ごとの上書き) を適用し直す関数
+        self.config_overrides = config_overrides
+        # モデルIDごとの llm.Model インスタンスのキャッシュ (複数のマネージャーで共有可能)
+        self.model_cache = model_cache if model_cache is not None else {}
+        # ペルソナは一度だけ読み込み、毎ターン同じフラグメントを再利用する
+        self.personas = persona_registry or PersonaRegistry(
+            prompt_cache=config.prompt_cache,
+            store_fragments=config.store_persona_fragments,
+        )
+        # トークン数と料金の予算管理
+        self.budget = BudgetManager(
+            config.budget, config.pricing, self.conversation_id, db_path=config.db_path, on_warning=self._budget_warning,
+        )
+        # 会話の進行 (ターンの開始・チャンク・ターンの終了) を通知するコールバック
+        self.event_callback = event_callback
+        # 会話が終了した理由 (conversation_end イベントの reason と同じ値。ジョブキューのワーカーなどが参照する)
+        self.stop_reason: Optional[str] = None
+        # False の場合はコンソールへの表示とスピナーを行わない (サーバーモード用)
+        self.console = console
+        # False の場合、Ctrl+C で中断されても継続するかを問い合わせず、KeyboardInterrupt を呼び出し元に伝える
+        # (標準入力を使えないジョブキューのワーカー用)
+        self.interactive = interactive
+        # 同じテーマ・参加者の会話で MC の開始アナウンスを共有するキャッシュ
+        if moderator_cache is None and config.cache_moderator_intro:
+            # データベースに保存し、実行をまたいで同じ開始アナウンスを再利用する
+            moderator_cache = ModeratorCache(db_path=config.db_path)
+        self.moderator_cache = moderator_cache
+        # True の場合、開始アナウンスを参加者に依存しない内容にして、同じテーマの会話間で共有できるようにする
+        self.shared_intro = shared_intro
+        # 他のスレッドからこのセッションだけをキャンセルするためのトークン
+        self.cancel_token = cancel_token or CancelToken()
+        # Ctrl+C で中断されたターンの途中までのレスポンス (継続時にその続きから再開する)
+        self._partial_text = ""
+        # モデルごとの同時実行数の制限 (複数の会話で共有すると、ローカルのサーバーのスロット数に合わせて呼び出しを調整できる)
+        self.limiter = limiter or ModelConcurrencyLimiter.from_profiles(config.model_profiles)
+        # 分岐 (fork): 分岐元の会話のターン fork_turn までを引き継ぎ、その続きから別の設定で会話する
+        if (parent_conversation_id is None) != (fork_turn is None):
+            raise ValueError("分岐元の会話IDと分岐するターン番号は両方指定する必要があります。")
+        if fork_turn is not None and fork_turn < 1:
+            raise ValueError(f"分岐するターン番号は1以上である必要があります: {fork_turn}")
+        self.parent_conversation_id = parent_conversation_id
+        self.fork_turn = fork_turn
+        # ターンの埋め込みベクトルによる意味検索 (関連する過去の発言を参加者とMCの終了判定に参照させる)
+        if semantic_index is None and config.retrieval:
+            semantic_index = SemanticIndex(config.retrieval.embedding_model, db_path=config.db_path)
+        self.semantic_index = semantic_index
+        # 直前のターンの発言の埋め込みベクトル (次のターンのプロンプトの検索に使う)
+        self._last_vector: Optional[bytes] = None
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """
+        会話のキャンセルを要求する (他のスレッドから呼び出せる)。
+
+        実行中のターンはチャンクの区切りで中断され、途中までのレスポンスは is_partial として記録される。
+        """
+        self.logger.info(
+            "会話のキャンセルが要求されました (ID: %s): %s", self.conversation_id, reason,
+            extra=self._log_fields(event="cancel_requested", reason=reason),
+        )
+        self.cancel_token.cancel(reason)
+
+    def _log_fields(self, speaker: Optional[ParticipantConfig] = None, **fields: Any) -> Dict[str, Any]:
+        """構造化ログ (event_log.JsonLinesFormatter) に付加するフィールド"""
+        log_fields: Dict[str, Any] = {"conversation_id": self.conversation_id, "turn": self.turn_count}
+        if speaker is not None:
+            log_fields["speaker"] = speaker.name
+            log_fields["model"] = speaker.model
+        log_fields.update(fields)
+        return log_fields
+
+    def _emit(self, event_type: str, **fields: Any):
+        """イベントコールバックに会話の進行を通知する"""
+        if event_type == "conversation_end":
+            self.stop_reason = fields.get("reason")
+        if self.event_callback is None:
+            return
+        event = {"type": event_type, "conversation_id": self.conversation_id}
+        event.update(fields)
+        try:
+            self.event_callback(event)
+        except Exception as e:
+            # 通知先の不具合で会話自体は止めない
+            self.logger.warning("イベントの通知に失敗しました (%s): %s", event_type, e, extra=self._log_fields(event="event_callback_failed"))
+
+    def _budget_warning(self, message: str) -> None:
+        """予算の警告をコンソールに表示し、イベントとして通知する (ログへの記録は BudgetManager が行う)"""
+        self._print(f"[予算警告] {message}")
+        self._emit("budget_warning", message=message)
+
+    def _print(self, *args: Any, **kwargs: Any):
+        """コンソール出力が有効な場合のみ表示する"""
+        if self.console:
+            print(*args, **kwargs)
 
     def _get_llm_model(self, participant: ParticipantConfig):
-        """ParticipantConfigからllm.Modelインスタンスを取得"""
+        """ParticipantConfigからllm.Modelインスタンスを取得 (取得済みのモデルはキャッシュを再利用)"""
+        cached = self.model_cache.get(participant.model)
+        if cached is not None:
+            return cached
         try:
-            self.logger.debug(f"モデル '{participant.model}' を取得します。")
-            # デバッグ用にプラグインマネージャーの状態を出力
-            self.logger.debug(f"プラグインマネージャー: {llm.pm}")
-            self.logger.debug(f"ロードされているプラグイン: {list(llm.pm.list_name_plugin())}")
-            # デバッグ用に登録されているモデルとエイリアスの一覧を出力
-            models_with_aliases = llm.get_models_with_aliases()
-            self.logger.debug(f"登録されているモデルとエイリアス:")
-            for mwa in models_with_aliases:
-                self.logger.debug(f"  モデル: {mwa.model}, エイリアス: {mwa.aliases}")
-            model = llm.get_model(participant.model)
-            self.logger.debug(f"モデル '{participant.model}' を取得しました。")
+            self.logger.debug("モデル '%s' を取得します。", participant.model, extra={"model": participant.model})
+            if self.logger.isEnabledFor(logging.DEBUG):
+                # デバッグ用にプラグインマネージャーの状態と、登録されているモデルとエイリアスの一覧を出力
+                # (一覧の取得は全プラグインを走査するため、DEBUG が無効な場合は行わない)
+                self.logger.debug("プラグインマネージャー: %s", llm.pm)
+                self.logger.debug("ロードされているプラグイン: %s", list(llm.pm.list_name_plugin()))
+                self.logger.debug(
+                    "登録されているモデルとエイリアス:\n%s",
+                    "\n".join(f"  モデル: {mwa.model}, エイリアス: {mwa.aliases}" for mwa in llm.get_models_with_aliases()),
+                )
+            # model_profiles にローカルのバックエンドが設定されていればそれを使う
+            model = backends.get_model(participant.model, self.config.model_profiles.get(participant.model))
+            self.model_cache[participant.model] = model
+            self.logger.debug("モデル '%s' を取得しました。", participant.model, extra={"model": participant.model})
             # llmのキー設定は外部で行われている前提
             return model
         except Exception as e:
-            self.logger.error(f"モデル '{participant.model}' の取得に失敗しました (参加者: {participant.name}): {e}")
+            self.logger.error(
+                "モデル '%s' の取得に失敗しました (参加者: %s): %s", participant.model, participant.name, e,
+                extra=self._log_fields(participant, event="model_load_failed"),
+            )
             raise ValueError(
                 f"モデル '{participant.model}' の取得に失敗しました (参加者: {participant.name}): {e}"
             ) from e
@@ -72,7 +259,7 @@ class ConversationManager:
         default_color = Fore.WHITE
 
         color = speaker_colors.get(speaker_name, default_color)
-        print(f"{color}{response_text}{Style.RESET_ALL}", end=end)
+        self._print(f"{color}{response_text}{Style.RESET_ALL}", end=end)
 
     def _print_colored_chunk(self, speaker_name: str, chunk: str, with_name: bool = False):
         """話者名に応じて色を付けたレスポンステキストのチャンクを表示する (ストリーム用)"""
@@ -89,12 +276,49 @@ class ConversationManager:
         color = speaker_colors.get(speaker_name, default_color)
         # 最初のチャンクが改行のみの場合は、話者名を表示しない
         if with_name and chunk.strip():
-            print(f"{color}{speaker_name}: {chunk}{Style.RESET_ALL}", end="", flush=True)
+            self._print(f"{color}{speaker_name}: {chunk}{Style.RESET_ALL}", end="", flush=True)
         elif with_name and not chunk.strip():
             # 最初のチャンクが改行のみの場合は、何も表示しない
             pass
         else:
-            print(f"{color}{chunk}{Style.RESET_ALL}", end="", flush=True)
+            self._print(f"{color}{chunk}{Style.RESET_ALL}", end="", flush=True)
+
+    def _prepare_prompt(self, speaker: ParticipantConfig, prompt_text: str, context_fragments: Optional[List[str]] = None):
+        """
+        LLM呼び出しの準備として、モデル・フラグメント・オプションと推定入力トークン数を返す。
+
+        Raises:
+            BudgetExceededError: 予算の上限に達している場合。
+        """
+        model = self._get_llm_model(speaker)
+
+        # プロンプトの構築
+        # speaker.persona をシステムフラグメントとして使用
+        # (レジストリ経由で毎ターン同一のフラグメントを送信し、プレフィックスキャッシュを効かせる)
+        system_fragments = [self.personas.fragment(speaker.persona)] if speaker.persona else []
+        # 関連する発言などターンごとのコンテキストは毎回変わるため、レジストリには登録せず文字列のまま渡す
+        fragments = list(context_fragments or [])
+        prompt_options = self.personas.cache_options(model)
+        profile = self.config.model_profiles.get(speaker.model)
+        if profile is not None:
+            # プロファイルのオプション (temperature など) を適用する
+            prompt_options.update(profile.options)
+        # 入力トークン数を推定 (ペルソナ分はレジストリにキャッシュされている)
+        estimated_input_tokens = count_tokens(prompt_text, model) + sum(count_tokens(f, model) for f in fragments)
+        if speaker.persona:
+            persona_tokens = self.personas.token_count(speaker.persona, model)
+            estimated_input_tokens += persona_tokens
+            self.logger.debug("システムプロンプトのトークン数: %d", persona_tokens, extra=self._log_fields(speaker))
+
+        # 予算の確認: 上限に達していれば呼び出さず、残りが少なければ出力トークン数を制限する
+        self.budget.check(speaker.model)
+        max_output_tokens = self.budget.output_token_limit(
+            speaker.model, estimated_input_tokens, cap=model_output_limit(model, profile.options if profile else None),
+        )
+        prompt_options.update(max_tokens_options(model, max_output_tokens))
+        if max_output_tokens is not None:
+            self.logger.debug("予算に基づく出力トークン数の上限: %d", max_output_tokens, extra=self._log_fields(speaker))
+        return model, system_fragments, fragments, prompt_options, estimated_input_tokens
 
     def _run_single_turn(
         self,
@@ -103,78 +327,131 @@ class ConversationManager:
         context_fragments: Optional[List[str]] = None,
         show_prompt: bool = False, # 新しい引数
         is_moderator: bool = False, # MC発言かどうかのフラグ (デフォルトはFalse)
+        resume_from: str = "",
     ) -> str:
-        """1人のLLMにプロンプトを送信し、レスポンスを取得する"""
-        model = self._get_llm_model(speaker)
+        """
+        1人のLLMにプロンプトを送信し、レスポンスを取得する。
 
-        # プロンプトの構築
-        # speaker.persona をシステムフラグメントとして使用
-        system_fragments = [speaker.persona] if speaker.persona else []
-        fragments = context_fragments if context_fragments else []
+        ストリームが中断・キャンセルされた場合は、途中までのレスポンスを is_partial として記録してから例外を送出する。
+        resume_from に途中までのレスポンスを指定すると、その続きを生成させて連結したものを1ターンとする。
 
-        self.logger.info(f"{speaker.name} ({speaker.model}) の発言開始")
+        Raises:
+            TurnCancelled: キャンセルトークンでキャンセルされた場合。
+            KeyboardInterrupt: Ctrl+C で中断された場合 (途中までのレスポンスは `_partial_text` に保持される)。
+        """
+        self._partial_text = ""
+        self.cancel_token.raise_if_cancelled()
+        request_text = prompt_text
+        if resume_from:
+            request_text = (
+                f"{prompt_text}\n\n(あなたの発言は次の箇所で中断されました。"
+                f"同じ内容を繰り返さずに、この続きから発言を続けてください)\n{resume_from}"
+            )
+        model, system_fragments, fragments, prompt_options, estimated_input_tokens = self._prepare_prompt(
+            speaker, request_text, context_fragments
+        )
+
+        self.logger.info(
+            "%s (%s) の発言%s", speaker.name, speaker.model, "を再開" if resume_from else "開始",
+            extra=self._log_fields(speaker, event="turn_start", is_moderator=is_moderator),
+        )
         # show_prompt が True の場合のみプロンプトを表示
         if show_prompt:
-            self.logger.debug(f"プロンプト: {prompt_text}")
+            self.logger.debug("プロンプト: %s", request_text, extra=self._log_fields(speaker))
 
         # show_prompt が True の場合のみ \"レスポンス:\" ラベルを表示
         if show_prompt:
-            print("レスポンス:")
+            self._print("レスポンス:")
         else:
             # プロンプト非表示時は、レスポンス本文の前に話者名を表示
             # この表示はストリーム処理の最初に移動したためコメントアウト
             # self._print_colored_response(speaker.name, f"{speaker.name}: ")
             pass
 
-        # LLM呼び出し中にスピナーを表示
-        response_text = "" # 例外発生時に空文字を返すため事前に定義
+        self._emit("turn_start", turn=self.turn_count, speaker=speaker.name, model=speaker.model, is_moderator=is_moderator, resumed=bool(resume_from))
+
+        # レスポンスをストリームで処理 (タイプライター効果)
+        # 話者名プレフィックスや推論タグの除去はチャンクをまたいでも動作するパイプラインで行い、
+        # 表示とデータベースへの記録には同じ加工済みのテキストを使う
+        max_chars = self.config.max_response_chars
+        if max_chars and resume_from:
+            max_chars = max(max_chars - len(resume_from), 1)
+        pipeline = build_stream_pipeline(speaker.name, max_chars=max_chars, strip_reasoning=self.config.strip_reasoning)
+        # プロンプト非表示時は、最初の出力の前に話者名を表示
+        name_pending = not show_prompt
+        if resume_from:
+            # 中断前の部分を表示し直してから続きを表示する
+            self._print_colored_chunk(speaker.name, resume_from, with_name=name_pending)
+            self._emit("chunk", turn=self.turn_count, speaker=speaker.name, text=resume_from)
+            name_pending = False
+
+        response = None
+        interrupt: Optional[KeyboardInterrupt] = None
+        started = time.monotonic()
+        spinner_context = (
+            yaspin(Spinners.bouncingBall, color="magenta", text=f"{speaker.name} is thinking...")
+            if self.console else _NullSpinner()
+        )
         try:
-            with yaspin(Spinners.bouncingBall, color="magenta",
-                        text=f"{speaker.name} is thinking...") as spinner:
+            # スピナーは例外で抜けた場合もコンテキストの終了時に停止する
+            # (モデルの実行枠はストリームを読み終えるまで確保し続ける。過負荷のエラーは枠の上限の調整に使われる)
+            with spinner_context as spinner, self.limiter.slot(speaker.model, self.cancel_token) as slot:
                 response = model.prompt(
-                    prompt_text,
+                    request_text,
                     system_fragments=system_fragments,
                     fragments=fragments,
-                    # stream=True # ストリーミングを使用 (デフォルトでTrueの可能性あり)
+                    **prompt_options,
                 )
-                # スピナーを停止
-                spinner.stop()
-                # レスポンスをストリームで処理 (タイプライター効果)
-                # 最初のチャンクの前に話者名を表示するロジックは、
-                # first_chunk の処理に集約されているため、ここは削除
-                response_text = ""
-                first_chunk = True
+                waiting = True
                 for chunk in response:
-                    if show_prompt:
-                        self._print_colored_chunk(speaker.name, chunk)
-                    else:
-                        # プロンプト非表示時は、最初のチャンクの前に話者名を表示
-                        if first_chunk:
-                            cleaned_chunk = chunk
-                            # 話者名プレフィックスをチェックして削除
-                            speaker_prefix = f"{speaker.name}:"
-                            if cleaned_chunk.lstrip().startswith(speaker_prefix):
-                                # プレフィックスが見つかった場合、それを取り除く
-                                prefix_pos = cleaned_chunk.find(speaker_prefix)
-                                cleaned_chunk = cleaned_chunk[prefix_pos + len(speaker_prefix):]
-                            
-                            # 先頭の改行を削除
-                            cleaned_chunk = cleaned_chunk.lstrip()
-
-                            self._print_colored_chunk(speaker.name, cleaned_chunk, with_name=True)
-                            first_chunk = False
-                        else:
-                            self._print_colored_chunk(speaker.name, chunk)
-                    response_text += chunk
-        except KeyboardInterrupt:
-            # LLM呼び出し中にCtrl+Cが押された場合、スピナーを停止し、例外を再送出
-            spinner.stop()
-            self.logger.info("LLM呼び出しが中断されました")
-            raise # KeyboardInterruptを呼び出し元に伝播
+                    if waiting:
+                        # 最初のチャンクが届いたらスピナーを停止し、そこまでの時間を同時実行数の調整に使う
+                        slot.first_chunk()
+                        spinner.stop()
+                        waiting = False
+                    # キャンセルはチャンクの区切りで検出する (受信済みの部分は途中までのレスポンスとして残す)
+                    if self.cancel_token.cancelled:
+                        break
+                    cleaned_chunk = pipeline.feed(chunk)
+                    if cleaned_chunk:
+                        self._print_colored_chunk(speaker.name, cleaned_chunk, with_name=name_pending)
+                        self._emit("chunk", turn=self.turn_count, speaker=speaker.name, text=cleaned_chunk)
+                        name_pending = False
+                    if pipeline.exhausted:
+                        self.logger.info(
+                            "%s のレスポンスが上限 (%d 文字) に達したため打ち切りました",
+                            speaker.name, self.config.max_response_chars, extra=self._log_fields(speaker),
+                        )
+                        break
+        except KeyboardInterrupt as e:
+            # Ctrl+C で中断された場合も、受信済みの部分を記録してから呼び出し元に伝播する
+            interrupt = e
+        cleaned_chunk = pipeline.flush()
+        if cleaned_chunk:
+            self._print_colored_chunk(speaker.name, cleaned_chunk, with_name=name_pending)
+            self._emit("chunk", turn=self.turn_count, speaker=speaker.name, text=cleaned_chunk)
+        generated_text = pipeline.text()
+        response_text = resume_from + generated_text
+        latency_ms = int((time.monotonic() - started) * 1000)
+        is_partial = interrupt is not None or self.cancel_token.cancelled
 
         # レスポンステキスト表示後に改行と区切り線を表示
-        print("\n") # レスポンステキスト表示後に改行
-        print("-" * 20)
+        self._print("\n") # レスポンステキスト表示後に改行
+        self._print("-" * 20)
+
+        # 使用量を記録 (llm が使用量を返さないモデルや中断されたレスポンスでは推定値を使う)
+        if response is not None:
+            input_tokens, output_tokens = self._response_usage(response, model, estimated_input_tokens, generated_text)
+        else:
+            input_tokens, output_tokens = estimated_input_tokens, 0
+        cost = self.budget.record(speaker.model, input_tokens, output_tokens)
+        self.logger.info(
+            "使用量: 入力 %d / 出力 %d トークン, $%.6f, %d ms", input_tokens, output_tokens, cost, latency_ms,
+            extra=self._log_fields(
+                speaker, event="turn_end", is_moderator=is_moderator, latency_ms=latency_ms,
+                input_tokens=input_tokens, output_tokens=output_tokens, cost=cost,
+            ),
+        )
 
         # データベースに記録
         log_conversation_turn(
@@ -185,10 +462,210 @@ class ConversationManager:
             prompt=prompt_text,
             response=response_text,
             is_moderator=is_moderator, # MCフラグを記録
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            latency_ms=latency_ms,
+            is_partial=is_partial,
+            db_path=self.config.db_path,
         )
+        self.transcript.append(
+            self.turn_count, speaker.name, speaker.model, response_text, is_moderator=is_moderator, is_partial=is_partial,
+            input_tokens=input_tokens, output_tokens=output_tokens, latency_ms=latency_ms,
+        )
+        self._emit(
+            "turn_end", turn=self.turn_count, speaker=speaker.name, model=speaker.model,
+            is_moderator=is_moderator, response=response_text,
+            input_tokens=input_tokens, output_tokens=output_tokens, latency_ms=latency_ms,
+            partial=is_partial,
+        )
+
+        if interrupt is not None:
+            self.logger.info("LLM呼び出しが中断されました", extra=self._log_fields(speaker, event="turn_interrupted"))
+            self._partial_text = response_text
+            raise interrupt # KeyboardInterruptを呼び出し元に伝播
+        self.cancel_token.raise_if_cancelled(response_text)
+        return response_text
+
+    def _generate_quietly(self, speaker: ParticipantConfig, prompt_text: str) -> Tuple[str, int, int, int]:
+        """
+        表示・イベント通知・記録を行わずにLLMのレスポンスを生成する (バックグラウンド実行用)。
 
+        Returns:
+            Tuple[str, int, int, int]: (レスポンス, 入力トークン数, 出力トークン数, レイテンシ (ミリ秒))。
+        """
+        model, system_fragments, fragments, prompt_options, estimated_input_tokens = self._prepare_prompt(speaker, prompt_text)
+        started = time.monotonic()
+        pipeline = build_stream_pipeline(
+            speaker.name,
+            max_chars=self.config.max_response_chars,
+            strip_reasoning=self.config.strip_reasoning,
+        )
+        with self.limiter.slot(speaker.model, self.cancel_token) as slot:
+            response = model.prompt(prompt_text, system_fragments=system_fragments, fragments=fragments, **prompt_options)
+            for chunk in response:
+                slot.first_chunk()
+                self.cancel_token.raise_if_cancelled(pipeline.text())
+                pipeline.feed(chunk)
+                if pipeline.exhausted:
+                    break
+        pipeline.flush()
+        response_text = pipeline.text()
+        latency_ms = int((time.monotonic() - started) * 1000)
+        input_tokens, output_tokens = self._response_usage(response, model, estimated_input_tokens, response_text)
+        self.budget.record(speaker.model, input_tokens, output_tokens)
+        return response_text, input_tokens, output_tokens, latency_ms
+
+    def generate(self, speaker: ParticipantConfig, prompt_text: str, purpose: str) -> str:
+        """
+        会話のターンにならないLLM呼び出し (終了判定・途中要約・採点など) を行い、レスポンスを返す。
+
+        ターンと同じく予算の確認・同時実行数の制限・使用量の集計を行い、使用量を llm_call_log に記録する
+        (表示・イベント通知・会話履歴への記録は行わない)。
+
+        Raises:
+            BudgetExceededError: 予算の上限に達している場合。
+        """
+        response_text, input_tokens, output_tokens, latency_ms = self._generate_quietly(speaker, prompt_text)
+        log_llm_call(
+            self.conversation_id, purpose, speaker.model, input_tokens, output_tokens, latency_ms,
+            db_path=self.config.db_path,
+        )
+        self.logger.info(
+            "LLM呼び出し (%s): 入力 %d / 出力 %d トークン, %d ms", purpose, input_tokens, output_tokens, latency_ms,
+            extra=self._log_fields(
+                speaker, event="llm_call", reason=purpose, latency_ms=latency_ms,
+                input_tokens=input_tokens, output_tokens=output_tokens,
+            ),
+        )
+        return response_text
+
+    def _record_turn(
+        self,
+        speaker: ParticipantConfig,
+        prompt_text: str,
+        response_text: str,
+        is_moderator: bool = False,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        latency_ms: int = 0,
+        cached: bool = False,
+        turn_number: Optional[int] = None,
+    ) -> str:
+        """生成済みの発言を1ターンとして表示・記録する (キャッシュや非同期生成の発言用)"""
+        turn_number = self.turn_count if turn_number is None else turn_number
+        if cached:
+            self.logger.info(
+                "%s (%s) の発言をキャッシュから再利用します", speaker.name, speaker.model,
+                extra=self._log_fields(speaker, event="turn_cached", turn=turn_number),
+            )
+        self._emit("turn_start", turn=turn_number, speaker=speaker.name, model=speaker.model, is_moderator=is_moderator)
+        self._print_colored_chunk(speaker.name, response_text, with_name=True)
+        self._emit("chunk", turn=turn_number, speaker=speaker.name, text=response_text)
+        self._print("\n")
+        self._print("-" * 20)
+        # キャッシュから再利用した発言はLLMを呼び出していないため、使用量は0として記録する
+        log_conversation_turn(
+            conversation_id=self.conversation_id,
+            turn_number=turn_number,
+            speaker_name=speaker.name,
+            model_used=speaker.model,
+            prompt=prompt_text,
+            response=response_text,
+            is_moderator=is_moderator,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            latency_ms=latency_ms,
+            db_path=self.config.db_path,
+        )
+        self.transcript.append(
+            turn_number, speaker.name, speaker.model, response_text, is_moderator=is_moderator,
+            input_tokens=input_tokens, output_tokens=output_tokens, latency_ms=latency_ms,
+        )
+        self._emit(
+            "turn_end", turn=turn_number, speaker=speaker.name, model=speaker.model,
+            is_moderator=is_moderator, response=response_text,
+            input_tokens=input_tokens, output_tokens=output_tokens, latency_ms=latency_ms, cached=cached,
+        )
         return response_text
 
+    def _run_moderator_intro(self, moderator: ParticipantConfig, prompt_text: str, show_prompt: bool = False) -> str:
+        """MCの開始アナウンスを実行する (キャッシュがあれば再利用する)"""
+        if self.moderator_cache is None:
+            return self._run_single_turn(speaker=moderator, prompt_text=prompt_text, show_prompt=show_prompt, is_moderator=True)
+        key = moderator_cache_key(moderator.model, moderator.persona, prompt_text)
+        text, cached = self.moderator_cache.get_or_create(
+            key,
+            lambda: self._run_single_turn(speaker=moderator, prompt_text=prompt_text, show_prompt=show_prompt, is_moderator=True),
+            model_id=moderator.model,
+        )
+        if cached:
+            self._record_turn(moderator, prompt_text, text, is_moderator=True, cached=True)
+        return text
+
+    def _start_moderator_intro_async(self, moderator: ParticipantConfig, prompt_text: str) -> "Future[Tuple[str, Optional[Tuple[int, int, int]]]]":
+        """
+        MCの開始アナウンスをバックグラウンドで生成する。
+
+        生成結果は `_join_moderator_intro()` でターン0として表示・記録する。
+        Future の値は (発言, (入力トークン数, 出力トークン数, レイテンシ)) で、キャッシュから取得した場合の使用量は None。
+        """
+        def generate() -> Tuple[str, Optional[Tuple[int, int, int]]]:
+            usage: List[Tuple[int, int, int]] = []
+
+            def factory() -> str:
+                text, *turn_usage = self._generate_quietly(moderator, prompt_text)
+                usage.append(tuple(turn_usage))
+                return text
+
+            if self.moderator_cache is None:
+                text = factory()
+            else:
+                key = moderator_cache_key(moderator.model, moderator.persona, prompt_text)
+                text, _ = self.moderator_cache.get_or_create(key, factory, model_id=moderator.model)
+            return text, (usage[0] if usage else None)
+
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="talktable-intro")
+        try:
+            return executor.submit(generate)
+        finally:
+            # 生成の完了を待たずにスレッドを解放する
+            executor.shutdown(wait=False)
+
+    def _join_moderator_intro(self, moderator: ParticipantConfig, prompt_text: str, future: "Future") -> None:
+        """バックグラウンドで生成したMCの開始アナウンスを待ち、ターン0として表示・記録する"""
+        try:
+            text, usage = future.result()
+        except Exception as e:
+            # 開始アナウンスがなくても会話は続けられるため、警告にとどめる
+            self.logger.warning(
+                "MCの開始アナウンスの生成に失敗しました: %s", e, extra=self._log_fields(moderator, event="moderator_intro_failed", turn=0),
+            )
+            return
+        if not text:
+            return
+        input_tokens, output_tokens, latency_ms = usage or (0, 0, 0)
+        self._record_turn(
+            moderator, prompt_text, text, is_moderator=True,
+            input_tokens=input_tokens, output_tokens=output_tokens, latency_ms=latency_ms,
+            cached=usage is None, turn_number=0,
+        )
+
+    @staticmethod
+    def _response_usage(response, model, estimated_input_tokens: int, response_text: str):
+        """
+        レスポンスの使用量 (入力・出力トークン数) を取得する。
+
+        `response.usage()` は未読のストリームを最後まで読んでしまうため、属性を直接参照する。
+        使用量が報告されていない場合は推定値を返す。
+        """
+        input_tokens = getattr(response, "input_tokens", None)
+        output_tokens = getattr(response, "output_tokens", None)
+        if not isinstance(input_tokens, int):
+            input_tokens = estimated_input_tokens
+        if not isinstance(output_tokens, int):
+            output_tokens = count_tokens(response_text, model)
+        return input_tokens, output_tokens
+
     def _handle_interrupt(self) -> bool:
         """
         ターンの実行中に `KeyboardInterrupt` が発生した際のユーザーインタラクションを処理する。
@@ -219,30 +696,216 @@ class ConversationManager:
                 print("\n再度中断されました。プログラムを終了します。")
                 raise # KeyboardInterruptをさらに上位に伝播 (main.pyで処理される)
 
+    def _reload_config(self) -> bool:
+        """
+        設定ファイルが変更されていれば、ターンの区切りで新しい設定に差し替える。
+
+        予算・同時実行数の制限・トランスクリプトに保持する本文の文字数・意味検索・ペルソナのキャッシュの設定も
+        新しい設定に合わせる。モデルIDが変わらない参加者のモデルはキャッシュを再利用し、
+        使われなくなったモデルのみキャッシュから取り除く。会話の途中で変えられない設定の変更は
+        再読み込み全体を無視するか、次の会話から適用されることをログに記録する。
+
+        Returns:
+            bool: 設定を差し替えた場合は `True`。
+        """
+        if self.config_watcher is None:
+            return False
+        change = self.config_watcher.changed_since(self._config_version)
+        if change is None:
+            return False
+        self._config_version, new_config = change
+        if self.config_overrides is not None:
+            new_config = self.config_overrides(new_config)
+        if len(new_config.participants) < 2:
+            self.logger.warning(
+                "新しい設定の参加者が2人未満のため、再読み込みを無視します。",
+                extra=self._log_fields(event="config_reload_ignored", reason="participants"),
+            )
+            return False
+        if new_config.db_path != self.config.db_path:
+            self.logger.warning(
+                "db_path は会話の途中で変更できないため、再読み込みを無視します: %s", new_config.db_path,
+                extra=self._log_fields(event="config_reload_ignored", reason="db_path"),
+            )
+            return False
+        deferred = [
+            name for name in ("max_turns", "cache_moderator_intro", "async_moderator_intro")
+            if getattr(new_config, name) != getattr(self.config, name)
+        ]
+        if deferred:
+            self.logger.info(
+                "%s の変更は実行中の会話には適用されず、次の会話から適用されます", ", ".join(deferred),
+                extra=self._log_fields(event="config_reload_deferred", reason=",".join(deferred)),
+            )
+        self._apply_config(new_config)
+        self.logger.info("ターン %d の後で設定を差し替えました", self.turn_count, extra=self._log_fields(event="config_reloaded"))
+        return True
+
+    def _apply_config(self, new_config: AppConfig) -> None:
+        """新しい設定に差し替え、設定から作られたコンポーネントを更新する"""
+        self.config = new_config
+        self.budget.reconfigure(new_config.budget, new_config.pricing)
+        self.limiter.reconfigure(new_config.model_profiles)
+        self.transcript.set_text_chars_limit(new_config.summary_chunk_chars)
+        self.personas.prompt_cache = new_config.prompt_cache
+        self.personas.store_fragments = new_config.store_persona_fragments
+        embedding_model = new_config.retrieval.embedding_model if new_config.retrieval else None
+        current_model = self.semantic_index.embedding_model if self.semantic_index is not None else None
+        if embedding_model != current_model:
+            # 埋め込みモデルが変わると以前のベクトルとは比較できないため、次のターンから新しいモデルで保存・検索する
+            self.semantic_index = SemanticIndex(embedding_model, db_path=new_config.db_path) if embedding_model else None
+            self._last_vector = None
+        active_models = {p.model for p in new_config.participants} | {new_config.moderator.model}
+        for model_id in list(self.model_cache):
+            if model_id not in active_models:
+                del self.model_cache[model_id]
+
+    def _index_turn(self, turn_number: int, text: str) -> None:
+        """発言の埋め込みベクトルを保存する (失敗しても会話は続ける)"""
+        self._last_vector = None
+        if self.semantic_index is None or not text:
+            return
+        try:
+            self._last_vector = self.semantic_index.add(self.conversation_id, turn_number, text)
+        except Exception as e:
+            self.logger.warning(
+                "ターン %d の埋め込みベクトルの保存に失敗しました: %s", turn_number, e,
+                extra=self._log_fields(event="embedding_failed", turn=turn_number),
+            )
+
+    def _related_turns(self, max_turn: int) -> List[SearchResult]:
+        """直前のターンの発言に意味の近い、ターン max_turn までの発言を検索する"""
+        retrieval = self.config.retrieval
+        if self.semantic_index is None or self._last_vector is None or max_turn < 1:
+            return []
+        try:
+            return self.semantic_index.search_vector(
+                self._last_vector,
+                top_k=retrieval.top_k,
+                conversation_id=self.conversation_id,
+                max_turn=max_turn,
+                min_score=retrieval.min_score,
+            )
+        except Exception as e:
+            self.logger.warning("関連する発言の検索に失敗しました: %s", e, extra=self._log_fields(event="retrieval_failed"))
+            return []
+
+    def _related_context(self) -> Optional[List[str]]:
+        """現在のターンのプロンプト (前のターンの発言) に関連する過去の発言を、コンテキストのフラグメントにする"""
+        results = self._related_turns(self.turn_count - 1 - self.config.retrieval.exclude_recent)
+        if not results:
+            return None
+        self.logger.debug(
+            "関連する過去の発言: %s", [result.turn_number for result in results], extra=self._log_fields(),
+        )
+        return [f"関連する過去の発言 (ターン {result.turn_number}, {result.speaker}):\n{result.text}" for result in results]
+
+    def _judge_conclusion(self, recent_responses: List[str]) -> bool:
+        """
+        MCに直近の発言を見せ、会話が結論に達したか (新しい内容が出なくなったか) を判定させる。
+
+        判定はコンソールにも会話履歴にも記録しない (使用量は llm_call_log に記録する)。
+        """
+        moderator = self.config.moderator
+        # 直近の発言に似た以前の発言があれば、繰り返しの判断材料として見せる
+        earlier = [
+            f"(ターン {result.turn_number}, {result.speaker}) {result.text}"
+            for result in self._related_turns(self.turn_count - len(recent_responses))
+        ]
+        answer = self.generate(moderator, build_judge_prompt(self.config.topic, recent_responses, earlier), "judge").strip()
+        self.logger.debug("MCの終了判定: %s", answer, extra=self._log_fields(moderator, event="judge"))
+        return answer.startswith("はい") or answer.upper().startswith("YES")
+
+    def _summarize_conversation(self, show_prompt: bool = False) -> str:
+        """
+        MCに会話全体を要約させる。
+
+        会話履歴はトランスクリプトから (本文を捨てたターンがあればデータベースから少しずつ) 読み込み、
+        プロンプトに含める履歴が summary_chunk_chars を超える場合はそれまでの部分を途中の要約に畳み込んでから続きを読む。
+        長い会話でもメモリ使用量とプロンプトの長さは summary_chunk_chars 程度に抑えられる。
+        """
+        limit = self.config.summary_chunk_chars
+        running_summary = ""
+        lines: List[str] = []
+        size = 0
+        for speaker_name, model_used, response in self.transcript.iter_history(db_path=self.config.db_path):
+            # MCと参加者の発言を区別してリストアップする
+            line = f"{speaker_name} ({model_used}): {response}"
+            if limit and lines and size + len(line) > limit:
+                running_summary = self._fold_summary(running_summary, lines)
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line)
+
+        summary_prompt_parts = [f"テーマ: {self.config.topic}"]
+        if running_summary:
+            summary_prompt_parts.append(f"これまでの会話の要約:\n{running_summary}\n\n続きの会話:")
+        summary_prompt_parts.extend(lines)
+        summary_prompt = "\n".join(summary_prompt_parts)
+        del lines, summary_prompt_parts
+
+        # MCに会話全体の要約を依頼
+        self.logger.info("[MC] 会話全体の要約")
+        mc_summary_prompt = f"{SUMMARY_INSTRUCTION}{summary_prompt}"
+        return self._run_single_turn(
+            speaker=self.config.moderator,
+            prompt_text=mc_summary_prompt,
+            show_prompt=show_prompt,
+            is_moderator=True, # MCフラグを設定
+        )
+
+    def _fold_summary(self, running_summary: str, lines: List[str]) -> str:
+        """途中までの要約に続きの会話履歴を畳み込んだ要約を作る (表示・会話履歴への記録はしない)"""
+        self.logger.info(
+            "[MC] 会話履歴の途中要約 (%d 件の発言)", len(lines), extra=self._log_fields(self.config.moderator, event="fold_summary"),
+        )
+        parts = [f"テーマ: {self.config.topic}"]
+        if running_summary:
+            parts.append(f"これまでの会話の要約:\n{running_summary}\n\n続きの会話:")
+        parts.extend(lines)
+        history = "\n".join(parts)
+        prompt_text = f"{FOLD_SUMMARY_INSTRUCTION}{history}"
+        return self.generate(self.config.moderator, prompt_text, "fold_summary")
+
     def start_conversation(self, max_turns: int = 10, show_prompt: bool = False, show_summary: bool = False): # 引数を追加
         """会話を開始する"""
         if len(self.config.participants) < 2:
             raise ValueError("会話には少なくとも2人の参加者が必要です。")
 
-        participant_a = self.config.participants[0]
-        participant_b = self.config.participants[1]
         moderator = self.config.moderator # MCを取得
 
-        self.logger.info(f"会話セッション開始 (ID: {self.conversation_id})")
+        self.logger.info("会話セッション開始 (ID: %s)", self.conversation_id, extra=self._log_fields(event="conversation_start"))
+        if self.parent_conversation_id is not None:
+            return self._start_fork(max_turns, show_prompt, show_summary)
+        self._emit("conversation_start", topic=self.config.topic, max_turns=max_turns)
         
         # MCによる会話の開始
         self.turn_count = 0
         self.logger.info("[MC] 会話の開始")
         # MCに会話のテーマと参加者を紹介するプロンプトを送信
-        mc_intro_prompt = f"テーマ: {self.config.topic}\n参加者A: {participant_a.name} ({participant_a.model})\n参加者B: {participant_b.name} ({participant_b.model})\n\nこれらの情報を使って、会話の開始をアナウンスしてください。"
-        self._run_single_turn(
-            speaker=moderator,
-            prompt_text=mc_intro_prompt,
-            show_prompt=show_prompt,
-            is_moderator=True, # MCフラグを設定
-        )
-        
+        mc_intro_prompt = build_moderator_intro_prompt(self.config, shared_intro=self.shared_intro)
+        intro_future = None
+        if self.config.async_moderator_intro:
+            # 開始アナウンスは最初のターンと並行して生成し、最初のターンの後に表示・記録する
+            intro_future = self._start_moderator_intro_async(moderator, mc_intro_prompt)
+        else:
+            try:
+                self._run_moderator_intro(moderator, mc_intro_prompt, show_prompt=show_prompt)
+            except TurnCancelled as e:
+                self._print(f"会話がキャンセルされました: {e.reason}")
+                self._emit("conversation_end", turns=0, reason=f"cancelled: {e.reason}")
+                return
+
         # 会話メタデータをデータベースに記録
+        self._log_meta()
+
+        # 初期プロンプト: テーマを提示
+        self._run_turns(self.config.topic, 0, max_turns, show_prompt, show_summary, moderator, mc_intro_prompt, intro_future)
+
+    def _log_meta(self) -> None:
+        """会話メタデータをデータベースに記録する"""
+        participant_a, participant_b = self.config.participants[0], self.config.participants[1]
         log_conversation_meta(
             conversation_id=self.conversation_id,
             topic=self.config.topic,
@@ -250,21 +913,76 @@ class ConversationManager:
             participant_a_model=participant_a.model,
             participant_b_name=participant_b.name,
             participant_b_model=participant_b.model,
-            moderator_name=moderator.name,
-            moderator_model=moderator.model,
+            moderator_name=self.config.moderator.name,
+            moderator_model=self.config.moderator.model,
+            batch_id=self.config.budget.batch_id,
+            parent_conversation_id=self.parent_conversation_id,
+            fork_turn=self.fork_turn,
+            db_path=self.config.db_path,
         )
 
-        # 初期プロンプト: テーマを提示
-        current_prompt = self.config.topic
-        current_speaker = participant_a
-        next_speaker = participant_b
+    def _start_fork(self, max_turns: int, show_prompt: bool, show_summary: bool):
+        """
+        分岐元の会話のターン fork_turn の続きから会話を進める。
 
-        for turn in range(max_turns):
+        MCの開始アナウンスとターン 1..fork_turn は再生成せず、分岐元の記録を参照する
+        (履歴と要約には分岐元のターンも含まれる)。max_turns は引き継いだターンを含めた合計のターン数。
+        """
+        # 分岐元から引き継いだターンをトランスクリプトに読み込み、ターン fork_turn の発言を次のプロンプトにする
+        self.transcript = Transcript.load(
+            self.parent_conversation_id,
+            db_path=self.config.db_path,
+            max_turn=self.fork_turn,
+            text_chars_limit=self.config.summary_chunk_chars,
+            as_conversation_id=self.conversation_id,
+        )
+        fork_point = self.transcript.last(participants_only=True)
+        if fork_point is None or fork_point.turn_number != self.fork_turn:
+            raise ValueError(
+                f"分岐元の会話 {self.parent_conversation_id} にターン {self.fork_turn} の発言が記録されていません。"
+            )
+        if max_turns <= self.fork_turn:
+            raise ValueError(f"最大ターン数 ({max_turns}) は分岐するターン番号 ({self.fork_turn}) より大きい必要があります。")
+        self.logger.info(
+            "会話 %s のターン %d から分岐します", self.parent_conversation_id, self.fork_turn,
+            extra=self._log_fields(event="fork", turn=self.fork_turn),
+        )
+        self._emit(
+            "conversation_start", topic=self.config.topic, max_turns=max_turns,
+            parent_conversation_id=self.parent_conversation_id, fork_turn=self.fork_turn,
+        )
+        self._print(f"会話 {self.parent_conversation_id} のターン {self.fork_turn} から分岐します (ID: {self.conversation_id})")
+        self._log_meta()
+        self._run_turns(fork_point.text, self.fork_turn, max_turns, show_prompt, show_summary)
+
+    def _run_turns(
+        self,
+        current_prompt: str,
+        first_turn: int,
+        max_turns: int,
+        show_prompt: bool,
+        show_summary: bool,
+        moderator: Optional[ParticipantConfig] = None,
+        mc_intro_prompt: str = "",
+        intro_future: Optional[Future] = None,
+    ):
+        """ターン first_turn + 1 から max_turns まで会話を進め、必要なら要約する"""
+        # ターン終了後に評価する早期終了ポリシー
+        termination_policies = build_termination_policies(self.config.termination, judge=self._judge_conclusion)
+        completed_turns = first_turn
+        stop_reason = None
+
+        for turn in range(first_turn, max_turns):
             self.turn_count = turn + 1
-            self.logger.info(f"[ターン {self.turn_count}] 開始")
+            # 参加者は設定の再読み込みで差し替わる可能性があるため、インデックスで参照する
+            current_speaker = self.config.participants[turn % 2]
+            self.logger.info("[ターン %d] 開始", self.turn_count, extra=self._log_fields(current_speaker))
             
             # --- ターン実行とインタラプト処理 ---
+            # 前のターンの発言 (プロンプト) に関連する過去の発言を参照させる
+            context_fragments = self._related_context()
             response_text = "" # ループの外でレスポンス変数を初期化
+            resume_from = "" # 中断されたターンを継続する場合の途中までのレスポンス
             turn_in_progress = True
             while turn_in_progress:
                 try:
@@ -272,53 +990,103 @@ class ConversationManager:
                     response_text = self._run_single_turn(
                         speaker=current_speaker,
                         prompt_text=current_prompt,
+                        context_fragments=context_fragments,
                         show_prompt=show_prompt,
+                        resume_from=resume_from,
                     )
                     turn_in_progress = False # ターンが成功したらループを抜ける
 
+                except BudgetExceededError as e:
+                    # 予算の上限に達した場合は会話を終了する (要約も行わない)
+                    self.logger.warning(
+                        "予算の上限に達したため会話を終了します: %s", e, extra=self._log_fields(event="budget_exceeded", reason=str(e)),
+                    )
+                    self._print(f"予算の上限に達したため会話を終了します: {e}")
+                    if intro_future is not None:
+                        self._join_moderator_intro(moderator, mc_intro_prompt, intro_future)
+                    self._emit("conversation_end", turns=completed_turns, reason=f"budget: {e}")
+                    return
+
+                except TurnCancelled as e:
+                    # 他のスレッドからキャンセルされた場合は、このセッションだけを終了する
+                    self.logger.info("会話がキャンセルされました: %s", e.reason, extra=self._log_fields(event="cancelled", reason=e.reason))
+                    self._print(f"会話がキャンセルされました: {e.reason}")
+                    if intro_future is not None:
+                        self._join_moderator_intro(moderator, mc_intro_prompt, intro_future)
+                    self._emit("conversation_end", turns=completed_turns, reason=f"cancelled: {e.reason}")
+                    return
+
                 except KeyboardInterrupt:
+                    if not self.interactive:
+                        # 問い合わせできない場合は会話を終了し、中断の扱いは呼び出し元に任せる
+                        self._emit("conversation_end", turns=completed_turns, reason="interrupted")
+                        raise
                     # 中断処理を専用メソッドに委譲
                     if self._handle_interrupt():
                         # Trueが返された場合 (ユーザーが 'S' を選択)、会話を終了
+                        if intro_future is not None:
+                            self._join_moderator_intro(moderator, mc_intro_prompt, intro_future)
+                        self._emit("conversation_end", turns=completed_turns, reason="interrupted")
                         return # start_conversation メソッドを終了
                     # Falseが返された場合 (ユーザーが 'C' を選択)、
-                    # ループが継続し、現在のターンが再試行される
+                    # ループが継続し、現在のターンを途中までのレスポンスの続きから再開する
+                    resume_from, self._partial_text = self._partial_text, ""
             
+            completed_turns = self.turn_count
+            self._index_turn(self.turn_count, response_text)
+
+            # 並行して生成していた開始アナウンスを記録する (最初のターンの後に1回だけ)
+            if intro_future is not None:
+                self._join_moderator_intro(moderator, mc_intro_prompt, intro_future)
+                intro_future = None
+
+            # 会話が収束・終了していれば残りのターンを打ち切る
+            stop_reason = check_termination(termination_policies, self.turn_count, response_text)
+            if stop_reason:
+                self.logger.info(
+                    "[ターン %d] 早期終了: %s", self.turn_count, stop_reason,
+                    extra=self._log_fields(event="early_stop", reason=stop_reason),
+                )
+                self._print(f"会話を早期終了します: {stop_reason}")
+                break
+
             # 次のターンの準備: レスポンスを次のプロンプトにする
+            # (スピーカーの交代はターン番号から決まる)
             current_prompt = response_text
-            # スピーカーを交代
-            current_speaker, next_speaker = next_speaker, current_speaker
+
+            # ターンの区切りで設定ファイルの変更を反映する
+            self._reload_config()
 
             # 少し待機してAPIレート制限を考慮 (設定値を使用)
-            time.sleep(self.config.llm_wait_time)
+            # キャンセルされた場合は待機を打ち切り、次のターンの開始時に終了する
+            self.cancel_token.wait(self.config.llm_wait_time)
         
         # 会話全体の要約 (show_summaryがTrueの場合)
         if show_summary:
-            # self.logger.info("[MC] 会話履歴の取得")
-            # 会話履歴を取得
-            conversation_history = fetch_conversation_history(self.conversation_id)
-            
-            # 会話履歴から要約プロンプトを構築
-            summary_prompt_parts = [f"テーマ: {self.config.topic}"]
-            for speaker_name, model_used, response in conversation_history:
-                # MCの発言は要約対象から除外するか、別途処理するかを検討。
-                # ここでは、MCと参加者の発言を区別してリストアップする。
-                summary_prompt_parts.append(f"{speaker_name} ({model_used}): {response}")
-            
-            summary_prompt = "\n".join(summary_prompt_parts)
-            
-            # MCに会話全体の要約を依頼
-            self.logger.info("[MC] 会話全体の要約")
-            mc_summary_prompt = f"以下の会話履歴を要約してください:\n\n{summary_prompt}"
-            self._run_single_turn(
-                speaker=moderator,
-                prompt_text=mc_summary_prompt,
-                show_prompt=show_prompt,
-                is_moderator=True, # MCフラグを設定
-            )
+            try:
+                self._summarize_conversation(show_prompt)
+            except BudgetExceededError as e:
+                self.logger.warning(
+                    "予算の上限に達したため要約を省略します: %s", e, extra=self._log_fields(event="budget_exceeded", reason=str(e)),
+                )
+                self._print(f"予算の上限に達したため要約を省略します: {e}")
+            except TurnCancelled as e:
+                self.logger.info(
+                    "会話がキャンセルされたため要約を中止しました: %s", e.reason, extra=self._log_fields(event="summary_cancelled", reason=e.reason),
+                )
+                self._print(f"会話がキャンセルされたため要約を中止しました: {e.reason}")
 
-        # self.logger.info(f"会話セッション終了 (ID: {self.conversation_id}, 最大ターン数: {max_turns})")
-        print(f"\n会話セッション終了 (ID: {self.conversation_id}, 最大ターン数: {max_turns})")
+        totals = self.transcript.totals()
+        self.logger.info(
+            "会話セッション終了: %d ターン, 入力 %d / 出力 %d トークン, %d ms",
+            completed_turns, totals["input_tokens"], totals["output_tokens"], totals["latency_ms"],
+            extra=self._log_fields(
+                event="conversation_end", reason=stop_reason or "max_turns", input_tokens=totals["input_tokens"],
+                output_tokens=totals["output_tokens"], latency_ms=totals["latency_ms"],
+            ),
+        )
+        self._emit("conversation_end", turns=completed_turns, reason=stop_reason or "max_turns")
+        self._print(f"\n会話セッション終了 (ID: {self.conversation_id}, ターン数: {completed_turns}/{max_turns})")
 
 
 # --- メイン実行用の関数 (オプション) ---
@@ -1,8 +1,11 @@
 import sqlite3
 import os
+import json
 import logging
+import threading
+import time
 from contextlib import contextmanager
-from typing import Generator, List, Tuple
+from typing import Any, Dict, Generator, Iterator, List, Optional, Tuple
 from config import DB_PATH
 
 # ロガーを取得
@@ -19,7 +22,12 @@ CREATE TABLE IF NOT EXISTS conversation_log (
     prompt TEXT NOT NULL,
     response TEXT NOT NULL,
     is_moderator BOOLEAN NOT NULL DEFAULT FALSE, -- MC発言かどうかのフラグ
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    input_tokens INTEGER, -- 入力トークン数 (llm の使用量情報、なければ推定値)
+    output_tokens INTEGER, -- 出力トークン数
+    latency_ms INTEGER, -- LLM呼び出しからレスポンス完了までの時間 (ミリ秒)
+    is_partial BOOLEAN NOT NULL DEFAULT FALSE, -- 中断・キャンセルされた途中までのレスポンスかどうか
+    response_chars INTEGER -- レスポンスの文字数 (集計時に本文を読まずに済むよう記録時に保存する)
 );
 """
 
@@ -34,10 +42,147 @@ CREATE TABLE IF NOT EXISTS conversation_meta (
     participant_b_model TEXT NOT NULL,
     moderator_name TEXT NOT NULL,
     moderator_model TEXT NOT NULL,
-    start_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    batch_id TEXT, -- バッチ実行の識別子 (予算をバッチ単位で管理するため)
+    parent_conversation_id TEXT, -- 分岐 (fork) した会話の場合、分岐元の会話ID
+    fork_turn INTEGER -- 分岐元の会話から引き継いだ最後のターン番号 (それ以前のターンは分岐元の記録を参照する)
 );
 """
 
+# 会話履歴をターン順に読み出すためのインデックス (長い会話でもソートせずに順に読み込める)
+CREATE_CONVERSATION_LOG_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_conversation_log_conversation ON conversation_log (conversation_id, turn_number);
+"""
+
+# 統計の集計用のカバリングインデックス (fetch_turn_stats・fetch_length_histogram・fetch_model_performance が
+# 読む列をすべて持ち、プロンプトやレスポンスの本文を含む表を読まずに走査できる)。
+# モデルと役割ごとの集計はインデックスの順に読めるため、一時的なソートも不要になる
+CREATE_CONVERSATION_LOG_STATS_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_conversation_log_model_stats ON conversation_log
+    (model_used, is_moderator, is_partial, speaker_name, conversation_id, response_chars, latency_ms, output_tokens);
+"""
+
+# 以前のバージョンが作成していた集計用のインデックス (列の順や列が異なるため削除する)
+DROP_LEGACY_CONVERSATION_LOG_STATS_INDEX_SQLS = (
+    "DROP INDEX IF EXISTS idx_conversation_log_stats;",
+    "DROP INDEX IF EXISTS idx_conversation_log_model;",
+)
+
+# バッチの使用量の集計用のインデックス (予算の確認のたびに同じバッチの会話を引くため)
+CREATE_CONVERSATION_META_BATCH_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_conversation_meta_batch ON conversation_meta (batch_id);
+"""
+
+# ジョブキューテーブル作成SQL (複数のワーカープロセスで会話を分担実行するため)
+CREATE_JOB_QUEUE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS job_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    config_path TEXT NOT NULL, -- 会話に使用する設定ファイルのパス
+    overrides TEXT NOT NULL DEFAULT '{}', -- 設定を上書きする値 (JSON: topic, max_turns など)
+    status TEXT NOT NULL DEFAULT 'pending', -- pending / running / done / failed
+    attempts INTEGER NOT NULL DEFAULT 0, -- 実行を開始した回数
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker_id TEXT, -- 実行中 (最後に実行した) ワーカー
+    lease_expires_at REAL, -- リースの有効期限 (UNIX時刻)。期限切れのジョブは再実行される
+    conversation_id TEXT, -- 実行結果の会話ID
+    error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+CREATE_JOB_QUEUE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_job_queue_status ON job_queue (status, id);
+"""
+
+# トーナメントの対戦結果テーブル作成SQL (MCの採点を記録し、リーダーボードを集計する)
+CREATE_TOURNAMENT_RESULT_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS tournament_result (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tournament_id TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    conversation_id TEXT, -- 対戦した会話のID (会話の開始前に失敗した場合は NULL)
+    entrant_a TEXT NOT NULL, -- 参加者Aの名前
+    model_a TEXT NOT NULL,
+    entrant_b TEXT NOT NULL, -- 参加者Bの名前
+    model_b TEXT NOT NULL,
+    score_a REAL, -- MCによる採点 (失敗した対戦は NULL)
+    score_b REAL,
+    error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+CREATE_TOURNAMENT_RESULT_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_tournament_result_tournament ON tournament_result (tournament_id, round);
+"""
+
+# MCの発言 (開始アナウンス) のキャッシュテーブル作成SQL (同じテーマ・参加者の会話で再利用する)
+CREATE_MODERATOR_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS moderator_cache (
+    cache_key TEXT PRIMARY KEY, -- MCのモデルID・ペルソナ・プロンプトのハッシュ
+    model_used TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# 会話のターンにならないLLM呼び出し (終了判定・途中要約・採点) の使用量テーブル作成SQL
+# (予算・統計の集計で conversation_log と合算する)
+CREATE_LLM_CALL_LOG_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS llm_call_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    purpose TEXT NOT NULL, -- 呼び出しの用途 (judge / fold_summary / score)
+    model_used TEXT NOT NULL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    latency_ms INTEGER,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+CREATE_LLM_CALL_LOG_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_llm_call_log_conversation ON llm_call_log (conversation_id);
+"""
+
+# ターンの埋め込みベクトルテーブル作成SQL (意味検索用)
+CREATE_TURN_EMBEDDING_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS turn_embedding (
+    conversation_id TEXT NOT NULL,
+    turn_number INTEGER NOT NULL,
+    embedding_model TEXT NOT NULL,
+    dimensions INTEGER NOT NULL,
+    vector BLOB NOT NULL, -- 正規化した float32 (リトルエンディアン) の列
+    PRIMARY KEY (embedding_model, conversation_id, turn_number)
+);
+"""
+
+# 既存のデータベースに追加するカラム (テーブル名 -> [(カラム名, 型)])
+MIGRATION_COLUMNS = {
+    "conversation_log": [
+        ("input_tokens", "INTEGER"),
+        ("output_tokens", "INTEGER"),
+        ("latency_ms", "INTEGER"),
+        ("is_partial", "BOOLEAN NOT NULL DEFAULT FALSE"),
+        ("response_chars", "INTEGER"),
+    ],
+    "conversation_meta": [
+        ("batch_id", "TEXT"),
+        ("parent_conversation_id", "TEXT"),
+        ("fork_turn", "INTEGER"),
+    ],
+}
+
+# カラムを追加したときに既存の行を埋めるSQL
+MIGRATION_BACKFILL = {
+    ("conversation_log", "response_chars"): "UPDATE conversation_log SET response_chars = LENGTH(response)",
+}
+
+
+# データベースがロックされている場合に待機する秒数
+DB_TIMEOUT_SECONDS = 30
+
 
 @contextmanager
 def get_db_connection(db_path: str = DB_PATH) -> Generator[sqlite3.Connection, None, None]:
@@ -45,7 +190,8 @@ def get_db_connection(db_path: str = DB_PATH) -> Generator[sqlite3.Connection, N
     # データベースファイルのディレクトリが存在しない場合は作成
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
     
-    conn = sqlite3.connect(db_path)
+    # 複数のセッション (スレッド・プロセス) から同時に書き込まれても待機できるようにタイムアウトを設定
+    conn = sqlite3.connect(db_path, timeout=DB_TIMEOUT_SECONDS)
     try:
         yield conn
         conn.commit()
@@ -56,12 +202,94 @@ def get_db_connection(db_path: str = DB_PATH) -> Generator[sqlite3.Connection, N
         conn.close()
 
 
+# 共有の書き込み用接続 (データベースファイルの絶対パス -> (接続, 接続を使う間保持するロック))
+_shared_writers: Dict[str, Tuple[sqlite3.Connection, threading.Lock]] = {}
+_shared_writers_lock = threading.Lock()
+
+
+@contextmanager
+def shared_db_writer(db_path: str = DB_PATH) -> Generator[None, None, None]:
+    """
+    このコンテキストの間、プロセス内の書き込みを1つの接続にまとめるコンテキストマネージャー。
+
+    サーバーモードのように多数のセッションが別々のスレッドから記録する場合、書き込みのたびに接続を開いて
+    SQLiteのロックを奪い合う代わりに、共有の接続をロックで順番に使う。読み込みは引き続き個別の接続で並行して行う。
+    既に共有の接続がある場合は何もしない。
+    """
+    key = os.path.abspath(db_path)
+    with _shared_writers_lock:
+        if key in _shared_writers:
+            owner = False
+        else:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            conn = sqlite3.connect(db_path, timeout=DB_TIMEOUT_SECONDS, check_same_thread=False)
+            _shared_writers[key] = (conn, threading.Lock())
+            owner = True
+    try:
+        yield
+    finally:
+        if owner:
+            with _shared_writers_lock:
+                conn, lock = _shared_writers.pop(key)
+            with lock:
+                conn.close()
+
+
+@contextmanager
+def get_db_writer(db_path: str = DB_PATH) -> Generator[sqlite3.Connection, None, None]:
+    """書き込み用の接続のコンテキストマネージャー (共有の書き込み用接続があればそれを使う)"""
+    shared = _shared_writers.get(os.path.abspath(db_path))
+    if shared is None:
+        with get_db_connection(db_path) as conn:
+            yield conn
+        return
+    conn, lock = shared
+    with lock:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
 def init_db(db_path: str = DB_PATH):
     """データベースとテーブルを初期化する"""
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
+        # WAL モードでは書き込み中も読み込みがブロックされないため、並行セッションに適している
+        cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute(CREATE_CONVERSATION_LOG_TABLE_SQL)
+        cursor.execute(CREATE_CONVERSATION_LOG_INDEX_SQL)
         cursor.execute(CREATE_CONVERSATION_META_TABLE_SQL)
+        cursor.execute(CREATE_JOB_QUEUE_TABLE_SQL)
+        cursor.execute(CREATE_JOB_QUEUE_INDEX_SQL)
+        cursor.execute(CREATE_TOURNAMENT_RESULT_TABLE_SQL)
+        cursor.execute(CREATE_TOURNAMENT_RESULT_INDEX_SQL)
+        cursor.execute(CREATE_MODERATOR_CACHE_TABLE_SQL)
+        cursor.execute(CREATE_TURN_EMBEDDING_TABLE_SQL)
+        cursor.execute(CREATE_LLM_CALL_LOG_TABLE_SQL)
+        cursor.execute(CREATE_LLM_CALL_LOG_INDEX_SQL)
+        _migrate_columns(cursor)
+        # 統計用のインデックスは追加されたカラムを含むため、マイグレーションの後に作成する
+        for sql in DROP_LEGACY_CONVERSATION_LOG_STATS_INDEX_SQLS:
+            cursor.execute(sql)
+        cursor.execute(CREATE_CONVERSATION_LOG_STATS_INDEX_SQL)
+        cursor.execute(CREATE_CONVERSATION_META_BATCH_INDEX_SQL)
+
+
+def _migrate_columns(cursor: sqlite3.Cursor):
+    """古いスキーマで作成されたテーブルに不足しているカラムを追加する"""
+    for table, columns in MIGRATION_COLUMNS.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, column_type in columns:
+            if column not in existing:
+                logger.info("テーブル %s にカラム %s を追加します", table, column)
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                backfill = MIGRATION_BACKFILL.get((table, column))
+                if backfill:
+                    cursor.execute(backfill)
 
 
 def log_conversation_turn(
@@ -73,21 +301,55 @@ def log_conversation_turn(
     prompt: str,
     response: str,
     is_moderator: bool = False, # MC発言かどうかのフラグ (デフォルトはFalse)
+    input_tokens: Optional[int] = None,
+    output_tokens: Optional[int] = None,
+    latency_ms: Optional[int] = None,
+    is_partial: bool = False, # 中断・キャンセルされた途中までのレスポンスかどうか
     db_path: str = DB_PATH,
 ):
     """1ターン分の会話をデータベースに記録する"""
-    with get_db_connection(db_path) as conn:
+    with get_db_writer(db_path) as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
             INSERT INTO conversation_log
-            (conversation_id, turn_number, speaker_name, model_used, prompt, response, is_moderator)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            (conversation_id, turn_number, speaker_name, model_used, prompt, response, is_moderator,
+             input_tokens, output_tokens, latency_ms, is_partial, response_chars)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (conversation_id, turn_number, speaker_name, model_used, prompt, response, is_moderator,
+             input_tokens, output_tokens, latency_ms, is_partial, len(response)),
+        )
+
+
+def log_llm_call(
+    conversation_id: str,
+    purpose: str,
+    model_used: str,
+    input_tokens: Optional[int] = None,
+    output_tokens: Optional[int] = None,
+    latency_ms: Optional[int] = None,
+    db_path: str = DB_PATH,
+):
+    """会話のターンにならないLLM呼び出しの使用量を記録する"""
+    with get_db_writer(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO llm_call_log (conversation_id, purpose, model_used, input_tokens, output_tokens, latency_ms)
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (conversation_id, turn_number, speaker_name, model_used, prompt, response, is_moderator),
+            (conversation_id, purpose, model_used, input_tokens, output_tokens, latency_ms),
         )
 
 
+# 読み込む会話ログの列 (transcript.TurnRecord の順)
+TURN_RECORD_COLUMNS = (
+    "turn_number", "speaker_name", "model_used", "response", "is_moderator", "is_partial",
+    "input_tokens", "output_tokens", "latency_ms",
+)
+
+
 def log_conversation_meta(
     conversation_id: str,
     topic: str,
@@ -97,17 +359,21 @@ def log_conversation_meta(
     participant_b_model: str,
     moderator_name: str,
     moderator_model: str,
+    batch_id: Optional[str] = None,
+    parent_conversation_id: Optional[str] = None,
+    fork_turn: Optional[int] = None,
     db_path: str = DB_PATH,
 ):
     """会話セッションのメタデータをデータベースに記録する"""
-    with get_db_connection(db_path) as conn:
+    with get_db_writer(db_path) as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
             INSERT OR REPLACE INTO conversation_meta
             (conversation_id, topic, participant_a_name, participant_a_model,
-             participant_b_name, participant_b_model, moderator_name, moderator_model)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+             participant_b_name, participant_b_model, moderator_name, moderator_model, batch_id,
+             parent_conversation_id, fork_turn)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 conversation_id,
@@ -118,13 +384,43 @@ def log_conversation_meta(
                 participant_b_model,
                 moderator_name,
                 moderator_model,
+                batch_id,
+                parent_conversation_id,
+                fork_turn,
             ),
         )
 
 
+# 会話とその分岐元を再帰的にたどる共通テーブル式 (パラメータは会話ID)。
+# 各祖先の会話について、引き継いだ最後のターン番号 (max_turn) を求める
+# (分岐した会話は、分岐元のターンをコピーせずに参照する)
+LINEAGE_CTE = """
+WITH RECURSIVE lineage(conversation_id, max_turn) AS (
+    SELECT ?, NULL
+    UNION ALL
+    SELECT m.parent_conversation_id,
+           CASE WHEN lineage.max_turn IS NULL OR m.fork_turn < lineage.max_turn THEN m.fork_turn ELSE lineage.max_turn END
+    FROM conversation_meta AS m
+    JOIN lineage ON m.conversation_id = lineage.conversation_id
+    WHERE m.parent_conversation_id IS NOT NULL
+)
+"""
+
+# 会話履歴 (分岐元から引き継いだターンを含む) を読み出すSQL
+CONVERSATION_HISTORY_SQL = LINEAGE_CTE + """
+SELECT l.speaker_name, l.model_used, l.response
+FROM lineage
+JOIN conversation_log AS l ON l.conversation_id = lineage.conversation_id
+WHERE (lineage.max_turn IS NULL OR l.turn_number <= lineage.max_turn) AND NOT l.is_partial
+ORDER BY l.turn_number ASC
+"""
+
+
 def fetch_conversation_history(conversation_id: str, db_path: str = DB_PATH) -> List[Tuple[str, str, str]]:
     """
-    指定された会話IDの会話履歴を取得する。
+    指定された会話IDの会話履歴を取得する (中断された途中までのレスポンスは含まない)。
+
+    分岐した会話の場合は、分岐元から引き継いだターンも含める。
     
     Args:
         conversation_id: 取得する会話のID。
@@ -133,15 +429,685 @@ def fetch_conversation_history(conversation_id: str, db_path: str = DB_PATH) ->
     Returns:
         List[Tuple[str, str, str]]: (speaker_name, model_used, response) のタプルのリスト。
     """
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(CONVERSATION_HISTORY_SQL, (conversation_id,))
+        return cursor.fetchall()
+
+
+def iter_conversation_history(
+    conversation_id: str,
+    db_path: str = DB_PATH,
+    batch_size: int = 500,
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    指定された会話IDの会話履歴を、ターン順に少しずつ読み込みながら返す。
+
+    長い会話でも履歴全体をメモリに載せないよう、batch_size 件ずつ取得する。
+    分岐した会話の場合は、分岐元から引き継いだターンも含める。
+
+    Yields:
+        Tuple[str, str, str]: (speaker_name, model_used, response)。
+    """
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(CONVERSATION_HISTORY_SQL, (conversation_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+
+# 会話 (分岐元から引き継いだターンを含む) のターンを TURN_RECORD_COLUMNS の列で読み出すSQL
+TURN_RECORDS_SQL = LINEAGE_CTE + """
+SELECT l.turn_number, l.speaker_name, l.model_used, l.response, l.is_moderator, l.is_partial,
+       l.input_tokens, l.output_tokens, l.latency_ms
+FROM lineage
+JOIN conversation_log AS l ON l.conversation_id = lineage.conversation_id
+WHERE (lineage.max_turn IS NULL OR l.turn_number <= lineage.max_turn) AND (? IS NULL OR l.turn_number <= ?)
+ORDER BY l.turn_number ASC, l.id ASC
+"""
+
+
+def iter_turn_records(
+    conversation_id: str,
+    max_turn: Optional[int] = None,
+    batch_size: int = 500,
+    db_path: str = DB_PATH,
+) -> Iterator[Tuple[Any, ...]]:
+    """
+    会話のターンを TURN_RECORD_COLUMNS の列で、ターン順に batch_size 件ずつ読み込みながら返す。
+
+    中断された途中までのレスポンスも is_partial を付けて含める。分岐した会話の場合は、分岐元から引き継いだターンも含める。
+    """
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(TURN_RECORDS_SQL, (conversation_id, max_turn, max_turn))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+
+def fetch_fork_point(conversation_id: str, fork_turn: int, db_path: str = DB_PATH) -> Optional[str]:
+    """
+    会話 (分岐元を含む) の指定したターンの参加者の発言を取得する (分岐した会話の次のプロンプトにする)。
+
+    Returns:
+        Optional[str]: 発言。会話やターンが記録されていない場合は None。
+    """
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            LINEAGE_CTE + """
+            SELECT l.response
+            FROM lineage
+            JOIN conversation_log AS l ON l.conversation_id = lineage.conversation_id
+            WHERE l.turn_number = ? AND (lineage.max_turn IS NULL OR l.turn_number <= lineage.max_turn)
+              AND NOT l.is_moderator AND NOT l.is_partial
+            """,
+            (conversation_id, fork_turn),
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def fetch_usage_by_model(
+    conversation_id: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    exclude_conversation_id: Optional[str] = None,
+    db_path: str = DB_PATH,
+) -> Dict[str, Tuple[int, int]]:
+    """
+    記録済みのトークン使用量をモデルごとに集計する (会話のターンと、ターンにならないLLM呼び出しの合計)。
+
+    Args:
+        conversation_id: 指定した場合、その会話の使用量のみを集計する。
+        batch_id: 指定した場合、そのバッチに属する会話の使用量のみを集計する。
+        exclude_conversation_id: 指定した場合、その会話の使用量を除く (実行中の会話はメモリ上で集計するため)。
+        db_path: データベースファイルのパス。
+
+    Returns:
+        Dict[str, Tuple[int, int]]: モデルID -> (入力トークン数, 出力トークン数)。
+    """
+    conditions = []
+    params: List[str] = []
+    if conversation_id is not None:
+        conditions.append("l.conversation_id = ?")
+        params.append(conversation_id)
+    if batch_id is not None:
+        conditions.append("m.batch_id = ?")
+        params.append(batch_id)
+    if exclude_conversation_id is not None:
+        conditions.append("l.conversation_id != ?")
+        params.append(exclude_conversation_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    usage: Dict[str, Tuple[int, int]] = {}
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        # テーブルごとに集計し、それぞれの会話IDのインデックスを使えるようにする
+        for table in ("conversation_log", "llm_call_log"):
+            cursor.execute(
+                f"""
+                SELECT l.model_used, COALESCE(SUM(l.input_tokens), 0), COALESCE(SUM(l.output_tokens), 0)
+                FROM {table} AS l
+                LEFT JOIN conversation_meta AS m ON m.conversation_id = l.conversation_id
+                {where}
+                GROUP BY l.model_used
+                """,
+                params,
+            )
+            for model, input_tokens, output_tokens in cursor.fetchall():
+                total_input, total_output = usage.get(model, (0, 0))
+                usage[model] = (total_input + input_tokens, total_output + output_tokens)
+    return usage
+
+
+# 統計の集計に使える軸 (名前 -> SQL式)。ペルソナは会話ログ上の話者名で区別する
+STATS_DIMENSIONS = {
+    "model": "l.model_used",
+    "persona": "l.speaker_name",
+    "topic": "m.topic",
+    "role": "CASE WHEN l.is_moderator THEN 'moderator' ELSE 'participant' END",
+}
+
+# レスポンスの文字数の分布を数える区間の上限 (最後の区間は上限なし)
+LENGTH_BUCKETS = (100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def _stats_query_parts(
+    group_by: List[str],
+    batch_id: Optional[str],
+    include_partial: bool,
+) -> Tuple[str, str, str, List[str]]:
+    """集計クエリの SELECT する軸・FROM 句・WHERE 句・パラメータを組み立てる"""
+    unknown = [name for name in group_by if name not in STATS_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"不明な集計の軸です: {', '.join(unknown)} (使用可能: {', '.join(STATS_DIMENSIONS)})")
+    dimensions = ", ".join(f"{STATS_DIMENSIONS[name]} AS {name}" for name in group_by)
+    # テーマやバッチが不要な場合は結合せず、会話ログのインデックスだけで集計する
+    from_clause = "conversation_log AS l"
+    if "topic" in group_by or batch_id is not None:
+        from_clause += " LEFT JOIN conversation_meta AS m ON m.conversation_id = l.conversation_id"
+    conditions = [] if include_partial else ["NOT l.is_partial"]
+    params: List[str] = []
+    if batch_id is not None:
+        conditions.append("m.batch_id = ?")
+        params.append(batch_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return dimensions, from_clause, where, params
+
+
+def fetch_turn_stats(
+    group_by: List[str],
+    batch_id: Optional[str] = None,
+    include_partial: bool = False,
+    db_path: str = DB_PATH,
+) -> List[Dict[str, Any]]:
+    """
+    会話ログを group_by の軸ごとにSQLで集計する。
+
+    Args:
+        group_by: 集計の軸 (STATS_DIMENSIONS のキー: model, persona, topic, role)。
+        batch_id: 指定した場合、そのバッチに属する会話のみを集計する。
+        include_partial: True の場合、中断された途中までのレスポンスも含める。
+        db_path: データベースファイルのパス。
+
+    Returns:
+        List[Dict[str, Any]]: 軸の値と turns, conversations, moderator_turns, avg_chars, min_chars,
+        max_chars, avg_latency_ms, avg_output_tokens を持つ辞書のリスト (ターン数の多い順)。
+    """
+    dimensions, from_clause, where, params = _stats_query_parts(group_by, batch_id, include_partial)
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT {dimensions},
+                   COUNT(*) AS turns,
+                   COUNT(DISTINCT l.conversation_id) AS conversations,
+                   COALESCE(SUM(l.is_moderator), 0) AS moderator_turns,
+                   AVG(l.response_chars) AS avg_chars,
+                   MIN(l.response_chars) AS min_chars,
+                   MAX(l.response_chars) AS max_chars,
+                   AVG(l.latency_ms) AS avg_latency_ms,
+                   AVG(l.output_tokens) AS avg_output_tokens
+            FROM {from_clause}
+            {where}
+            GROUP BY {", ".join(group_by)}
+            ORDER BY turns DESC
+            """,
+            params,
+        )
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def fetch_length_histogram(
+    group_by: List[str],
+    batch_id: Optional[str] = None,
+    include_partial: bool = False,
+    db_path: str = DB_PATH,
+) -> List[Tuple[Any, ...]]:
+    """
+    レスポンスの文字数の分布を group_by の軸ごとにSQLで集計する。
+
+    Returns:
+        List[Tuple[Any, ...]]: (軸の値..., 区間の番号, ターン数) のタプルのリスト。
+        区間の番号 i は LENGTH_BUCKETS[i] 文字未満 (i が len(LENGTH_BUCKETS) の場合は上限なし) を表す。
+    """
+    dimensions, from_clause, where, params = _stats_query_parts(group_by, batch_id, include_partial)
+    bucket = "CASE " + " ".join(
+        f"WHEN l.response_chars < {limit} THEN {i}" for i, limit in enumerate(LENGTH_BUCKETS)
+    ) + f" ELSE {len(LENGTH_BUCKETS)} END"
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT {dimensions}, {bucket} AS bucket, COUNT(*)
+            FROM {from_clause}
+            {where}
+            GROUP BY {", ".join(group_by)}, bucket
+            """,
+            params,
+        )
+        return cursor.fetchall()
+
+
+def fetch_call_stats(batch_id: Optional[str] = None, db_path: str = DB_PATH) -> List[Dict[str, Any]]:
+    """
+    会話のターンにならないLLM呼び出しをモデルと用途ごとに集計する。
+
+    Returns:
+        List[Dict[str, Any]]: model, purpose, calls, input_tokens, output_tokens, avg_latency_ms を持つ辞書のリスト。
+    """
+    join = ""
+    where = ""
+    params: List[str] = []
+    if batch_id is not None:
+        join = "LEFT JOIN conversation_meta AS m ON m.conversation_id = c.conversation_id"
+        where = "WHERE m.batch_id = ?"
+        params.append(batch_id)
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT c.model_used AS model, c.purpose AS purpose, COUNT(*) AS calls,
+                   COALESCE(SUM(c.input_tokens), 0) AS input_tokens,
+                   COALESCE(SUM(c.output_tokens), 0) AS output_tokens,
+                   AVG(c.latency_ms) AS avg_latency_ms
+            FROM llm_call_log AS c
+            {join}
+            {where}
+            GROUP BY c.model_used, c.purpose
+            ORDER BY calls DESC
+            """,
+            params,
+        )
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def fetch_model_performance(db_path: str = DB_PATH) -> Dict[Tuple[str, bool], Dict[str, float]]:
+    """
+    記録済みの会話ログから、モデルと役割 (MCかどうか) ごとの実績を集計する (見積もり用)。
+
+    使用量やレイテンシが記録されていないターン・途中までのレスポンスは含めない。
+
+    Returns:
+        Dict[Tuple[str, bool], Dict[str, float]]: (モデルID, MCかどうか) -> turns, avg_output_tokens,
+        avg_latency_ms, ms_per_output_token, chars_per_token を持つ辞書。
+    """
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
-            SELECT speaker_name, model_used, response
+            SELECT model_used, is_moderator, COUNT(*),
+                   AVG(output_tokens), AVG(latency_ms),
+                   1.0 * SUM(latency_ms) / SUM(output_tokens),
+                   1.0 * SUM(response_chars) / SUM(output_tokens)
             FROM conversation_log
-            WHERE conversation_id = ?
-            ORDER BY turn_number ASC
+            WHERE NOT is_partial AND output_tokens > 0 AND latency_ms IS NOT NULL
+            GROUP BY model_used, is_moderator
+            """
+        )
+        return {
+            (model, bool(is_moderator)): {
+                "turns": turns,
+                "avg_output_tokens": avg_output_tokens,
+                "avg_latency_ms": avg_latency_ms,
+                "ms_per_output_token": ms_per_output_token,
+                "chars_per_token": chars_per_token,
+            }
+            for model, is_moderator, turns, avg_output_tokens, avg_latency_ms, ms_per_output_token, chars_per_token
+            in cursor.fetchall()
+        }
+
+
+def iter_turn_rows(
+    batch_size: int = 10000,
+    include_text: bool = False,
+    db_path: str = DB_PATH,
+) -> Iterator[Tuple[List[str], List[Tuple[Any, ...]]]]:
+    """
+    会話ログをテーマ・バッチIDと結合して batch_size 件ずつ返す (列指向の書き出し用)。
+
+    Yields:
+        Tuple[List[str], List[Tuple[Any, ...]]]: (列名のリスト, 行のリスト)。
+    """
+    text_columns = ", l.prompt, l.response" if include_text else ""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT l.conversation_id, l.turn_number, l.speaker_name, l.model_used, l.is_moderator,
+                   l.is_partial, l.timestamp, l.input_tokens, l.output_tokens, l.latency_ms,
+                   l.response_chars, m.topic, m.batch_id{text_columns}
+            FROM conversation_log AS l
+            LEFT JOIN conversation_meta AS m ON m.conversation_id = l.conversation_id
+            ORDER BY l.id
+            """
+        )
+        columns = [description[0] for description in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield columns, rows
+
+
+def fetch_moderator_cache(cache_key: str, db_path: str = DB_PATH) -> Optional[str]:
+    """キャッシュされたMCの発言を取得する (なければ None)"""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT response FROM moderator_cache WHERE cache_key = ?", (cache_key,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def store_moderator_cache(cache_key: str, model_used: str, response: str, db_path: str = DB_PATH) -> None:
+    """MCの発言をキャッシュに保存する"""
+    with get_db_writer(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO moderator_cache (cache_key, model_used, response) VALUES (?, ?, ?)",
+            (cache_key, model_used, response),
+        )
+
+
+def log_turn_embedding(
+    conversation_id: str,
+    turn_number: int,
+    embedding_model: str,
+    dimensions: int,
+    vector: bytes,
+    db_path: str = DB_PATH,
+) -> None:
+    """ターンの埋め込みベクトルを保存する (同じターンのベクトルは置き換える)"""
+    with get_db_writer(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO turn_embedding (conversation_id, turn_number, embedding_model, dimensions, vector)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (conversation_id, turn_number, embedding_model, dimensions, vector),
+        )
+
+
+# 会話 (分岐元から引き継いだターンを含む) のターンの埋め込みベクトルを読み出すSQL
+CONVERSATION_EMBEDDINGS_SQL = LINEAGE_CTE + """
+SELECT e.conversation_id, e.turn_number, e.dimensions, e.vector
+FROM lineage
+JOIN turn_embedding AS e ON e.conversation_id = lineage.conversation_id
+WHERE e.embedding_model = ? AND (lineage.max_turn IS NULL OR e.turn_number <= lineage.max_turn)
+  AND (? IS NULL OR e.turn_number <= ?)
+"""
+
+
+def iter_turn_embeddings(
+    embedding_model: str,
+    conversation_id: Optional[str] = None,
+    max_turn: Optional[int] = None,
+    exclude_conversation_id: Optional[str] = None,
+    batch_size: int = 10000,
+    db_path: str = DB_PATH,
+) -> Iterator[List[Tuple[str, int, int, bytes]]]:
+    """
+    ターンの埋め込みベクトルを batch_size 件ずつ返す。
+
+    conversation_id を指定するとその会話 (分岐元から引き継いだターンを含む) のターン番号 max_turn までに限り、
+    指定しなければすべての会話 (exclude_conversation_id の会話を除く) を対象にする。
+
+    Yields:
+        List[Tuple[str, int, int, bytes]]: (会話ID, ターン番号, 次元数, ベクトル) のリスト。
+    """
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        if conversation_id is not None:
+            cursor.execute(
+                CONVERSATION_EMBEDDINGS_SQL,
+                (conversation_id, embedding_model, max_turn, max_turn),
+            )
+        else:
+            cursor.execute(
+                """
+                SELECT conversation_id, turn_number, dimensions, vector FROM turn_embedding
+                WHERE embedding_model = ? AND conversation_id IS NOT ?
+                """,
+                (embedding_model, exclude_conversation_id),
+            )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def fetch_turn_texts(keys: List[Tuple[str, int]], db_path: str = DB_PATH) -> Dict[Tuple[str, int], Tuple[str, str]]:
+    """(会話ID, ターン番号) のターンの話者と発言を取得する (途中までのレスポンスは含めない)"""
+    if not keys:
+        return {}
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        placeholders = ", ".join("(?, ?)" for _ in keys)
+        cursor.execute(
+            f"""
+            SELECT conversation_id, turn_number, speaker_name, response FROM conversation_log
+            WHERE (conversation_id, turn_number) IN (VALUES {placeholders}) AND NOT is_partial
+            """,
+            [value for key in keys for value in key],
+        )
+        return {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
+
+class Job:
+    """ジョブキューから取得したジョブの情報を保持するクラス"""
+
+    def __init__(self, job_id: int, config_path: str, overrides: Dict[str, Any], attempts: int):
+        self.id = job_id
+        self.config_path = config_path
+        self.overrides = overrides
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"<Job id={self.id} config_path='{self.config_path}' attempts={self.attempts}>"
+
+
+def enqueue_job(
+    config_path: str,
+    overrides: Optional[Dict[str, Any]] = None,
+    max_attempts: int = 3,
+    db_path: str = DB_PATH,
+) -> int:
+    """会話ジョブをキューに追加し、ジョブIDを返す"""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO job_queue (config_path, overrides, max_attempts) VALUES (?, ?, ?)",
+            (config_path, json.dumps(overrides or {}, ensure_ascii=False), max_attempts),
+        )
+        return cursor.lastrowid
+
+
+def claim_job(worker_id: str, lease_seconds: float, db_path: str = DB_PATH) -> Optional[Job]:
+    """
+    実行待ちのジョブを1件アトミックに取得し、リースを設定する。
+
+    リースの期限が切れた実行中のジョブ (ワーカーがクラッシュしたもの) も再取得の対象になる。
+    再試行回数の上限に達したジョブは失敗として扱う。
+
+    Returns:
+        Optional[Job]: 取得したジョブ。実行可能なジョブがなければ None。
+    """
+    now = time.time()
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        # 他のワーカーと同時に同じジョブを取得しないよう、書き込みロックを先に取得する
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            """
+            UPDATE job_queue
+            SET status = 'failed', error = 'リースの期限切れ (再試行回数の上限に達しました)',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts
+            """,
+            (now,),
+        )
+        cursor.execute(
+            """
+            UPDATE job_queue
+            SET status = 'running', worker_id = ?, attempts = attempts + 1,
+                lease_expires_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM job_queue
+                WHERE status = 'pending' OR (status = 'running' AND lease_expires_at < ?)
+                ORDER BY id
+                LIMIT 1
+            )
+            RETURNING id, config_path, overrides, attempts
+            """,
+            (worker_id, now + lease_seconds, now),
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return Job(row[0], row[1], json.loads(row[2]), row[3])
+
+
+def renew_job_lease(job_id: int, worker_id: str, lease_seconds: float, db_path: str = DB_PATH) -> bool:
+    """実行中のジョブのリースを延長する (他のワーカーに取得し直されていれば False)"""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE job_queue SET lease_expires_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND worker_id = ? AND status = 'running'
+            """,
+            (time.time() + lease_seconds, job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+
+
+def complete_job(job_id: int, worker_id: str, conversation_id: str, db_path: str = DB_PATH) -> None:
+    """ジョブを完了として記録する"""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE job_queue
+            SET status = 'done', conversation_id = ?, lease_expires_at = NULL, error = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND worker_id = ?
+            """,
+            (conversation_id, job_id, worker_id),
+        )
+
+
+def fail_job(
+    job_id: int,
+    worker_id: str,
+    error: str,
+    conversation_id: Optional[str] = None,
+    retry: bool = True,
+    db_path: str = DB_PATH,
+) -> None:
+    """ジョブの失敗を記録する (retry が True で再試行回数が残っていれば実行待ちに戻す)"""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE job_queue
+            SET status = CASE WHEN ? AND attempts < max_attempts THEN 'pending' ELSE 'failed' END,
+                error = ?, conversation_id = ?, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND worker_id = ?
+            """,
+            (retry, error, conversation_id, job_id, worker_id),
+        )
+
+
+def release_job(job_id: int, worker_id: str, db_path: str = DB_PATH) -> bool:
+    """
+    実行中のジョブを実行待ちに戻す (ワーカーが中断された場合用)。
+
+    ジョブの失敗ではないため、今回の試行は再試行回数に数えない。
+
+    Returns:
+        bool: ジョブを戻した場合は True (他のワーカーに取得し直されていれば False)。
+    """
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE job_queue
+            SET status = 'pending', attempts = MAX(attempts - 1, 0), lease_expires_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND worker_id = ? AND status = 'running'
+            """,
+            (job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+
+
+def fetch_job_counts(db_path: str = DB_PATH) -> Dict[str, int]:
+    """ステータスごとのジョブ数を取得する"""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) FROM job_queue GROUP BY status")
+        return dict(cursor.fetchall())
+
+def log_tournament_result(
+    tournament_id: str,
+    round_number: int,
+    conversation_id: Optional[str],
+    entrant_a: str,
+    model_a: str,
+    entrant_b: str,
+    model_b: str,
+    score_a: Optional[float],
+    score_b: Optional[float],
+    error: Optional[str] = None,
+    db_path: str = DB_PATH,
+) -> None:
+    """トーナメントの1対戦の結果を記録する"""
+    with get_db_writer(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO tournament_result
+            (tournament_id, round, conversation_id, entrant_a, model_a, entrant_b, model_b, score_a, score_b, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (tournament_id, round_number, conversation_id, entrant_a, model_a, entrant_b, model_b, score_a, score_b, error),
+        )
+
+
+def fetch_tournament_pairings(tournament_id: str, db_path: str = DB_PATH) -> List[Tuple[str, str]]:
+    """トーナメントで対戦済みの (参加者A, 参加者B) の組み合わせを取得する"""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT entrant_a, entrant_b FROM tournament_result WHERE tournament_id = ? ORDER BY id",
+            (tournament_id,),
+        )
+        return cursor.fetchall()
+
+
+def fetch_leaderboard(tournament_id: str, db_path: str = DB_PATH) -> List[Dict[str, Any]]:
+    """
+    トーナメントの結果を参加者ごとに集計したリーダーボードを取得する。
+
+    勝ちを1点、引き分けを0.5点として勝ち点の高い順 (同点の場合は平均スコアの高い順) に並べる。
+    採点できなかった対戦は集計に含めない。
+
+    Returns:
+        List[Dict[str, Any]]: entrant, model, games, wins, draws, losses, points, avg_score を持つ辞書のリスト。
+    """
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            WITH sides AS (
+                SELECT entrant_a AS entrant, model_a AS model, score_a AS score, score_b AS opponent_score
+                FROM tournament_result
+                WHERE tournament_id = ? AND score_a IS NOT NULL AND score_b IS NOT NULL
+                UNION ALL
+                SELECT entrant_b, model_b, score_b, score_a
+                FROM tournament_result
+                WHERE tournament_id = ? AND score_a IS NOT NULL AND score_b IS NOT NULL
+            )
+            SELECT entrant, model, COUNT(*) AS games,
+                   SUM(score > opponent_score) AS wins,
+                   SUM(score = opponent_score) AS draws,
+                   SUM(score < opponent_score) AS losses,
+                   SUM(score > opponent_score) + 0.5 * SUM(score = opponent_score) AS points,
+                   AVG(score) AS avg_score
+            FROM sides
+            GROUP BY entrant, model
+            ORDER BY points DESC, avg_score DESC, entrant ASC
             """,
-            (conversation_id,)
+            (tournament_id, tournament_id),
         )
-        return cursor.fetchall()
\ No newline at end of file
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,296 @@
+"""
+会話の実行前のトークン数・料金・所要時間の見積もり (dry run)
+
+設定から各ターンで送るプロンプト (ペルソナのシステムフラグメント、テーマ、MCの開始アナウンスと要約) を組み立て、
+モデルごとのトークナイザーで入力トークン数を数える。発言の長さとレイテンシは記録済みの会話ログの実績
+(モデルと役割ごとの平均出力トークン数・出力1トークンあたりの時間) から予測する。LLMは一切呼び出さない。
+
+早期終了は予測できないため、すべての会話が max_turns まで続くものとして見積もる (上限の見積もり)。
+"""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import backends
+from config import AppConfig, ParticipantConfig
+from conversation import FOLD_SUMMARY_INSTRUCTION, SUMMARY_INSTRUCTION, build_judge_prompt, build_moderator_intro_prompt
+from database import fetch_model_performance
+from persona import count_tokens
+
+# 実績のないモデルに使う既定値
+DEFAULT_OUTPUT_TOKENS = 300
+DEFAULT_MS_PER_OUTPUT_TOKEN = 25.0
+DEFAULT_CHARS_PER_TOKEN = 1.5
+# MCの終了判定 (「はい」「いいえ」) の出力トークン数
+JUDGE_OUTPUT_TOKENS = 2
+
+
+class ModelEstimate:
+    """1つのモデルの見積もりの累計"""
+
+    def __init__(self, model_id: str, history_turns: int = 0):
+        self.model_id = model_id
+        # 実績として使った記録済みのターン数 (0 の場合は既定値で見積もった)
+        self.history_turns = history_turns
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.seconds = 0.0
+        self.cost = 0.0
+
+    def add(self, input_tokens: int, output_tokens: int, seconds: float, cost: float) -> None:
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.seconds += seconds
+        self.cost += cost
+
+    def scaled(self, factor: int) -> "ModelEstimate":
+        """factor 回分の見積もり"""
+        scaled = ModelEstimate(self.model_id, self.history_turns)
+        scaled.calls = self.calls * factor
+        scaled.input_tokens = self.input_tokens * factor
+        scaled.output_tokens = self.output_tokens * factor
+        scaled.seconds = self.seconds * factor
+        scaled.cost = self.cost * factor
+        return scaled
+
+    def merge(self, other: "ModelEstimate") -> None:
+        self.calls += other.calls
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.seconds += other.seconds
+        self.cost += other.cost
+
+    def __repr__(self):
+        return (
+            f"<ModelEstimate model='{self.model_id}' calls={self.calls} input={self.input_tokens} "
+            f"output={self.output_tokens} seconds={self.seconds:.1f} cost={self.cost:.4f}>"
+        )
+
+
+class Estimator:
+    """
+    設定から会話のトークン数・料金・所要時間を見積もるクラス。
+
+    トークン数はモデルのハンドルのトークナイザー (count_tokens、なければ tiktoken、なければ推定) で数える。
+    モデルのハンドルの取得はプラグインの解決だけで、LLMへのリクエストは行わない。
+    """
+
+    def __init__(self, config: AppConfig, performance: Optional[Dict[Tuple[str, bool], Dict[str, float]]] = None):
+        self.config = config
+        self.performance = performance if performance is not None else fetch_model_performance(config.db_path)
+        self._models: Dict[str, Any] = {}
+
+    def _model(self, model_id: str) -> Any:
+        """トークン数を数えるためのモデルのハンドル (取得できない場合は None で推定値を使う)"""
+        if model_id not in self._models:
+            try:
+                self._models[model_id] = backends.get_model(model_id, self.config.model_profiles.get(model_id))
+            except Exception:
+                self._models[model_id] = None
+        return self._models[model_id]
+
+    def tokens(self, text: str, model_id: str) -> int:
+        return count_tokens(text, self._model(model_id)) if text else 0
+
+    def _performance(self, model_id: str, is_moderator: bool) -> Tuple[Dict[str, float], int]:
+        """モデルと役割の実績 (なければ同じモデルの他の役割、それもなければ既定値) と実績のターン数"""
+        for key in ((model_id, is_moderator), (model_id, not is_moderator)):
+            record = self.performance.get(key)
+            if record:
+                return record, int(record["turns"])
+        return {
+            "avg_output_tokens": DEFAULT_OUTPUT_TOKENS,
+            "ms_per_output_token": DEFAULT_MS_PER_OUTPUT_TOKEN,
+            "chars_per_token": DEFAULT_CHARS_PER_TOKEN,
+        }, 0
+
+    def _output_tokens(self, speaker: ParticipantConfig, is_moderator: bool) -> int:
+        """1回の発言の出力トークン数の予測 (max_response_chars で打ち切られる分を反映する)"""
+        record, _ = self._performance(speaker.model, is_moderator)
+        output_tokens = int(round(record["avg_output_tokens"]))
+        if self.config.max_response_chars:
+            chars_per_token = record.get("chars_per_token") or DEFAULT_CHARS_PER_TOKEN
+            output_tokens = min(output_tokens, int(self.config.max_response_chars / chars_per_token) + 1)
+        return output_tokens
+
+    def _call(
+        self,
+        totals: Dict[str, ModelEstimate],
+        speaker: ParticipantConfig,
+        is_moderator: bool,
+        input_tokens: int,
+        output_tokens: int,
+    ) -> float:
+        """1回のLLM呼び出しを累計に加え、予測した所要時間 (秒) を返す"""
+        record, history_turns = self._performance(speaker.model, is_moderator)
+        seconds = output_tokens * (record.get("ms_per_output_token") or DEFAULT_MS_PER_OUTPUT_TOKEN) / 1000
+        price = self.config.pricing.get(speaker.model)
+        cost = price.cost(input_tokens, output_tokens) if price else 0.0
+        entry = totals.setdefault(speaker.model, ModelEstimate(speaker.model, history_turns))
+        entry.add(input_tokens, output_tokens, seconds, cost)
+        return seconds
+
+    def _persona_tokens(self, speaker: ParticipantConfig) -> int:
+        return self.tokens(speaker.persona, speaker.model)
+
+    def estimate_intro(self) -> Tuple[Dict[str, ModelEstimate], float, int]:
+        """MCの開始アナウンスの見積もり (累計, 所要時間, 出力トークン数)"""
+        moderator = self.config.moderator
+        totals: Dict[str, ModelEstimate] = {}
+        prompt = build_moderator_intro_prompt(self.config)
+        output_tokens = self._output_tokens(moderator, True)
+        seconds = self._call(
+            totals, moderator, True,
+            self._persona_tokens(moderator) + self.tokens(prompt, moderator.model), output_tokens,
+        )
+        return totals, seconds, output_tokens
+
+    def estimate_turns(self, intro_output_tokens: int = 0) -> Tuple[Dict[str, ModelEstimate], float]:
+        """開始アナウンスを除く1会話 (全ターン・終了判定・要約) の見積もり (累計, 所要時間)"""
+        config = self.config
+        moderator = config.moderator
+        totals: Dict[str, ModelEstimate] = {}
+        seconds = 0.0
+        previous_output = self.tokens(config.topic, config.participants[0].model)
+        outputs: List[int] = []
+        history_chars = intro_output_tokens * self._chars_per_token(moderator)
+        judge_every = config.termination.moderator_judge_every
+        judge_template = self.tokens(build_judge_prompt(config.topic, []), moderator.model)
+
+        for turn in range(1, config.max_turns + 1):
+            speaker = config.participants[(turn - 1) % 2]
+            output_tokens = self._output_tokens(speaker, False)
+            # 2ターン目以降は、前の話者の発言がそのままプロンプトになる
+            input_tokens = self._persona_tokens(speaker) + previous_output
+            if config.retrieval:
+                # 意味検索で参照させる過去の発言 (上限は top_k 件)
+                candidates = outputs[:max(0, turn - 1 - config.retrieval.exclude_recent)]
+                input_tokens += sum(sorted(candidates, reverse=True)[:config.retrieval.top_k])
+            seconds += self._call(totals, speaker, False, input_tokens, output_tokens)
+            outputs.append(output_tokens)
+            history_chars += output_tokens * self._chars_per_token(speaker) + len(speaker.name) + len(speaker.model) + 4
+            previous_output = output_tokens
+            if judge_every and turn % judge_every == 0:
+                seconds += self._call(
+                    totals, moderator, True,
+                    self._persona_tokens(moderator) + judge_template + sum(outputs[-4:]),
+                    JUDGE_OUTPUT_TOKENS,
+                )
+            # ターンの間の待機
+            seconds += config.llm_wait_time
+
+        if config.show_summary:
+            seconds += self._estimate_summary(totals, history_chars)
+        return totals, seconds
+
+    def _chars_per_token(self, speaker: ParticipantConfig) -> float:
+        record, _ = self._performance(speaker.model, speaker is self.config.moderator)
+        return record.get("chars_per_token") or DEFAULT_CHARS_PER_TOKEN
+
+    def _estimate_summary(self, totals: Dict[str, ModelEstimate], history_chars: float) -> float:
+        """要約 (summary_chunk_chars を超える分の途中要約を含む) の見積もり"""
+        moderator = self.config.moderator
+        chars_per_token = self._chars_per_token(moderator)
+        summary_output = self._output_tokens(moderator, True)
+        persona_tokens = self._persona_tokens(moderator)
+        limit = self.config.summary_chunk_chars
+        folds = max(0, math.ceil(history_chars / limit) - 1) if limit else 0
+        seconds = 0.0
+        fold_instruction = self.tokens(FOLD_SUMMARY_INSTRUCTION, moderator.model)
+        for fold in range(folds):
+            running = summary_output if fold else 0
+            seconds += self._call(
+                totals, moderator, True,
+                persona_tokens + fold_instruction + running + int(limit / chars_per_token), summary_output,
+            )
+        remaining_chars = history_chars - folds * limit
+        seconds += self._call(
+            totals, moderator, True,
+            persona_tokens + self.tokens(SUMMARY_INSTRUCTION + f"テーマ: {self.config.topic}", moderator.model)
+            + (summary_output if folds else 0) + int(remaining_chars / chars_per_token),
+            summary_output,
+        )
+        return seconds
+
+    def estimate(self, conversations: int = 1, concurrency: int = 1) -> Dict[str, Any]:
+        """
+        conversations 件の会話を concurrency 件ずつ並行して実行した場合の見積もり。
+
+        cache_moderator_intro が有効な場合、開始アナウンスは最初の1回だけ生成されるものとして数える。
+
+        Returns:
+            Dict[str, Any]: models (モデルごとの ModelEstimate のリスト), conversation (1会話の ModelEstimate の合計),
+            total (全会話の合計), conversation_seconds (1会話の所要時間), wall_seconds (全会話の所要時間)。
+        """
+        intro_totals, intro_seconds, intro_output = self.estimate_intro()
+        turn_totals, turn_seconds = self.estimate_turns(intro_output)
+        intro_runs = 1 if self.config.cache_moderator_intro else conversations
+
+        models: Dict[str, ModelEstimate] = {}
+        per_conversation = ModelEstimate("*")
+        for model_id, entry in intro_totals.items():
+            models.setdefault(model_id, ModelEstimate(model_id, entry.history_turns)).merge(entry.scaled(intro_runs))
+            per_conversation.merge(entry)
+        for model_id, entry in turn_totals.items():
+            models.setdefault(model_id, ModelEstimate(model_id, entry.history_turns)).merge(entry.scaled(conversations))
+            per_conversation.merge(entry)
+        total = ModelEstimate("*")
+        for entry in models.values():
+            total.merge(entry)
+
+        conversation_seconds = intro_seconds + turn_seconds
+        if self.config.async_moderator_intro:
+            # 開始アナウンスは最初のターンと並行して生成される
+            conversation_seconds -= min(intro_seconds, turn_seconds)
+        waves = math.ceil(conversations / max(1, concurrency))
+        return {
+            "models": sorted(models.values(), key=lambda entry: entry.model_id),
+            "conversation": per_conversation,
+            "total": total,
+            "conversation_seconds": conversation_seconds,
+            "wall_seconds": conversation_seconds * waves,
+        }
+
+    def budget_warnings(self, result: Dict[str, Any]) -> List[str]:
+        """見積もりが予算の上限を超える場合の警告"""
+        warnings = []
+        budget = self.config.budget
+        for label, limit, entry in (("会話", budget.conversation, result["conversation"]), ("バッチ", budget.batch, result["total"])):
+            tokens = entry.input_tokens + entry.output_tokens
+            if limit.max_tokens and tokens > limit.max_tokens:
+                warnings.append(f"{label}の予測トークン数 {tokens} が上限 {limit.max_tokens} を超えています")
+            if limit.max_cost and entry.cost > limit.max_cost:
+                warnings.append(f"{label}の予測料金 ${entry.cost:.4f} が上限 ${limit.max_cost:.4f} を超えています")
+        return warnings
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}"
+
+
+def format_estimate(result: Dict[str, Any], conversations: int, concurrency: int, warnings: Optional[List[str]] = None) -> str:
+    """見積もりを表形式の文字列にする"""
+    lines = [f"{'モデル':<40} {'呼び出し':>8} {'入力':>10} {'出力':>10} {'料金($)':>10} {'秒':>9}  実績"]
+    for entry in result["models"]:
+        source = f"{entry.history_turns} ターン" if entry.history_turns else "なし (既定値)"
+        lines.append(
+            f"{entry.model_id:<40} {entry.calls:>8} {entry.input_tokens:>10} {entry.output_tokens:>10} "
+            f"{entry.cost:>10.4f} {entry.seconds:>9.1f}  {source}"
+        )
+    conversation, total = result["conversation"], result["total"]
+    lines.append("")
+    lines.append(
+        f"1会話あたり: {conversation.input_tokens + conversation.output_tokens} トークン, "
+        f"${conversation.cost:.4f}, {_format_seconds(result['conversation_seconds'])}"
+    )
+    lines.append(
+        f"{conversations} 会話 (同時実行数 {concurrency}): {total.input_tokens + total.output_tokens} トークン, "
+        f"${total.cost:.4f}, 所要時間 {_format_seconds(result['wall_seconds'])}"
+    )
+    lines.append("(早期終了は考慮せず、すべての会話が max_turns まで続くものとして見積もっています)")
+    for warning in warnings or []:
+        lines.append(f"警告: {warning}")
+    return "\n".join(lines)
@@ -0,0 +1,110 @@
+"""
+構造化されたイベントログ (JSONL)
+
+ログのレコードを1行1件の JSON として書き出す。会話の進行に関するレコードは
+`extra` で渡された conversation_id・turn・speaker・latency_ms などのフィールドを持つため、
+jq や pandas でそのまま集計できる。ファイルへの書き込みは QueueListener のバックグラウンドスレッドで行い、
+会話のスレッドではレコードをキューに入れるだけにする。
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# レコードに付加されていれば JSON に含めるフィールド (logger.info(..., extra={...}) で渡す)
+EVENT_FIELDS = (
+    "event",
+    "conversation_id",
+    "turn",
+    "speaker",
+    "model",
+    "is_moderator",
+    "latency_ms",
+    "input_tokens",
+    "output_tokens",
+    "cost",
+    "reason",
+)
+
+# 実行中の QueueListener (setup_logger を呼び直した場合は止めてから差し替える)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# キューに入れる前に例外のトレースバックを文字列にするフォーマッター
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """ログのレコードを1行の JSON に変換するフォーマッター"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            # メッセージの % 展開は、レベルを満たして書き出されるレコードについてのみ行われる
+            "message": record.getMessage(),
+        }
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                event[field] = value
+        # キューを経由したレコードは、トレースバックを exc_text として文字列で持つ
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event["exc_info"] = record.exc_text
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class _EventQueueHandler(logging.handlers.QueueHandler):
+    """
+    メッセージの展開とトレースバックの整形を行ってからレコードをキューに入れるハンドラ。
+
+    標準の QueueHandler.prepare() はトレースバックをメッセージに連結して exc_info と exc_text を消すため、
+    JsonLinesFormatter が exc_info のフィールドを書き出せない。ここでは message には本文だけを入れ、
+    トレースバックは exc_text に残す。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def start_queue_logging(logger: logging.Logger, handler: logging.Handler) -> logging.handlers.QueueListener:
+    """
+    handler への書き込みをバックグラウンドスレッドに移し、logger には QueueHandler を追加する。
+
+    リスナーはプロセスの終了時に停止し、キューに残ったレコードを書き出してから終了する。
+    """
+    global _listener
+    stop_queue_logging()
+    log_queue = queue.SimpleQueue()
+    queue_handler = _EventQueueHandler(log_queue)
+    queue_handler.setLevel(handler.level)
+    logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_queue_logging() -> None:
+    """実行中のリスナーを停止する (キューに残ったレコードは書き出される)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_queue_logging)
@@ -0,0 +1,86 @@
+"""
+会話の分岐 (what-if fork)
+
+記録済みの会話のターン K までを共有し、その続きを別のペルソナやモデルの設定で並行して実行する。
+分岐した会話はターン 1..K をコピーせず conversation_meta の parent_conversation_id / fork_turn で
+分岐元を参照するため、N ターンの会話から10通りの分岐を試すコストは 10 × (N − K) ターンになる。
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from concurrency import ModelConcurrencyLimiter
+from config import AppConfig
+from conversation import ConversationManager
+from database import fetch_fork_point
+from persona import PersonaRegistry
+
+
+def run_forks(
+    variants: List[AppConfig],
+    logger: logging.Logger,
+    parent_conversation_id: str,
+    fork_turn: int,
+    concurrency: int = 4,
+) -> List[Optional[str]]:
+    """
+    分岐元の会話のターン fork_turn から、variants の設定ごとに分岐した会話を並行して実行する。
+
+    モデルのハンドル・ペルソナ・同時実行数の上限はすべての分岐で共有する。分岐が1つの場合は
+    通常の会話と同じくコンソールに表示し、複数の場合は表示せずに結果の一覧だけを出力する。
+
+    Returns:
+        List[Optional[str]]: 分岐した会話のID (variants の順、失敗した分岐は None)。
+
+    Raises:
+        ValueError: 分岐元の会話にターン fork_turn の発言が記録されていない場合。
+    """
+    base = variants[0]
+    if fetch_fork_point(parent_conversation_id, fork_turn, db_path=base.db_path) is None:
+        raise ValueError(f"分岐元の会話 {parent_conversation_id} にターン {fork_turn} の発言が記録されていません。")
+    model_cache: Dict[str, Any] = {}
+    personas = PersonaRegistry(base.prompt_cache, base.store_persona_fragments)
+    profiles = {}
+    for variant in variants:
+        profiles.update(variant.model_profiles)
+    limiter = ModelConcurrencyLimiter.from_profiles(profiles)
+    console = len(variants) == 1
+    managers = [
+        ConversationManager(
+            variant,
+            logger,
+            persona_registry=personas,
+            model_cache=model_cache,
+            console=console,
+            limiter=limiter,
+            parent_conversation_id=parent_conversation_id,
+            fork_turn=fork_turn,
+        )
+        for variant in variants
+    ]
+
+    def _run(manager: ConversationManager) -> Optional[str]:
+        try:
+            manager.start_conversation(
+                max_turns=manager.config.max_turns,
+                show_prompt=manager.config.show_prompt if console else False,
+                show_summary=manager.config.show_summary,
+            )
+        except Exception as e:
+            logger.exception(
+                "分岐 %s の実行に失敗しました: %s", manager.conversation_id, e,
+                extra={"event": "fork_failed", "conversation_id": manager.conversation_id},
+            )
+            return None
+        return manager.conversation_id
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="talktable-fork") as executor:
+        results = list(executor.map(_run, managers))
+
+    if not console:
+        print(f"会話 {parent_conversation_id} のターン {fork_turn} から {len(variants)} 件の分岐を実行しました:")
+        for variant, manager, result in zip(variants, managers, results):
+            participants = ", ".join(f"{p.name} ({p.model})" for p in variant.participants[:2])
+            status = manager.conversation_id if result else f"{manager.conversation_id} (失敗)"
+            print(f"  {status}: {participants}")
+    return results
@@ -0,0 +1,265 @@
+import copy
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from config import AppConfig, ConfigWatcher, DB_PATH, load_config_from_file
+from conversation import ConversationManager
+from database import claim_job, complete_job, fail_job, init_db, release_job, renew_job_lease, Job
+from budget import BudgetExceededError
+from moderator_cache import ModeratorCache
+
+# Ctrl+C で中断した際に、ワーカーが実行中のジョブを戻して終了するのを待つ秒数
+WORKER_SHUTDOWN_SECONDS = 10
+
+
+def validate_job_overrides(overrides: Dict[str, Any]) -> None:
+    """ジョブに保存された上書きの値を検証する (不正な場合は ValueError)"""
+    max_turns = overrides.get("max_turns")
+    if max_turns is not None and (isinstance(max_turns, bool) or not isinstance(max_turns, int) or max_turns <= 0):
+        raise ValueError(f"'max_turns' は正の整数である必要があります: {max_turns}")
+
+
+def apply_job_overrides(config: AppConfig, overrides: Dict[str, Any]) -> AppConfig:
+    """ジョブに保存された値で設定を上書きする"""
+    validate_job_overrides(overrides)
+    if overrides.get("topic"):
+        config.topic = overrides["topic"]
+    if overrides.get("max_turns") is not None:
+        config.max_turns = overrides["max_turns"]
+    if "show_summary" in overrides:
+        config.show_summary = bool(overrides["show_summary"])
+    if overrides.get("batch_id"):
+        config.budget.batch_id = overrides["batch_id"]
+    return config
+
+
+class _LeaseHeartbeat(threading.Thread):
+    """会話の実行中、バックグラウンドでジョブのリースを定期的に延長するスレッド"""
+
+    def __init__(self, job: Job, worker_id: str, lease_seconds: float, db_path: str, logger: logging.Logger):
+        super().__init__(name=f"lease-heartbeat-{job.id}", daemon=True)
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.db_path = db_path
+        self.logger = logger
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # リースの期限の 1/3 ごとに延長する
+        while not self._stop_event.wait(self.lease_seconds / 3):
+            try:
+                if not renew_job_lease(self.job.id, self.worker_id, self.lease_seconds, db_path=self.db_path):
+                    self.logger.warning("ジョブ %d のリースを延長できませんでした (他のワーカーに再取得された可能性があります)", self.job.id)
+                    return
+            except Exception as e:
+                self.logger.warning("ジョブ %d のリースの延長に失敗しました: %s", self.job.id, e)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class Worker:
+    """
+    ジョブキューからジョブを取得して会話を実行するワーカー。
+
+    ジョブの取得はデータベース上でアトミックに行われるため、同じデータベースを
+    参照する複数のワーカープロセスを同時に実行できる。実行中はリースを延長し続け、
+    ワーカーがクラッシュした場合はリースの期限切れ後に他のワーカーがジョブを再実行する。
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        db_path: str = DB_PATH,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = 300,
+        poll_interval: float = 2.0,
+        watch_config: bool = False,
+    ):
+        self.logger = logger
+        self.db_path = db_path
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        # 同じワーカーで実行する会話間でモデルのハンドルを共有する
+        self.model_cache: Dict[str, Any] = {}
+        # watch_config が有効な場合、設定ファイルのパスごとの監視を同じ設定ファイルのジョブで共有する
+        self.watch_config = watch_config
+        self._config_watchers: Dict[str, ConfigWatcher] = {}
+        # cache_moderator_intro が有効なジョブの間で、MCの開始アナウンスを共有する
+        self.moderator_cache = ModeratorCache(db_path=db_path)
+
+    def _config_watcher(self, config_path: str) -> Optional[ConfigWatcher]:
+        """設定ファイルの監視を返す (監視しない場合は None)"""
+        if not self.watch_config:
+            return None
+        watcher = self._config_watchers.get(config_path)
+        if watcher is None:
+            watcher = self._config_watchers[config_path] = ConfigWatcher(config_path)
+        else:
+            watcher.poll()
+        return watcher
+
+    def _job_config(self, job: Job, base: AppConfig) -> AppConfig:
+        """設定ファイルの設定にジョブの上書きを適用した設定を作る (再読み込みした設定にも使う)"""
+        config = copy.copy(base)
+        # 監視中の設定は他のジョブと共有しているため、上書きする予算の設定もコピーする
+        config.budget = copy.copy(base.budget)
+        config = apply_job_overrides(config, job.overrides)
+        config.db_path = self.db_path
+        return config
+
+    def run_job(self, job: Job) -> None:
+        """
+        1件のジョブ (会話) を実行し、結果をジョブキューに記録する。
+
+        Raises:
+            KeyboardInterrupt: 会話の実行中に中断された場合 (ジョブは実行待ちに戻してから再送出する)。
+        """
+        try:
+            validate_job_overrides(job.overrides)
+        except ValueError as e:
+            # 上書きの値が不正なジョブは再試行しても成功しないため、会話を始めずに失敗にする
+            self.logger.error(
+                "ジョブ %d の設定が不正です: %s", job.id, e, extra={"event": "job_failed", "reason": str(e)},
+            )
+            fail_job(job.id, self.worker_id, str(e), retry=False, db_path=self.db_path)
+            return
+        heartbeat = _LeaseHeartbeat(job, self.worker_id, self.lease_seconds, self.db_path, self.logger)
+        heartbeat.start()
+        manager = None
+        try:
+            watcher = self._config_watcher(job.config_path)
+            config = self._job_config(job, watcher.config if watcher is not None else load_config_from_file(job.config_path))
+            manager = ConversationManager(
+                config, self.logger, model_cache=self.model_cache, console=False,
+                moderator_cache=self.moderator_cache if config.cache_moderator_intro else None,
+                config_watcher=watcher,
+                config_overrides=lambda new_config: self._job_config(job, new_config),
+                interactive=False,
+            )
+            self.logger.info(
+                "ジョブ %d を開始します (会話ID: %s, 試行: %d)", job.id, manager.conversation_id, job.attempts,
+                extra={"event": "job_start", "conversation_id": manager.conversation_id},
+            )
+            manager.start_conversation(
+                max_turns=config.max_turns,
+                show_prompt=False,
+                show_summary=config.show_summary,
+            )
+            if manager.stop_reason and manager.stop_reason.startswith("budget:"):
+                # 会話の途中で予算の上限に達して打ち切られた場合も完了扱いにしない
+                raise BudgetExceededError(manager.stop_reason)
+        except KeyboardInterrupt:
+            # 中断はジョブの失敗ではないため、試行回数を戻して他のワーカーが最初から実行できるようにする
+            release_job(job.id, self.worker_id, db_path=self.db_path)
+            self.logger.warning(
+                "ジョブ %d は中断されたため実行待ちに戻しました", job.id,
+                extra={"event": "job_released", "conversation_id": manager.conversation_id if manager else None},
+            )
+            raise
+        except BudgetExceededError as e:
+            # 予算の上限は再試行しても解消しないため、再実行しない
+            self.logger.warning(
+                "ジョブ %d は予算の上限に達したため完了できませんでした: %s", job.id, e,
+                extra={"event": "job_failed", "conversation_id": manager.conversation_id if manager else None, "reason": str(e)},
+            )
+            fail_job(job.id, self.worker_id, str(e),
+                     conversation_id=manager.conversation_id if manager else None, retry=False, db_path=self.db_path)
+        except Exception as e:
+            self.logger.exception(
+                "ジョブ %d の実行に失敗しました: %s", job.id, e,
+                extra={"event": "job_failed", "conversation_id": manager.conversation_id if manager else None, "reason": str(e)},
+            )
+            fail_job(job.id, self.worker_id, str(e),
+                     conversation_id=manager.conversation_id if manager else None, db_path=self.db_path)
+        else:
+            complete_job(job.id, self.worker_id, manager.conversation_id, db_path=self.db_path)
+            self.logger.info(
+                "ジョブ %d が完了しました (会話ID: %s)", job.id, manager.conversation_id,
+                extra={"event": "job_done", "conversation_id": manager.conversation_id},
+            )
+        finally:
+            heartbeat.stop()
+
+    def run(self, max_jobs: Optional[int] = None, stop_when_empty: bool = True) -> int:
+        """
+        ジョブを順に取得して実行する。
+
+        Args:
+            max_jobs: 実行するジョブ数の上限 (None の場合は無制限)。
+            stop_when_empty: True の場合、実行待ちのジョブがなくなったら終了する。
+
+        Returns:
+            int: 実行したジョブ数。
+        """
+        processed = 0
+        while max_jobs is None or processed < max_jobs:
+            job = claim_job(self.worker_id, self.lease_seconds, db_path=self.db_path)
+            if job is None:
+                if stop_when_empty:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            self.run_job(job)
+            processed += 1
+        self.logger.info("ワーカー %s は %d 件のジョブを実行しました", self.worker_id, processed)
+        return processed
+
+
+def _worker_process(db_path: str, log_level: str, lease_seconds: float, stop_when_empty: bool, watch_config: bool) -> None:
+    """ワーカープロセスのエントリーポイント"""
+    from main import setup_logger
+    logger = setup_logger(log_level)
+    try:
+        Worker(logger, db_path=db_path, lease_seconds=lease_seconds, watch_config=watch_config).run(stop_when_empty=stop_when_empty)
+    except KeyboardInterrupt:
+        # 実行中のジョブは run_job で実行待ちに戻してあるため、トレースバックを出さずに終了する
+        logger.info("ワーカーが中断されました")
+
+
+def run_worker_pool(
+    num_workers: int,
+    db_path: str = DB_PATH,
+    log_level: str = "none",
+    lease_seconds: float = 300,
+    stop_when_empty: bool = True,
+    watch_config: bool = False,
+) -> None:
+    """
+    複数のワーカープロセスを起動し、すべて終了するまで待機する。
+
+    watch_config が有効な場合、各ワーカープロセスはジョブの設定ファイルを監視し、
+    実行中の会話にもターンの区切りで変更を適用する。
+    """
+    init_db(db_path)
+    # プラグインの状態を引き継がないよう、ワーカーは spawn で起動する
+    context = multiprocessing.get_context("spawn")
+    processes: List[multiprocessing.Process] = [
+        context.Process(
+            target=_worker_process,
+            args=(db_path, log_level, lease_seconds, stop_when_empty, watch_config),
+            name=f"talktable-worker-{i}",
+        )
+        for i in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C は同じプロセスグループのワーカーにも届き、各ワーカーは実行中のジョブを実行待ちに戻して終了する。
+        # 時間内に終了しないワーカーは強制終了する (そのジョブはリースの期限切れ後に再実行される)
+        for process in processes:
+            process.join(WORKER_SHUTDOWN_SECONDS)
+            if process.is_alive():
+                process.terminate()
+        raise
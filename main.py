@@ -6,9 +6,11 @@ import argparse
 import sys
 import io
 import os
-from config import get_app_config, AppConfig
+from config import get_app_config, parse_arguments, apply_arguments, load_config_from_file, AppConfig, ConfigWatcher
 from conversation import ConversationManager
-from database import init_db
+from budget import BudgetExceededError
+from database import init_db, enqueue_job, fetch_job_counts
+from event_log import JsonLinesFormatter, start_queue_logging
 import logging
 from colorama import init as colorama_init
 
@@ -22,49 +24,52 @@ if sys.platform == "win32":
 
 
 def setup_logger(log_level_str: str) -> logging.Logger:
-    """ロガーをセットアップする"""
+    """
+    ロガーをセットアップする
+
+    ファイルには logs/app.jsonl に1行1件の JSON (event_log.JsonLinesFormatter) で書き出す。
+    ファイルへの書き込みは QueueListener のバックグラウンドスレッドで行い、会話の進行を待たせない。
+    ファイルのハンドラはルートロガーに追加し、各モジュールの `logging.getLogger(__name__)` のレコードも書き出す。
+    """
     # ルートロガーのハンドラをクリア
     root_logger = logging.getLogger()
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
 
     logger = logging.getLogger("__main__")  # ロガー名を "__main__" に固定
-    logger.setLevel(logging.DEBUG)  # ロガー自体のレベルはDEBUGに設定
 
     # 既存のハンドラをクリア
     if logger.hasHandlers():
         logger.handlers.clear()
 
+    # log_level_str に基づいてレベルを決定
+    if log_level_str.lower() == "debug":
+        level = logging.DEBUG
+    elif log_level_str.lower() == "info":
+        level = logging.INFO
+    else:  # "none" or others
+        level = logging.CRITICAL # CRITICAL以上のみ出力 -> 実質出力なし
+    # ロガー自体のレベルもハンドラに合わせ、出力されないレコードは作成もメッセージの展開も行わない
+    logger.setLevel(level)
+
     # コンソールハンドラ (常に追加)
     console_handler = logging.StreamHandler(sys.stdout)
     console_formatter = logging.Formatter('%(levelname)s:%(name)s: %(message)s')
     console_handler.setFormatter(console_formatter)
-    
-    # log_level_str に基づいてコンソールハンドラのレベルを設定
-    if log_level_str.lower() == "debug":
-        console_handler.setLevel(logging.DEBUG)
-    elif log_level_str.lower() == "info":
-        console_handler.setLevel(logging.INFO)
-    else:  # "none" or others
-        console_handler.setLevel(logging.CRITICAL) # CRITICAL以上のみ出力 -> 実質出力なし
-    
+    console_handler.setLevel(level)
     logger.addHandler(console_handler)
 
     # ファイルハンドラ (log_levelがinfoまたはdebugの場合のみ追加)
     if log_level_str.lower() in ["info", "debug"]:
         log_dir = "logs"
         os.makedirs(log_dir, exist_ok=True)
-        log_file = os.path.join(log_dir, "app.log")
+        log_file = os.path.join(log_dir, "app.jsonl")
         file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(file_formatter)
-        
-        if log_level_str.lower() == "debug":
-            file_handler.setLevel(logging.DEBUG)
-        else:  # "info"
-            file_handler.setLevel(logging.INFO)
-            
-        logger.addHandler(file_handler)
+        file_handler.setFormatter(JsonLinesFormatter())
+        file_handler.setLevel(level)
+        # "__main__" のレコードは伝播してルートロガーのハンドラで書き出される
+        root_logger.setLevel(level)
+        start_queue_logging(root_logger, file_handler)
 
     return logger
 
@@ -73,17 +78,127 @@ def main():
     """アプリケーションのメインエントリーポイント"""
     try:
         # 1. 設定を読み込む
-        app_config = get_app_config()
+        args = parse_arguments()
+        config_watcher = None
+        if args.watch_config:
+            # 設定ファイルを監視し、ターンの区切りで新しい設定に差し替える
+            config_watcher = ConfigWatcher(args.config, args)
+            app_config = config_watcher.config
+        else:
+            app_config = get_app_config(args)
         
         # 2. ロガーをセットアップ
         logger = setup_logger(app_config.log_level)
 
         # 3. データベースを初期化
         init_db(app_config.db_path)
-        logger.info(f"データベースを初期化しました: {app_config.db_path}")
+        logger.info("データベースを初期化しました: %s", app_config.db_path)
+
+        # 統計: 会話は実行せず、記録済みの会話ログを集計する
+        if args.command == "stats":
+            import stats
+            if args.export_parquet:
+                count = stats.export_parquet(args.export_parquet, include_text=args.include_text, db_path=app_config.db_path)
+                print(f"{count} 行を {args.export_parquet} に書き出しました")
+                return
+            group_by = [name.strip() for name in args.group_by.split(",") if name.strip()]
+            rows = stats.compute_stats(
+                group_by,
+                batch_id=app_config.budget.batch_id,
+                include_partial=args.include_partial,
+                db_path=app_config.db_path,
+            )
+            print(stats.format_stats(rows, group_by))
+            call_stats = stats.format_call_stats(batch_id=app_config.budget.batch_id, db_path=app_config.db_path)
+            if call_stats:
+                print(f"\n{call_stats}")
+            return
+
+        # 見積もり (dry run): LLMを呼び出さずにトークン数・料金・所要時間を予測する
+        if args.estimate:
+            from estimate import Estimator, format_estimate
+            estimator = Estimator(app_config)
+            result = estimator.estimate(args.estimate, concurrency=args.estimate_concurrency)
+            print(format_estimate(result, args.estimate, args.estimate_concurrency, estimator.budget_warnings(result)))
+            return
+
+        # 意味検索: 記録済みの会話から似た議論を探す
+        if args.similar:
+            if not app_config.retrieval.embedding_model:
+                raise ValueError("--similar には設定ファイルの retrieval.embedding_model の指定が必要です。")
+            from semantic_index import SemanticIndex
+            index = SemanticIndex(app_config.retrieval.embedding_model, db_path=app_config.db_path)
+            for result in index.search(args.similar, top_k=args.top_k):
+                print(f"[{result.score:.3f}] {result.conversation_id} ターン {result.turn_number} ({result.speaker})")
+                print(f"  {result.text[:200]}")
+            return
+
+        # ジョブキューへの追加: 会話は実行せず、ワーカーに任せる
+        if args.enqueue:
+            overrides = {"topic": app_config.topic, "show_summary": app_config.show_summary}
+            if app_config.budget.batch_id:
+                overrides["batch_id"] = app_config.budget.batch_id
+            job_ids = [
+                enqueue_job(os.path.abspath(args.config), overrides, db_path=app_config.db_path)
+                for _ in range(args.enqueue)
+            ]
+            print(f"{len(job_ids)} 件のジョブをキューに追加しました (ID: {job_ids[0]}-{job_ids[-1]})")
+            return
+
+        # ワーカーモード: 複数プロセスでジョブキューの会話を実行する
+        if args.workers:
+            from jobqueue import run_worker_pool
+            run_worker_pool(
+                args.workers, db_path=app_config.db_path, log_level=app_config.log_level,
+                lease_seconds=args.lease_seconds, watch_config=args.watch_config,
+            )
+            print(f"ジョブの実行が終了しました: {fetch_job_counts(app_config.db_path)}")
+            return
+
+        # サーバーモード: HTTP API で会話を受け付け、SSE/WebSocket で配信する
+        if args.serve:
+            from server import run_server
+            run_server(
+                app_config, logger, host=args.host, port=args.port, max_sessions=args.max_sessions,
+                config_watcher=config_watcher,
+            )
+            return
+
+        # 分岐 (fork): 記録済みの会話のターン K までを引き継ぎ、その続きを別の設定で実行する
+        if args.fork:
+            if args.fork_turn is None:
+                raise ValueError("--fork には --fork-turn の指定が必要です。")
+            from fork import run_forks
+            variants = [app_config]
+            if args.fork_config:
+                variants = [apply_arguments(load_config_from_file(path), args) for path in args.fork_config]
+                for variant in variants:
+                    variant.db_path = app_config.db_path
+            run_forks(variants, logger, args.fork, args.fork_turn, concurrency=args.fork_concurrency)
+            return
+
+        # トーナメントモード: 参加者の組み合わせを対戦させ、MCの採点でリーダーボードを作成する
+        if args.tournament:
+            from tournament import Tournament
+            Tournament(app_config, logger, config_watcher=config_watcher).run()
+            return
+
+        # 記録と再生: LLM呼び出しのチャンクと時間をフィクスチャに記録する / フィクスチャを再生する
+        model_cache = None
+        if args.record and args.replay:
+            raise ValueError("--record と --replay は同時に指定できません。")
+        if args.record:
+            import backends
+            from replay import Recorder
+            model_cache = Recorder(args.record).wrap_cache(
+                lambda model_id: backends.get_model(model_id, app_config.model_profiles.get(model_id))
+            )
+        elif args.replay:
+            from replay import build_replay_cache, load_fixture
+            model_cache = build_replay_cache(load_fixture(args.replay), speed=args.replay_speed, strict=args.replay_strict)
 
         # 4. 会話マネージャーを作成し、会話を開始
-        conversation_manager = ConversationManager(app_config, logger)
+        conversation_manager = ConversationManager(app_config, logger, config_watcher=config_watcher, model_cache=model_cache)
         conversation_manager.start_conversation(
             max_turns=app_config.max_turns, 
             show_prompt=app_config.show_prompt,
@@ -97,9 +212,15 @@ def main():
         else:
             print("アプリケーションがユーザーにより中断されました。")
         raise
+    except BudgetExceededError as e:
+        # 会話の開始前に予算の上限に達していた場合
+        if 'logger' in locals():
+            logger.warning("予算の上限に達しているため会話を開始できません: %s", e, extra={"event": "budget_exceeded", "reason": str(e)})
+        print(f"予算の上限に達しているため会話を開始できません: {e}", file=sys.stderr)
+        sys.exit(2)
     except Exception as e:
         if 'logger' in locals():
-            logger.exception(f"アプリケーション実行中に予期せぬエラーが発生しました: {e}")
+            logger.exception("アプリケーション実行中に予期せぬエラーが発生しました: %s", e)
         else:
             # ロガーがセットアップされる前にエラーが発生した場合のフォールバック
             import traceback
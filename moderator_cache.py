@@ -0,0 +1,81 @@
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from database import fetch_moderator_cache, store_moderator_cache
+
+# ロガーを取得
+logger = logging.getLogger(__name__)
+
+
+def moderator_cache_key(model_id: str, persona: str, prompt: str) -> str:
+    """MCの発言をキャッシュするキー (モデルID・ペルソナ・プロンプトのハッシュ)"""
+    digest = hashlib.sha256()
+    for part in (model_id, persona, prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ModeratorCache:
+    """
+    同じモデル・ペルソナ・プロンプトに対するMCの発言 (会話の開始アナウンスなど) を共有するキャッシュ。
+
+    複数の会話から同時に同じキーが要求された場合は、最初の1件だけがLLMを呼び出し、
+    残りはその結果を待って再利用する。db_path を指定すると moderator_cache テーブルにも保存し、
+    プロセスや実行をまたいで再利用する。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        self._entries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュされた発言を返す (なければ None)"""
+        with self._lock:
+            text = self._entries.get(key)
+        if text is None and self.db_path is not None:
+            text = fetch_moderator_cache(key, db_path=self.db_path)
+            if text is not None:
+                with self._lock:
+                    self._entries[key] = text
+        return text
+
+    def put(self, key: str, text: str, model_id: str = "") -> None:
+        """発言をキャッシュに保存する"""
+        with self._lock:
+            self._entries[key] = text
+        if self.db_path is not None:
+            store_moderator_cache(key, model_id, text, db_path=self.db_path)
+
+    def get_or_create(self, key: str, factory: Callable[[], str], model_id: str = "") -> Tuple[str, bool]:
+        """
+        キャッシュされた発言を返し、なければ factory で生成して保存する。
+
+        Returns:
+            Tuple[str, bool]: (発言, キャッシュから取得したかどうか)。
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                logger.debug(
+                    "MCの発言をキャッシュから取得しました: %s", key[:12],
+                    extra={"event": "moderator_cache_hit", "model": model_id or None},
+                )
+                return cached, True
+            text = factory()
+            self.misses += 1
+            if text:
+                self.put(key, text, model_id)
+            return text, False
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import threading
+from typing import Any, Dict
+
+import llm
+
+# tiktoken はオプション依存 (インストールされていればOpenAI系モデルのトークン数を正確に数える)
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - 環境依存
+    tiktoken = None
+
+# ロガーを取得
+logger = logging.getLogger(__name__)
+
+
+def estimate_token_count(text: str) -> int:
+    """
+    トークナイザーが利用できない場合の簡易トークン数推定。
+
+    ASCII 文字はおよそ4文字で1トークン、日本語などの非ASCII文字は1文字1トークンとして数える。
+    """
+    ascii_chars = 0
+    non_ascii_chars = 0
+    for ch in text:
+        if ord(ch) < 128:
+            ascii_chars += 1
+        else:
+            non_ascii_chars += 1
+    return (ascii_chars + 3) // 4 + non_ascii_chars
+
+
+def count_tokens(text: str, model: Any = None) -> int:
+    """
+    モデルのトークナイザーでテキストのトークン数を数える。
+
+    モデルが `count_tokens` を提供していればそれを使い、次に tiktoken を試し、
+    どちらも使えない場合は `estimate_token_count` による推定値を返す。
+    """
+    if model is not None:
+        counter = getattr(model, "count_tokens", None)
+        if callable(counter):
+            try:
+                return int(counter(text))
+            except Exception as e:
+                logger.debug("count_tokens の呼び出しに失敗しました (%s): %s", _model_id(model), e)
+        if tiktoken is not None:
+            model_name = getattr(model, "model_name", None) or getattr(model, "model_id", None)
+            if isinstance(model_name, str):
+                try:
+                    return len(tiktoken.encoding_for_model(model_name).encode(text))
+                except KeyError:
+                    pass  # tiktoken が知らないモデル
+    return estimate_token_count(text)
+
+
+def _model_id(model: Any) -> str:
+    """キャッシュキー用のモデルIDを取得する"""
+    model_id = getattr(model, "model_id", None)
+    return model_id if isinstance(model_id, str) else str(model)
+
+
+class PersonaEntry:
+    """登録済みペルソナの情報 (フラグメントとトークン数) を保持するクラス"""
+
+    def __init__(self, text: str, source: str = ""):
+        self.fragment = llm.Fragment(text, source)
+        self.hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self.token_counts: Dict[str, int] = {}
+
+    def __repr__(self):
+        return f"<PersonaEntry hash='{self.hash[:12]}' source='{self.fragment.source}'>"
+
+
+class PersonaRegistry:
+    """
+    ペルソナ (システムフラグメント) を一度だけ読み込み、ハッシュ単位で共有するレジストリ。
+
+    同じペルソナは毎ターン同一の `llm.Fragment` オブジェクトとして送信されるため、
+    プロバイダ側のプレフィックスキャッシュに乗りやすくなる。
+    トークン数はモデルごとに一度だけ計算してキャッシュする。
+    """
+
+    def __init__(self, prompt_cache: bool = True, store_fragments: bool = False):
+        self.prompt_cache = prompt_cache
+        self.store_fragments = store_fragments
+        self._entries: Dict[str, PersonaEntry] = {}
+        self._lock = threading.Lock()
+
+    def register(self, text: str, source: str = "") -> PersonaEntry:
+        """ペルソナを登録し、そのエントリを返す (登録済みなら既存のエントリを返す)"""
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            entry = PersonaEntry(text, source)
+            self._entries[key] = entry
+        logger.debug("ペルソナを登録しました: %r", entry)
+        if self.store_fragments:
+            self._store_fragment(entry)
+        return entry
+
+    def fragment(self, text: str, source: str = "") -> llm.Fragment:
+        """ペルソナのテキストに対応する `llm.Fragment` を取得する"""
+        return self.register(text, source).fragment
+
+    def token_count(self, text: str, model: Any = None) -> int:
+        """ペルソナのトークン数をモデルごとにキャッシュして返す"""
+        entry = self.register(text)
+        key = _model_id(model) if model is not None else ""
+        count = entry.token_counts.get(key)
+        if count is None:
+            count = count_tokens(text, model)
+            entry.token_counts[key] = count
+            logger.debug("ペルソナ %s のトークン数: %d (モデル: %s)", entry.hash[:12], count, key or "-")
+        return count
+
+    def cache_options(self, model: Any) -> Dict[str, Any]:
+        """
+        モデルがプロンプトキャッシュのオプションをサポートしていれば、それを有効にするオプションを返す。
+
+        例えば llm-anthropic の `cache` オプションはシステムプロンプトやフラグメントを
+        キャッシュ対象としてマークする。Gemini や OpenAI のように暗黙的にキャッシュする
+        プロバイダでは、プレフィックスを毎回同一に保つこと自体がキャッシュに効く。
+        """
+        if not self.prompt_cache:
+            return {}
+        options_class = getattr(model, "Options", None)
+        fields = getattr(options_class, "model_fields", None)
+        if isinstance(fields, dict) and "cache" in fields:
+            return {"cache": True}
+        return {}
+
+    def _store_fragment(self, entry: PersonaEntry) -> None:
+        """ペルソナを llm のフラグメントストア (logs.db) にハッシュで保存する"""
+        try:
+            import sqlite_utils
+            from llm.cli import logs_db_path
+            from llm.migrations import migrate
+            from llm.utils import ensure_fragment
+
+            db = sqlite_utils.Database(logs_db_path())
+            migrate(db)
+            with db.conn:
+                ensure_fragment(db, entry.fragment)
+        except Exception as e:
+            # フラグメントストアへの保存は最適化のため、失敗しても会話は継続する
+            logger.warning("ペルソナをフラグメントストアに保存できませんでした: %s", e)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, text: str) -> bool:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest() in self._entries
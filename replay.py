@@ -0,0 +1,288 @@
+"""
+LLM呼び出しの記録と再生 (record / replay)
+
+記録モードでは、実際のモデルの `prompt` 呼び出しごとにチャンクの列と各チャンクが届くまでの時間、
+使用量をフィクスチャファイル (1行1呼び出しの JSONL) に書き出す。再生モードでは、フィクスチャの
+チャンクを記録された速度 (または speed 倍の速度) で返す偽のモデルを model_cache に入れて会話を実行する。
+LLMを呼び出さずに、実際のチャンクの届き方で表示・データベース・会話の制御のオーバーヘッドを再現性のある形で計測できる。
+"""
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+FIXTURE_VERSION = 1
+
+
+class ReplayMismatchError(Exception):
+    """再生するモデルの呼び出しがフィクスチャに記録されていない場合の例外"""
+
+
+class RecordedCall:
+    """1回の `prompt` 呼び出しの記録"""
+
+    def __init__(
+        self,
+        model_id: str,
+        prompt: str,
+        system: Optional[List[str]] = None,
+        chunks: Optional[List[Tuple[float, str]]] = None,
+        input_tokens: Optional[int] = None,
+        output_tokens: Optional[int] = None,
+    ):
+        self.model_id = model_id
+        self.prompt = prompt
+        self.system = system or []
+        # (直前のチャンクから (最初のチャンクは呼び出しから) の秒数, テキスト) のリスト
+        self.chunks = chunks or []
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def seconds(self) -> float:
+        """記録された呼び出しの所要時間"""
+        return sum(delay for delay, _ in self.chunks)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": FIXTURE_VERSION,
+            "model_id": self.model_id,
+            "prompt": self.prompt,
+            "system": self.system,
+            "chunks": [[round(delay, 6), text] for delay, text in self.chunks],
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RecordedCall":
+        return cls(
+            data["model_id"],
+            data["prompt"],
+            data.get("system"),
+            [(float(delay), text) for delay, text in data.get("chunks", [])],
+            data.get("input_tokens"),
+            data.get("output_tokens"),
+        )
+
+    def __repr__(self):
+        return f"<RecordedCall model='{self.model_id}' chunks={len(self.chunks)} seconds={self.seconds:.3f}>"
+
+
+def _fragment_texts(fragments: Any) -> List[str]:
+    return [str(fragment) for fragment in fragments or []]
+
+
+class Recorder:
+    """
+    記録した呼び出しを保持し、フィクスチャファイルに書き出すクラス。
+
+    path を指定すると、呼び出しが完了するたびにファイルに追記する (途中で中断しても記録済みの分は残る)。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.calls: List[RecordedCall] = []
+        self._lock = threading.Lock()
+        if path:
+            # 既存のフィクスチャは上書きする
+            open(path, "w", encoding="utf-8").close()
+
+    def add(self, call: RecordedCall) -> None:
+        with self._lock:
+            self.calls.append(call)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(call.to_dict(), ensure_ascii=False) + "\n")
+
+    def wrap(self, model: Any, model_id: str) -> "RecordingModel":
+        return RecordingModel(model, model_id, self)
+
+    def wrap_cache(self, get_model: Callable[[str], Any], model_cache: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        取得したモデルを記録用のラッパーで包んで返すモデルのキャッシュ (ConversationManager の model_cache) を作成する。
+
+        Args:
+            get_model (Callable[[str], Any]): モデルIDから実際のモデルを取得する関数。
+            model_cache (Optional[Dict[str, Any]]): 取得済みのモデル (ラッパーで包んで引き継ぐ)。
+        """
+        return _RecordingCache(self, get_model, model_cache or {})
+
+
+class _RecordingCache(dict):
+    """取得したモデルを記録用のラッパーで包んで返すモデルのキャッシュ"""
+
+    def __init__(self, recorder: Recorder, get_model: Callable[[str], Any], model_cache: Dict[str, Any]):
+        super().__init__()
+        self._recorder = recorder
+        self._get_model = get_model
+        for model_id, model in model_cache.items():
+            self[model_id] = model
+
+    def __setitem__(self, model_id: str, model: Any) -> None:
+        if not isinstance(model, RecordingModel):
+            model = self._recorder.wrap(model, model_id)
+        super().__setitem__(model_id, model)
+
+    def get(self, model_id: str, default: Any = None) -> Any:
+        # ConversationManager は取得したモデルをそのまま使うため、キャッシュにないモデルもここで取得して包む
+        if model_id not in self:
+            try:
+                self[model_id] = self._get_model(model_id)
+            except Exception:
+                return default
+        return super().get(model_id, default)
+
+
+class RecordingResponse:
+    """実際のレスポンスのチャンクと時間を記録しながら返すレスポンス"""
+
+    def __init__(self, response: Any, call: RecordedCall, recorder: Recorder):
+        self._response = response
+        self._call = call
+        self._recorder = recorder
+        self._started = time.perf_counter()
+        self._done = False
+
+    def __iter__(self) -> Iterator[str]:
+        last = self._started
+        try:
+            for chunk in self._response:
+                now = time.perf_counter()
+                self._call.chunks.append((now - last, chunk))
+                last = now
+                yield chunk
+            self._finish()
+        finally:
+            if not self._done:
+                # 途中で読むのをやめたストリームも、受信済みの部分を記録する
+                self._finish()
+
+    def _finish(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        input_tokens = getattr(self._response, "input_tokens", None)
+        output_tokens = getattr(self._response, "output_tokens", None)
+        self._call.input_tokens = input_tokens if isinstance(input_tokens, int) else None
+        self._call.output_tokens = output_tokens if isinstance(output_tokens, int) else None
+        self._recorder.add(self._call)
+
+    def text(self) -> str:
+        return "".join(self)
+
+    def __getattr__(self, name: str) -> Any:
+        # input_tokens など、実際のレスポンスの属性はそのまま返す
+        return getattr(self._response, name)
+
+
+class RecordingModel:
+    """実際のモデルの `prompt` 呼び出しを記録するラッパー (その他の属性は実際のモデルのものを返す)"""
+
+    def __init__(self, model: Any, model_id: str, recorder: Recorder):
+        self._model = model
+        # 記録には設定のモデルID (エイリアスやプロファイル名) を使い、再生時の model_cache のキーと揃える
+        self._model_id = model_id
+        self._recorder = recorder
+
+    def prompt(self, prompt: str, system_fragments: Any = None, **kwargs: Any) -> RecordingResponse:
+        call = RecordedCall(self._model_id, prompt, _fragment_texts(system_fragments))
+        response = self._model.prompt(prompt, system_fragments=system_fragments, **kwargs)
+        return RecordingResponse(response, call, self._recorder)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._model, name)
+
+
+def load_fixture(path: str) -> List[RecordedCall]:
+    """フィクスチャファイルを読み込む"""
+    calls = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                calls.append(RecordedCall.from_dict(json.loads(line)))
+    return calls
+
+
+class ReplayResponse:
+    """記録されたチャンクを記録された間隔 (の 1/speed) で返すレスポンス"""
+
+    def __init__(self, call: RecordedCall, speed: float = 1.0):
+        self.call = call
+        self.speed = speed
+        self.input_tokens = call.input_tokens
+        self.output_tokens = call.output_tokens
+
+    def __iter__(self) -> Iterator[str]:
+        for delay, chunk in self.call.chunks:
+            if self.speed > 0 and delay > 0:
+                time.sleep(delay / self.speed)
+            yield chunk
+
+    def text(self) -> str:
+        return "".join(self)
+
+
+class ReplayModel:
+    """
+    フィクスチャの呼び出しを再生する偽のモデル。
+
+    呼び出しは同じプロンプトの記録を優先して記録順に割り当てる。strict が False の場合、
+    同じプロンプトの記録がなければ、まだ使っていないこのモデルの記録を記録順に割り当てる。
+    """
+
+    def __init__(self, model_id: str, calls: List[RecordedCall], speed: float = 1.0, strict: bool = False):
+        self.model_id = model_id
+        self.speed = speed
+        self.strict = strict
+        self._remaining: Deque[RecordedCall] = deque(calls)
+        self._lock = threading.Lock()
+
+    def _take(self, prompt: str) -> RecordedCall:
+        with self._lock:
+            for call in self._remaining:
+                if call.prompt == prompt:
+                    self._remaining.remove(call)
+                    return call
+            if self.strict or not self._remaining:
+                raise ReplayMismatchError(
+                    f"モデル '{self.model_id}' の呼び出しがフィクスチャに記録されていません: {prompt[:80]!r}"
+                )
+            return self._remaining.popleft()
+
+    def prompt(self, prompt: str, **kwargs: Any) -> ReplayResponse:
+        return ReplayResponse(self._take(prompt), self.speed)
+
+    @property
+    def remaining(self) -> int:
+        """まだ再生していない記録の数"""
+        return len(self._remaining)
+
+    def __repr__(self):
+        return f"<ReplayModel model='{self.model_id}' remaining={self.remaining} speed={self.speed}>"
+
+
+class _ReplayCache(dict):
+    """
+    フィクスチャに記録されたモデルだけを返すモデルのキャッシュ。
+
+    ConversationManager はキャッシュにないモデルを実際のバックエンドから取得するため、
+    記録のないモデルは None ではなく ReplayMismatchError にして、再生中に実際のLLMを呼び出さないようにする。
+    """
+
+    def get(self, model_id: str, default: Any = None) -> ReplayModel:
+        return self[model_id]
+
+    def __missing__(self, model_id: str) -> ReplayModel:
+        raise ReplayMismatchError(f"モデル '{model_id}' の呼び出しがフィクスチャに記録されていません")
+
+
+def build_replay_cache(calls: List[RecordedCall], speed: float = 1.0, strict: bool = False) -> Dict[str, ReplayModel]:
+    """フィクスチャの記録をモデルIDごとの ReplayModel にまとめ、ConversationManager の model_cache として返す"""
+    by_model: Dict[str, List[RecordedCall]] = {}
+    for call in calls:
+        by_model.setdefault(call.model_id, []).append(call)
+    return _ReplayCache(
+        (model_id, ReplayModel(model_id, model_calls, speed, strict)) for model_id, model_calls in by_model.items()
+    )
@@ -0,0 +1,166 @@
+"""
+ターンの埋め込みベクトルによる意味検索
+
+各ターンの発言を llm の埋め込みモデルでベクトルにし、正規化した float32 の列 (BLOB) としてデータベースに保存する。
+検索は保存したベクトルを batch_size 件ずつ読み込んで内積 (= コサイン類似度) を計算する総当たりで、
+numpy がインストールされていれば行列積で、なければ Python だけで計算する。
+1会話のターン数や数万ターン規模の会話ログでは、近似検索のインデックスを作るより総当たりのほうが速く、結果も正確になる。
+"""
+import heapq
+import math
+import sys
+import threading
+from array import array
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import llm
+
+from config import DB_PATH
+from database import fetch_turn_texts, iter_turn_embeddings, log_turn_embedding
+
+# numpy はオプション依存 (検索の高速化に使う)
+try:
+    import numpy
+except ImportError:  # pragma: no cover - 環境依存
+    numpy = None
+
+def encode_vector(values: Sequence[float]) -> bytes:
+    """ベクトルを正規化し、float32 (リトルエンディアン) のバイト列にする"""
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    vector = array("f", (v / norm for v in values))
+    if sys.byteorder == "big":  # pragma: no cover - 環境依存
+        vector.byteswap()
+    return vector.tobytes()
+
+
+def decode_vector(blob: bytes) -> array:
+    """encode_vector で作成したバイト列をベクトルに戻す"""
+    vector = array("f")
+    vector.frombytes(blob)
+    if sys.byteorder == "big":  # pragma: no cover - 環境依存
+        vector.byteswap()
+    return vector
+
+
+class SearchResult:
+    """意味検索の結果の1件"""
+
+    def __init__(self, conversation_id: str, turn_number: int, score: float, speaker: str = "", text: str = ""):
+        self.conversation_id = conversation_id
+        self.turn_number = turn_number
+        self.score = score
+        self.speaker = speaker
+        self.text = text
+
+    def __repr__(self):
+        return (
+            f"<SearchResult conversation_id='{self.conversation_id}' turn={self.turn_number} "
+            f"score={self.score:.3f} speaker='{self.speaker}'>"
+        )
+
+
+def _top_scores(query: bytes, rows: List[Tuple[str, int, int, bytes]], top_k: int) -> List[Tuple[float, str, int]]:
+    """1バッチのベクトルとクエリの内積を計算し、上位 top_k 件の (スコア, 会話ID, ターン番号) を返す"""
+    # 次元数の異なるベクトル (埋め込みモデルの設定を変えた場合など) は比較しない
+    dimensions = len(query) // 4
+    rows = [row for row in rows if row[2] == dimensions]
+    if not rows:
+        return []
+    if numpy is not None:
+        matrix = numpy.frombuffer(b"".join(row[3] for row in rows), dtype="<f4").reshape(len(rows), dimensions)
+        scores = matrix @ numpy.frombuffer(query, dtype="<f4")
+        if len(rows) > top_k:
+            indexes = numpy.argpartition(-scores, top_k)[:top_k]
+        else:
+            indexes = range(len(rows))
+        return [(float(scores[i]), rows[i][0], rows[i][1]) for i in indexes]
+    query_vector = decode_vector(query)
+    return heapq.nlargest(
+        top_k,
+        ((sum(q * v for q, v in zip(query_vector, decode_vector(row[3]))), row[0], row[1]) for row in rows),
+    )
+
+
+class SemanticIndex:
+    """
+    ターンの埋め込みベクトルの保存と意味検索を行うクラス。
+
+    埋め込みモデルのハンドルはスレッド間で共有する (最初の呼び出しで取得する)。
+    """
+
+    def __init__(self, embedding_model: str, db_path: str = DB_PATH, model: Any = None):
+        self.embedding_model = embedding_model
+        self.db_path = db_path
+        self._model = model
+        self._lock = threading.Lock()
+
+    @property
+    def model(self) -> Any:
+        with self._lock:
+            if self._model is None:
+                self._model = llm.get_embedding_model(self.embedding_model)
+            return self._model
+
+    def embed(self, text: str) -> bytes:
+        """テキストを埋め込みベクトル (encode_vector のバイト列) にする"""
+        return encode_vector(self.model.embed(text))
+
+    def add(self, conversation_id: str, turn_number: int, text: str) -> bytes:
+        """ターンの発言を埋め込みベクトルにして保存し、そのベクトルを返す (続けて search_vector で検索できる)"""
+        vector = self.embed(text)
+        log_turn_embedding(
+            conversation_id, turn_number, self.embedding_model, len(vector) // 4, vector, db_path=self.db_path,
+        )
+        return vector
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 3,
+        conversation_id: Optional[str] = None,
+        max_turn: Optional[int] = None,
+        exclude_conversation_id: Optional[str] = None,
+        min_score: float = -1.0,
+        batch_size: int = 10000,
+    ) -> List[SearchResult]:
+        """
+        query に意味の近いターンを類似度の高い順に top_k 件返す。
+
+        conversation_id を指定するとその会話 (分岐元から引き継いだターンを含む) のターン番号 max_turn までを、
+        指定しなければ exclude_conversation_id 以外のすべての会話を検索する。
+        """
+        if top_k <= 0:
+            return []
+        return self.search_vector(
+            self.embed(query), top_k, conversation_id, max_turn, exclude_conversation_id, min_score, batch_size,
+        )
+
+    def search_vector(
+        self,
+        vector: bytes,
+        top_k: int = 3,
+        conversation_id: Optional[str] = None,
+        max_turn: Optional[int] = None,
+        exclude_conversation_id: Optional[str] = None,
+        min_score: float = -1.0,
+        batch_size: int = 10000,
+    ) -> List[SearchResult]:
+        """埋め込み済みのベクトルで検索する (search と同じ)"""
+        best: List[Tuple[float, str, int]] = []
+        batches: Iterable[List[Tuple[str, int, int, bytes]]] = iter_turn_embeddings(
+            self.embedding_model,
+            conversation_id=conversation_id,
+            max_turn=max_turn,
+            exclude_conversation_id=exclude_conversation_id,
+            batch_size=batch_size,
+            db_path=self.db_path,
+        )
+        for rows in batches:
+            best = heapq.nlargest(top_k, best + _top_scores(vector, rows, top_k))
+        best = [item for item in best if item[0] >= min_score]
+        texts = fetch_turn_texts([(cid, turn) for _, cid, turn in best], db_path=self.db_path)
+        results = []
+        for score, cid, turn in best:
+            speaker, text = texts.get((cid, turn), ("", ""))
+            results.append(SearchResult(cid, turn, score, speaker, text))
+        return results
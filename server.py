@@ -0,0 +1,466 @@
+"""
+LLM TalkTable のサーバーモード
+
+asyncio ベースの HTTP サーバーで会話セッションを開始し、ターンの進行を
+Server-Sent Events (SSE) または WebSocket でライブ配信する。
+1つのプロセス内で複数のセッションを同時に実行し、モデルのハンドルとペルソナは全セッションで共有する。
+
+エンドポイント:
+    GET  /conversations                    実行中・終了済みのセッション一覧
+    POST /conversations                    セッションを開始 (JSON: topic, max_turns, show_summary)
+    GET  /conversations/{id}/events        セッションのイベントを SSE で配信
+    GET  /conversations/{id}/ws            セッションのイベントを WebSocket で配信
+    GET  /conversations/{id}/history       conversation_log に記録された会話履歴
+    DELETE /conversations/{id}             セッションをキャンセル (他のセッションは影響を受けない)
+    GET  /metrics                          モデルごとの同時実行数の上限・実行中の呼び出し数・応答の集計
+"""
+import asyncio
+import base64
+import copy
+import hashlib
+import json
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set, Tuple
+
+from config import AppConfig, ConfigWatcher
+from concurrency import ModelConcurrencyLimiter
+from conversation import ConversationManager
+from database import fetch_conversation_history, fetch_fork_point, shared_db_writer
+from moderator_cache import ModeratorCache
+from persona import PersonaRegistry
+
+# WebSocket ハンドシェイクで使用する固定の GUID (RFC 6455)
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# 保持する終了済みセッションの最大数 (古いものから破棄する)
+MAX_FINISHED_SESSIONS = 100
+
+# セッションごとに保持するイベントの最大数 (長い会話でもメモリを一定に保つため、古いものから破棄する)
+MAX_SESSION_EVENTS = 2000
+
+# リクエストボディの最大バイト数 (セッション開始のパラメータは小さな JSON のため)
+MAX_REQUEST_BODY_BYTES = 64 * 1024
+
+HTTP_REASONS = {
+    200: "OK",
+    201: "Created",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    """HTTP エラーレスポンスとして返す例外"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Session:
+    """1つの会話セッションとそのイベント履歴を保持するクラス (イベントループのスレッドからのみ操作する)"""
+
+    def __init__(self, manager: ConversationManager, topic: str):
+        self.manager = manager
+        self.conversation_id = manager.conversation_id
+        self.topic = topic
+        # 直近のイベントのみ保持する (破棄されたターンの内容は /history で取得できる)
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=MAX_SESSION_EVENTS)
+        self.published = 0  # これまでに追加したイベントの総数
+        self.done = False
+        self.error: Optional[str] = None
+        self._waiters: Set[asyncio.Future] = set()
+
+    @property
+    def status(self) -> str:
+        cancelled = self.manager.cancel_token.cancelled
+        if not self.done:
+            return "cancelling" if cancelled else "running"
+        if self.error:
+            return "failed"
+        return "cancelled" if cancelled else "finished"
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """イベントを履歴に追加し、待機中の購読者を起こす"""
+        self.events.append(event)
+        self.published += 1
+        self._wake()
+
+    def finish(self, error: Optional[str] = None) -> None:
+        """セッションの終了を記録する"""
+        self.done = True
+        self.error = error
+        if error:
+            self.publish({"type": "error", "conversation_id": self.conversation_id, "message": error})
+        else:
+            self._wake()
+
+    def _wake(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def stream(self) -> AsyncIterator[Dict[str, Any]]:
+        """保持されている最も古いイベントから順に返し、セッションが終了するまで新しいイベントを待つ"""
+        index = 0
+        while True:
+            while True:
+                # yield の間に古いイベントが破棄される可能性があるため、毎回位置を計算し直す
+                first = self.published - len(self.events)
+                index = max(index, first)
+                if index >= self.published:
+                    break
+                event = self.events[index - first]
+                index += 1
+                yield event
+            if self.done:
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.add(waiter)
+            await waiter
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "conversation_id": self.conversation_id,
+            "topic": self.topic,
+            "status": self.status,
+            "turns": self.manager.turn_count,
+            "error": self.error,
+        }
+
+
+def _websocket_frame(text: str, opcode: int = 0x1) -> bytes:
+    """サーバーから送信する WebSocket フレーム (マスクなし、単一フレーム) を作る"""
+    payload = text.encode("utf-8")
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+    return header + payload
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    """HTTP リクエストを読み込み、(メソッド, パス, ヘッダー, ボディ) を返す"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "不正なリクエスト行です")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    content_length = headers.get("content-length", "0") or "0"
+    if not content_length.isdigit():
+        raise HttpError(400, f"不正な Content-Length です: {content_length}")
+    length = int(content_length)
+    if length > MAX_REQUEST_BODY_BYTES:
+        raise HttpError(413, f"リクエストボディが大きすぎます ({length} > {MAX_REQUEST_BODY_BYTES} バイト)")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+class TalkTableServer:
+    """複数の会話セッションを管理し、HTTP/SSE/WebSocket で公開するサーバー"""
+
+    def __init__(self, config: AppConfig, logger: logging.Logger, max_sessions: int = 8, config_watcher: Optional[ConfigWatcher] = None):
+        self.config = config
+        self.logger = logger
+        # 設定ファイルの監視 (全セッションで共有し、実行中のセッションにもターンの区切りで変更を適用する)
+        self.config_watcher = config_watcher
+        self.sessions: Dict[str, Session] = {}
+        # 会話は同期的に LLM を呼び出すため、セッションごとにワーカースレッドで実行する
+        self.executor = ThreadPoolExecutor(max_workers=max_sessions, thread_name_prefix="talktable-session")
+        # モデルのハンドルとペルソナは全セッションで共有する
+        self.model_cache: Dict[str, Any] = {}
+        self.personas = PersonaRegistry(
+            prompt_cache=config.prompt_cache,
+            store_fragments=config.store_persona_fragments,
+        )
+        # cache_moderator_intro が有効な場合、同じテーマのセッションで開始アナウンスを共有する
+        self.moderator_cache = ModeratorCache(db_path=config.db_path) if config.cache_moderator_intro else None
+        # モデルごとの同時実行数の上限は全セッションで共有する
+        self.limiter = ModelConcurrencyLimiter.from_profiles(config.model_profiles)
+
+    def _session_config(self, params: Dict[str, Any], base: Optional[AppConfig] = None) -> AppConfig:
+        """
+        リクエストのパラメータでセッション用の設定を作る。
+
+        base を省略した場合は現在の設定 (設定ファイルを監視していれば最後に読み込んだ設定) を元にする。
+        再読み込みした設定にも同じパラメータを適用し直すため、実行中のセッションの設定を差し替える際にも使う。
+        """
+        if base is None:
+            base = self.config_watcher.config if self.config_watcher is not None else self.config
+        config = copy.copy(base)
+        topic = params.get("topic")
+        if topic is not None:
+            if not isinstance(topic, str) or not topic.strip():
+                raise HttpError(400, "'topic' は空でない文字列である必要があります")
+            config.topic = topic
+        max_turns = params.get("max_turns", config.max_turns)
+        if isinstance(max_turns, bool) or not isinstance(max_turns, int) or max_turns <= 0:
+            raise HttpError(400, f"'max_turns' は正の整数である必要があります: {max_turns}")
+        config.max_turns = max_turns
+        show_summary = params.get("show_summary", config.show_summary)
+        if not isinstance(show_summary, bool):
+            raise HttpError(400, f"'show_summary' は真偽値である必要があります: {show_summary}")
+        config.show_summary = show_summary
+        return config
+
+    async def _fork_params(self, params: Dict[str, Any], config: AppConfig) -> Tuple[Optional[str], Optional[int]]:
+        """分岐 (fork) のパラメータを検証する。分岐しない場合は (None, None) を返す"""
+        parent_conversation_id = params.get("parent_conversation_id")
+        fork_turn = params.get("fork_turn")
+        if parent_conversation_id is None and fork_turn is None:
+            return None, None
+        if not isinstance(parent_conversation_id, str) or not parent_conversation_id:
+            raise HttpError(400, "'parent_conversation_id' は空でない文字列である必要があります")
+        if isinstance(fork_turn, bool) or not isinstance(fork_turn, int) or fork_turn <= 0:
+            raise HttpError(400, f"'fork_turn' は正の整数である必要があります: {fork_turn}")
+        if fork_turn >= config.max_turns:
+            raise HttpError(400, f"'max_turns' ({config.max_turns}) は 'fork_turn' ({fork_turn}) より大きい必要があります")
+        # 分岐元の確認はデータベースを読むため、イベントループを止めないようスレッドで行う
+        loop = asyncio.get_running_loop()
+        fork_point = await loop.run_in_executor(None, fetch_fork_point, parent_conversation_id, fork_turn, config.db_path)
+        if fork_point is None:
+            raise HttpError(404, f"分岐元の会話 {parent_conversation_id} にターン {fork_turn} が見つかりません")
+        return parent_conversation_id, fork_turn
+
+    async def start_session(self, params: Dict[str, Any]) -> Session:
+        """会話セッションを開始する (イベントループのスレッドから呼び出す)"""
+        loop = asyncio.get_running_loop()
+        config = self._session_config(params)
+        parent_conversation_id, fork_turn = await self._fork_params(params, config)
+        manager = ConversationManager(
+            config,
+            self.logger,
+            persona_registry=self.personas,
+            model_cache=self.model_cache,
+            console=False,
+            moderator_cache=self.moderator_cache,
+            limiter=self.limiter,
+            parent_conversation_id=parent_conversation_id,
+            fork_turn=fork_turn,
+            config_watcher=self.config_watcher,
+            config_overrides=lambda new_config: self._session_config(params, new_config),
+        )
+        session = Session(manager, config.topic)
+        # ワーカースレッドからのイベントはイベントループのスレッドで履歴に追加する
+        manager.event_callback = lambda event: loop.call_soon_threadsafe(session.publish, event)
+        self.sessions[session.conversation_id] = session
+        self._prune_sessions()
+
+        future = loop.run_in_executor(
+            self.executor,
+            manager.start_conversation,
+            config.max_turns,
+            False,
+            config.show_summary,
+        )
+
+        def _on_done(done_future: "asyncio.Future[Any]") -> None:
+            # サーバーの停止時に開始前のセッションはキャンセルされる (exception() は CancelledError を送出する)
+            if done_future.cancelled():
+                session.manager.cancel("サーバーを停止します")
+                session.finish()
+                return
+            error = done_future.exception()
+            if error is not None:
+                self.logger.error(
+                    "セッション %s でエラーが発生しました: %s", session.conversation_id, error,
+                    extra={"event": "session_failed", "conversation_id": session.conversation_id},
+                )
+                session.finish(str(error))
+            else:
+                session.finish()
+
+        future.add_done_callback(_on_done)
+        self.logger.info(
+            "セッションを開始しました (ID: %s, テーマ: %s)", session.conversation_id, config.topic,
+            extra={"event": "session_start", "conversation_id": session.conversation_id},
+        )
+        return session
+
+    def _prune_sessions(self) -> None:
+        """終了済みセッションが多すぎる場合、古いものからイベント履歴ごと破棄する"""
+        finished = [cid for cid, s in self.sessions.items() if s.done]
+        for conversation_id in finished[:max(0, len(finished) - MAX_FINISHED_SESSIONS)]:
+            del self.sessions[conversation_id]
+
+    def _get_session(self, conversation_id: str) -> Session:
+        session = self.sessions.get(conversation_id)
+        if session is None:
+            raise HttpError(404, f"セッションが見つかりません: {conversation_id}")
+        return session
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Any) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def _stream_sse(self, writer: asyncio.StreamWriter, session: Session) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        await writer.drain()
+        async for event in session.stream():
+            data = json.dumps(event, ensure_ascii=False)
+            writer.write(f"event: {event['type']}\ndata: {data}\n\n".encode("utf-8"))
+            await writer.drain()
+
+    async def _stream_websocket(self, writer: asyncio.StreamWriter, headers: Dict[str, str], session: Session) -> None:
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            raise HttpError(400, "WebSocket のハンドシェイクが不正です")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("latin-1")).digest()).decode("latin-1")
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+        async for event in session.stream():
+            writer.write(_websocket_frame(json.dumps(event, ensure_ascii=False)))
+            await writer.drain()
+        # 正常終了 (1000) のクローズフレーム
+        writer.write(bytes([0x88, 0x02]) + (1000).to_bytes(2, "big"))
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """1つの HTTP 接続を処理する"""
+        try:
+            try:
+                method, path, headers, body = await _read_request(reader)
+                await self._route(method, path, headers, body, writer)
+            except HttpError as e:
+                await self._send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass  # クライアントが切断した
+        except Exception as e:
+            self.logger.exception("リクエストの処理中にエラーが発生しました: %s", e)
+            try:
+                await self._send_json(writer, 500, {"error": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, headers: Dict[str, str], body: bytes, writer: asyncio.StreamWriter) -> None:
+        parts = [p for p in path.split("/") if p]
+        if parts == ["metrics"]:
+            if method != "GET":
+                raise HttpError(405, f"サポートされていないメソッドです: {method}")
+            running = sum(1 for session in self.sessions.values() if not session.done)
+            await self._send_json(writer, 200, {
+                "sessions": {"running": running, "done": len(self.sessions) - running},
+                "concurrency": self.limiter.metrics(),
+            })
+            return
+        if parts[:1] != ["conversations"]:
+            raise HttpError(404, f"見つかりません: {path}")
+
+        if len(parts) == 1:
+            if method == "GET":
+                await self._send_json(writer, 200, [s.summary() for s in self.sessions.values()])
+            elif method == "POST":
+                try:
+                    params = json.loads(body.decode("utf-8")) if body else {}
+                except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                    raise HttpError(400, f"JSON を解析できません: {e}")
+                if not isinstance(params, dict):
+                    raise HttpError(400, "リクエストボディは JSON オブジェクトである必要があります")
+                session = await self.start_session(params)
+                await self._send_json(writer, 201, session.summary())
+            else:
+                raise HttpError(405, f"サポートされていないメソッドです: {method}")
+            return
+
+        if len(parts) == 2:
+            if method != "DELETE":
+                raise HttpError(405, f"サポートされていないメソッドです: {method}")
+            session = self._get_session(parts[1])
+            if not session.done:
+                # 実行中のターンはチャンクの区切りで中断され、途中までのレスポンスが記録される
+                session.manager.cancel("APIからキャンセルされました")
+            await self._send_json(writer, 202, session.summary())
+            return
+
+        if method != "GET" or len(parts) != 3:
+            raise HttpError(404, f"見つかりません: {path}")
+        conversation_id, action = parts[1], parts[2]
+        if action == "history":
+            # 保持しているセッションはトランスクリプトから、破棄されたセッションやサーバー再起動前の会話は
+            # データベースから読む (トランスクリプトも本文を捨てたターンがあればデータベースから読み直す)
+            loop = asyncio.get_running_loop()
+            session = self.sessions.get(conversation_id)
+            if session is not None:
+                manager = session.manager
+                history = await loop.run_in_executor(
+                    None, lambda: list(manager.transcript.iter_history(db_path=manager.config.db_path))
+                )
+            else:
+                history = await loop.run_in_executor(None, fetch_conversation_history, conversation_id, self.config.db_path)
+            if not history and session is None:
+                raise HttpError(404, f"会話が見つかりません: {conversation_id}")
+            await self._send_json(writer, 200, [
+                {"speaker_name": speaker_name, "model_used": model_used, "response": response}
+                for speaker_name, model_used, response in history
+            ])
+        elif action == "events":
+            await self._stream_sse(writer, self._get_session(conversation_id))
+        elif action == "ws":
+            await self._stream_websocket(writer, headers, self._get_session(conversation_id))
+        else:
+            raise HttpError(404, f"見つかりません: {path}")
+
+    async def serve(self, host: str, port: int) -> None:
+        """サーバーを起動し、停止されるまで接続を受け付ける"""
+        server = await asyncio.start_server(self.handle, host, port)
+        addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+        self.logger.info("サーバーを起動しました: %s", addresses)
+        print(f"LLM TalkTable サーバーを起動しました: http://{host}:{port}/conversations")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # 実行中のセッションをキャンセルしてワーカースレッドを早く終了させる
+            for session in self.sessions.values():
+                if not session.done:
+                    session.manager.cancel("サーバーを停止します")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_server(
+    config: AppConfig,
+    logger: logging.Logger,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    max_sessions: int = 8,
+    config_watcher: Optional[ConfigWatcher] = None,
+) -> None:
+    """サーバーモードでアプリケーションを実行する"""
+    # 全セッションの記録は1つの書き込み用接続にまとめる
+    with shared_db_writer(config.db_path):
+        asyncio.run(TalkTableServer(config, logger, max_sessions=max_sessions, config_watcher=config_watcher).serve(host, port))
@@ -0,0 +1,174 @@
+"""
+会話ログの統計と列指向形式への書き出し
+
+集計はすべてSQL (会話ログの集計用カバリングインデックス) で行い、Python には集計済みの行だけを読み込む。
+Parquet への書き出しは pyarrow がインストールされている場合のみ利用できる。
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+from config import DB_PATH
+from database import LENGTH_BUCKETS, fetch_call_stats, fetch_length_histogram, fetch_turn_stats, iter_turn_rows
+
+# pyarrow はオプション依存 (Parquet への書き出しに使う)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - 環境依存
+    pyarrow = None
+
+DEFAULT_GROUP_BY = ("model", "persona")
+
+# Parquet に書き出す列と型 (iter_turn_rows の列順)
+EXPORT_COLUMNS = (
+    ("conversation_id", "string"),
+    ("turn_number", "int64"),
+    ("speaker_name", "string"),
+    ("model_used", "string"),
+    ("is_moderator", "bool_"),
+    ("is_partial", "bool_"),
+    ("timestamp", "string"),
+    ("input_tokens", "int64"),
+    ("output_tokens", "int64"),
+    ("latency_ms", "int64"),
+    ("response_chars", "int64"),
+    ("topic", "string"),
+    ("batch_id", "string"),
+)
+TEXT_EXPORT_COLUMNS = (("prompt", "string"), ("response", "string"))
+
+
+def _bucket_label(index: int) -> str:
+    """分布の区間の表示名"""
+    if index == 0:
+        return f"<{LENGTH_BUCKETS[0]}"
+    if index == len(LENGTH_BUCKETS):
+        return f">={LENGTH_BUCKETS[-1]}"
+    return f"<{LENGTH_BUCKETS[index]}"
+
+
+def _approximate_quantile(histogram: List[int], quantile: float) -> Optional[int]:
+    """区間ごとの件数から分位点を含む区間の上限を返す (上限のない区間の場合は None)"""
+    total = sum(histogram)
+    threshold = quantile * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if count and seen >= threshold:
+            return LENGTH_BUCKETS[index] if index < len(LENGTH_BUCKETS) else None
+    return None
+
+
+def compute_stats(
+    group_by: Sequence[str] = DEFAULT_GROUP_BY,
+    batch_id: Optional[str] = None,
+    include_partial: bool = False,
+    db_path: str = DB_PATH,
+) -> List[Dict[str, Any]]:
+    """
+    group_by の軸ごとのターン数・MCの割合・レスポンスの文字数の分布を集計する。
+
+    Returns:
+        List[Dict[str, Any]]: fetch_turn_stats の各列に、moderator_share (MCの発言の割合)、
+        histogram (LENGTH_BUCKETS の区間ごとのターン数)、p50_chars / p90_chars (分位点を含む区間の上限) を加えた辞書のリスト。
+    """
+    group_by = list(group_by)
+    rows = fetch_turn_stats(group_by, batch_id=batch_id, include_partial=include_partial, db_path=db_path)
+    histograms: Dict[tuple, List[int]] = {}
+    for row in fetch_length_histogram(group_by, batch_id=batch_id, include_partial=include_partial, db_path=db_path):
+        key, bucket, count = tuple(row[:-2]), row[-2], row[-1]
+        histograms.setdefault(key, [0] * (len(LENGTH_BUCKETS) + 1))[bucket] = count
+    for row in rows:
+        histogram = histograms.get(tuple(row[name] for name in group_by), [0] * (len(LENGTH_BUCKETS) + 1))
+        row["moderator_share"] = row["moderator_turns"] / row["turns"] if row["turns"] else 0.0
+        row["histogram"] = histogram
+        row["p50_chars"] = _approximate_quantile(histogram, 0.5)
+        row["p90_chars"] = _approximate_quantile(histogram, 0.9)
+    return rows
+
+
+def _format_number(value: Optional[float], digits: int = 0) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def format_stats(rows: List[Dict[str, Any]], group_by: Sequence[str] = DEFAULT_GROUP_BY) -> str:
+    """集計結果を表形式の文字列にする"""
+    header = [*group_by, "ターン", "会話", "MC割合", "平均文字", "p50", "p90", "最大", "平均ms", "平均出力"]
+    table = [header]
+    for row in rows:
+        table.append([
+            *(str(row[name]) for name in group_by),
+            str(row["turns"]),
+            str(row["conversations"]),
+            f"{row['moderator_share']:.1%}",
+            _format_number(row["avg_chars"]),
+            f"<{row['p50_chars']}" if row["p50_chars"] is not None else f">={LENGTH_BUCKETS[-1]}",
+            f"<{row['p90_chars']}" if row["p90_chars"] is not None else f">={LENGTH_BUCKETS[-1]}",
+            _format_number(row["max_chars"]),
+            _format_number(row["avg_latency_ms"]),
+            _format_number(row["avg_output_tokens"]),
+        ])
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in table]
+
+    # 文字数の分布
+    lines.append("")
+    lines.append("文字数の分布: " + " / ".join(_bucket_label(i) for i in range(len(LENGTH_BUCKETS) + 1)))
+    for row in rows:
+        label = ", ".join(str(row[name]) for name in group_by)
+        lines.append(f"  {label}: {' / '.join(str(count) for count in row['histogram'])}")
+    return "\n".join(lines)
+
+
+def format_call_stats(batch_id: Optional[str] = None, db_path: str = DB_PATH) -> str:
+    """会話のターンにならないLLM呼び出し (終了判定・途中要約・採点) の集計を表形式の文字列にする (なければ空文字列)"""
+    rows = fetch_call_stats(batch_id=batch_id, db_path=db_path)
+    if not rows:
+        return ""
+    table = [["model", "用途", "呼び出し", "入力", "出力", "平均ms"]]
+    for row in rows:
+        table.append([
+            str(row["model"]),
+            str(row["purpose"]),
+            str(row["calls"]),
+            str(row["input_tokens"]),
+            str(row["output_tokens"]),
+            _format_number(row["avg_latency_ms"]),
+        ])
+    widths = [max(len(line[i]) for line in table) for i in range(len(table[0]))]
+    lines = ["ターン以外のLLM呼び出し:"]
+    lines.extend("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in table)
+    return "\n".join(lines)
+
+
+def export_parquet(path: str, include_text: bool = False, batch_size: int = 100000, db_path: str = DB_PATH) -> int:
+    """
+    会話ログ (テーマ・バッチIDと結合したもの) を Parquet ファイルに書き出す。
+
+    行は batch_size 件ずつ読み込んで行グループとして書き出すため、全体をメモリに載せない。
+    プロンプトとレスポンスの本文は include_text が True の場合のみ含める。
+
+    Returns:
+        int: 書き出した行数。
+
+    Raises:
+        RuntimeError: pyarrow がインストールされていない場合。
+    """
+    if pyarrow is None:
+        raise RuntimeError("Parquet への書き出しには pyarrow が必要です (pip install pyarrow)")
+    fields = EXPORT_COLUMNS + (TEXT_EXPORT_COLUMNS if include_text else ())
+    # 最初の行グループに NULL しかない列があっても型が変わらないよう、スキーマは固定する
+    schema = pyarrow.schema([(name, getattr(pyarrow, type_name)()) for name, type_name in fields])
+    total = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for _, rows in iter_turn_rows(batch_size=batch_size, include_text=include_text, db_path=db_path):
+            arrays = [
+                # SQLite の真偽値は整数で返るため変換する
+                pyarrow.array(
+                    [row[i] if row[i] is None or field.type != pyarrow.bool_() else bool(row[i]) for row in rows],
+                    type=field.type,
+                )
+                for i, field in enumerate(schema)
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            total += len(rows)
+    return total
@@ -0,0 +1,216 @@
+import re
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+
+class StreamFilter(ABC):
+    """
+    ストリーミングレスポンスのチャンクを逐次加工するフィルタの基底クラス。
+
+    `feed()` はチャンクを受け取り、確定した出力を返す。判定に先読みが必要な部分は
+    内部に保持し、`flush()` でストリームの終端に残りを吐き出す。
+    """
+
+    # これ以上の出力が不要になった場合 (長さの上限など) に True になる
+    exhausted = False
+
+    @abstractmethod
+    def feed(self, chunk: str) -> str:
+        """チャンクを受け取り、確定した出力を返す"""
+
+    def flush(self) -> str:
+        return ""
+
+
+def _partial_suffix_length(text: str, tag: str) -> int:
+    """text の末尾が tag の先頭部分と一致する最長の長さ (tag 全体は含まない) を返す"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ReasoningTagFilter(StreamFilter):
+    """deepseek-r1 などが出力する <think>...</think> のような推論部分を取り除く"""
+
+    def __init__(self, tags: Sequence[Tuple[str, str]] = (("<think>", "</think>"),)):
+        self.tags = list(tags)
+        self._inside: Optional[Tuple[str, str]] = None
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> str:
+        text = self._buffer + chunk
+        self._buffer = ""
+        output: List[str] = []
+        while text:
+            if self._inside is not None:
+                close_tag = self._inside[1]
+                index = text.find(close_tag)
+                if index == -1:
+                    # 閉じタグがチャンクをまたぐ可能性があるので末尾だけ保持する
+                    keep = _partial_suffix_length(text, close_tag)
+                    self._buffer = text[len(text) - keep:] if keep else ""
+                    break
+                text = text[index + len(close_tag):]
+                self._inside = None
+            else:
+                found = None
+                for open_tag, close_tag in self.tags:
+                    index = text.find(open_tag)
+                    if index != -1 and (found is None or index < found[0]):
+                        found = (index, open_tag, close_tag)
+                if found is None:
+                    keep = max(_partial_suffix_length(text, open_tag) for open_tag, _ in self.tags)
+                    output.append(text[:len(text) - keep])
+                    self._buffer = text[len(text) - keep:] if keep else ""
+                    break
+                index, open_tag, close_tag = found
+                output.append(text[:index])
+                text = text[index + len(open_tag):]
+                self._inside = (open_tag, close_tag)
+        return "".join(output)
+
+    def flush(self) -> str:
+        # 閉じられていない推論部分は捨てる
+        output = "" if self._inside is not None else self._buffer
+        self._buffer = ""
+        self._inside = None
+        return output
+
+
+class SpeakerPrefixFilter(StreamFilter):
+    """
+    レスポンス先頭の "アリス:" のような話者名プレフィックスを取り除く。
+
+    プレフィックスがチャンクをまたいでも判定できるよう、先頭がプレフィックスの
+    一部と一致している間だけ出力を保留する (先読みはプレフィックス長で制限される)。
+    """
+
+    def __init__(self, speaker_name: str):
+        self.prefixes = [f"{speaker_name}:", f"{speaker_name}："]
+        self._buffer = ""
+        self._decided = False
+
+    def feed(self, chunk: str) -> str:
+        if self._decided:
+            return chunk
+        self._buffer += chunk
+        head = self._buffer.lstrip()
+        for prefix in self.prefixes:
+            if head.startswith(prefix):
+                self._decided = True
+                self._buffer = ""
+                return head[len(prefix):]
+        if any(prefix.startswith(head) for prefix in self.prefixes):
+            return ""  # まだプレフィックスかどうか判定できない
+        self._decided = True
+        output, self._buffer = self._buffer, ""
+        return output
+
+    def flush(self) -> str:
+        output, self._buffer = self._buffer, ""
+        self._decided = True
+        return output
+
+
+# 空行が3行以上続く箇所 (空白のみの行を含む)
+_EXCESS_NEWLINES = re.compile(r"\n[ \t\r]*\n(?:[ \t\r]*\n)+")
+
+
+class WhitespaceFilter(StreamFilter):
+    """先頭と末尾の空白を取り除き、連続する空行を1行にまとめる"""
+
+    def __init__(self):
+        self._started = False
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + chunk
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                self._pending = ""
+                return ""
+            self._started = True
+        # 末尾の空白は次のチャンク次第で不要になるので保留する
+        body = text.rstrip()
+        self._pending = text[len(body):]
+        return _EXCESS_NEWLINES.sub("\n\n", body)
+
+    def flush(self) -> str:
+        # ストリーム末尾の空白は出力しない
+        self._pending = ""
+        return ""
+
+
+class LengthCapFilter(StreamFilter):
+    """出力を指定文字数で打ち切る"""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self._emitted = 0
+
+    def feed(self, chunk: str) -> str:
+        remaining = self.max_chars - self._emitted
+        if remaining <= 0:
+            self.exhausted = True
+            return ""
+        if len(chunk) >= remaining:
+            self.exhausted = True
+            chunk = chunk[:remaining]
+        self._emitted += len(chunk)
+        return chunk
+
+
+class StreamPipeline:
+    """
+    複数の StreamFilter を順に適用するパイプライン。
+
+    加工後のチャンクはリストに蓄積し、最終的なテキストは `text()` で一度だけ結合する。
+    """
+
+    def __init__(self, filters: Iterable[StreamFilter]):
+        self.filters = list(filters)
+        self._parts: List[str] = []
+
+    @property
+    def exhausted(self) -> bool:
+        """これ以上チャンクを読む必要がなければ True"""
+        return any(f.exhausted for f in self.filters)
+
+    def feed(self, chunk: str) -> str:
+        """チャンクを全フィルタに通し、表示・記録可能になった出力を返す"""
+        for stream_filter in self.filters:
+            if not chunk:
+                break
+            chunk = stream_filter.feed(chunk)
+        if chunk:
+            self._parts.append(chunk)
+        return chunk
+
+    def flush(self) -> str:
+        """ストリームの終端で各フィルタに保留されている出力を吐き出す"""
+        output = ""
+        for stream_filter in self.filters:
+            # 前段のフィルタから吐き出された出力を後段のフィルタに通してから、後段を flush する
+            output = stream_filter.feed(output) if output else ""
+            output += stream_filter.flush()
+        if output:
+            self._parts.append(output)
+        return output
+
+    def text(self) -> str:
+        """加工済みのレスポンス全体を返す"""
+        return "".join(self._parts)
+
+
+def build_stream_pipeline(speaker_name: str, max_chars: int = 0, strip_reasoning: bool = True) -> StreamPipeline:
+    """会話ターン用の標準的なフィルタパイプラインを構築する"""
+    filters: List[StreamFilter] = []
+    if strip_reasoning:
+        filters.append(ReasoningTagFilter())
+    filters.append(SpeakerPrefixFilter(speaker_name))
+    filters.append(WhitespaceFilter())
+    if max_chars:
+        filters.append(LengthCapFilter(max_chars))
+    return StreamPipeline(filters)
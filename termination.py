@@ -0,0 +1,160 @@
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Deque, FrozenSet, List, Optional, Sequence
+
+from config import TerminationConfig
+from persona import estimate_token_count
+
+# ロガーを取得
+logger = logging.getLogger(__name__)
+
+
+class TerminationPolicy(ABC):
+    """
+    ターン終了後に会話を打ち切るかどうかを判定するポリシーの基底クラス。
+
+    `check()` は会話を終了すべき場合にその理由を、継続する場合は None を返す。
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def check(self, turn_number: int, response_text: str) -> Optional[str]:
+        """ターン終了後に呼び出され、会話を終了すべき場合にその理由を返す"""
+
+    def reset(self) -> None:
+        """新しい会話のために内部状態をリセットする"""
+
+
+def _shingles(text: str, size: int) -> FrozenSet[str]:
+    """空白を除いたテキストから文字 n-gram (シングル) の集合を作る"""
+    normalized = "".join(text.split())
+    if len(normalized) <= size:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[i:i + size] for i in range(len(normalized) - size + 1))
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SimilarityPolicy(TerminationPolicy):
+    """直近のターンと発言内容がほぼ同じ (シングルの Jaccard 類似度が閾値以上) になったら終了する"""
+
+    name = "similarity"
+
+    def __init__(self, threshold: float = 0.8, window: int = 4, shingle_size: int = 3):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        # 直近のターンのシングル集合だけを保持する (テキスト全体は保持しない)
+        self._recent: Deque[FrozenSet[str]] = deque(maxlen=window)
+
+    def check(self, turn_number: int, response_text: str) -> Optional[str]:
+        current = _shingles(response_text, self.shingle_size)
+        best = max((_jaccard(current, previous) for previous in self._recent), default=0.0)
+        self._recent.append(current)
+        if best >= self.threshold:
+            return f"直近の発言との類似度が閾値を超えました ({best:.2f} >= {self.threshold})"
+        return None
+
+    def reset(self) -> None:
+        self._recent.clear()
+
+
+class EndMarkerPolicy(TerminationPolicy):
+    """発言に終了マーカー (例: "[END]") が含まれていたら終了する"""
+
+    name = "end_marker"
+
+    def __init__(self, markers: Sequence[str]):
+        self.markers = [m for m in markers if m]
+
+    def check(self, turn_number: int, response_text: str) -> Optional[str]:
+        for marker in self.markers:
+            if marker in response_text:
+                return f"終了マーカー '{marker}' が検出されました"
+        return None
+
+
+class ModeratorJudgePolicy(TerminationPolicy):
+    """
+    一定ターンごとにMCに会話が結論に達したかを判定させ、達していれば終了する。
+
+    判定関数は直近の発言のリストを受け取り、結論に達していれば True を返す。
+    """
+
+    name = "moderator_judge"
+
+    def __init__(self, judge: Callable[[List[str]], bool], every: int = 4, window: int = 4):
+        self.judge = judge
+        self.every = every
+        self._recent: Deque[str] = deque(maxlen=window)
+
+    def check(self, turn_number: int, response_text: str) -> Optional[str]:
+        self._recent.append(response_text)
+        if turn_number % self.every != 0:
+            return None
+        try:
+            concluded = self.judge(list(self._recent))
+        except Exception as e:
+            # 判定の失敗で会話自体は止めない
+            logger.warning("MCによる終了判定に失敗しました: %s", e, extra={"event": "judge_failed", "turn": turn_number})
+            return None
+        if concluded:
+            return "MCが会話は結論に達したと判定しました"
+        return None
+
+    def reset(self) -> None:
+        self._recent.clear()
+
+
+class TokenBudgetPolicy(TerminationPolicy):
+    """会話全体の発言トークン数 (推定) が上限に達したら終了する"""
+
+    name = "token_budget"
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.used_tokens = 0
+
+    def check(self, turn_number: int, response_text: str) -> Optional[str]:
+        self.used_tokens += estimate_token_count(response_text)
+        if self.used_tokens >= self.max_tokens:
+            return f"会話のトークン数が上限に達しました ({self.used_tokens} >= {self.max_tokens})"
+        return None
+
+    def reset(self) -> None:
+        self.used_tokens = 0
+
+
+def build_termination_policies(
+    termination: TerminationConfig,
+    judge: Optional[Callable[[List[str]], bool]] = None,
+) -> List[TerminationPolicy]:
+    """設定から終了ポリシーのリストを構築する (設定されていないポリシーは含めない)"""
+    policies: List[TerminationPolicy] = []
+    if termination.similarity_threshold is not None:
+        policies.append(SimilarityPolicy(
+            threshold=termination.similarity_threshold,
+            window=termination.similarity_window,
+        ))
+    if termination.end_markers:
+        policies.append(EndMarkerPolicy(termination.end_markers))
+    if termination.max_tokens:
+        policies.append(TokenBudgetPolicy(termination.max_tokens))
+    # LLM呼び出しを伴う判定は最も高コストなので最後に評価する
+    if termination.moderator_judge_every and judge is not None:
+        policies.append(ModeratorJudgePolicy(judge, every=termination.moderator_judge_every))
+    return policies
+
+
+def check_termination(policies: Sequence[TerminationPolicy], turn_number: int, response_text: str) -> Optional[str]:
+    """ポリシーを順に評価し、最初に見つかった終了理由を返す (以降のポリシーは評価しない)"""
+    for policy in policies:
+        reason = policy.check(turn_number, response_text)
+        if reason:
+            return f"[{policy.name}] {reason}"
+    return None
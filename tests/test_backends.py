@@ -0,0 +1,35 @@
+import unittest
+from unittest.mock import patch
+import backends
+from config import ModelProfile
+
+
+class TestBackends(unittest.TestCase):
+    """backends.py のテストクラス"""
+
+    def test_openai_compatible_model(self):
+        """OpenAI 互換サーバーのモデルがプロファイルの api_base とモデル名で作成されるテスト"""
+        profile = ModelProfile(backend="openai_compatible", api_base="http://localhost:8080/v1", model_name="llama")
+        model = backends.get_model("local-llama", profile)
+        self.assertEqual(model.model_id, "local-llama")
+        self.assertEqual(model.model_name, "llama")
+        self.assertEqual(model.api_base, "http://localhost:8080/v1")
+        # ローカルのサーバーにはキーを要求しない
+        self.assertIsNone(model.needs_key)
+
+        keyed = backends.get_model("hosted", ModelProfile(
+            backend="openai_compatible", api_base="https://example.com/v1", api_key_env="HOSTED_API_KEY",
+        ))
+        self.assertEqual(keyed.model_name, "hosted")
+        self.assertEqual(keyed.key_env_var, "HOSTED_API_KEY")
+
+    @patch('backends.llm.get_model')
+    def test_llm_backend_uses_plugins(self, mock_get_model):
+        """backend が llm の場合はプラグインでモデルを解決するテスト"""
+        backends.get_model("gpt4all-model", ModelProfile(max_concurrency=1))
+        backends.get_model("other-model")
+        self.assertEqual([c.args[0] for c in mock_get_model.call_args_list], ["gpt4all-model", "other-model"])
+
+
+if __name__ == '__main__':
+    unittest.main()
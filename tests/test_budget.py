@@ -0,0 +1,165 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import MagicMock, patch
+from config import BudgetConfig, BudgetLimit, ModelPrice
+from database import init_db, log_conversation_turn, log_conversation_meta
+from budget import BudgetManager, BudgetExceededError, DEFAULT_OUTPUT_TOKEN_CAP, max_tokens_options, model_output_limit
+
+
+class TestBudgetManager(unittest.TestCase):
+    """budget.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "test_conversation.db")
+        self.pricing = {"paid-model": ModelPrice(input_per_million=1.0, output_per_million=2.0)}
+
+    def tearDown(self):
+        """テスト後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_record_and_cost(self):
+        """使用量と料金の集計テスト"""
+        budget = BudgetManager(BudgetConfig(), self.pricing, "conv-1", db_path=self.db_path)
+        cost = budget.record("paid-model", 1_000_000, 500_000)
+        budget.record("free-model", 100, 100)
+
+        self.assertAlmostEqual(cost, 2.0)
+        self.assertEqual(budget.conversation.tokens, 1_500_200)
+        self.assertAlmostEqual(budget.conversation.cost, 2.0)
+        self.assertEqual(budget.models["free-model"].tokens, 200)
+        # 上限が設定されていなければ制限しない
+        budget.check("paid-model")
+        self.assertIsNone(budget.remaining_output_tokens("paid-model"))
+
+    def test_warning_goes_to_callback_not_stdout(self):
+        """warn_ratio を超えた警告が標準出力ではなくコールバックに一度だけ渡されるテスト"""
+        config = BudgetConfig(conversation=BudgetLimit(max_tokens=1000))
+        on_warning = MagicMock()
+        budget = BudgetManager(config, self.pricing, "conv-1", db_path=self.db_path, on_warning=on_warning)
+        with patch("builtins.print") as mock_print, self.assertLogs("budget", level="WARNING"):
+            budget.record("free-model", 700, 200)
+            budget.record("free-model", 10, 10)
+        mock_print.assert_not_called()
+        on_warning.assert_called_once()
+        self.assertIn("会話 の予算の 90%", on_warning.call_args.args[0])
+
+    def test_conversation_token_limit(self):
+        """会話単位のトークン上限のテスト"""
+        config = BudgetConfig(conversation=BudgetLimit(max_tokens=1000))
+        budget = BudgetManager(config, self.pricing, "conv-1", db_path=self.db_path)
+        budget.record("free-model", 600, 100)
+
+        budget.check("free-model")
+        self.assertEqual(budget.remaining_output_tokens("free-model", input_tokens=200), 100)
+
+        budget.record("free-model", 200, 100)
+        with self.assertRaises(BudgetExceededError):
+            budget.check("free-model")
+
+    def test_model_cost_limit(self):
+        """モデル単位の料金上限が出力トークン数の上限に換算されるテスト"""
+        config = BudgetConfig(models={"paid-model": BudgetLimit(max_cost=1.0)})
+        budget = BudgetManager(config, self.pricing, "conv-1", db_path=self.db_path)
+        budget.record("paid-model", 0, 250_000)  # $0.5
+
+        self.assertEqual(budget.remaining_output_tokens("paid-model"), 250_000)
+        self.assertIsNone(budget.remaining_output_tokens("free-model"))
+
+        budget.record("paid-model", 0, 250_000)
+        with self.assertRaises(BudgetExceededError):
+            budget.check("paid-model")
+        budget.check("free-model")
+
+    def test_batch_usage_is_loaded_from_db(self):
+        """同じバッチの過去の使用量がデータベースから復元されるテスト"""
+        init_db(self.db_path)
+        log_conversation_meta("old-conv", "Topic", "A", "paid-model", "B", "paid-model", "MC", "paid-model",
+                              batch_id="batch-1", db_path=self.db_path)
+        log_conversation_turn("old-conv", 1, "A", "paid-model", "prompt", "response",
+                              input_tokens=300, output_tokens=200, db_path=self.db_path)
+
+        config = BudgetConfig(batch=BudgetLimit(max_tokens=500), batch_id="batch-1")
+        budget = BudgetManager(config, self.pricing, "new-conv", db_path=self.db_path)
+
+        self.assertEqual(budget.batch.tokens, 500)
+        with self.assertRaises(BudgetExceededError):
+            budget.check("paid-model")
+
+        # 別のバッチには影響しない
+        other = BudgetManager(BudgetConfig(batch=BudgetLimit(max_tokens=500), batch_id="batch-2"),
+                              self.pricing, "new-conv", db_path=self.db_path)
+        other.check("paid-model")
+
+    def test_batch_usage_of_concurrent_conversations(self):
+        """同時に実行中の他の会話の使用量が check() のたびに反映されるテスト"""
+        init_db(self.db_path)
+        config = BudgetConfig(batch=BudgetLimit(max_tokens=1000), models={"paid-model": BudgetLimit(max_tokens=800)}, batch_id="batch-1")
+        first = BudgetManager(config, self.pricing, "conv-a", db_path=self.db_path)
+        second = BudgetManager(config, self.pricing, "conv-b", db_path=self.db_path)
+        for conversation_id in ("conv-a", "conv-b"):
+            log_conversation_meta(conversation_id, "Topic", "A", "paid-model", "B", "paid-model", "MC", "paid-model",
+                                  batch_id="batch-1", db_path=self.db_path)
+
+        # 1つ目の会話の使用量 (記録済みのターンと、まだ記録していない呼び出し)
+        first.record("paid-model", 300, 300)
+        log_conversation_turn("conv-a", 1, "A", "paid-model", "prompt", "response",
+                              input_tokens=300, output_tokens=300, db_path=self.db_path)
+        first.record("free-model", 100, 0)
+        first.check("paid-model")
+        # 自分の記録済みのターンを二重に数えない
+        self.assertEqual(first.batch.tokens, 700)
+
+        # 2つ目の会話は開始時には使用量0だったが、次の確認で1つ目の会話の記録済みの使用量を反映する
+        second.record("paid-model", 100, 100)
+        second.check("free-model")
+        self.assertEqual(second.batch.tokens, 800)
+        with self.assertRaises(BudgetExceededError):
+            second.check("paid-model")
+
+    def test_max_tokens_options(self):
+        """モデルがサポートするオプション名で出力トークン数の上限を指定するテスト"""
+        model = MagicMock()
+        model.Options.model_fields = {"max_output_tokens": None}
+        self.assertEqual(max_tokens_options(model, 100), {"max_output_tokens": 100})
+        self.assertEqual(max_tokens_options(model, None), {})
+
+        plain = MagicMock()
+        plain.Options.model_fields = {"temperature": None}
+        self.assertEqual(max_tokens_options(plain, 100), {})
+
+    def test_output_token_limit_only_near_budget(self):
+        """予算の残りが1回の出力上限より多い間は出力トークン数を制限しないテスト"""
+        config = BudgetConfig(conversation=BudgetLimit(max_tokens=1_000_000))
+        budget = BudgetManager(config, self.pricing, "conv-1", db_path=self.db_path)
+        budget.record("free-model", 100_000, 100_000)
+
+        # 残り 800,000 トークンをそのまま max_tokens にするとプロバイダーの上限を超えるため、指定しない
+        self.assertEqual(budget.remaining_output_tokens("free-model", input_tokens=1000), 799_000)
+        self.assertIsNone(budget.output_token_limit("free-model", input_tokens=1000))
+        self.assertIsNone(budget.output_token_limit("free-model", input_tokens=1000, cap=8192))
+
+        # 残りが上限を下回ると、残りの予算で制限する
+        budget.record("free-model", 0, 798_000)
+        self.assertEqual(budget.output_token_limit("free-model", input_tokens=1000), 1000)
+        self.assertEqual(budget.output_token_limit("free-model", input_tokens=1000, cap=500), None)
+
+        # 予算の上限がなければ制限しない
+        self.assertIsNone(BudgetManager(BudgetConfig(), self.pricing, "conv-2").output_token_limit("free-model"))
+
+    def test_model_output_limit(self):
+        """プロファイルのオプション・モデルの既定値・デフォルトの順で出力上限を決めるテスト"""
+        model = MagicMock()
+        model.Options.model_fields = {"max_tokens": MagicMock(default=8192)}
+        self.assertEqual(model_output_limit(model, {"max_tokens": 1024}), 1024)
+        self.assertEqual(model_output_limit(model), 8192)
+        plain = MagicMock()
+        plain.Options.model_fields = {"max_tokens": MagicMock(default=None)}
+        self.assertEqual(model_output_limit(plain, {"temperature": 0.7}), DEFAULT_OUTPUT_TOKEN_CAP)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import threading
+from cancellation import CancelToken, TurnCancelled
+
+
+class TestCancelToken(unittest.TestCase):
+    """cancellation.py のテストクラス"""
+
+    def test_cancel_keeps_first_reason(self):
+        """キャンセルの理由は最初のものが保持されるテスト"""
+        token = CancelToken()
+        self.assertFalse(token.cancelled)
+        token.raise_if_cancelled()
+
+        token.cancel("first")
+        token.cancel("second")
+        self.assertTrue(token.cancelled)
+        with self.assertRaises(TurnCancelled) as context:
+            token.raise_if_cancelled("途中まで")
+        self.assertEqual(context.exception.reason, "first")
+        self.assertEqual(context.exception.partial_text, "途中まで")
+
+    def test_wait_returns_on_cancel(self):
+        """待機中に他のスレッドからキャンセルされるとすぐに戻るテスト"""
+        token = CancelToken()
+        threading.Timer(0.05, token.cancel).start()
+        self.assertTrue(token.wait(5))
+        self.assertFalse(CancelToken().wait(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import unittest
+import contextlib
+import threading
+import time
+from unittest.mock import patch
+from cancellation import CancelToken, TurnCancelled
+from concurrency import ModelConcurrencyLimiter, is_overload_error
+from config import ModelProfile
+
+
+class TestModelConcurrencyLimiter(unittest.TestCase):
+    """concurrency.py のテストクラス"""
+
+    def test_slot_limits_concurrent_calls(self):
+        """モデルごとの同時実行数が上限を超えないテスト"""
+        limiter = ModelConcurrencyLimiter.from_profiles({
+            "local": ModelProfile(max_concurrency=2),
+            "remote": ModelProfile(),
+        })
+        self.assertEqual(limiter.limits, {"local": 2})
+        peak = []
+
+        def call():
+            with limiter.slot("local"):
+                peak.append(limiter.in_flight("local"))
+                time.sleep(0.02)
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+        self.assertGreater(limiter.waits, 0)
+        self.assertEqual(limiter.in_flight("local"), 0)
+
+        # 上限のないモデルは待たずに実行する
+        with limiter.slot("remote"), limiter.slot("remote"):
+            self.assertEqual(limiter.in_flight("remote"), 2)
+
+    def test_slot_wait_is_cancellable(self):
+        """空きを待っている間にキャンセルされると TurnCancelled を送出するテスト"""
+        limiter = ModelConcurrencyLimiter({"local": 1})
+        token = CancelToken()
+        with limiter.slot("local"):
+            threading.Timer(0.05, token.cancel, args=("stop",)).start()
+            with self.assertRaises(TurnCancelled):
+                with limiter.slot("local", token):
+                    pass
+        # 枠は解放されている
+        with limiter.slot("local", token):
+            self.assertEqual(limiter.in_flight("local"), 1)
+
+    def test_adaptive_limit_increases_and_backs_off(self):
+        """正常な応答で上限が増え、過負荷のエラーで半分に減るテスト"""
+        limiter = ModelConcurrencyLimiter.from_profiles({
+            "remote": ModelProfile(max_concurrency=4, adaptive_concurrency=True),
+        })
+        # 下限 (min_concurrency) から始める
+        self.assertEqual(limiter.limits, {"remote": 1})
+        # 上限まで使い切っていない呼び出しでは増えない
+        for _ in range(3):
+            with limiter.slot("remote"), limiter.slot("other"):
+                pass
+        with limiter.slot("remote") as slot:
+            slot.first_chunk()
+        self.assertEqual(limiter.limits, {"remote": 2})
+        with limiter.slot("remote"):
+            pass
+        self.assertEqual(limiter.limits, {"remote": 2})
+
+        # 上限まで使い切っていた呼び出しのたびに 1/上限 ずつ増え、max_concurrency で止まる
+        calls = 5
+        for _ in range(8):
+            with contextlib.ExitStack() as stack:
+                for _ in range(limiter.limits["remote"]):
+                    stack.enter_context(limiter.slot("remote"))
+                    calls += 1
+        self.assertEqual(limiter.limits, {"remote": 4})
+
+        # 実行中の呼び出しが同じ混雑で一斉に失敗しても、減らすのは1回だけ
+        error = RateLimitError()
+        contexts = [limiter.slot("remote") for _ in range(4)]
+        for context in contexts:
+            context.__enter__()
+        for context in contexts:
+            context.__exit__(type(error), error, None)
+        self.assertEqual(limiter.limits, {"remote": 2})
+        metrics = limiter.metrics()["remote"]
+        self.assertEqual((metrics["overloads"], metrics["errors"], metrics["successes"]), (4, 4, calls))
+        self.assertEqual(metrics["in_flight"], 0)
+
+        # 過負荷以外のエラーやキャンセルでは上限を変えない
+        with self.assertRaises(ValueError):
+            with limiter.slot("remote"):
+                raise ValueError("bad prompt")
+        with self.assertRaises(TurnCancelled):
+            with limiter.slot("remote"):
+                raise TurnCancelled("stop")
+        self.assertEqual(limiter.limits, {"remote": 2})
+
+    def test_adaptive_limit_backs_off_on_latency_spike(self):
+        """最初のチャンクまでの時間のスパイクで上限が減るテスト"""
+        limiter = ModelConcurrencyLimiter({"remote": 4}, adaptive={"remote": 1})
+        limiter._gates["remote"].limit = 4.0
+        with patch("concurrency.time.monotonic") as monotonic:
+            for latency in (1.0, 1.0, 1.0, 1.0, 1.0, 5.0):
+                monotonic.return_value = 100.0
+                with limiter.slot("remote"):
+                    monotonic.return_value = 100.0 + latency
+            self.assertEqual(limiter.limits, {"remote": 3})
+            self.assertEqual(limiter.metrics()["remote"]["latency_spikes"], 1)
+
+    def test_concurrency_group_shares_slots(self):
+        """concurrency_group が同じモデルが枠を共有するテスト"""
+        limiter = ModelConcurrencyLimiter.from_profiles({
+            "model-a": ModelProfile(max_concurrency=2, concurrency_group="provider"),
+            "model-b": ModelProfile(max_concurrency=1, concurrency_group="provider"),
+        })
+        self.assertEqual(limiter.limits, {"provider": 2})
+        token = CancelToken()
+        with limiter.slot("model-a"), limiter.slot("model-b"):
+            self.assertEqual(limiter.metrics()["provider"]["in_flight"], 2)
+            threading.Timer(0.05, token.cancel, args=("stop",)).start()
+            with self.assertRaises(TurnCancelled):
+                with limiter.slot("model-a", token):
+                    pass
+
+    def test_reconfigure_keeps_in_flight_calls(self):
+        """設定の再読み込みで上限が変わり、実行中の呼び出しは元の枠に返却されるテスト"""
+        limiter = ModelConcurrencyLimiter.from_profiles({"model-a": ModelProfile(max_concurrency=1)})
+        with limiter.slot("model-a"):
+            limiter.reconfigure({
+                "model-a": ModelProfile(max_concurrency=3),
+                "model-b": ModelProfile(max_concurrency=2, adaptive_concurrency=True, min_concurrency=1),
+            })
+            self.assertEqual(limiter.limits, {"model-a": 3, "model-b": 1})
+            # 上限が増えたため、実行中の呼び出しがあっても待たずに確保できる
+            with limiter.slot("model-a"):
+                self.assertEqual(limiter.metrics()["model-a"]["in_flight"], 2)
+            limiter.reconfigure({})
+        self.assertEqual(limiter.limits, {})
+
+    def test_is_overload_error(self):
+        """過負荷によるエラーの判定のテスト"""
+        self.assertTrue(is_overload_error(RateLimitError()))
+        self.assertTrue(is_overload_error(StatusError(503)))
+        self.assertTrue(is_overload_error(TimeoutError()))
+        self.assertFalse(is_overload_error(StatusError(400)))
+        self.assertFalse(is_overload_error(ValueError("bad prompt")))
+
+
+class RateLimitError(Exception):
+    """openai.RateLimitError のようにクラス名だけで判定される例外"""
+
+
+class StatusError(Exception):
+    """HTTP のステータスコードを持つ例外"""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 import unittest
 import os
 import tempfile
-from config import load_config_from_file, AppConfig, ParticipantConfig
+from config import load_config_from_file, AppConfig, ParticipantConfig, ConfigWatcher
 
 class TestConfig(unittest.TestCase):
     """config.py のテストクラス"""
@@ -90,5 +90,253 @@ topic: "Test Topic"
         
         self.assertIn("participants", str(context.exception))
 
+    def test_load_config_termination(self):
+        """早期終了設定の読み込みとバリデーションのテスト"""
+        config = load_config_from_file(self.config_file_path)
+        self.assertIsNone(config.termination.similarity_threshold)
+        self.assertEqual(config.termination.end_markers, [])
+
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+termination:
+  similarity_threshold: 0.85
+  end_markers: "[END]"
+  max_tokens: 5000
+""")
+        config = load_config_from_file(self.config_file_path)
+        self.assertEqual(config.termination.similarity_threshold, 0.85)
+        self.assertEqual(config.termination.end_markers, ["[END]"])
+        self.assertEqual(config.termination.max_tokens, 5000)
+
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+termination:
+  similarity_threshold: 1.5
+""")
+        with self.assertRaises(ValueError) as context:
+            load_config_from_file(self.config_file_path)
+        self.assertIn("similarity_threshold", str(context.exception))
+
+    def test_load_config_budget(self):
+        """予算と料金の設定の読み込みテスト"""
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+budget:
+  conversation:
+    max_tokens: 50000
+  batch:
+    max_cost: 10
+  models:
+    test-model-a:
+      max_cost: 1.5
+  batch_id: "nightly"
+pricing:
+  test-model-a:
+    input: 0.3
+    output: 2.5
+""")
+        config = load_config_from_file(self.config_file_path)
+        self.assertEqual(config.budget.conversation.max_tokens, 50000)
+        self.assertEqual(config.budget.batch.max_cost, 10)
+        self.assertEqual(config.budget.models["test-model-a"].max_cost, 1.5)
+        self.assertEqual(config.budget.batch_id, "nightly")
+        self.assertAlmostEqual(config.pricing["test-model-a"].cost(1_000_000, 1_000_000), 2.8)
+
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+pricing:
+  test-model-a:
+    input: -1
+""")
+        with self.assertRaises(ValueError) as context:
+            load_config_from_file(self.config_file_path)
+        self.assertIn("pricing", str(context.exception))
+
+    def test_load_config_tournament(self):
+        """トーナメント設定の読み込みテスト (models x personas の組み合わせを含む)"""
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+tournament:
+  format: swiss
+  rounds: 2
+  entrants:
+    - name: "Carol"
+      model: "test-model-c"
+      persona: "Carol's persona"
+  models: ["test-model-a", "test-model-b"]
+  personas:
+    - name: "Critic"
+      persona: "Critic persona"
+""")
+        config = load_config_from_file(self.config_file_path)
+        self.assertEqual(config.tournament.format, "swiss")
+        self.assertEqual(config.tournament.rounds, 2)
+        self.assertEqual(
+            [(e.name, e.model) for e in config.tournament.entrants],
+            [("Carol", "test-model-c"), ("Critic (test-model-a)", "test-model-a"), ("Critic (test-model-b)", "test-model-b")],
+        )
+
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+tournament:
+  format: knockout
+  models: ["test-model-a", "test-model-b"]
+  personas:
+    - name: "Critic"
+      persona: "Critic persona"
+""")
+        with self.assertRaises(ValueError):
+            load_config_from_file(self.config_file_path)
+
+    def test_load_config_model_profiles(self):
+        """モデルプロファイル (ローカルのバックエンド) の読み込みテスト"""
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+model_profiles:
+  local-llama:
+    backend: openai_compatible
+    api_base: "http://localhost:8080/v1"
+    model_name: "llama-3.1-8b-instruct"
+    max_concurrency: 4
+    options:
+      temperature: 0.7
+  test-model-a:
+    max_concurrency: 2
+""")
+        config = load_config_from_file(self.config_file_path)
+        profile = config.model_profiles["local-llama"]
+        self.assertEqual(profile.backend, "openai_compatible")
+        self.assertEqual(profile.api_base, "http://localhost:8080/v1")
+        self.assertEqual(profile.model_name, "llama-3.1-8b-instruct")
+        self.assertEqual(profile.max_concurrency, 4)
+        self.assertEqual(profile.options, {"temperature": 0.7})
+        self.assertEqual(config.model_profiles["test-model-a"].backend, "llm")
+
+        # openai_compatible には api_base が必要
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+model_profiles:
+  local-llama:
+    backend: openai_compatible
+""")
+        with self.assertRaises(ValueError):
+            load_config_from_file(self.config_file_path)
+
+    def test_load_config_adaptive_concurrency(self):
+        """同時実行数の上限を調整するモデルプロファイルの読み込みテスト"""
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+model_profiles:
+  test-model-a:
+    max_concurrency: 8
+    adaptive_concurrency: true
+    min_concurrency: 2
+    concurrency_group: "free-tier"
+""")
+        config = load_config_from_file(self.config_file_path)
+        profile = config.model_profiles["test-model-a"]
+        self.assertTrue(profile.adaptive_concurrency)
+        self.assertEqual((profile.min_concurrency, profile.max_concurrency), (2, 8))
+        self.assertEqual(profile.concurrency_group, "free-tier")
+
+        # adaptive_concurrency には上限の最大値 (max_concurrency) が必要で、min_concurrency はそれ以下
+        for profile_yaml in (
+            "    adaptive_concurrency: true\n",
+            "    max_concurrency: 2\n    adaptive_concurrency: true\n    min_concurrency: 4\n",
+            "    max_concurrency: 2\n    adaptive_concurrency: \"yes\"\n",
+        ):
+            with open(self.config_file_path, 'w', encoding='utf-8') as f:
+                f.write(self.test_yaml_content + "\nmodel_profiles:\n  test-model-a:\n" + profile_yaml)
+            with self.assertRaises(ValueError):
+                load_config_from_file(self.config_file_path)
+
+    def test_load_config_retrieval(self):
+        """意味検索の設定の読み込みテスト"""
+        config = load_config_from_file(self.config_file_path)
+        self.assertFalse(config.retrieval)
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+retrieval:
+  embedding_model: "3-small"
+  top_k: 2
+  min_score: 0.3
+""")
+        config = load_config_from_file(self.config_file_path)
+        self.assertTrue(config.retrieval)
+        self.assertEqual(config.retrieval.embedding_model, "3-small")
+        self.assertEqual((config.retrieval.top_k, config.retrieval.exclude_recent, config.retrieval.min_score), (2, 1, 0.3))
+
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(self.test_yaml_content + """
+retrieval:
+  embedding_model: "3-small"
+  min_score: 2
+""")
+        with self.assertRaises(ValueError):
+            load_config_from_file(self.config_file_path)
+
+    def _touch(self, path, content):
+        """ファイルを書き換え、更新時刻を確実に進める"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+    def test_config_watcher_reload(self):
+        """設定ファイルの変更が再読み込みされるテスト"""
+        watcher = ConfigWatcher(self.config_file_path)
+        self.assertEqual(watcher.config.llm_wait_time, 2)
+        self.assertIsNone(watcher.poll())
+
+        self._touch(self.config_file_path, self.test_yaml_content.replace("llm_wait_time: 2", "llm_wait_time: 0"))
+        new_config = watcher.poll()
+
+        self.assertIsNotNone(new_config)
+        self.assertEqual(new_config.llm_wait_time, 0)
+        self.assertIs(watcher.config, new_config)
+        self.assertIsNone(watcher.poll())
+
+    def test_config_watcher_fans_out_changes(self):
+        """1つの監視を共有する複数の利用者が、どちらが検知した変更も受け取るテスト"""
+        watcher = ConfigWatcher(self.config_file_path)
+        first, second = watcher.version, watcher.version
+        self.assertIsNone(watcher.changed_since(first))
+
+        self._touch(self.config_file_path, self.test_yaml_content.replace("llm_wait_time: 2", "llm_wait_time: 0"))
+        first, config = watcher.changed_since(first)
+        self.assertEqual(config.llm_wait_time, 0)
+        # 変更を検知したのは1人目だが、2人目にも同じ変更が届く
+        second, config = watcher.changed_since(second)
+        self.assertEqual((first, second, config.llm_wait_time), (1, 1, 0))
+        self.assertIsNone(watcher.changed_since(first))
+
+    def test_config_watcher_keeps_config_on_invalid_file(self):
+        """不正な設定ファイルに変更された場合に現在の設定を維持するテスト"""
+        watcher = ConfigWatcher(self.config_file_path)
+        old_config = watcher.config
+
+        self._touch(self.config_file_path, 'topic: "Test Topic"\n')
+
+        self.assertIsNone(watcher.poll())
+        self.assertIs(watcher.config, old_config)
+
+    def test_config_watcher_tracks_included_files(self):
+        """!include で参照されたペルソナファイルの変更を検知するテスト"""
+        persona_path = os.path.join(self.temp_dir, "alice_persona.txt")
+        with open(persona_path, 'w', encoding='utf-8') as f:
+            f.write("Alice's persona v1")
+        content = self.test_yaml_content.replace('persona: "Alice\'s persona"', f'persona: !include {persona_path}')
+        with open(self.config_file_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+        watcher = ConfigWatcher(self.config_file_path)
+        self.assertEqual(watcher.config.participants[0].persona, "Alice's persona v1")
+
+        self._touch(persona_path, "Alice's persona v2")
+        new_config = watcher.poll()
+
+        self.assertIsNotNone(new_config)
+        self.assertEqual(new_config.participants[0].persona, "Alice's persona v2")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
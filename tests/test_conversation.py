@@ -1,8 +1,12 @@
 import unittest
-from unittest.mock import patch, MagicMock
+import copy
+from unittest.mock import patch, MagicMock, ANY
 import logging
-from config import AppConfig, ParticipantConfig
+from config import AppConfig, ParticipantConfig, TerminationConfig, BudgetConfig, BudgetLimit, ModelProfile
+from concurrency import ModelConcurrencyLimiter
 from conversation import ConversationManager
+from budget import BudgetExceededError
+from moderator_cache import ModeratorCache
 
 class TestConversationManager(unittest.TestCase):
     """conversation.py のテストクラス"""
@@ -97,8 +101,347 @@ class TestConversationManager(unittest.TestCase):
             model_used="test-model-a",
             prompt="Test prompt",
             response="Test response",
-            is_moderator=False
+            is_moderator=False,
+            input_tokens=ANY,
+            output_tokens=ANY,
+            latency_ms=ANY,
+            is_partial=False,
+            db_path=self.config.db_path,
         )
 
+    @patch('conversation.llm.get_model')
+    def test__get_llm_model_uses_cache(self, mock_get_model):
+        """同じモデルIDのモデルはキャッシュが再利用されるテスト"""
+        mock_get_model.return_value = MagicMock()
+
+        cm = ConversationManager(self.config, self.logger)
+        first = cm._get_llm_model(self.participants[0])
+        second = cm._get_llm_model(ParticipantConfig("Carol", "test-model-a", "Carol's persona"))
+
+        mock_get_model.assert_called_once_with("test-model-a")
+        self.assertIs(first, second)
+
+    def test__reload_config(self):
+        """ターンの区切りで設定が差し替えられ、不要なモデルだけキャッシュから除かれるテスト"""
+        new_config = AppConfig(
+            topic="Test Topic",
+            participants=[
+                ParticipantConfig("Alice", "test-model-a", "Alice's new persona"),
+                ParticipantConfig("Carol", "test-model-c", "Carol's persona"),
+            ],
+            moderator=self.moderator,
+            llm_wait_time=0,
+        )
+        watcher = MagicMock(version=0)
+        watcher.changed_since.return_value = (1, new_config)
+
+        cm = ConversationManager(self.config, self.logger, config_watcher=watcher)
+        model_a = MagicMock()
+        cm.model_cache.update({"test-model-a": model_a, "test-model-b": MagicMock()})
+
+        self.assertTrue(cm._reload_config())
+        self.assertIs(cm.config, new_config)
+        self.assertIs(cm.model_cache["test-model-a"], model_a)
+        self.assertNotIn("test-model-b", cm.model_cache)
+        # 適用済みの version を渡して、次の変更だけを受け取る
+        watcher.changed_since.return_value = None
+        self.assertFalse(cm._reload_config())
+        watcher.changed_since.assert_called_with(1)
+
+    def test__reload_config_updates_components(self):
+        """再読み込みした設定に会話固有の上書きを適用し、予算・同時実行数・トランスクリプトも更新するテスト"""
+        new_config = AppConfig(
+            topic="New Topic",
+            participants=self.participants,
+            moderator=self.moderator,
+            max_turns=9,
+            llm_wait_time=0,
+            summary_chunk_chars=10,
+            budget=BudgetConfig(conversation=BudgetLimit(max_tokens=100)),
+            model_profiles={"test-model-a": ModelProfile(max_concurrency=2)},
+        )
+        watcher = MagicMock(version=0)
+        watcher.changed_since.return_value = (1, new_config)
+
+        def overrides(config):
+            config = copy.copy(config)
+            config.topic = "Session Topic"
+            return config
+
+        cm = ConversationManager(self.config, self.logger, config_watcher=watcher, config_overrides=overrides)
+        cm.transcript.append(1, "Alice", "test-model-a", "x" * 8)
+        cm.budget.record("test-model-a", 60, 40)
+
+        self.assertTrue(cm._reload_config())
+        self.assertEqual(cm.config.topic, "Session Topic")
+        self.assertIs(cm.budget.budget, new_config.budget)
+        with self.assertRaises(BudgetExceededError):
+            cm.budget.check("test-model-a")
+        self.assertEqual(cm.limiter.limits, {"test-model-a": 2})
+        self.assertEqual(cm.transcript.text_chars_limit, 10)
+
+        # db_path は会話の途中で変更できない
+        moved = copy.copy(new_config)
+        moved.db_path = "other.db"
+        watcher.changed_since.return_value = (2, moved)
+        self.assertFalse(cm._reload_config())
+        self.assertEqual(cm.config.db_path, self.config.db_path)
+
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_start_conversation_early_stop(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta):
+        """終了マーカーで max_turns より前に会話が終了するテスト"""
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = lambda *args, **kwargs: iter(["ありがとうございました [END]"])
+        mock_get_model.return_value = mock_model
+        self.config.termination = TerminationConfig(end_markers=["[END]"])
+
+        cm = ConversationManager(self.config, self.logger)
+        cm.start_conversation(max_turns=5)
+
+        # MCの開始 + 1ターンで終了する
+        self.assertEqual(mock_model.prompt.call_count, 2)
+        self.assertEqual(cm.turn_count, 1)
+
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_start_conversation_budget_hard_stop(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta):
+        """会話の予算の上限に達したら残りのターンを実行しないテスト"""
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = lambda *args, **kwargs: iter(["こんにちは"])
+        mock_get_model.return_value = mock_model
+        self.config.budget = BudgetConfig(conversation=BudgetLimit(max_tokens=1))
+
+        cm = ConversationManager(self.config, self.logger)
+        cm.start_conversation(max_turns=5, show_summary=True)
+
+        # MCの開始で上限に達するため、参加者のターンも要約も実行されない
+        self.assertEqual(mock_model.prompt.call_count, 1)
+        self.assertEqual(mock_log_conversation_turn.call_count, 1)
+
+    @patch('conversation.log_llm_call')
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_judge_goes_through_budget_and_limiter(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta, mock_log_llm_call):
+        """MCの終了判定の呼び出しが予算・同時実行数の制限を通り、使用量が記録されるテスト"""
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = lambda prompt, **kwargs: iter(["はい" if "結論" in prompt else "こんにちは"])
+        mock_get_model.return_value = mock_model
+        self.config.termination = TerminationConfig(moderator_judge_every=2)
+
+        cm = ConversationManager(self.config, self.logger, console=False)
+        with patch.object(cm.limiter, "slot", wraps=cm.limiter.slot) as mock_slot:
+            cm.start_conversation(max_turns=5)
+
+        # MCの開始 + 2ターン + 判定で終了し、判定の呼び出しも実行枠を確保する
+        self.assertEqual(cm.turn_count, 2)
+        self.assertEqual(mock_slot.call_count, 4)
+        mock_log_llm_call.assert_called_once()
+        self.assertEqual(mock_log_llm_call.call_args.args[:3], (cm.conversation_id, "judge", "test-model-mc"))
+        # 判定の使用量も会話の予算に集計される
+        turn_tokens = sum(c.kwargs["input_tokens"] + c.kwargs["output_tokens"] for c in mock_log_conversation_turn.call_args_list)
+        self.assertGreater(cm.budget.conversation.tokens, turn_tokens)
+
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test__run_single_turn_events(self, mock_get_model, mock_log_conversation_turn):
+        """コンソール出力なしでターンの進行がイベントとして通知されるテスト"""
+        mock_model = MagicMock()
+        mock_model.prompt.return_value = iter(["Alice: Test ", "response"])
+        mock_get_model.return_value = mock_model
+        events = []
+
+        cm = ConversationManager(self.config, self.logger, event_callback=events.append, console=False)
+        with patch('builtins.print') as mock_print:
+            cm._run_single_turn(speaker=self.participants[0], prompt_text="Test prompt")
+
+        mock_print.assert_not_called()
+        self.assertEqual([e["type"] for e in events], ["turn_start", "chunk", "chunk", "turn_end"])
+        self.assertEqual("".join(e["text"] for e in events if e["type"] == "chunk"), "Test response")
+        self.assertEqual(events[-1]["response"], "Test response")
+
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test__run_single_turn_model_profile(self, mock_get_model, mock_log_conversation_turn):
+        """モデルプロファイルのオプションが適用され、呼び出しが共有の実行枠の中で行われるテスト"""
+        self.config.model_profiles = {"test-model-a": ModelProfile(max_concurrency=1, options={"temperature": 0.2})}
+        limiter = ModelConcurrencyLimiter.from_profiles(self.config.model_profiles)
+        in_flight = []
+
+        def prompt(*args, **kwargs):
+            in_flight.append(limiter.in_flight("test-model-a"))
+            return iter(["Test response"])
+
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = prompt
+        mock_get_model.return_value = mock_model
+
+        cm = ConversationManager(self.config, self.logger, console=False, limiter=limiter)
+        with patch('builtins.print'):
+            cm._run_single_turn(speaker=self.participants[0], prompt_text="Test prompt")
+
+        self.assertEqual(mock_model.prompt.call_args.kwargs["temperature"], 0.2)
+        self.assertEqual(in_flight, [1])
+        self.assertEqual(limiter.in_flight("test-model-a"), 0)
+
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_start_conversation_shared_intro_cache(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta):
+        """同じテーマの会話でMCの開始アナウンスがキャッシュから再利用されるテスト"""
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = lambda *args, **kwargs: iter(["こんにちは"])
+        mock_get_model.return_value = mock_model
+        moderator_cache = ModeratorCache()
+
+        for participants in (self.participants, list(reversed(self.participants))):
+            self.config.participants = participants
+            cm = ConversationManager(self.config, self.logger, console=False, moderator_cache=moderator_cache, shared_intro=True)
+            cm.start_conversation(max_turns=1)
+
+        # 2回目の会話では開始アナウンスのLLM呼び出しが省略される (MC 1回 + 参加者 1ターン x 2)
+        self.assertEqual(mock_model.prompt.call_count, 3)
+        self.assertEqual((moderator_cache.hits, moderator_cache.misses), (1, 1))
+        cached_intro = mock_log_conversation_turn.call_args_list[2]
+        self.assertTrue(cached_intro.kwargs["is_moderator"])
+        self.assertEqual(cached_intro.kwargs["response"], "こんにちは")
+        self.assertEqual(cached_intro.kwargs["output_tokens"], 0)
+
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_start_conversation_async_intro(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta):
+        """非同期に生成したMCの開始アナウンスが最初のターンの後にターン0として記録されるテスト"""
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = lambda prompt, **kwargs: iter(["ようこそ" if "アナウンス" in prompt else "こんにちは"])
+        mock_get_model.return_value = mock_model
+        self.config.async_moderator_intro = True
+
+        cm = ConversationManager(self.config, self.logger, console=False)
+        cm.start_conversation(max_turns=2)
+
+        logged = [(c.kwargs["turn_number"], c.kwargs["speaker_name"], c.kwargs["response"]) for c in mock_log_conversation_turn.call_args_list]
+        self.assertEqual(logged, [(1, "Alice", "こんにちは"), (0, "MC", "ようこそ"), (2, "Bob", "こんにちは")])
+        # メモリ上のトランスクリプトはデータベースと同じターン番号順になる
+        self.assertEqual([record.turn_number for record in cm.transcript], [0, 1, 2])
+        self.assertEqual([name for name, _, _ in cm.transcript.iter_history()], ["MC", "Alice", "Bob"])
+
+    @patch('transcript.iter_conversation_history')
+    def test__summarize_conversation_bounded(self, mock_iter_history):
+        """長い会話履歴が途中の要約に畳み込まれ、要約のプロンプトが上限程度に収まるテスト"""
+        mock_iter_history.return_value = iter([("Alice", "test-model-a", "x" * 40)] * 10)
+        self.config.summary_chunk_chars = 130
+        cm = ConversationManager(self.config, self.logger, console=False)
+        for turn in range(1, 11):
+            cm.transcript.append(turn, "Alice", "test-model-a", "x" * 40)
+        # トランスクリプトが保持していない古い本文はデータベースから読み直す
+        self.assertFalse(cm.transcript.complete)
+
+        with patch.object(cm, "generate", return_value="途中の要約") as mock_generate, \
+                patch.object(cm, "_run_single_turn", return_value="要約") as mock_run_single_turn:
+            self.assertEqual(cm._summarize_conversation(), "要約")
+
+        # 2件 (124文字) ごとに畳み込まれ、最後の2件はそのまま要約のプロンプトに含まれる
+        self.assertEqual(mock_generate.call_count, 4)
+        self.assertIn("途中の要約", mock_generate.call_args_list[-1].args[1])
+        summary_prompt = mock_run_single_turn.call_args.kwargs["prompt_text"]
+        self.assertIn("これまでの会話の要約:\n途中の要約", summary_prompt)
+        self.assertEqual(summary_prompt.count("x" * 40), 2)
+
+    @patch('transcript.iter_conversation_history')
+    def test__summarize_conversation_from_transcript(self, mock_iter_history):
+        """本文をすべて保持している短い会話は、データベースを読み直さずに要約するテスト"""
+        cm = ConversationManager(self.config, self.logger, console=False)
+        cm.transcript.append(0, "MC", "test-model-mc", "ようこそ", is_moderator=True)
+        cm.transcript.append(1, "Alice", "test-model-a", "こんにちは")
+        cm.transcript.append(2, "Bob", "test-model-b", "途中", is_partial=True)
+
+        with patch.object(cm, "_run_single_turn", return_value="要約") as mock_run_single_turn:
+            cm._summarize_conversation()
+
+        mock_iter_history.assert_not_called()
+        summary_prompt = mock_run_single_turn.call_args.kwargs["prompt_text"]
+        self.assertIn("MC (test-model-mc): ようこそ\nAlice (test-model-a): こんにちは", summary_prompt)
+        self.assertNotIn("途中", summary_prompt)
+
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_start_conversation_cancel_keeps_partial(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta):
+        """ストリームの途中でキャンセルされた場合、途中までのレスポンスが記録されて会話が終了するテスト"""
+        cm = ConversationManager(self.config, self.logger, console=False)
+
+        def stream(prompt, **kwargs):
+            if "アナウンス" in prompt:
+                yield "ようこそ"
+                return
+            yield "途中まで"
+            cm.cancel("test")
+            yield "届かない部分"
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = stream
+        mock_get_model.return_value = mock_model
+        events = []
+        cm.event_callback = events.append
+
+        cm.start_conversation(max_turns=3, show_summary=True)
+
+        last_turn = mock_log_conversation_turn.call_args.kwargs
+        self.assertEqual((last_turn["response"], last_turn["is_partial"]), ("途中まで", True))
+        self.assertEqual(mock_model.prompt.call_count, 2)
+        self.assertEqual(events[-1]["reason"], "cancelled: test")
+
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_start_conversation_interrupt_resumes_partial(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta):
+        """Ctrl+C で中断したターンを継続すると、途中までのレスポンスの続きから再開されるテスト"""
+        calls = []
+
+        def stream(prompt, **kwargs):
+            calls.append(prompt)
+            if len(calls) == 2:
+                yield "前半"
+                raise KeyboardInterrupt
+            yield "後半" if len(calls) == 3 else "こんにちは"
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = stream
+        mock_get_model.return_value = mock_model
+
+        cm = ConversationManager(self.config, self.logger, console=False)
+        with patch.object(cm, "_handle_interrupt", return_value=False):
+            cm.start_conversation(max_turns=1)
+
+        # 再開時のプロンプトには途中までのレスポンスが含まれる
+        self.assertIn("前半", calls[2])
+        logged = [(c.kwargs["response"], c.kwargs["is_partial"]) for c in mock_log_conversation_turn.call_args_list[1:]]
+        self.assertEqual(logged, [("前半", True), ("前半後半", False)])
+
+    @patch('conversation.log_conversation_meta')
+    @patch('conversation.log_conversation_turn')
+    @patch('conversation.llm.get_model')
+    def test_start_conversation_interrupt_non_interactive(self, mock_get_model, mock_log_conversation_turn, mock_log_conversation_meta):
+        """interactive=False の場合、Ctrl+C で問い合わせずに会話を終了して中断を伝えるテスト"""
+        def stream(prompt, **kwargs):
+            if mock_model.prompt.call_count == 2:
+                yield "前半"
+                raise KeyboardInterrupt
+            yield "こんにちは"
+        mock_model = MagicMock()
+        mock_model.prompt.side_effect = stream
+        mock_get_model.return_value = mock_model
+
+        cm = ConversationManager(self.config, self.logger, console=False, interactive=False)
+        with patch('builtins.input') as mock_input, self.assertRaises(KeyboardInterrupt):
+            cm.start_conversation(max_turns=2)
+
+        mock_input.assert_not_called()
+        self.assertEqual(cm.stop_reason, "interrupted")
+        last_turn = mock_log_conversation_turn.call_args.kwargs
+        self.assertEqual((last_turn["response"], last_turn["is_partial"]), ("前半", True))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -2,7 +2,9 @@ import unittest
 import os
 import tempfile
 import sqlite3
-from database import init_db, log_conversation_turn, log_conversation_meta, get_db_connection
+from database import init_db, log_conversation_turn, log_conversation_meta, get_db_connection, fetch_usage_by_model, iter_conversation_history, fetch_turn_stats, fetch_length_histogram, fetch_conversation_history, fetch_fork_point, fetch_model_performance, log_llm_call, fetch_call_stats, shared_db_writer
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
 
 class TestDatabase(unittest.TestCase):
     """database.py のテストクラス"""
@@ -39,7 +41,7 @@ class TestDatabase(unittest.TestCase):
             cursor.execute("PRAGMA table_info(conversation_log)")
             columns = cursor.fetchall()
             column_names = [column[1] for column in columns]
-            expected_columns = ['id', 'conversation_id', 'turn_number', 'speaker_name', 'model_used', 'prompt', 'response', 'is_moderator', 'timestamp']
+            expected_columns = ['id', 'conversation_id', 'turn_number', 'speaker_name', 'model_used', 'prompt', 'response', 'is_moderator', 'timestamp', 'input_tokens', 'output_tokens', 'latency_ms', 'is_partial', 'response_chars']
             for col in expected_columns:
                 self.assertIn(col, column_names)
                 
@@ -134,5 +136,197 @@ class TestDatabase(unittest.TestCase):
             self.assertEqual(row[6], moderator_name)          # moderator_name
             self.assertEqual(row[7], moderator_model)         # moderator_model
 
+    def test_init_db_migrates_old_schema(self):
+        """古いスキーマのデータベースに不足カラムが追加されるテスト"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE conversation_log (id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, turn_number INTEGER NOT NULL, speaker_name TEXT NOT NULL, model_used TEXT NOT NULL, prompt TEXT NOT NULL, response TEXT NOT NULL, is_moderator BOOLEAN NOT NULL DEFAULT FALSE, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        conn.execute("INSERT INTO conversation_log (conversation_id, turn_number, speaker_name, model_used, prompt, response) VALUES ('conv-1', 1, 'Alice', 'model-a', 'p', 'こんにちは')")
+        conn.commit()
+        conn.close()
+
+        init_db(self.db_path)
+
+        with get_db_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(conversation_log)")
+            column_names = [column[1] for column in cursor.fetchall()]
+            for col in ['input_tokens', 'output_tokens', 'latency_ms', 'response_chars']:
+                self.assertIn(col, column_names)
+            # 追加したカラムは既存の行についても埋められる
+            cursor.execute("SELECT response_chars FROM conversation_log")
+            self.assertEqual(cursor.fetchone()[0], 5)
+
+    def test_init_db_replaces_legacy_stats_index(self):
+        """以前の集計用のインデックスが削除され、集計用のカバリングインデックスに置き換わるテスト"""
+        init_db(self.db_path)
+        with get_db_connection(self.db_path) as conn:
+            conn.execute("CREATE INDEX idx_conversation_log_stats ON conversation_log (model_used, speaker_name, conversation_id, response_chars)")
+            conn.execute("CREATE INDEX idx_conversation_log_model ON conversation_log (model_used, is_moderator, is_partial)")
+
+        init_db(self.db_path)
+
+        with get_db_connection(self.db_path) as conn:
+            indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'conversation_log'")}
+            columns = [row[2] for row in conn.execute("PRAGMA index_info(idx_conversation_log_model_stats)")]
+        self.assertNotIn("idx_conversation_log_stats", indexes)
+        self.assertNotIn("idx_conversation_log_model", indexes)
+        self.assertEqual(columns[:3], ["model_used", "is_moderator", "is_partial"])
+
+    def test_stats_queries_use_covering_index(self):
+        """統計の集計クエリが会話ログの表を読まず、カバリングインデックスだけで実行されるテスト"""
+        init_db(self.db_path)
+        for turn in range(1, 5):
+            log_conversation_turn("conv-1", turn, "Alice", "model-a", "p", "r" * turn, latency_ms=100, output_tokens=10, db_path=self.db_path)
+
+        statements = []
+        sqlite_connect = sqlite3.connect
+
+        def connect(*args, **kwargs):
+            conn = sqlite_connect(*args, **kwargs)
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        with patch('database.sqlite3.connect', side_effect=connect):
+            fetch_turn_stats(["model", "persona"], db_path=self.db_path)
+            fetch_turn_stats(["role"], include_partial=True, db_path=self.db_path)
+            fetch_length_histogram(["model"], db_path=self.db_path)
+            fetch_model_performance(db_path=self.db_path)
+        queries = [sql for sql in statements if sql.lstrip().startswith("SELECT")]
+        self.assertEqual(len(queries), 4)
+
+        with get_db_connection(self.db_path) as conn:
+            for sql in queries:
+                plan = " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+                self.assertIn("USING COVERING INDEX idx_conversation_log_model_stats", plan, sql)
+
+    def test_fetch_usage_by_model(self):
+        """モデルごとの使用量集計テスト"""
+        init_db(self.db_path)
+        log_conversation_meta("conv-1", "Topic", "Alice", "model-a", "Bob", "model-b", "MC", "model-mc",
+                              batch_id="batch-1", db_path=self.db_path)
+        log_conversation_turn("conv-1", 1, "Alice", "model-a", "p", "r", input_tokens=10, output_tokens=5, db_path=self.db_path)
+        log_conversation_turn("conv-1", 2, "Bob", "model-b", "p", "r", input_tokens=20, output_tokens=7, db_path=self.db_path)
+        log_conversation_turn("conv-1", 3, "Alice", "model-a", "p", "r", input_tokens=1, output_tokens=1, db_path=self.db_path)
+        log_conversation_turn("conv-2", 1, "Alice", "model-a", "p", "r", input_tokens=100, output_tokens=100, db_path=self.db_path)
+
+        usage = fetch_usage_by_model(conversation_id="conv-1", db_path=self.db_path)
+        self.assertEqual(usage, {"model-a": (11, 6), "model-b": (20, 7)})
+
+        usage = fetch_usage_by_model(batch_id="batch-1", db_path=self.db_path)
+        self.assertEqual(usage["model-a"], (11, 6))
+
+        usage = fetch_usage_by_model(db_path=self.db_path)
+        self.assertEqual(usage["model-a"], (111, 106))
+
+        # ターンにならないLLM呼び出しの使用量も合算する
+        log_llm_call("conv-1", "judge", "model-mc", input_tokens=50, output_tokens=2, latency_ms=100, db_path=self.db_path)
+        log_llm_call("conv-2", "score", "model-mc", input_tokens=70, output_tokens=4, latency_ms=300, db_path=self.db_path)
+        usage = fetch_usage_by_model(batch_id="batch-1", db_path=self.db_path)
+        self.assertEqual(usage["model-mc"], (50, 2))
+        usage = fetch_usage_by_model(batch_id="batch-1", exclude_conversation_id="conv-1", db_path=self.db_path)
+        self.assertEqual(usage, {})
+        self.assertEqual(
+            [(row["model"], row["purpose"], row["calls"], row["input_tokens"]) for row in fetch_call_stats(db_path=self.db_path)],
+            [("model-mc", "judge", 1, 50), ("model-mc", "score", 1, 70)],
+        )
+        self.assertEqual(len(fetch_call_stats(batch_id="batch-1", db_path=self.db_path)), 1)
+
+    def test_iter_conversation_history(self):
+        """会話履歴をターン順に少しずつ読み込むテスト"""
+        init_db(self.db_path)
+        for turn in (3, 1, 2, 0):
+            log_conversation_turn("conv-1", turn, f"Speaker{turn}", "model", "p", f"r{turn}", db_path=self.db_path)
+        log_conversation_turn("conv-2", 1, "Other", "model", "p", "other", db_path=self.db_path)
+        # 中断された途中までのレスポンスは履歴に含まない
+        log_conversation_turn("conv-1", 2, "Speaker2", "model", "p", "r2 (partial)", is_partial=True, db_path=self.db_path)
+
+        history = iter_conversation_history("conv-1", db_path=self.db_path, batch_size=2)
+        self.assertEqual(next(history), ("Speaker0", "model", "r0"))
+        self.assertEqual([row[2] for row in history], ["r1", "r2", "r3"])
+
+    def test_fork_history_references_parent(self):
+        """分岐した会話の履歴が分岐元のターンを参照して組み立てられるテスト"""
+        init_db(self.db_path)
+        log_conversation_meta("root", "Topic", "Alice", "a", "Bob", "b", "MC", "mc", db_path=self.db_path)
+        log_conversation_turn("root", 0, "MC", "mc", "p", "intro", is_moderator=True, db_path=self.db_path)
+        for turn in range(1, 5):
+            log_conversation_turn("root", turn, "Alice" if turn % 2 else "Bob", "a", "p", f"root-{turn}", db_path=self.db_path)
+        # root のターン3から分岐し、さらにそのターン4から分岐する
+        log_conversation_meta("fork-1", "Topic", "Alice", "a", "Carol", "c", "MC", "mc",
+                              parent_conversation_id="root", fork_turn=3, db_path=self.db_path)
+        log_conversation_turn("fork-1", 4, "Carol", "c", "p", "fork1-4", db_path=self.db_path)
+        log_conversation_turn("fork-1", 5, "Alice", "a", "p", "fork1-5", db_path=self.db_path)
+        log_conversation_meta("fork-2", "Topic", "Alice", "a", "Dave", "d", "MC", "mc",
+                              parent_conversation_id="fork-1", fork_turn=4, db_path=self.db_path)
+        log_conversation_turn("fork-2", 5, "Alice", "a", "p", "fork2-5", db_path=self.db_path)
+
+        self.assertEqual([row[2] for row in fetch_conversation_history("fork-1", db_path=self.db_path)],
+                         ["intro", "root-1", "root-2", "root-3", "fork1-4", "fork1-5"])
+        self.assertEqual([row[2] for row in iter_conversation_history("fork-2", db_path=self.db_path, batch_size=2)],
+                         ["intro", "root-1", "root-2", "root-3", "fork1-4", "fork2-5"])
+
+        self.assertEqual(fetch_fork_point("fork-2", 4, db_path=self.db_path), "fork1-4")
+        self.assertEqual(fetch_fork_point("fork-1", 2, db_path=self.db_path), "root-2")
+        # 分岐した後の分岐元のターンは引き継がない
+        self.assertIsNone(fetch_fork_point("fork-1", 6, db_path=self.db_path))
+        self.assertIsNone(fetch_fork_point("missing", 1, db_path=self.db_path))
+
+    def test_fetch_turn_stats(self):
+        """会話ログをモデル・話者ごとにSQLで集計するテスト"""
+        init_db(self.db_path)
+        log_conversation_meta("conv-1", "Topic", "Alice", "model-a", "Bob", "model-b", "MC", "model-mc", db_path=self.db_path)
+        log_conversation_turn("conv-1", 0, "MC", "model-mc", "p", "a" * 50, is_moderator=True, latency_ms=100, db_path=self.db_path)
+        log_conversation_turn("conv-1", 1, "Alice", "model-a", "p", "a" * 150, latency_ms=200, db_path=self.db_path)
+        log_conversation_turn("conv-1", 3, "Alice", "model-a", "p", "a" * 350, latency_ms=400, db_path=self.db_path)
+        log_conversation_turn("conv-1", 4, "Alice", "model-a", "p", "a" * 999, is_partial=True, db_path=self.db_path)
+
+        rows = fetch_turn_stats(["model", "persona"], db_path=self.db_path)
+        self.assertEqual([(row["model"], row["persona"], row["turns"]) for row in rows],
+                         [("model-a", "Alice", 2), ("model-mc", "MC", 1)])
+        self.assertEqual((rows[0]["avg_chars"], rows[0]["min_chars"], rows[0]["max_chars"]), (250, 150, 350))
+        self.assertEqual(rows[0]["avg_latency_ms"], 300)
+
+        rows = fetch_turn_stats(["topic", "role"], include_partial=True, db_path=self.db_path)
+        self.assertEqual({(row["topic"], row["role"]): row["turns"] for row in rows},
+                         {("Topic", "participant"): 3, ("Topic", "moderator"): 1})
+
+        histogram = fetch_length_histogram(["model"], db_path=self.db_path)
+        self.assertEqual(sorted(histogram), [("model-a", 1, 1), ("model-a", 2, 1), ("model-mc", 0, 1)])
+
+        with self.assertRaises(ValueError):
+            fetch_turn_stats(["speaker; DROP TABLE conversation_log"], db_path=self.db_path)
+
+    def test_fetch_model_performance(self):
+        """モデルと役割ごとの出力トークン数・レイテンシの実績を集計するテスト"""
+        init_db(self.db_path)
+        log_conversation_turn("conv-1", 1, "Alice", "model-a", "p", "a" * 200, output_tokens=100, latency_ms=1000, db_path=self.db_path)
+        log_conversation_turn("conv-1", 3, "Alice", "model-a", "p", "a" * 400, output_tokens=300, latency_ms=3000, db_path=self.db_path)
+        # 途中までのレスポンスと使用量のないターンは含めない
+        log_conversation_turn("conv-1", 5, "Alice", "model-a", "p", "a", output_tokens=1, latency_ms=9999, is_partial=True, db_path=self.db_path)
+        log_conversation_turn("conv-1", 0, "MC", "model-a", "p", "a", is_moderator=True, db_path=self.db_path)
+
+        performance = fetch_model_performance(self.db_path)
+        self.assertEqual(list(performance), [("model-a", False)])
+        record = performance[("model-a", False)]
+        self.assertEqual((record["turns"], record["avg_output_tokens"], record["avg_latency_ms"]), (2, 200, 2000))
+        self.assertAlmostEqual(record["ms_per_output_token"], 10.0)
+        self.assertAlmostEqual(record["chars_per_token"], 1.5)
+
+    def test_shared_db_writer(self):
+        """共有の書き込み用接続を使う間、複数スレッドの書き込みが1つの接続で順に記録されるテスト"""
+        init_db(self.db_path)
+        with shared_db_writer(self.db_path):
+            with patch('database.sqlite3.connect', wraps=sqlite3.connect) as connect:
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    for turn in range(1, 21):
+                        executor.submit(log_conversation_turn, "conv-1", turn, "Alice", "model-a", "p", f"turn {turn}", db_path=self.db_path)
+                self.assertEqual(connect.call_count, 0)
+                # 読み込みは個別の接続で行う
+                self.assertEqual(len(fetch_conversation_history("conv-1", db_path=self.db_path)), 20)
+                self.assertEqual(connect.call_count, 1)
+        # コンテキストを抜けると書き込みも個別の接続に戻る
+        log_conversation_turn("conv-1", 21, "Alice", "model-a", "p", "turn 21", db_path=self.db_path)
+        self.assertEqual(len(fetch_conversation_history("conv-1", db_path=self.db_path)), 21)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
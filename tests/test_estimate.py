@@ -0,0 +1,96 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+import estimate
+from config import AppConfig, BudgetConfig, BudgetLimit, ModelPrice, ParticipantConfig, TerminationConfig
+from database import init_db, log_conversation_turn
+
+
+class TestEstimate(unittest.TestCase):
+    """estimate.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "test.db")
+        init_db(self.db_path)
+        self.config = AppConfig(
+            topic="Topic",
+            participants=[
+                ParticipantConfig("Alice", "model-a", "Alice's persona"),
+                ParticipantConfig("Bob", "model-b", "Bob's persona"),
+            ],
+            moderator=ParticipantConfig("MC", "model-mc", "MC's persona"),
+            max_turns=4,
+            llm_wait_time=0,
+            show_summary=False,
+            pricing={"model-a": ModelPrice(1_000_000, 1_000_000)},
+        )
+        self.config.db_path = self.db_path
+        # トークナイザーの取得でプラグインを解決しないようにする
+        patcher = patch("estimate.backends.get_model", side_effect=Exception("unknown model"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """テスト後処理"""
+        self.temp_dir.cleanup()
+
+    def test_estimate_uses_history(self):
+        """実績のあるモデルは記録済みの出力トークン数とレイテンシから見積もるテスト"""
+        for turn in (1, 3):
+            log_conversation_turn("conv-1", turn, "Alice", "model-a", "p", "a" * 200,
+                                  input_tokens=10, output_tokens=100, latency_ms=2000, db_path=self.db_path)
+        estimator = estimate.Estimator(self.config)
+        result = estimator.estimate()
+        models = {entry.model_id: entry for entry in result["models"]}
+
+        # Alice はターン 1, 3 を話し、実績の平均 100 トークン・1トークン 20ms で見積もる
+        self.assertEqual(models["model-a"].calls, 2)
+        self.assertEqual(models["model-a"].output_tokens, 200)
+        self.assertAlmostEqual(models["model-a"].seconds, 4.0)
+        self.assertEqual(models["model-a"].history_turns, 2)
+        self.assertEqual(models["model-a"].cost, models["model-a"].input_tokens + 200)
+        # 実績のないモデルは既定値
+        self.assertEqual(models["model-b"].output_tokens, 2 * estimate.DEFAULT_OUTPUT_TOKENS)
+        self.assertEqual(models["model-b"].history_turns, 0)
+        # MC は開始アナウンスの1回
+        self.assertEqual(models["model-mc"].calls, 1)
+        # Bob のプロンプトには Alice の発言 (100 トークン) が含まれる
+        self.assertGreater(models["model-b"].input_tokens, 200)
+        self.assertIn("model-a", estimate.format_estimate(result, 1, 1))
+
+    def test_estimate_batch_and_intro_cache(self):
+        """会話の件数・同時実行数と開始アナウンスの共有を反映するテスト"""
+        single = estimate.Estimator(self.config).estimate()
+        self.config.cache_moderator_intro = True
+        batch = estimate.Estimator(self.config).estimate(conversations=4, concurrency=2)
+        models = {entry.model_id: entry for entry in batch["models"]}
+        self.assertEqual(models["model-mc"].calls, 1)
+        self.assertEqual(models["model-a"].calls, 8)
+        self.assertAlmostEqual(batch["wall_seconds"], single["conversation_seconds"] * 2)
+
+    def test_estimate_judge_summary_and_truncation(self):
+        """MCの終了判定・要約と、max_response_chars による打ち切りを反映するテスト"""
+        self.config.termination = TerminationConfig(moderator_judge_every=2)
+        self.config.show_summary = True
+        self.config.max_response_chars = 30
+        result = estimate.Estimator(self.config).estimate()
+        models = {entry.model_id: entry for entry in result["models"]}
+        # 開始アナウンス + 判定2回 + 要約
+        self.assertEqual(models["model-mc"].calls, 4)
+        self.assertEqual(models["model-a"].output_tokens, 2 * (int(30 / estimate.DEFAULT_CHARS_PER_TOKEN) + 1))
+
+    def test_budget_warnings(self):
+        """見積もりが予算の上限を超える場合の警告テスト"""
+        self.config.budget = BudgetConfig(conversation=BudgetLimit(max_tokens=10), batch=BudgetLimit(max_cost=0.5))
+        estimator = estimate.Estimator(self.config)
+        warnings = estimator.budget_warnings(estimator.estimate(conversations=2))
+        self.assertEqual(len(warnings), 2)
+        self.assertIn("会話", warnings[0])
+        self.assertIn("バッチ", warnings[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import json
+import logging
+import os
+import tempfile
+import event_log
+from event_log import JsonLinesFormatter, start_queue_logging, stop_queue_logging
+
+
+class TestEventLog(unittest.TestCase):
+    """event_log.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.logger = logging.getLogger("test_event_log")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        """テスト後処理"""
+        stop_queue_logging()
+        self.logger.handlers.clear()
+        self.temp_dir.cleanup()
+
+    def test_queue_logging_writes_json_lines(self):
+        """バックグラウンドのリスナー経由で1行1件の JSON が書き出されるテスト"""
+        path = os.path.join(self.temp_dir.name, "app.jsonl")
+        handler = logging.FileHandler(path, encoding="utf-8")
+        handler.setFormatter(JsonLinesFormatter())
+        handler.setLevel(logging.INFO)
+        start_queue_logging(self.logger, handler)
+
+        self.logger.info(
+            "使用量: %d ms", 120,
+            extra={"event": "turn_end", "conversation_id": "conv-1", "turn": 3, "speaker": "Alice", "latency_ms": 120},
+        )
+        self.logger.debug("出力されない %s", "message")
+        stop_queue_logging()
+        self.assertIsNone(event_log._listener)
+
+        with open(path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 1)
+        record = lines[0]
+        self.assertEqual(record["message"], "使用量: 120 ms")
+        self.assertEqual(record["level"], "INFO")
+        self.assertEqual(
+            {key: record[key] for key in ("event", "conversation_id", "turn", "speaker", "latency_ms")},
+            {"event": "turn_end", "conversation_id": "conv-1", "turn": 3, "speaker": "Alice", "latency_ms": 120},
+        )
+        self.assertNotIn("input_tokens", record)
+
+    def test_queue_logging_keeps_traceback(self):
+        """キューを経由しても例外のトレースバックが exc_info として書き出されるテスト"""
+        path = os.path.join(self.temp_dir.name, "app.jsonl")
+        handler = logging.FileHandler(path, encoding="utf-8")
+        handler.setFormatter(JsonLinesFormatter())
+        handler.setLevel(logging.INFO)
+        start_queue_logging(self.logger, handler)
+
+        try:
+            raise RuntimeError("失敗しました")
+        except RuntimeError as e:
+            self.logger.exception("エラー: %s", e, extra={"event": "job_failed"})
+        stop_queue_logging()
+
+        with open(path, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record["message"], "エラー: 失敗しました")
+        self.assertEqual(record["event"], "job_failed")
+        self.assertIn("Traceback", record["exc_info"])
+        self.assertIn("RuntimeError: 失敗しました", record["exc_info"])
+
+    def test_setup_logger_writes_module_loggers(self):
+        """main.setup_logger のファイル出力にモジュールのロガーのレコードも書き出されるテスト"""
+        from main import setup_logger
+        root_logger = logging.getLogger()
+        saved_handlers, saved_level = list(root_logger.handlers), root_logger.level
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        try:
+            logger = setup_logger("info")
+            logger.info("メイン")
+            logging.getLogger("concurrency").info("モジュール", extra={"event": "concurrency_limit", "model": "model-a"})
+            logging.getLogger("concurrency").debug("出力されない")
+            stop_queue_logging()
+            with open(os.path.join("logs", "app.jsonl"), encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+        finally:
+            os.chdir(cwd)
+            logging.getLogger("__main__").handlers.clear()
+            root_logger.handlers[:] = saved_handlers
+            root_logger.setLevel(saved_level)
+
+        self.assertEqual([(line["logger"], line["message"]) for line in lines], [("__main__", "メイン"), ("concurrency", "モジュール")])
+        self.assertEqual(lines[1]["event"], "concurrency_limit")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import logging
+import os
+import tempfile
+from config import AppConfig, ParticipantConfig
+from conversation import ConversationManager
+from database import init_db, fetch_conversation_history, get_db_connection
+from fork import run_forks
+
+
+class TestFork(unittest.TestCase):
+    """fork.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.CRITICAL + 1)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "test.db")
+        init_db(self.db_path)
+
+    def tearDown(self):
+        """テスト後処理"""
+        self.temp_dir.cleanup()
+
+    def _config(self, participant_b_model="test-model-b"):
+        config = AppConfig(
+            topic="Test Topic",
+            participants=[
+                ParticipantConfig("Alice", "test-model-a", "Alice's persona"),
+                ParticipantConfig("Bob", participant_b_model, "Bob's persona"),
+            ],
+            moderator=ParticipantConfig("MC", "test-model-mc", "MC's persona"),
+            max_turns=4,
+            llm_wait_time=0,
+            show_summary=False,
+        )
+        config.db_path = self.db_path
+        return config
+
+    @patch('conversation.llm.get_model')
+    def test_forks_reuse_parent_turns(self, mock_get_model):
+        """分岐した会話は分岐元のターンを再生成せず、その続きだけを実行するテスト"""
+        calls = []
+
+        def get_model(model_id):
+            model = MagicMock()
+
+            def prompt(text, **kwargs):
+                calls.append((model_id, text))
+                return iter([f"{model_id} turn {len(calls)}"])
+
+            model.prompt.side_effect = prompt
+            return model
+
+        mock_get_model.side_effect = get_model
+        parent = ConversationManager(self._config(), self.logger, console=False)
+        with patch('builtins.print'):
+            parent.start_conversation(max_turns=4, show_summary=False)
+        # MCの開始アナウンスと4ターン
+        self.assertEqual(len(calls), 5)
+        # ターン2の発言が分岐した会話の最初のプロンプトになる
+        fork_prompt = fetch_conversation_history(parent.conversation_id, db_path=self.db_path)[2][2]
+
+        calls.clear()
+        with patch('builtins.print'):
+            results = run_forks(
+                [self._config("test-model-c"), self._config("test-model-d")],
+                self.logger, parent.conversation_id, fork_turn=2, concurrency=2,
+            )
+        self.assertTrue(all(results))
+        # 分岐ごとにターン3と4だけを生成する (2 × (4 - 2))
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(sorted(model_id for model_id, _ in calls), ["test-model-a", "test-model-a", "test-model-c", "test-model-d"])
+        self.assertTrue(all(text == fork_prompt for model_id, text in calls if model_id == "test-model-a"))
+
+        for fork_id in results:
+            history = fetch_conversation_history(fork_id, db_path=self.db_path)
+            self.assertEqual(len(history), 5)
+            self.assertEqual(history[:3], fetch_conversation_history(parent.conversation_id, db_path=self.db_path)[:3])
+        # 分岐元のターンはコピーされない
+        with get_db_connection(self.db_path) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM conversation_log").fetchone()[0]
+        self.assertEqual(count, 5 + 2 * 2)
+
+    def test_fork_requires_recorded_turn(self):
+        """分岐元のターンが記録されていない場合はエラーになるテスト"""
+        with self.assertRaises(ValueError):
+            run_forks([self._config()], self.logger, "missing", fork_turn=1)
+        with self.assertRaises(ValueError):
+            ConversationManager(self._config(), self.logger, parent_conversation_id="missing")
+
+
+if __name__ == '__main__':
+    unittest.main()
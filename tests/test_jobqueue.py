@@ -0,0 +1,138 @@
+import unittest
+import os
+import tempfile
+import logging
+from unittest.mock import patch, MagicMock
+from database import init_db, enqueue_job, claim_job, renew_job_lease, complete_job, fail_job, fetch_job_counts, get_db_connection
+from jobqueue import Worker
+
+
+class TestJobQueue(unittest.TestCase):
+    """database.py のジョブキューと jobqueue.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "test_conversation.db")
+        init_db(self.db_path)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.CRITICAL + 1)
+
+    def tearDown(self):
+        """テスト後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_claim_is_exclusive(self):
+        """同じジョブが複数のワーカーに取得されないテスト"""
+        job_id = enqueue_job("config.yaml", {"topic": "Topic"}, db_path=self.db_path)
+
+        job = claim_job("worker-1", 60, db_path=self.db_path)
+        self.assertEqual(job.id, job_id)
+        self.assertEqual(job.overrides, {"topic": "Topic"})
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(claim_job("worker-2", 60, db_path=self.db_path))
+
+        self.assertTrue(renew_job_lease(job_id, "worker-1", 60, db_path=self.db_path))
+        self.assertFalse(renew_job_lease(job_id, "worker-2", 60, db_path=self.db_path))
+
+        complete_job(job_id, "worker-1", "conv-1", db_path=self.db_path)
+        self.assertEqual(fetch_job_counts(self.db_path), {"done": 1})
+
+    def test_expired_lease_is_requeued(self):
+        """リースが切れたジョブが他のワーカーに再取得され、上限を超えると失敗になるテスト"""
+        job_id = enqueue_job("config.yaml", max_attempts=2, db_path=self.db_path)
+        claim_job("crashed-worker", -1, db_path=self.db_path)  # 期限切れのリース
+
+        job = claim_job("worker-2", -1, db_path=self.db_path)
+        self.assertEqual(job.id, job_id)
+        self.assertEqual(job.attempts, 2)
+
+        # 再試行回数の上限に達したジョブは再取得されない
+        self.assertIsNone(claim_job("worker-3", 60, db_path=self.db_path))
+        self.assertEqual(fetch_job_counts(self.db_path), {"failed": 1})
+
+    def test_fail_job_retry(self):
+        """失敗したジョブが再試行回数の範囲で実行待ちに戻るテスト"""
+        job_id = enqueue_job("config.yaml", max_attempts=2, db_path=self.db_path)
+        claim_job("worker-1", 60, db_path=self.db_path)
+        fail_job(job_id, "worker-1", "API error", db_path=self.db_path)
+        self.assertEqual(fetch_job_counts(self.db_path), {"pending": 1})
+
+        claim_job("worker-1", 60, db_path=self.db_path)
+        fail_job(job_id, "worker-1", "budget", retry=False, db_path=self.db_path)
+        self.assertEqual(fetch_job_counts(self.db_path), {"failed": 1})
+
+    @patch('jobqueue.ConversationManager')
+    @patch('jobqueue.load_config_from_file')
+    def test_worker_runs_jobs(self, mock_load_config, mock_manager_class):
+        """ワーカーがキューが空になるまでジョブを実行するテスト"""
+        mock_config = MagicMock()
+        mock_load_config.return_value = mock_config
+        managers = [MagicMock(conversation_id="conv-1", stop_reason="max_turns"), MagicMock(conversation_id="conv-2")]
+        managers[1].start_conversation.side_effect = Exception("API error")
+        mock_manager_class.side_effect = managers
+
+        enqueue_job("config.yaml", {"topic": "Topic 1", "max_turns": 4}, max_attempts=1, db_path=self.db_path)
+        enqueue_job("config.yaml", {"topic": "Topic 2"}, max_attempts=1, db_path=self.db_path)
+
+        processed = Worker(self.logger, db_path=self.db_path, worker_id="worker-1").run()
+
+        self.assertEqual(processed, 2)
+        self.assertEqual(mock_manager_class.call_args_list[0].args[0].max_turns, 4)
+        self.assertFalse(mock_manager_class.call_args.kwargs["console"])
+        with get_db_connection(self.db_path) as conn:
+            rows = conn.execute("SELECT status, conversation_id, error FROM job_queue ORDER BY id").fetchall()
+        self.assertEqual(rows, [("done", "conv-1", None), ("failed", "conv-2", "API error")])
+
+    @patch('jobqueue.ConversationManager')
+    @patch('jobqueue.load_config_from_file')
+    def test_worker_fails_job_stopped_by_budget(self, mock_load_config, mock_manager_class):
+        """会話の途中で予算の上限に達したジョブが再試行なしで失敗になるテスト"""
+        mock_load_config.return_value = MagicMock()
+        mock_manager_class.return_value = MagicMock(conversation_id="conv-1", stop_reason="budget: 上限に達しました")
+
+        enqueue_job("config.yaml", max_attempts=3, db_path=self.db_path)
+        Worker(self.logger, db_path=self.db_path, worker_id="worker-1").run()
+
+        with get_db_connection(self.db_path) as conn:
+            rows = conn.execute("SELECT status, conversation_id, error FROM job_queue").fetchall()
+        self.assertEqual(rows, [("failed", "conv-1", "budget: 上限に達しました")])
+
+    @patch('jobqueue.ConversationManager')
+    @patch('jobqueue.load_config_from_file')
+    def test_worker_releases_interrupted_job(self, mock_load_config, mock_manager_class):
+        """中断されたワーカーが問い合わせずにジョブを実行待ちに戻し、試行回数を数えないテスト"""
+        mock_load_config.return_value = MagicMock()
+        mock_manager_class.return_value = MagicMock(conversation_id="conv-1")
+        mock_manager_class.return_value.start_conversation.side_effect = KeyboardInterrupt
+
+        job_id = enqueue_job("config.yaml", max_attempts=3, db_path=self.db_path)
+        with self.assertRaises(KeyboardInterrupt):
+            Worker(self.logger, db_path=self.db_path, worker_id="worker-1").run()
+
+        self.assertFalse(mock_manager_class.call_args.kwargs["interactive"])
+        with get_db_connection(self.db_path) as conn:
+            rows = conn.execute("SELECT status, attempts, lease_expires_at FROM job_queue").fetchall()
+        self.assertEqual(rows, [("pending", 0, None)])
+        self.assertEqual(claim_job("worker-2", 60, db_path=self.db_path).id, job_id)
+
+    @patch('jobqueue.ConversationManager')
+    @patch('jobqueue.load_config_from_file')
+    def test_worker_fails_job_with_invalid_max_turns(self, mock_load_config, mock_manager_class):
+        """max_turns の上書きが正の整数でないジョブが、会話を始めずに再試行なしで失敗になるテスト"""
+        mock_load_config.return_value = MagicMock()
+        for max_turns in (0, -1, "5", 2.5, True):
+            enqueue_job("config.yaml", {"max_turns": max_turns}, max_attempts=3, db_path=self.db_path)
+
+        self.assertEqual(Worker(self.logger, db_path=self.db_path, worker_id="worker-1").run(), 5)
+
+        mock_manager_class.assert_not_called()
+        with get_db_connection(self.db_path) as conn:
+            rows = conn.execute("SELECT status, error FROM job_queue ORDER BY id").fetchall()
+        self.assertEqual([status for status, _ in rows], ["failed"] * 5)
+        self.assertIn("'max_turns' は正の整数である必要があります", rows[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
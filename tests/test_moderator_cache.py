@@ -0,0 +1,64 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from database import init_db
+from moderator_cache import ModeratorCache, moderator_cache_key
+
+
+class TestModeratorCache(unittest.TestCase):
+    """moderator_cache.py のテストクラス"""
+
+    def test_key_depends_on_model_persona_and_prompt(self):
+        """キャッシュキーがモデル・ペルソナ・プロンプトのすべてに依存するテスト"""
+        key = moderator_cache_key("model", "persona", "prompt")
+        self.assertEqual(key, moderator_cache_key("model", "persona", "prompt"))
+        self.assertNotEqual(key, moderator_cache_key("other", "persona", "prompt"))
+        self.assertNotEqual(key, moderator_cache_key("model", "other", "prompt"))
+        self.assertNotEqual(key, moderator_cache_key("model", "persona", "other"))
+
+    def test_get_or_create_calls_factory_once(self):
+        """同時に要求された場合も生成は1回だけ行われるテスト"""
+        cache = ModeratorCache()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            time.sleep(0.05)
+            return "開始します"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("key", factory))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(cached for _, cached in results), [False, True, True, True])
+        self.assertEqual({text for text, _ in results}, {"開始します"})
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_empty_response_is_not_cached(self):
+        """空の発言はキャッシュしないテスト"""
+        cache = ModeratorCache()
+        self.assertEqual(cache.get_or_create("key", lambda: ""), ("", False))
+        self.assertEqual(len(cache), 0)
+
+    def test_persisted_across_instances(self):
+        """db_path を指定した場合、別のインスタンス (プロセス) からも再利用できるテスト"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        db_path = os.path.join(temp_dir, "test_conversation.db")
+        init_db(db_path)
+
+        ModeratorCache(db_path=db_path).get_or_create("key", lambda: "開始します", model_id="test-model-mc")
+        cache = ModeratorCache(db_path=db_path)
+        self.assertEqual(cache.get_or_create("key", lambda: self.fail("再生成されました")), ("開始します", True))
+        self.assertIsNone(ModeratorCache().get("key"))
+
+
+if __name__ == '__main__':
+    unittest.main()
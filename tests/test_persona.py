@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import MagicMock
+import llm
+from persona import PersonaRegistry, estimate_token_count, count_tokens
+
+
+class TestPersonaRegistry(unittest.TestCase):
+    """persona.py のテストクラス"""
+
+    def test_register_returns_same_fragment(self):
+        """同じペルソナは同一のフラグメントとして再利用されるテスト"""
+        registry = PersonaRegistry()
+        first = registry.fragment("Alice's persona")
+        second = registry.fragment("Alice's persona")
+
+        self.assertIsInstance(first, llm.Fragment)
+        self.assertIs(first, second)
+        self.assertEqual(len(registry), 1)
+        self.assertIn("Alice's persona", registry)
+
+    def test_token_count_is_cached_per_model(self):
+        """トークン数がモデルごとに一度だけ計算されるテスト"""
+        registry = PersonaRegistry()
+        model = MagicMock()
+        model.model_id = "test-model-a"
+        model.count_tokens.return_value = 42
+
+        self.assertEqual(registry.token_count("Alice's persona", model), 42)
+        self.assertEqual(registry.token_count("Alice's persona", model), 42)
+        model.count_tokens.assert_called_once_with("Alice's persona")
+
+    def test_estimate_token_count(self):
+        """簡易トークン数推定のテスト"""
+        self.assertEqual(estimate_token_count(""), 0)
+        self.assertEqual(estimate_token_count("abcd"), 1)
+        self.assertEqual(estimate_token_count("こんにちは"), 5)
+        self.assertEqual(count_tokens("こんにちは"), 5)
+
+    def test_cache_options(self):
+        """プロンプトキャッシュ対応モデルでのみ cache オプションを付与するテスト"""
+        registry = PersonaRegistry()
+
+        cacheable = MagicMock()
+        cacheable.Options.model_fields = {"cache": None, "temperature": None}
+        self.assertEqual(registry.cache_options(cacheable), {"cache": True})
+
+        plain = MagicMock()
+        plain.Options.model_fields = {"temperature": None}
+        self.assertEqual(registry.cache_options(plain), {})
+
+        disabled = PersonaRegistry(prompt_cache=False)
+        self.assertEqual(disabled.cache_options(cacheable), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import patch
+import logging
+import os
+import tempfile
+from config import AppConfig, ParticipantConfig
+from conversation import ConversationManager
+from database import init_db, fetch_conversation_history
+from replay import Recorder, ReplayMismatchError, ReplayModel, build_replay_cache, load_fixture
+
+
+class FakeResponse:
+    """使用量を報告するストリーミングレスポンス"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.input_tokens = None
+        self.output_tokens = None
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield chunk
+        self.input_tokens = 7
+        self.output_tokens = len(self._chunks)
+
+
+class FakeModel:
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.calls = 0
+
+    def prompt(self, prompt, **kwargs):
+        self.calls += 1
+        return FakeResponse([f"{self.model_id} ", "says ", f"#{self.calls}"])
+
+
+class TestReplay(unittest.TestCase):
+    """replay.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.CRITICAL + 1)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "test.db")
+        self.fixture = os.path.join(self.temp_dir.name, "fixture.jsonl")
+        init_db(self.db_path)
+        self.config = AppConfig(
+            topic="Test Topic",
+            participants=[
+                ParticipantConfig("Alice", "test-model-a", "Alice's persona"),
+                ParticipantConfig("Bob", "test-model-b", "Bob's persona"),
+            ],
+            moderator=ParticipantConfig("MC", "test-model-mc", "MC's persona"),
+            max_turns=3,
+            llm_wait_time=0,
+            show_summary=False,
+        )
+        self.config.db_path = self.db_path
+
+    def tearDown(self):
+        """テスト後処理"""
+        self.temp_dir.cleanup()
+
+    def _run(self, model_cache):
+        manager = ConversationManager(self.config, self.logger, model_cache=model_cache, console=False)
+        manager.start_conversation(max_turns=3, show_summary=False)
+        return [row[2] for row in fetch_conversation_history(manager.conversation_id, db_path=self.db_path)]
+
+    def test_record_and_replay(self):
+        """記録したチャンクと使用量を再生すると、同じ会話が記録されるテスト"""
+        models = {}
+        recorder = Recorder(self.fixture)
+        recorded = self._run(recorder.wrap_cache(lambda model_id: models.setdefault(model_id, FakeModel(model_id))))
+        # MCの開始アナウンスと3ターン
+        self.assertEqual(len(recorder.calls), 4)
+
+        calls = load_fixture(self.fixture)
+        self.assertEqual([call.model_id for call in calls], ["test-model-mc", "test-model-a", "test-model-b", "test-model-a"])
+        self.assertEqual(calls[1].chunks[0][1], "test-model-a ")
+        self.assertEqual((calls[1].input_tokens, calls[1].output_tokens), (7, 3))
+        self.assertEqual(calls[1].system, ["Alice's persona"])
+
+        replay_cache = build_replay_cache(calls, speed=0)
+        with patch("replay.time.sleep") as mock_sleep:
+            replayed = self._run(replay_cache)
+        mock_sleep.assert_not_called()
+        self.assertEqual(replayed, recorded)
+        self.assertTrue(all(model.remaining == 0 for model in replay_cache.values()))
+
+    def test_replay_speed_and_mismatch(self):
+        """再生速度の倍率で待機時間が変わり、記録のない呼び出しはエラーになるテスト"""
+        recorder = Recorder()
+        model = recorder.wrap(FakeModel("test-model-a"), "test-model-a")
+        self.assertEqual(model.prompt("hello").text(), "test-model-a says #1")
+        recorder.calls[0].chunks = [(0.2, "a"), (0.4, "b")]
+
+        replay_model = build_replay_cache(recorder.calls, speed=2)["test-model-a"]
+        with patch("replay.time.sleep") as mock_sleep:
+            response = replay_model.prompt("hello")
+            self.assertEqual(list(response), ["a", "b"])
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list], [0.1, 0.2])
+        self.assertEqual(response.output_tokens, 3)
+        with self.assertRaises(ReplayMismatchError):
+            replay_model.prompt("hello")
+
+        strict = build_replay_cache(recorder.calls, speed=0, strict=True)["test-model-a"]
+        with self.assertRaises(ReplayMismatchError):
+            strict.prompt("another prompt")
+        # strict でなければ、記録のないプロンプトにも記録順に割り当てる
+        self.assertEqual(build_replay_cache(recorder.calls, speed=0)["test-model-a"].prompt("another prompt").text(), "ab")
+
+    @patch('conversation.backends.get_model')
+    def test_replay_unknown_model_does_not_call_backend(self, mock_get_model):
+        """フィクスチャに記録のないモデルは実際のバックエンドから取得せず、エラーになるテスト"""
+        recorder = Recorder()
+        recorder.wrap(FakeModel("test-model-a"), "test-model-a").prompt("hello").text()
+        replay_cache = build_replay_cache(recorder.calls, speed=0)
+        self.assertIsInstance(replay_cache.get("test-model-a"), ReplayModel)
+
+        cm = ConversationManager(self.config, self.logger, console=False, model_cache=replay_cache)
+        with self.assertRaises(ReplayMismatchError):
+            cm.start_conversation(max_turns=2)
+        mock_get_model.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
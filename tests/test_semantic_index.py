@@ -0,0 +1,139 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import logging
+import os
+import tempfile
+import semantic_index
+from config import AppConfig, ParticipantConfig, RetrievalConfig
+from conversation import ConversationManager
+from database import init_db, log_conversation_meta, log_conversation_turn
+from semantic_index import SemanticIndex, decode_vector, encode_vector
+
+VOCABULARY = ("cat", "dog", "fish", "bird")
+
+
+class FakeEmbeddingModel:
+    """単語の出現回数をベクトルにする埋め込みモデル"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, text):
+        self.calls += 1
+        return [text.count(word) + 0.01 for word in VOCABULARY]
+
+
+class TestSemanticIndex(unittest.TestCase):
+    """semantic_index.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "test.db")
+        init_db(self.db_path)
+        self.index = SemanticIndex("fake-embed", db_path=self.db_path, model=FakeEmbeddingModel())
+
+    def tearDown(self):
+        """テスト後処理"""
+        self.temp_dir.cleanup()
+
+    def _add_turns(self, conversation_id, texts):
+        for turn, text in enumerate(texts, start=1):
+            log_conversation_turn(conversation_id, turn, "Alice", "model-a", "p", text, db_path=self.db_path)
+            self.index.add(conversation_id, turn, text)
+
+    def test_encode_vector(self):
+        """ベクトルは正規化した float32 として保存されるテスト"""
+        vector = decode_vector(encode_vector([3.0, 4.0]))
+        self.assertAlmostEqual(vector[0], 0.6, places=6)
+        self.assertAlmostEqual(vector[1], 0.8, places=6)
+        self.assertEqual(len(encode_vector([1.0] * 8)), 32)
+
+    def test_search_within_conversation(self):
+        """会話の中で意味の近い発言をターン番号の上限つきで検索するテスト"""
+        self._add_turns("conv-1", ["cat cat", "dog dog", "fish", "cat dog", "bird"])
+        results = self.index.search("cat", top_k=2, conversation_id="conv-1")
+        self.assertEqual([r.turn_number for r in results], [1, 4])
+        self.assertEqual((results[0].speaker, results[0].text), ("Alice", "cat cat"))
+        self.assertGreater(results[0].score, results[1].score)
+        # ターン3までに限る
+        results = self.index.search("cat", top_k=2, conversation_id="conv-1", max_turn=3)
+        self.assertEqual(results[0].turn_number, 1)
+        self.assertNotIn(4, [r.turn_number for r in results])
+        # 類似度の下限
+        results = self.index.search("cat", top_k=5, conversation_id="conv-1", min_score=0.5)
+        self.assertEqual(sorted(r.turn_number for r in results), [1, 4])
+
+    def test_search_across_conversations_and_forks(self):
+        """全会話の検索と、分岐した会話が分岐元のターンを検索できるテスト"""
+        self._add_turns("conv-1", ["cat", "dog", "fish fish"])
+        log_conversation_meta("conv-2", "Topic", "Alice", "model-a", "Bob", "model-b", "MC", "model-mc",
+                              parent_conversation_id="conv-1", fork_turn=2, db_path=self.db_path)
+        log_conversation_turn("conv-2", 3, "Bob", "model-b", "p", "bird", db_path=self.db_path)
+        self.index.add("conv-2", 3, "bird")
+
+        # 分岐した会話はターン2までの分岐元のターン (fish fish を含まない) と自身のターンを検索する
+        results = self.index.search("fish", top_k=5, conversation_id="conv-2")
+        self.assertEqual(sorted((r.conversation_id, r.turn_number) for r in results),
+                         [("conv-1", 1), ("conv-1", 2), ("conv-2", 3)])
+
+        results = self.index.search("fish", top_k=1, batch_size=1)
+        self.assertEqual((results[0].conversation_id, results[0].turn_number), ("conv-1", 3))
+        results = self.index.search("bird", top_k=5, exclude_conversation_id="conv-2")
+        self.assertNotIn("conv-2", [r.conversation_id for r in results])
+
+    def test_conversation_uses_related_turns(self):
+        """参加者のプロンプトに関連する過去の発言がコンテキストとして渡されるテスト"""
+        config = AppConfig(
+            topic="Test Topic",
+            participants=[
+                ParticipantConfig("Alice", "test-model-a", "Alice's persona"),
+                ParticipantConfig("Bob", "test-model-b", "Bob's persona"),
+            ],
+            moderator=ParticipantConfig("MC", "test-model-mc", "MC's persona"),
+            max_turns=4,
+            llm_wait_time=0,
+            show_summary=False,
+            retrieval=RetrievalConfig("fake-embed", top_k=1),
+        )
+        config.db_path = self.db_path
+        responses = iter(["intro", "cat cat", "dog", "cat", "fish"])
+        fragments = []
+
+        def prompt(text, **kwargs):
+            fragments.append([str(f) for f in kwargs.get("fragments", [])])
+            return iter([next(responses)])
+
+        model = MagicMock()
+        model.prompt.side_effect = prompt
+        model_cache = {model_id: model for model_id in ("test-model-a", "test-model-b", "test-model-mc")}
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.CRITICAL + 1)
+        manager = ConversationManager(config, logger, model_cache=model_cache, console=False, semantic_index=self.index)
+        with patch('builtins.print'):
+            manager.start_conversation(max_turns=4, show_summary=False)
+
+        # 開始アナウンスとターン1・2には参照できる過去の発言がない
+        self.assertEqual(fragments[:3], [[], [], []])
+        # ターン4のプロンプト (ターン3の "cat") には、直前を除くターンから "cat cat" (ターン1) を参照させる
+        self.assertEqual(len(fragments[4]), 1)
+        self.assertIn("ターン 1", fragments[4][0])
+        self.assertIn("cat cat", fragments[4][0])
+        # 参加者のターンはすべて埋め込みベクトルが保存される
+        self.assertEqual(self.index.model.calls, 4)
+        # ターンごとのコンテキストはペルソナのレジストリに残らない (ペルソナ3件だけ)
+        self.assertEqual(len(manager.personas), 3)
+
+    def test_search_without_numpy(self):
+        """numpy がない場合も同じ結果になるテスト"""
+        self._add_turns("conv-1", ["cat cat", "dog dog", "fish", "cat dog"])
+        with patch.object(semantic_index, "numpy", None):
+            fallback = [(r.turn_number, round(r.score, 5)) for r in self.index.search("cat", top_k=2)]
+        if semantic_index.numpy is not None:
+            expected = [(r.turn_number, round(r.score, 5)) for r in self.index.search("cat", top_k=2)]
+            self.assertEqual(fallback, expected)
+        self.assertEqual([turn for turn, _ in fallback], [1, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
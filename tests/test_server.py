@@ -0,0 +1,257 @@
+import unittest
+import asyncio
+import base64
+import json
+import logging
+import os
+import tempfile
+from unittest.mock import patch
+from cancellation import CancelToken
+from concurrency import ModelConcurrencyLimiter
+from config import AppConfig, ParticipantConfig
+from database import init_db, log_conversation_turn
+from server import MAX_REQUEST_BODY_BYTES, TalkTableServer, Session, _websocket_frame
+from transcript import Transcript
+
+
+class FakeConversationManager:
+    """イベントを通知するだけの ConversationManager の代替"""
+
+    instances = []
+
+    def __init__(self, config, logger, persona_registry=None, model_cache=None, console=True, **kwargs):
+        self.config = config
+        self.conversation_id = f"conv-{len(FakeConversationManager.instances)}"
+        self.turn_count = 0
+        self.model_cache = model_cache
+        self.console = console
+        self.event_callback = None
+        self.cancel_token = CancelToken()
+        self.transcript = Transcript(self.conversation_id)
+        self.kwargs = kwargs
+        FakeConversationManager.instances.append(self)
+
+    def cancel(self, reason="cancelled"):
+        self.cancel_token.cancel(reason)
+
+    def start_conversation(self, max_turns=10, show_prompt=False, show_summary=False):
+        self.event_callback({"type": "conversation_start", "topic": self.config.topic})
+        for turn in range(1, max_turns + 1):
+            # "Slow Topic" のセッションはキャンセルされるまでターンを進めない
+            if self.config.topic == "Slow Topic":
+                self.cancel_token.wait(5)
+            if self.cancel_token.cancelled:
+                self.event_callback({"type": "conversation_end", "turns": self.turn_count, "reason": "cancelled"})
+                return
+            self.turn_count = turn
+            self.transcript.append(turn, "Alice", "test-model-a", f"発言{turn}")
+            self.event_callback({"type": "chunk", "turn": turn, "text": f"発言{turn}"})
+            self.event_callback({"type": "turn_end", "turn": turn, "response": f"発言{turn}"})
+        self.event_callback({"type": "conversation_end", "turns": max_turns})
+
+
+class TestTalkTableServer(unittest.IsolatedAsyncioTestCase):
+    """server.py のテストクラス"""
+
+    async def asyncSetUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.CRITICAL + 1)
+        self.config = AppConfig(
+            topic="Test Topic",
+            participants=[
+                ParticipantConfig("Alice", "test-model-a", "Alice's persona"),
+                ParticipantConfig("Bob", "test-model-b", "Bob's persona"),
+            ],
+            moderator=ParticipantConfig("MC", "test-model-mc", "MC's persona"),
+            max_turns=2,
+            llm_wait_time=0,
+        )
+        self.config.db_path = os.path.join(self.temp_dir, "test_conversation.db")
+        init_db(self.config.db_path)
+
+        FakeConversationManager.instances = []
+        self.patcher = patch('server.ConversationManager', FakeConversationManager)
+        self.patcher.start()
+        self.app = TalkTableServer(self.config, logger, max_sessions=2)
+        self.server = await asyncio.start_server(self.app.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        """テスト後処理"""
+        self.server.close()
+        await self.server.wait_closed()
+        self.app.executor.shutdown(wait=True)
+        self.patcher.stop()
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    async def _request(self, method, path, body=None, headers=None):
+        """リクエストを送り、レスポンス全体 (接続が閉じられるまで) を返す"""
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(payload)}\r\n"
+        for key, value in (headers or {}).items():
+            head += f"{key}: {value}\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + payload)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout=5)
+        writer.close()
+        status = int(response.split(b" ", 2)[1])
+        return status, response.split(b"\r\n\r\n", 1)[1]
+
+    async def test_session_events_are_bounded(self):
+        """セッションのイベント履歴が上限までしか保持されず、購読は保持されている分から続くテスト"""
+        with patch('server.MAX_SESSION_EVENTS', 3):
+            session = Session(FakeConversationManager(self.config, None), "Topic")
+        stream = session.stream()
+        session.publish({"type": "chunk", "n": 0})
+        self.assertEqual((await stream.__anext__())["n"], 0)
+        for n in range(1, 6):
+            session.publish({"type": "chunk", "n": n})
+        session.finish()
+
+        self.assertEqual(len(session.events), 3)
+        self.assertEqual([event["n"] async for event in stream], [3, 4, 5])
+
+    async def test_cancel_session(self):
+        """実行中のセッションだけをキャンセルできるテスト"""
+        _, body = await self._request("POST", "/conversations", {"topic": "Slow Topic", "max_turns": 3})
+        slow_id = json.loads(body)["conversation_id"]
+        _, body = await self._request("POST", "/conversations", {"topic": "New Topic", "max_turns": 2})
+        other_id = json.loads(body)["conversation_id"]
+
+        status, body = await self._request("DELETE", f"/conversations/{slow_id}")
+        self.assertEqual(status, 202)
+        _, body = await self._request("GET", f"/conversations/{slow_id}/events")
+        self.assertIn('"reason": "cancelled"', body.decode("utf-8"))
+
+        self.assertEqual(self.app.sessions[slow_id].status, "cancelled")
+        await self._request("GET", f"/conversations/{other_id}/events")
+        self.assertEqual(self.app.sessions[other_id].status, "finished")
+
+        status, _ = await self._request("DELETE", "/conversations/unknown")
+        self.assertEqual(status, 404)
+
+    async def test_start_session_and_stream_events(self):
+        """セッションを開始し、SSE でイベントを最後まで受信するテスト"""
+        status, body = await self._request("POST", "/conversations", {"topic": "New Topic", "max_turns": 3})
+        self.assertEqual(status, 201)
+        conversation_id = json.loads(body)["conversation_id"]
+
+        status, body = await self._request("GET", f"/conversations/{conversation_id}/events")
+        self.assertEqual(status, 200)
+        events = [json.loads(line[len("data: "):]) for line in body.decode("utf-8").splitlines() if line.startswith("data: ")]
+        self.assertEqual(events[0], {"type": "conversation_start", "topic": "New Topic"})
+        self.assertEqual(events[-1]["type"], "conversation_end")
+        self.assertEqual(len([e for e in events if e["type"] == "turn_end"]), 3)
+
+        # コンソール出力は無効化され、モデルのキャッシュはセッション間で共有される
+        manager = FakeConversationManager.instances[0]
+        self.assertFalse(manager.console)
+        self.assertIs(manager.model_cache, self.app.model_cache)
+
+        status, body = await self._request("GET", "/conversations")
+        self.assertEqual(json.loads(body)[0]["status"], "finished")
+
+    async def test_websocket_stream(self):
+        """WebSocket でイベントを受信するテスト"""
+        status, body = await self._request("POST", "/conversations", {"max_turns": 1})
+        conversation_id = json.loads(body)["conversation_id"]
+
+        key = base64.b64encode(b"0123456789abcdef").decode("latin-1")
+        status, body = await self._request(
+            "GET", f"/conversations/{conversation_id}/ws",
+            headers={"Upgrade": "websocket", "Connection": "Upgrade", "Sec-WebSocket-Key": key, "Sec-WebSocket-Version": "13"},
+        )
+        self.assertEqual(status, 101)
+        self.assertIn(_websocket_frame(json.dumps({"type": "conversation_end", "turns": 1})), body)
+
+    async def test_history_and_errors(self):
+        """会話履歴の取得とエラーレスポンスのテスト"""
+        log_conversation_turn("old-conv", 1, "Alice", "test-model-a", "prompt", "こんにちは", db_path=self.config.db_path)
+
+        status, body = await self._request("GET", "/conversations/old-conv/history")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [{"speaker_name": "Alice", "model_used": "test-model-a", "response": "こんにちは"}])
+
+        # 保持しているセッションの履歴はトランスクリプトから読む
+        _, body = await self._request("POST", "/conversations", {"max_turns": 2})
+        conversation_id = json.loads(body)["conversation_id"]
+        await self._request("GET", f"/conversations/{conversation_id}/events")
+        status, body = await self._request("GET", f"/conversations/{conversation_id}/history")
+        self.assertEqual(status, 200)
+        self.assertEqual([turn["response"] for turn in json.loads(body)], ["発言1", "発言2"])
+
+        status, _ = await self._request("GET", "/conversations/unknown/events")
+        self.assertEqual(status, 404)
+        status, _ = await self._request("POST", "/conversations", {"max_turns": 0})
+        self.assertEqual(status, 400)
+
+    async def test_session_cancelled_before_start(self):
+        """サーバーの停止で開始前にキャンセルされたセッションが、エラーにならずキャンセル済みになるテスト"""
+        session_ids = []
+        for _ in range(3):
+            _, body = await self._request("POST", "/conversations", {"topic": "Slow Topic", "max_turns": 1})
+            session_ids.append(json.loads(body)["conversation_id"])
+        # スレッドプールの上限 (2) を超えた3つ目のセッションは開始前にキャンセルされる
+        self.app.executor.shutdown(wait=False, cancel_futures=True)
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+        queued = self.app.sessions[session_ids[2]]
+        self.assertTrue(queued.done)
+        self.assertEqual(queued.status, "cancelled")
+        for conversation_id in session_ids[:2]:
+            self.app.sessions[conversation_id].manager.cancel()
+
+    async def test_metrics(self):
+        """同時実行数の上限とセッション数の取得テスト"""
+        self.app.limiter = ModelConcurrencyLimiter({"test-model-a": 4}, adaptive={"test-model-a": 1})
+        status, body = await self._request("GET", "/metrics")
+        self.assertEqual(status, 200)
+        metrics = json.loads(body)
+        self.assertEqual(metrics["sessions"], {"running": 0, "done": 0})
+        self.assertEqual(metrics["concurrency"]["test-model-a"]["limit"], 1)
+        self.assertEqual(metrics["concurrency"]["test-model-a"]["ceiling"], 4)
+
+        status, _ = await self._request("POST", "/metrics")
+        self.assertEqual(status, 405)
+
+    async def test_invalid_content_length(self):
+        """不正な Content-Length は 400、大きすぎるボディは 413 を返すテスト"""
+        for value, expected in (("abc", 400), ("-5", 400), (str(MAX_REQUEST_BODY_BYTES + 1), 413)):
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            writer.write(f"POST /conversations HTTP/1.1\r\nHost: localhost\r\nContent-Length: {value}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+            self.assertEqual(int(response.split(b" ", 2)[1]), expected, value)
+        self.assertEqual(FakeConversationManager.instances, [])
+
+    async def test_fork_session(self):
+        """分岐元の会話とターンを指定してセッションを開始するテスト"""
+        log_conversation_turn("old-conv", 1, "Alice", "test-model-a", "prompt", "こんにちは", db_path=self.config.db_path)
+
+        status, _ = await self._request("POST", "/conversations", {"parent_conversation_id": "old-conv", "fork_turn": 2, "max_turns": 3})
+        self.assertEqual(status, 404)
+        status, _ = await self._request("POST", "/conversations", {"parent_conversation_id": "old-conv"})
+        self.assertEqual(status, 400)
+        status, _ = await self._request("POST", "/conversations", {"parent_conversation_id": "old-conv", "fork_turn": 1, "max_turns": 1})
+        self.assertEqual(status, 400)
+
+        status, _ = await self._request("POST", "/conversations", {"parent_conversation_id": "old-conv", "fork_turn": 1, "max_turns": 3})
+        self.assertEqual(status, 201)
+        manager = FakeConversationManager.instances[-1]
+        self.assertEqual(manager.kwargs["parent_conversation_id"], "old-conv")
+        self.assertEqual(manager.kwargs["fork_turn"], 1)
+
+    def test_websocket_frame_lengths(self):
+        """WebSocket フレームのペイロード長のエンコードテスト"""
+        self.assertEqual(_websocket_frame("a")[:2], bytes([0x81, 1]))
+        self.assertEqual(_websocket_frame("a" * 200)[:4], bytes([0x81, 126, 0, 200]))
+        self.assertEqual(_websocket_frame("a" * 70000)[1], 127)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import os
+import tempfile
+import stats
+from database import init_db, log_conversation_turn, log_conversation_meta, log_llm_call
+
+
+class TestStats(unittest.TestCase):
+    """stats.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "test.db")
+        init_db(self.db_path)
+        log_conversation_meta("conv-1", "Topic", "Alice", "model-a", "Bob", "model-b", "MC", "model-mc", db_path=self.db_path)
+        log_conversation_turn("conv-1", 0, "MC", "model-mc", "p", "a" * 50, is_moderator=True, db_path=self.db_path)
+        for turn, length in enumerate((50, 150, 150, 600, 20000), start=1):
+            log_conversation_turn("conv-1", turn, "Alice", "model-a", "p", "a" * length, db_path=self.db_path)
+
+    def tearDown(self):
+        """テスト後処理"""
+        self.temp_dir.cleanup()
+
+    def test_compute_stats(self):
+        """ターン数・MCの割合・文字数の分布と分位点の集計テスト"""
+        rows = stats.compute_stats(["topic"], db_path=self.db_path)
+        self.assertEqual(len(rows), 1)
+        row = rows[0]
+        self.assertEqual((row["topic"], row["turns"], row["conversations"]), ("Topic", 6, 1))
+        self.assertAlmostEqual(row["moderator_share"], 1 / 6)
+        self.assertEqual(row["histogram"], [2, 2, 0, 1, 0, 0, 0, 1])
+        self.assertEqual(row["p50_chars"], 200)
+        # 上限のない区間に含まれる場合は None
+        self.assertIsNone(row["p90_chars"])
+
+        text = stats.format_stats(stats.compute_stats(db_path=self.db_path))
+        self.assertIn("model-a", text)
+        self.assertIn("文字数の分布", text)
+
+        # ターン以外のLLM呼び出しは別の表に集計する
+        self.assertEqual(stats.format_call_stats(db_path=self.db_path), "")
+        log_llm_call("conv-1", "judge", "model-mc", input_tokens=40, output_tokens=1, latency_ms=120, db_path=self.db_path)
+        call_stats = stats.format_call_stats(db_path=self.db_path)
+        self.assertIn("judge", call_stats)
+        self.assertIn("120", call_stats)
+
+    @unittest.skipIf(stats.pyarrow is None, "pyarrow がインストールされていません")
+    def test_export_parquet(self):
+        """会話ログを Parquet に書き出すテスト"""
+        path = os.path.join(self.temp_dir.name, "turns.parquet")
+        self.assertEqual(stats.export_parquet(path, batch_size=4, db_path=self.db_path), 6)
+        table = stats.pyarrow.parquet.read_table(path)
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(table.column("topic").to_pylist()[0], "Topic")
+
+
+if __name__ == '__main__':
+    unittest.main()
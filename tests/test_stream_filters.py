@@ -0,0 +1,82 @@
+import unittest
+from stream_filters import (
+    StreamFilter,
+    ReasoningTagFilter,
+    SpeakerPrefixFilter,
+    WhitespaceFilter,
+    LengthCapFilter,
+    StreamPipeline,
+    build_stream_pipeline,
+)
+
+
+def run_filter(stream_filter, chunks):
+    """フィルタにチャンクを順に流し、出力全体を返す"""
+    return "".join(stream_filter.feed(c) for c in chunks) + stream_filter.flush()
+
+
+class TestStreamFilters(unittest.TestCase):
+    """stream_filters.py のテストクラス"""
+
+    def test_filter_requires_feed(self):
+        """feed() を実装しないフィルタは作成できないテスト"""
+        with self.assertRaises(TypeError):
+            StreamFilter()
+
+        class IncompleteFilter(StreamFilter):
+            def flush(self):
+                return ""
+
+        with self.assertRaises(TypeError):
+            IncompleteFilter()
+
+    def test_speaker_prefix_across_chunks(self):
+        """話者名プレフィックスがチャンクをまたいでも取り除かれるテスト"""
+        self.assertEqual(run_filter(SpeakerPrefixFilter("アリス"), ["\nア", "リ", "ス:", " こんにちは"]), " こんにちは")
+        self.assertEqual(run_filter(SpeakerPrefixFilter("アリス"), ["アリス：", "こんにちは"]), "こんにちは")
+
+    def test_speaker_prefix_not_present(self):
+        """プレフィックスがない場合は出力をそのまま返すテスト"""
+        self.assertEqual(run_filter(SpeakerPrefixFilter("アリス"), ["アリ", "ガトウ"]), "アリガトウ")
+        self.assertEqual(run_filter(SpeakerPrefixFilter("アリス"), ["アリ"]), "アリ")
+
+    def test_reasoning_tag_across_chunks(self):
+        """チャンクをまたぐ推論タグが取り除かれるテスト"""
+        chunks = ["<thi", "nk>考え中", "...</th", "ink>答え", "です"]
+        self.assertEqual(run_filter(ReasoningTagFilter(), chunks), "答えです")
+        self.assertEqual(run_filter(ReasoningTagFilter(), ["a < b", " です"]), "a < b です")
+        self.assertEqual(run_filter(ReasoningTagFilter(), ["答え<think>未完"]), "答え")
+
+    def test_whitespace_filter(self):
+        """先頭・末尾の空白除去と空行の圧縮のテスト"""
+        chunks = ["\n\n  こんにちは", "\n\n", "\n\n元気です", "\n"]
+        self.assertEqual(run_filter(WhitespaceFilter(), chunks), "こんにちは\n\n元気です")
+        self.assertEqual(run_filter(WhitespaceFilter(), ["Test ", "response"]), "Test response")
+
+    def test_length_cap_filter(self):
+        """文字数の上限で打ち切られるテスト"""
+        cap = LengthCapFilter(5)
+        self.assertEqual(cap.feed("abc"), "abc")
+        self.assertFalse(cap.exhausted)
+        self.assertEqual(cap.feed("defg"), "de")
+        self.assertTrue(cap.exhausted)
+        self.assertEqual(cap.feed("h"), "")
+
+    def test_pipeline(self):
+        """標準パイプラインで表示用の出力と最終テキストが一致するテスト"""
+        pipeline = build_stream_pipeline("ボブ")
+        chunks = ["<think>", "考え</think>\n", "ボ", "ブ: ", "そうですね", "。\n\n\n\nでも", "\n"]
+        outputs = [pipeline.feed(c) for c in chunks] + [pipeline.flush()]
+        self.assertEqual("".join(outputs), "そうですね。\n\nでも")
+        self.assertEqual(pipeline.text(), "そうですね。\n\nでも")
+
+    def test_pipeline_flush_passes_through_later_filters(self):
+        """前段で保留された出力が flush 時に後段のフィルタを通るテスト"""
+        pipeline = StreamPipeline([SpeakerPrefixFilter("アリス"), LengthCapFilter(1)])
+        self.assertEqual(pipeline.feed("アリ"), "")
+        self.assertEqual(pipeline.flush(), "ア")
+        self.assertEqual(pipeline.text(), "ア")
+
+
+if __name__ == '__main__':
+    unittest.main()
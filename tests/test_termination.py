@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import MagicMock
+from config import TerminationConfig
+from termination import (
+    TerminationPolicy,
+    SimilarityPolicy,
+    EndMarkerPolicy,
+    ModeratorJudgePolicy,
+    TokenBudgetPolicy,
+    build_termination_policies,
+    check_termination,
+)
+
+
+class TestTermination(unittest.TestCase):
+    """termination.py のテストクラス"""
+
+    def test_policy_requires_check(self):
+        """check() を実装しないポリシーは作成できないテスト"""
+        with self.assertRaises(TypeError):
+            TerminationPolicy()
+
+        class IncompletePolicy(TerminationPolicy):
+            name = "incomplete"
+
+        with self.assertRaises(TypeError):
+            IncompletePolicy()
+
+    def test_similarity_policy(self):
+        """直近の発言とほぼ同じ発言で終了するテスト"""
+        policy = SimilarityPolicy(threshold=0.8, window=2)
+        self.assertIsNone(policy.check(1, "人工知能の未来について話しましょう"))
+        self.assertIsNone(policy.check(2, "倫理的な課題も忘れてはいけません"))
+        self.assertIsNotNone(policy.check(3, "人工知能の未来について話しましょう"))
+
+    def test_similarity_policy_window(self):
+        """ウィンドウより古い発言とは比較しないテスト"""
+        policy = SimilarityPolicy(threshold=0.8, window=1)
+        policy.check(1, "人工知能の未来について話しましょう")
+        policy.check(2, "倫理的な課題も忘れてはいけません")
+        self.assertIsNone(policy.check(3, "人工知能の未来について話しましょう"))
+
+    def test_end_marker_policy(self):
+        """終了マーカーで終了するテスト"""
+        policy = EndMarkerPolicy(["[END]"])
+        self.assertIsNone(policy.check(1, "まだ続けましょう"))
+        self.assertIn("[END]", policy.check(2, "ありがとうございました [END]"))
+
+    def test_moderator_judge_policy(self):
+        """指定ターンごとにMCの判定を呼ぶテスト"""
+        judge = MagicMock(return_value=True)
+        policy = ModeratorJudgePolicy(judge, every=2)
+        self.assertIsNone(policy.check(1, "発言1"))
+        judge.assert_not_called()
+        self.assertIsNotNone(policy.check(2, "発言2"))
+        judge.assert_called_once_with(["発言1", "発言2"])
+
+    def test_moderator_judge_policy_failure(self):
+        """MCの判定が失敗しても会話を止めないテスト"""
+        policy = ModeratorJudgePolicy(MagicMock(side_effect=Exception("API error")), every=1)
+        self.assertIsNone(policy.check(1, "発言1"))
+
+    def test_token_budget_policy(self):
+        """トークン数の上限で終了するテスト"""
+        policy = TokenBudgetPolicy(max_tokens=10)
+        self.assertIsNone(policy.check(1, "あいうえお"))
+        self.assertIsNotNone(policy.check(2, "かきくけこ"))
+
+    def test_build_termination_policies(self):
+        """設定からポリシーを構築し、最初の終了理由を返すテスト"""
+        self.assertEqual(build_termination_policies(TerminationConfig()), [])
+
+        judge = MagicMock(return_value=False)
+        policies = build_termination_policies(
+            TerminationConfig(similarity_threshold=0.9, end_markers=["[END]"], moderator_judge_every=1, max_tokens=1000),
+            judge=judge,
+        )
+        self.assertEqual([p.name for p in policies], ["similarity", "end_marker", "token_budget", "moderator_judge"])
+
+        reason = check_termination(policies, 1, "おわり [END]")
+        self.assertTrue(reason.startswith("[end_marker]"))
+        # 安価なポリシーで終了が決まった場合、MCの判定は呼ばれない
+        judge.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
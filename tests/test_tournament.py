@@ -0,0 +1,139 @@
+import unittest
+import os
+import tempfile
+import logging
+from unittest.mock import patch, MagicMock
+from config import AppConfig, ParticipantConfig, TournamentConfig
+from database import init_db, log_conversation_turn, log_tournament_result, fetch_leaderboard
+from tournament import Tournament, round_robin_pairings, swiss_pairings, parse_scores
+from transcript import Transcript
+
+
+class TestTournament(unittest.TestCase):
+    """tournament.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "test_conversation.db")
+        init_db(self.db_path)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.CRITICAL + 1)
+        self.entrants = [ParticipantConfig(name, f"model-{name}", f"{name}'s persona") for name in ("A1", "B1", "C1")]
+        self.config = AppConfig(
+            topic="Test Topic",
+            participants=self.entrants[:2],
+            moderator=ParticipantConfig("MC", "test-model-mc", "MC's persona"),
+            max_turns=2,
+            llm_wait_time=0,
+            tournament=TournamentConfig(self.entrants, concurrency=2, max_turns=1),
+        )
+        self.config.db_path = self.db_path
+
+    def tearDown(self):
+        """テスト後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_round_robin_pairings(self):
+        """総当たりの対戦表で全組み合わせが対戦し、ゲームごとに先攻が入れ替わるテスト"""
+        matches = round_robin_pairings(self.entrants, games_per_pair=2)
+        names = [(r, a.name, b.name) for r, a, b in matches]
+        self.assertEqual(names, [
+            (1, "A1", "B1"), (1, "A1", "C1"), (1, "B1", "C1"),
+            (2, "B1", "A1"), (2, "C1", "A1"), (2, "C1", "B1"),
+        ])
+
+    def test_swiss_pairings_avoid_rematch(self):
+        """スイス式で対戦済みの組み合わせを避け、奇数の場合は不戦が出るテスト"""
+        pairs, bye = swiss_pairings(["A", "B", "C", "D", "E"], {frozenset(("A", "B"))})
+        self.assertEqual(pairs, [("A", "C"), ("B", "D")])
+        self.assertEqual(bye, "E")
+
+    def test_parse_scores(self):
+        """MCの採点結果からスコアを取り出すテスト"""
+        self.assertEqual(parse_scores("A: 7\nB：6.5"), (7.0, 6.5))
+        self.assertEqual(parse_scores("**A**: 12\n**B**: 3"), (10.0, 3.0))
+        with self.assertRaises(ValueError):
+            parse_scores("引き分けです")
+
+    def test_score_conversation_uses_match_manager(self):
+        """採点の呼び出しが対戦の ConversationManager を通り、名前を伏せたプロンプトで行われるテスト"""
+        transcript = Transcript("conv-1")
+        transcript.append(1, "A1", "model-A1", "最初の発言")
+        transcript.append(2, "B1", "model-B1", "次の発言")
+        tournament = Tournament(self.config, self.logger)
+        manager = MagicMock(conversation_id="conv-1", config=self.config, transcript=transcript)
+        manager.generate.return_value = "A: 8\nB: 5"
+
+        self.assertEqual(tournament.score_conversation(manager, self.entrants[0], self.entrants[1]), (8.0, 5.0))
+        speaker, prompt, purpose = manager.generate.call_args.args
+        self.assertEqual((speaker, purpose), (self.config.moderator, "score"))
+        self.assertIn("参加者A: 最初の発言", prompt)
+        self.assertNotIn("A1", prompt)
+
+        # 本文を捨てたターンがある場合はデータベースから読み直す
+        log_conversation_turn("conv-1", 1, "A1", "model-A1", "p", "記録された発言", db_path=self.db_path)
+        transcript.set_text_chars_limit(1)
+        tournament.score_conversation(manager, self.entrants[0], self.entrants[1])
+        self.assertIn("参加者A: 記録された発言", manager.generate.call_args.args[1])
+
+    def test_leaderboard(self):
+        """対戦結果がリーダーボードに集計されるテスト"""
+        log_tournament_result("t1", 1, "c1", "A1", "m-a", "B1", "m-b", 8, 5, db_path=self.db_path)
+        log_tournament_result("t1", 1, "c2", "B1", "m-b", "C1", "m-c", 6, 6, db_path=self.db_path)
+        log_tournament_result("t1", 1, None, "A1", "m-a", "C1", "m-c", None, None, error="API error", db_path=self.db_path)
+        log_tournament_result("t2", 1, "c3", "C1", "m-c", "A1", "m-a", 9, 1, db_path=self.db_path)
+
+        rows = fetch_leaderboard("t1", db_path=self.db_path)
+        self.assertEqual([(r["entrant"], r["games"], r["wins"], r["draws"], r["losses"], r["points"]) for r in rows], [
+            ("A1", 1, 1, 0, 0, 1.0),
+            ("C1", 1, 0, 1, 0, 0.5),
+            ("B1", 2, 0, 1, 1, 0.5),
+        ])
+
+    @patch('tournament.ConversationManager')
+    def test_run_round_robin(self, mock_manager_class):
+        """総当たりの全対戦が実行・採点され、リーダーボードが作成されるテスト"""
+        created = []
+
+        def make_manager(config, *args, **kwargs):
+            manager = MagicMock()
+            manager.conversation_id = f"conv-{len(created)}"
+            manager.config = config
+            created.append((config, kwargs))
+            return manager
+        mock_manager_class.side_effect = make_manager
+
+        tournament = Tournament(self.config, self.logger, tournament_id="t-test")
+        # 参加者Aが常に勝つ採点
+        with patch.object(tournament, "score_conversation", return_value=(7.0, 4.0)), patch('builtins.print'):
+            leaderboard = tournament.run()
+
+        self.assertEqual(len(created), 3)
+        for config, kwargs in created:
+            self.assertEqual(config.max_turns, 1)
+            self.assertEqual(config.budget.batch_id, "t-test")
+            # MCの開始アナウンスは全対戦で共有される
+            self.assertIs(kwargs["moderator_cache"], tournament.moderator_cache)
+            self.assertTrue(kwargs["shared_intro"])
+        self.assertEqual([row["entrant"] for row in leaderboard], ["A1", "B1", "C1"])
+        self.assertEqual([row["points"] for row in leaderboard], [2.0, 1.0, 0.0])
+        # 元の設定は変更されない
+        self.assertIsNone(self.config.budget.batch_id)
+
+    @patch('tournament.ConversationManager')
+    def test_run_records_failed_match(self, mock_manager_class):
+        """失敗した対戦がエラーとして記録され、集計から除外されるテスト"""
+        mock_manager_class.return_value.conversation_id = "conv"
+        self.config.tournament = TournamentConfig(self.entrants[:2], format="swiss", rounds=1)
+
+        tournament = Tournament(self.config, self.logger, tournament_id="t-fail")
+        with patch.object(tournament, "score_conversation", side_effect=ValueError("no scores")), patch('builtins.print'):
+            leaderboard = tournament.run()
+
+        self.assertEqual(leaderboard, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
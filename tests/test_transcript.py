@@ -0,0 +1,108 @@
+import unittest
+import os
+import tempfile
+from database import init_db, log_conversation_meta, log_conversation_turn
+from transcript import Transcript, TurnRecord
+
+
+class TestTranscript(unittest.TestCase):
+    """transcript.py のテストクラス"""
+
+    def setUp(self):
+        """テスト前処理"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "test.db")
+        init_db(self.db_path)
+
+    def tearDown(self):
+        """テスト後処理"""
+        self.temp_dir.cleanup()
+
+    def _transcript(self, text_chars_limit=0):
+        transcript = Transcript("conv-1", text_chars_limit=text_chars_limit)
+        transcript.append(0, "MC", "model-mc", "intro", is_moderator=True, input_tokens=5, output_tokens=3, latency_ms=10)
+        for turn in range(1, 5):
+            speaker, model = ("Alice", "model-a") if turn % 2 else ("Bob", "model-b")
+            # モデルIDは intern の確認のためターンごとに別の文字列として作る
+            transcript.append(turn, speaker, "".join(["model-", model[-1]]), f"turn {turn}", input_tokens=10, output_tokens=20, latency_ms=100)
+        return transcript
+
+    def test_append_and_views(self):
+        """ターンの追加・話者のインデックス・直近のターンの参照テスト"""
+        transcript = self._transcript()
+        self.assertEqual(len(transcript), 5)
+        self.assertEqual(transcript.speakers, ["MC", "Alice", "Bob"])
+        self.assertEqual(transcript.speaker_name(transcript[3]), "Alice")
+        # モデルIDは intern され、同じモデルのターンで同じ文字列を共有する
+        self.assertIs(transcript[1].model_id, transcript[3].model_id)
+        # __slots__ のため属性を追加できない
+        with self.assertRaises(AttributeError):
+            transcript[1].extra = 1
+        self.assertFalse(hasattr(TurnRecord(1, 0, "m", "t"), "__dict__"))
+
+        self.assertEqual(transcript.last(participants_only=True).turn_number, 4)
+        self.assertEqual(transcript.totals(), {"turns": 5, "input_tokens": 45, "output_tokens": 83, "latency_ms": 410})
+
+    def test_text_eviction(self):
+        """保持する本文が上限を超えると古いターンの本文を捨て、履歴はデータベースから読むテスト"""
+        transcript = self._transcript(text_chars_limit=13)
+        self.assertFalse(transcript.complete)
+        self.assertEqual([record.text for record in transcript], [None, None, None, "turn 3", "turn 4"])
+        # 記録のメタデータは残る
+        self.assertEqual(transcript.totals()["turns"], 5)
+
+        log_conversation_turn("conv-1", 1, "Alice", "model-a", "p", "from db", db_path=self.db_path)
+        self.assertEqual(list(transcript.iter_history(self.db_path)), [("Alice", "model-a", "from db")])
+        # 直近の1ターンは上限を超えても保持する
+        transcript.append(5, "Alice", "model-a", "x" * 100)
+        self.assertEqual(transcript[-1].text, "x" * 100)
+        self.assertIsNone(transcript[-2].text)
+
+    def test_append_keeps_turn_order(self):
+        """後から記録されたターン0がターン番号順の位置に挿入されるテスト"""
+        transcript = Transcript("conv-1")
+        transcript.append(1, "Alice", "model-a", "turn 1")
+        transcript.append(0, "MC", "model-mc", "intro", is_moderator=True)
+        transcript.append(2, "Bob", "model-b", "turn 2")
+        self.assertEqual([record.turn_number for record in transcript], [0, 1, 2])
+        self.assertEqual([text for _, _, text in transcript.iter_history(self.db_path)], ["intro", "turn 1", "turn 2"])
+
+        # 本文を捨てた範囲に挿入されたターンは本文を保持しない
+        transcript = Transcript("conv-2", text_chars_limit=6)
+        transcript.append(1, "Alice", "model-a", "turn 1")
+        transcript.append(2, "Bob", "model-b", "turn 2")
+        transcript.append(0, "MC", "model-mc", "intro", is_moderator=True)
+        self.assertEqual([record.text for record in transcript], [None, None, "turn 2"])
+
+    def test_load(self):
+        """会話ログからの読み込みと、分岐元のターンを含む読み込みのテスト"""
+        transcript = self._transcript()
+        transcript.append(5, "Alice", "model-a", "partial", is_partial=True)
+        for record in transcript:
+            log_conversation_turn(
+                "conv-1", record.turn_number, transcript.speaker_name(record), record.model_id, "p", record.text,
+                is_moderator=record.is_moderator, input_tokens=record.input_tokens, output_tokens=record.output_tokens,
+                latency_ms=record.latency_ms, is_partial=record.is_partial, db_path=self.db_path,
+            )
+
+        loaded = Transcript.load("conv-1", db_path=self.db_path)
+        self.assertEqual(
+            [(record.turn_number, record.text, record.is_partial, record.latency_ms) for record in loaded],
+            [(record.turn_number, record.text, record.is_partial, record.latency_ms) for record in transcript],
+        )
+        self.assertEqual(list(loaded.iter_history()), list(transcript.iter_history()))
+        self.assertEqual(loaded.totals(), transcript.totals())
+
+        log_conversation_meta("fork-1", "Topic", "Alice", "model-a", "Bob", "model-c", "MC", "model-mc",
+                              parent_conversation_id="conv-1", fork_turn=2, db_path=self.db_path)
+        log_conversation_turn("fork-1", 3, "Bob", "model-c", "p", "fork turn 3", db_path=self.db_path)
+        fork = Transcript.load("fork-1", db_path=self.db_path)
+        self.assertEqual([(record.turn_number, record.text) for record in fork],
+                         [(0, "intro"), (1, "turn 1"), (2, "turn 2"), (3, "fork turn 3")])
+        seeded = Transcript.load("conv-1", db_path=self.db_path, max_turn=2, as_conversation_id="fork-2")
+        self.assertEqual(seeded.conversation_id, "fork-2")
+        self.assertEqual(seeded.last().text, "turn 2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+"""
+LLM TalkTable のトーナメント (A/B 評価) モード
+
+設定ファイルの tournament セクションに並べたモデル・ペルソナの参加者を総当たり (round_robin)
+またはスイス式 (swiss) で対戦させ、各会話をMCに採点させてリーダーボードに集計する。
+対戦は並行して実行し、モデルのハンドル・ペルソナ・MCの開始アナウンスは全対戦で共有する。
+"""
+import copy
+import logging
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+
+from concurrency import ModelConcurrencyLimiter
+from config import AppConfig, ConfigWatcher, ParticipantConfig
+from conversation import ConversationManager
+from database import fetch_leaderboard, log_tournament_result
+from moderator_cache import ModeratorCache
+from persona import PersonaRegistry
+
+# (ラウンド, 参加者A, 参加者B)
+Match = Tuple[int, ParticipantConfig, ParticipantConfig]
+
+# MCの採点結果から "A: 7" / "B：6.5" のようなスコアを取り出す正規表現
+_SCORE_PATTERN = re.compile(r"^\s*\**\s*([AB])\s*\**\s*[:：]\s*\**\s*(\d+(?:\.\d+)?)", re.MULTILINE)
+
+MAX_SCORE = 10.0
+
+
+def round_robin_pairings(entrants: Sequence[ParticipantConfig], games_per_pair: int = 1) -> List[Match]:
+    """
+    総当たりの対戦表を作成する。
+
+    games_per_pair が2以上の場合は、先攻による有利不利を打ち消すため、ゲームごとに先攻と後攻を入れ替える。
+    ラウンド番号はゲームの番号 (1始まり) とする。
+    """
+    matches: List[Match] = []
+    for game in range(games_per_pair):
+        for i, a in enumerate(entrants):
+            for b in entrants[i + 1:]:
+                matches.append((game + 1, a, b) if game % 2 == 0 else (game + 1, b, a))
+    return matches
+
+
+def swiss_pairings(
+    standings: Sequence[str],
+    played: Set[FrozenSet[str]],
+) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+    """
+    スイス式の1ラウンド分の対戦を作成する。
+
+    順位の近い参加者同士を、対戦済みの組み合わせを避けながら上位から順に組み合わせる
+    (避けられない場合は再戦を許可する)。参加者が奇数の場合、最後に残った1人は不戦 (bye) とする。
+
+    Args:
+        standings: 現在の順位順に並べた参加者名。
+        played: 対戦済みの組み合わせ。
+
+    Returns:
+        Tuple[List[Tuple[str, str]], Optional[str]]: (対戦の組み合わせ, 不戦の参加者)。
+    """
+    remaining = list(standings)
+    pairs: List[Tuple[str, str]] = []
+    while len(remaining) >= 2:
+        a = remaining.pop(0)
+        opponent_index = next(
+            (i for i, b in enumerate(remaining) if frozenset((a, b)) not in played),
+            0,
+        )
+        pairs.append((a, remaining.pop(opponent_index)))
+    return pairs, (remaining[0] if remaining else None)
+
+
+def parse_scores(text: str) -> Tuple[float, float]:
+    """
+    MCの採点結果から参加者A・Bのスコアを取り出す。
+
+    Raises:
+        ValueError: 両方のスコアが見つからない場合。
+    """
+    scores: Dict[str, float] = {}
+    for label, value in _SCORE_PATTERN.findall(text):
+        scores.setdefault(label, min(float(value), MAX_SCORE))
+    if "A" not in scores or "B" not in scores:
+        raise ValueError(f"MCの採点結果からスコアを読み取れませんでした: {text!r}")
+    return scores["A"], scores["B"]
+
+
+def format_leaderboard(rows: List[Dict[str, Any]]) -> str:
+    """リーダーボードを表形式の文字列にする"""
+    lines = [f"{'順位':>4}  {'参加者':<32} {'試合':>4} {'勝':>3} {'分':>3} {'負':>3} {'勝ち点':>6} {'平均':>5}"]
+    for rank, row in enumerate(rows, start=1):
+        lines.append(
+            f"{rank:>4}  {row['entrant']:<32} {row['games']:>4} {row['wins']:>3} {row['draws']:>3} "
+            f"{row['losses']:>3} {row['points']:>6.1f} {row['avg_score']:>5.2f}"
+        )
+    return "\n".join(lines)
+
+
+class Tournament:
+    """
+    トーナメントを実行するクラス。
+
+    各対戦は通常の会話として conversation_log に記録され、MCによる採点は tournament_result に記録される。
+    対戦の会話はバッチとして扱われ (バッチIDが未指定の場合はトーナメントID)、予算の batch 上限が
+    トーナメント全体に適用される。
+
+    config_watcher を指定すると、設定ファイルの変更を実行中の対戦にもターンの区切りで適用し、
+    以降の対戦は新しい設定で開始する。対戦表 (tournament セクションの形式・ラウンド数・参加者の一覧) は
+    トーナメントの開始時のものを使い続け、参加者のペルソナやモデルは名前で新しい設定から引き直す。
+    """
+
+    def __init__(
+        self,
+        config: AppConfig,
+        logger: logging.Logger,
+        tournament_id: Optional[str] = None,
+        model_cache: Optional[Dict[str, Any]] = None,
+        config_watcher: Optional[ConfigWatcher] = None,
+    ):
+        if config.tournament is None:
+            raise ValueError("設定ファイルに 'tournament' セクションがありません。")
+        self.config = config
+        self.settings = config.tournament
+        self.logger = logger
+        self.config_watcher = config_watcher
+        self.tournament_id = tournament_id or f"tournament-{uuid.uuid4().hex[:8]}"
+        self.entrants = {entrant.name: entrant for entrant in self.settings.entrants}
+        # 全対戦で共有するキャッシュ
+        self.model_cache: Dict[str, Any] = model_cache if model_cache is not None else {}
+        self.personas = PersonaRegistry(config.prompt_cache, config.store_persona_fragments)
+        # cache_moderator_intro が有効な場合は、実行をまたいでデータベースにも保存する
+        self.moderator_cache = ModeratorCache(db_path=config.db_path if config.cache_moderator_intro else None)
+        # モデルごとの同時実行数の上限は全対戦で共有する (採点の呼び出しも含む)
+        self.limiter = ModelConcurrencyLimiter.from_profiles(config.model_profiles)
+        self._print_lock = threading.Lock()
+
+    def _print(self, message: str) -> None:
+        # 対戦は並行して実行されるため、行単位で出力する
+        with self._print_lock:
+            print(message, flush=True)
+
+    def _match_config(self, a: ParticipantConfig, b: ParticipantConfig, base: Optional[AppConfig] = None) -> AppConfig:
+        """
+        1対戦分の設定を作成する。
+
+        base を省略した場合は現在の設定 (設定ファイルを監視していれば最後に読み込んだ設定) を元にする。
+        再読み込みした設定から実行中の対戦の設定を作り直す際にも使う。
+        """
+        if base is None:
+            base = self.config
+            if self.config_watcher is not None:
+                self.config_watcher.poll()
+                base = self.config_watcher.config
+        entrants = {entrant.name: entrant for entrant in base.tournament.entrants} if base.tournament else {}
+        match_config = copy.copy(base)
+        match_config.participants = [entrants.get(a.name, a), entrants.get(b.name, b)]
+        match_config.max_turns = self.settings.max_turns or base.max_turns
+        match_config.show_summary = False
+        match_config.budget = copy.copy(base.budget)
+        # 対戦の使用量は開始時のバッチIDで集計する
+        match_config.budget.batch_id = self.config.budget.batch_id or self.tournament_id
+        return match_config
+
+    def score_conversation(self, manager: ConversationManager, a: ParticipantConfig, b: ParticipantConfig) -> Tuple[float, float]:
+        """
+        MCに会話を採点させる。
+
+        採点の公平性のため、MCには参加者の名前とモデルを伏せ、発言を「参加者A」「参加者B」として見せる。
+        採点の呼び出しは対戦の ConversationManager を通して行い、対戦の予算と同時実行数の制限を適用して使用量を記録する。
+        会話は対戦のトランスクリプトから読む (本文を捨てたターンがある場合だけデータベースから読み直す)。
+        """
+        conversation_id = manager.conversation_id
+        moderator = manager.config.moderator
+        labels = {a.name: "参加者A", b.name: "参加者B"}
+        transcript = "\n\n".join(
+            f"{labels[speaker_name]}: {response}"
+            for speaker_name, _, response in manager.transcript.iter_history(db_path=manager.config.db_path)
+            if speaker_name in labels
+        )
+        score_prompt = (
+            f"テーマ: {manager.config.topic}\n\n以下は参加者Aと参加者Bの会話です:\n\n{transcript}\n\n"
+            f"議論の質 (論理性、具体性、相手の発言への応答、テーマへの貢献) の観点から、"
+            f"各参加者を0から{MAX_SCORE:.0f}の数値で採点してください。\n"
+            "次の形式の2行だけで答えてください:\nA: <スコア>\nB: <スコア>"
+        )
+        answer = manager.generate(moderator, score_prompt, "score")
+        self.logger.debug(
+            "MCの採点 (%s): %s", conversation_id, answer,
+            extra={"event": "score", "conversation_id": conversation_id, "model": moderator.model},
+        )
+        return parse_scores(answer)
+
+    def play_match(self, round_number: int, a: ParticipantConfig, b: ParticipantConfig) -> Optional[Tuple[float, float]]:
+        """1対戦 (会話と採点) を実行して結果を記録する。失敗した場合は None を返す"""
+        match_config = self._match_config(a, b)
+        manager = None
+        try:
+            manager = ConversationManager(
+                match_config,
+                self.logger,
+                persona_registry=self.personas,
+                model_cache=self.model_cache,
+                console=False,
+                moderator_cache=self.moderator_cache,
+                shared_intro=True,
+                limiter=self.limiter,
+                config_watcher=self.config_watcher,
+                config_overrides=lambda new_config: self._match_config(a, b, new_config),
+            )
+            manager.start_conversation(max_turns=match_config.max_turns, show_prompt=False, show_summary=False)
+            score_a, score_b = self.score_conversation(manager, a, b)
+        except Exception as e:
+            self.logger.exception(
+                "対戦 %s vs %s (ラウンド %d) に失敗しました: %s", a.name, b.name, round_number, e,
+                extra={"event": "match_failed", "conversation_id": manager.conversation_id if manager else None},
+            )
+            self._print(f"[ラウンド {round_number}] {a.name} vs {b.name}: 失敗 ({e})")
+            log_tournament_result(
+                self.tournament_id, round_number, manager.conversation_id if manager else None,
+                a.name, a.model, b.name, b.model, None, None, error=str(e), db_path=self.config.db_path,
+            )
+            return None
+        log_tournament_result(
+            self.tournament_id, round_number, manager.conversation_id,
+            a.name, a.model, b.name, b.model, score_a, score_b, db_path=self.config.db_path,
+        )
+        self._print(f"[ラウンド {round_number}] {a.name} vs {b.name}: {score_a:g} - {score_b:g}")
+        return score_a, score_b
+
+    def _play_all(self, executor: ThreadPoolExecutor, matches: List[Match]) -> None:
+        futures = [executor.submit(self.play_match, *match) for match in matches]
+        for future in futures:
+            future.result()
+
+    def _swiss_rounds(self, executor: ThreadPoolExecutor) -> None:
+        played: Set[FrozenSet[str]] = set()
+        for round_number in range(1, self.settings.rounds + 1):
+            ranked = [row["entrant"] for row in fetch_leaderboard(self.tournament_id, db_path=self.config.db_path)]
+            # まだ採点された対戦のない参加者は設定順で後ろに並べる
+            standings = ranked + [name for name in self.entrants if name not in ranked]
+            pairs, bye = swiss_pairings(standings, played)
+            if bye:
+                self._print(f"[ラウンド {round_number}] {bye}: 不戦")
+            played.update(frozenset(pair) for pair in pairs)
+            self._play_all(executor, [(round_number, self.entrants[a], self.entrants[b]) for a, b in pairs])
+
+    def run(self) -> List[Dict[str, Any]]:
+        """トーナメントを実行し、リーダーボードを返す"""
+        self.logger.info(
+            "トーナメント %s を開始します (%s, 参加者: %d, 同時実行数: %d)",
+            self.tournament_id, self.settings.format, len(self.entrants), self.settings.concurrency,
+            extra={"event": "tournament_start"},
+        )
+        self._print(f"トーナメント {self.tournament_id} ({self.settings.format}) を開始します: {', '.join(self.entrants)}")
+        with ThreadPoolExecutor(max_workers=self.settings.concurrency, thread_name_prefix="talktable-match") as executor:
+            if self.settings.format == "swiss":
+                self._swiss_rounds(executor)
+            else:
+                self._play_all(executor, round_robin_pairings(self.settings.entrants, self.settings.games_per_pair))
+        self.logger.info(
+            "MCの開始アナウンスのキャッシュ: ヒット %d 件, ミス %d 件", self.moderator_cache.hits, self.moderator_cache.misses,
+        )
+        leaderboard = fetch_leaderboard(self.tournament_id, db_path=self.config.db_path)
+        self._print(f"\n--- リーダーボード ({self.tournament_id}) ---\n{format_leaderboard(leaderboard)}")
+        return leaderboard
@@ -0,0 +1,206 @@
+"""
+会話のトランスクリプト (メモリ上のターンの記録)
+
+1会話のターンを `__slots__` の TurnRecord のリストとして保持する。話者はインデックス、モデルIDは
+intern した文字列で持つため、1ターンあたりのオーバーヘッドは発言本文以外ほぼ一定になる。
+発言本文は直近の text_chars_limit 文字分だけ保持し、それより古い本文は捨ててデータベースから読み直す。
+これにより長い会話でもメモリ使用量は一定に保たれ、短い会話ではデータベースを読み直さずに済む。
+"""
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import DB_PATH
+from database import iter_conversation_history, iter_turn_records
+
+
+class TurnRecord:
+    """1ターンの記録 (列の順は database.TURN_RECORD_COLUMNS と同じ)"""
+
+    __slots__ = (
+        "turn_number",
+        "speaker_index",
+        "model_id",
+        "text",
+        "is_moderator",
+        "is_partial",
+        "input_tokens",
+        "output_tokens",
+        "latency_ms",
+    )
+
+    def __init__(
+        self,
+        turn_number: int,
+        speaker_index: int,
+        model_id: str,
+        text: Optional[str],
+        is_moderator: bool = False,
+        is_partial: bool = False,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        latency_ms: int = 0,
+    ):
+        self.turn_number = turn_number
+        self.speaker_index = speaker_index
+        self.model_id = model_id
+        # 古いターンの本文はメモリから捨てられ None になる
+        self.text = text
+        self.is_moderator = is_moderator
+        self.is_partial = is_partial
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.latency_ms = latency_ms
+
+    def __repr__(self):
+        return (
+            f"<TurnRecord turn={self.turn_number} speaker={self.speaker_index} model='{self.model_id}' "
+            f"chars={len(self.text) if self.text is not None else '-'} partial={self.is_partial}>"
+        )
+
+
+class Transcript:
+    """
+    1会話のターンの記録。
+
+    text_chars_limit が 0 の場合は発言本文をすべて保持する。正の場合は直近の発言本文の合計が
+    その文字数を超えない範囲で保持し (直近の1ターンは常に保持する)、それより古い本文は捨てる。
+    """
+
+    def __init__(self, conversation_id: str, text_chars_limit: int = 0):
+        self.conversation_id = conversation_id
+        self.text_chars_limit = text_chars_limit
+        self.speakers: List[str] = []
+        self._speaker_indexes: Dict[str, int] = {}
+        self._records: List[TurnRecord] = []
+        # 本文を保持している最初のレコードの位置と、保持している本文の合計文字数
+        self._first_text = 0
+        self._text_chars = 0
+
+    def speaker_index(self, name: str) -> int:
+        """話者名のインデックス (初出の話者は登録する)"""
+        index = self._speaker_indexes.get(name)
+        if index is None:
+            index = self._speaker_indexes[name] = len(self.speakers)
+            self.speakers.append(name)
+        return index
+
+    def speaker_name(self, record: TurnRecord) -> str:
+        return self.speakers[record.speaker_index]
+
+    def append(
+        self,
+        turn_number: int,
+        speaker_name: str,
+        model_id: str,
+        text: str,
+        is_moderator: bool = False,
+        is_partial: bool = False,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        latency_ms: int = 0,
+    ) -> TurnRecord:
+        """
+        ターンを追加する。
+
+        レコードはデータベースと同じターン番号順に保つ。非同期に生成したMCの開始アナウンス (ターン0) のように
+        後から記録されたターンは、ターン番号が同じか小さいターンの後ろに挿入する。
+        """
+        record = TurnRecord(
+            turn_number, self.speaker_index(speaker_name), sys.intern(model_id), text,
+            bool(is_moderator), bool(is_partial), input_tokens or 0, output_tokens or 0, latency_ms or 0,
+        )
+        position = len(self._records)
+        while position > 0 and self._records[position - 1].turn_number > turn_number:
+            position -= 1
+        self._records.insert(position, record)
+        if position < self._first_text:
+            # 本文を捨てた範囲に挿入されたターンの本文も保持しない (データベースから読み直す)
+            record.text = None
+            self._first_text += 1
+            return record
+        self._text_chars += len(text)
+        self._evict_texts()
+        return record
+
+    def set_text_chars_limit(self, limit: int) -> None:
+        """保持する本文の文字数の上限を変更する (捨てた本文は戻らず、引き続きデータベースから読む)"""
+        self.text_chars_limit = limit
+        self._evict_texts()
+
+    def _evict_texts(self) -> None:
+        """保持する本文が text_chars_limit を超えた分を古い順に捨てる"""
+        if not self.text_chars_limit:
+            return
+        last = len(self._records) - 1
+        while self._text_chars > self.text_chars_limit and self._first_text < last:
+            record = self._records[self._first_text]
+            self._text_chars -= len(record.text)
+            record.text = None
+            self._first_text += 1
+
+    @property
+    def complete(self) -> bool:
+        """すべてのターンの本文を保持しているかどうか"""
+        return self._first_text == 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[TurnRecord]:
+        return iter(self._records)
+
+    def __getitem__(self, index: int) -> TurnRecord:
+        return self._records[index]
+
+    def last(self, participants_only: bool = False) -> Optional[TurnRecord]:
+        """最後の (途中までのレスポンスではない) ターン"""
+        for record in reversed(self._records):
+            if record.is_partial or (participants_only and record.is_moderator):
+                continue
+            return record
+        return None
+
+    def iter_history(self, db_path: str = DB_PATH) -> Iterator[Tuple[str, str, str]]:
+        """
+        会話履歴を (話者名, モデルID, 発言) のタプルでターン順に返す (途中までのレスポンスは含まない)。
+
+        本文をすべて保持していればメモリ上の記録から、そうでなければデータベースから少しずつ読み込む。
+        """
+        if not self.complete:
+            yield from iter_conversation_history(self.conversation_id, db_path=db_path)
+            return
+        for record in self._records:
+            if not record.is_partial:
+                yield self.speakers[record.speaker_index], record.model_id, record.text
+
+    def totals(self) -> Dict[str, int]:
+        """記録したターン数・トークン数・レイテンシの合計"""
+        totals = {"turns": 0, "input_tokens": 0, "output_tokens": 0, "latency_ms": 0}
+        for record in self._records:
+            totals["turns"] += 1
+            totals["input_tokens"] += record.input_tokens
+            totals["output_tokens"] += record.output_tokens
+            totals["latency_ms"] += record.latency_ms
+        return totals
+
+    @classmethod
+    def load(
+        cls,
+        conversation_id: str,
+        db_path: str = DB_PATH,
+        max_turn: Optional[int] = None,
+        text_chars_limit: int = 0,
+        as_conversation_id: Optional[str] = None,
+    ) -> "Transcript":
+        """
+        会話ログ (分岐元から引き継いだターンを含む) からトランスクリプトを作成する。
+
+        as_conversation_id を指定すると、読み込んだターンをその会話のトランスクリプトとして持つ (分岐した会話用)。
+        """
+        transcript = cls(as_conversation_id or conversation_id, text_chars_limit)
+        for row in iter_turn_records(conversation_id, max_turn=max_turn, db_path=db_path):
+            transcript.append(*row)
+        return transcript
+
+    def __repr__(self):
+        return f"<Transcript conversation_id='{self.conversation_id}' turns={len(self)} complete={self.complete}>"